@@ -0,0 +1,41 @@
+"""doctor_monthly_stat rollup: med_rep_id, sold_amount, period indexes
+
+Revision ID: 3a7c91e04b2d
+Revises: d1f0aa94745c
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a7c91e04b2d'
+down_revision: Union[str, Sequence[str], None] = 'd1f0aa94745c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('doctor_monthly_stat', sa.Column('med_rep_id', sa.Integer(), nullable=True))
+    op.add_column('doctor_monthly_stat', sa.Column('sold_amount', sa.Float(), nullable=True, server_default='0'))
+    op.create_foreign_key('fk_doctor_monthly_stat_med_rep_id_user', 'doctor_monthly_stat', 'user', ['med_rep_id'], ['id'])
+    op.alter_column('doctor_monthly_stat', 'doctor_id', existing_type=sa.Integer(), nullable=True)
+    op.create_index(op.f('ix_doctor_monthly_stat_med_rep_id'), 'doctor_monthly_stat', ['med_rep_id'], unique=False)
+    op.create_index('ix_doctor_monthly_stat_rep_period', 'doctor_monthly_stat', ['med_rep_id', 'year', 'month'], unique=False)
+    op.create_index('ix_doctor_monthly_stat_doctor_period', 'doctor_monthly_stat', ['doctor_id', 'product_id', 'year', 'month'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_doctor_monthly_stat_doctor_period', table_name='doctor_monthly_stat')
+    op.drop_index('ix_doctor_monthly_stat_rep_period', table_name='doctor_monthly_stat')
+    op.drop_index(op.f('ix_doctor_monthly_stat_med_rep_id'), table_name='doctor_monthly_stat')
+    op.execute("DELETE FROM doctor_monthly_stat WHERE doctor_id IS NULL")
+    op.alter_column('doctor_monthly_stat', 'doctor_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('fk_doctor_monthly_stat_med_rep_id_user', 'doctor_monthly_stat', type_='foreignkey')
+    op.drop_column('doctor_monthly_stat', 'sold_amount')
+    op.drop_column('doctor_monthly_stat', 'med_rep_id')
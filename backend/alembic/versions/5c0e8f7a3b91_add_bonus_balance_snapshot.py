@@ -0,0 +1,84 @@
+"""add bonus_balance snapshot and monthly checkpoints
+
+Revision ID: 5c0e8f7a3b91
+Revises: b72d5e0f1c38
+Create Date: 2026-10-18 13:02:41.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c0e8f7a3b91'
+down_revision: Union[str, Sequence[str], None] = 'b72d5e0f1c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _money_columns():
+    return [
+        sa.Column(name, sa.Float(), nullable=False, server_default='0')
+        for name in ('accrued', 'paid_accrued', 'offset_amount', 'allocated',
+                     'advance_amount', 'payout_amount', 'reversal_amount', 'balance')
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('bonus_balance',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('ledger_category', sa.String(), nullable=False),
+    *_money_columns(),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'ledger_category')
+    )
+    op.create_table('bonus_balance_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('ledger_category', sa.String(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    *_money_columns(),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_bonus_balance_checkpoint_id'), 'bonus_balance_checkpoint', ['id'], unique=False)
+    op.create_index('ix_bonus_balance_checkpoint_period', 'bonus_balance_checkpoint', ['user_id', 'ledger_category', 'year', 'month'], unique=True)
+    op.create_index('ix_bonus_ledger_user_category', 'bonus_ledger', ['user_id', 'ledger_category'], unique=False)
+
+    # Initial fill of the current balances (same sums as BonusBalanceService.rebuild).
+    # Checkpoints are optional for correctness; run app.scripts.rebuild_bonus_balances to create them.
+    op.execute("""
+        INSERT INTO bonus_balance (user_id, ledger_category, accrued, paid_accrued, offset_amount, allocated,
+                                   advance_amount, payout_amount, reversal_amount, balance, updated_at)
+        SELECT
+            user_id,
+            ledger_category,
+            COALESCE(SUM(CASE WHEN ledger_type = 'accrual' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'accrual' AND is_paid THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'offset' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'offset' THEN ABS(amount) ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'advance' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'payout' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'reversal' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN ledger_type = 'accrual' AND is_paid THEN amount
+                              WHEN ledger_type = 'offset' THEN -amount ELSE 0 END), 0),
+            CURRENT_TIMESTAMP
+        FROM bonus_ledger
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, ledger_category
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_bonus_ledger_user_category', table_name='bonus_ledger')
+    op.drop_index('ix_bonus_balance_checkpoint_period', table_name='bonus_balance_checkpoint')
+    op.drop_index(op.f('ix_bonus_balance_checkpoint_id'), table_name='bonus_balance_checkpoint')
+    op.drop_table('bonus_balance_checkpoint')
+    op.drop_table('bonus_balance')
@@ -0,0 +1,36 @@
+"""add (date, id) indexes for keyset pagination
+
+Revision ID: 8d41c6e2f0a7
+Revises: 5c0e8f7a3b91
+Create Date: 2026-10-18 15:20:12.604318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41c6e2f0a7'
+down_revision: Union[str, Sequence[str], None] = '5c0e8f7a3b91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_invoice_date_id', 'invoice', ['date', 'id'], unique=False)
+    op.create_index('ix_invoice_status_date_id', 'invoice', ['status', 'date', 'id'], unique=False)
+    op.create_index('ix_reservation_date_id', 'reservation', ['date', 'id'], unique=False)
+    op.create_index('ix_payment_date_id', 'payment', ['date', 'id'], unique=False)
+    op.create_index('ix_auditlog_created_at_id', 'auditlog', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_auditlog_created_at_id', table_name='auditlog')
+    op.drop_index('ix_payment_date_id', table_name='payment')
+    op.drop_index('ix_reservation_date_id', table_name='reservation')
+    op.drop_index('ix_invoice_status_date_id', table_name='invoice')
+    op.drop_index('ix_invoice_date_id', table_name='invoice')
@@ -0,0 +1,55 @@
+"""add org_receivable summary table
+
+Revision ID: 8e41b6c2d7fa
+Revises: 3a7c91e04b2d
+Create Date: 2026-10-18 11:04:57.604113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e41b6c2d7fa'
+down_revision: Union[str, Sequence[str], None] = '3a7c91e04b2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('org_receivable',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('current_debt', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('invoice_surplus', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('open_invoice_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('oldest_unpaid_date', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['organization_id'], ['medicalorganization.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('organization_id')
+    )
+    op.create_index(op.f('ix_reservation_med_org_id'), 'reservation', ['med_org_id'], unique=False)
+
+    # Initial fill (same aggregation as ReceivableService.rebuild)
+    op.execute("""
+        INSERT INTO org_receivable (organization_id, current_debt, invoice_surplus, open_invoice_count, oldest_unpaid_date, updated_at)
+        SELECT
+            m.id,
+            COALESCE(SUM(CASE WHEN i.total_amount > COALESCE(i.paid_amount, 0) THEN i.total_amount - COALESCE(i.paid_amount, 0) ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN COALESCE(i.paid_amount, 0) > i.total_amount THEN COALESCE(i.paid_amount, 0) - i.total_amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN i.total_amount > COALESCE(i.paid_amount, 0) THEN 1 ELSE 0 END), 0),
+            MIN(CASE WHEN i.total_amount > COALESCE(i.paid_amount, 0) THEN COALESCE(i.realization_date, i.date) END),
+            CURRENT_TIMESTAMP
+        FROM medicalorganization m
+        LEFT JOIN reservation r ON r.med_org_id = m.id
+        LEFT JOIN invoice i ON i.reservation_id = r.id AND i.status != 'cancelled'
+        GROUP BY m.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_reservation_med_org_id'), table_name='reservation')
+    op.drop_table('org_receivable')
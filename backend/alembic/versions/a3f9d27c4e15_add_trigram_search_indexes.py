@@ -0,0 +1,54 @@
+"""add pg_trgm indexes for name / number search
+
+Revision ID: a3f9d27c4e15
+Revises: 8d41c6e2f0a7
+Create Date: 2026-10-18 16:04:37.915206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f9d27c4e15'
+down_revision: Union[str, Sequence[str], None] = '8d41c6e2f0a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, column); GIN trigram indexes serve ILIKE '%...%', similarity() and the % operator
+TRIGRAM_INDEXES = [
+    ('ix_medicalorganization_name_trgm', 'medicalorganization', 'name'),
+    ('ix_medicalorganization_inn_trgm', 'medicalorganization', 'inn'),
+    ('ix_doctor_full_name_trgm', 'doctor', 'full_name'),
+    ('ix_user_full_name_trgm', 'user', 'full_name'),
+    ('ix_invoice_factura_number_trgm', 'invoice', 'factura_number'),
+    ('ix_reservation_customer_name_trgm', 'reservation', 'customer_name'),
+    ('ix_auditlog_username_trgm', 'auditlog', 'username'),
+    ('ix_auditlog_ip_address_trgm', 'auditlog', 'ip_address'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return  # trigram indexes are PostgreSQL only; search_service falls back to plain LIKE
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Built concurrently so the listings stay writable while large tables are indexed
+    with op.get_context().autocommit_block():
+        for name, table, column in TRIGRAM_INDEXES:
+            op.create_index(
+                name, table, [column], unique=False, if_not_exists=True,
+                postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}, postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        for name, table, column in reversed(TRIGRAM_INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
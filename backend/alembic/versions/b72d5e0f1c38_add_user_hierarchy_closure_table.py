@@ -0,0 +1,56 @@
+"""add user_hierarchy closure table
+
+Revision ID: b72d5e0f1c38
+Revises: 8e41b6c2d7fa
+Create Date: 2026-10-18 12:21:09.447352
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b72d5e0f1c38'
+down_revision: Union[str, Sequence[str], None] = '8e41b6c2d7fa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_hierarchy',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index(op.f('ix_user_hierarchy_descendant_id'), 'user_hierarchy', ['descendant_id'], unique=False)
+    op.create_index(op.f('ix_user_manager_id'), 'user', ['manager_id'], unique=False)
+
+    # Initial fill from manager_id (depth guard protects against cycles in legacy data)
+    op.execute("""
+        WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+            SELECT manager_id, id, 1 FROM "user" WHERE manager_id IS NOT NULL
+            UNION ALL
+            SELECT u.manager_id, t.descendant_id, t.depth + 1
+            FROM tree t
+            JOIN "user" u ON u.id = t.ancestor_id
+            WHERE u.manager_id IS NOT NULL AND t.depth < 32
+        )
+        INSERT INTO user_hierarchy (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth)
+        FROM tree
+        WHERE ancestor_id != descendant_id
+        GROUP BY ancestor_id, descendant_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_user_manager_id'), table_name='user')
+    op.drop_index(op.f('ix_user_hierarchy_descendant_id'), table_name='user_hierarchy')
+    op.drop_table('user_hierarchy')
@@ -0,0 +1,28 @@
+"""add (med_rep_id, visit_date, id) index for visit history
+
+Revision ID: b7e2c5a9d134
+Revises: a3f9d27c4e15
+Create Date: 2026-10-18 18:05:41.219874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c5a9d134'
+down_revision: Union[str, Sequence[str], None] = 'a3f9d27c4e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_visit_med_rep_id_visit_date', 'visit', ['med_rep_id', 'visit_date', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_visit_med_rep_id_visit_date', table_name='visit')
@@ -0,0 +1,62 @@
+"""doctor_monthly_stat unique key
+
+Revision ID: b8d2f4a6c913
+Revises: a5e1f7c3d924
+Create Date: 2026-10-20 10:14:02.381557
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d2f4a6c913'
+down_revision: Union[str, Sequence[str], None] = 'a5e1f7c3d924'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+KEY = "coalesce(med_rep_id, 0), coalesce(doctor_id, 0), product_id, month, year"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Fold rows duplicated by concurrent first writes into the lowest id of each key
+    op.execute(f"""
+        UPDATE doctor_monthly_stat AS s
+        SET plan_quantity = d.plan_quantity,
+            sold_quantity = d.sold_quantity,
+            paid_quantity = d.paid_quantity,
+            sold_amount = d.sold_amount,
+            paid_amount = d.paid_amount,
+            bonus_amount = d.bonus_amount
+        FROM (
+            SELECT min(id) AS keep_id,
+                   sum(coalesce(plan_quantity, 0)) AS plan_quantity,
+                   sum(coalesce(sold_quantity, 0)) AS sold_quantity,
+                   sum(coalesce(paid_quantity, 0)) AS paid_quantity,
+                   sum(coalesce(sold_amount, 0)) AS sold_amount,
+                   sum(coalesce(paid_amount, 0)) AS paid_amount,
+                   sum(coalesce(bonus_amount, 0)) AS bonus_amount
+            FROM doctor_monthly_stat
+            GROUP BY {KEY}
+            HAVING count(*) > 1
+        ) AS d
+        WHERE s.id = d.keep_id
+    """)
+    op.execute(f"""
+        DELETE FROM doctor_monthly_stat
+        WHERE id NOT IN (SELECT min(id) FROM doctor_monthly_stat GROUP BY {KEY})
+    """)
+    op.create_index(
+        'uq_doctor_monthly_stat_key', 'doctor_monthly_stat',
+        [sa.text('coalesce(med_rep_id, 0)'), sa.text('coalesce(doctor_id, 0)'), 'product_id', 'month', 'year'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_doctor_monthly_stat_key', table_name='doctor_monthly_stat')
@@ -0,0 +1,43 @@
+"""add notification inbox index and notification_archive
+
+Revision ID: c9d3f1e6a820
+Revises: b7e2c5a9d134
+Create Date: 2026-10-18 19:12:08.447301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9d3f1e6a820'
+down_revision: Union[str, Sequence[str], None] = 'b7e2c5a9d134'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_notification_recipient_status_created', 'notification', ['recipient_id', 'status', 'created_at'], unique=False)
+    op.create_table('notification_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('topic', sa.String(), nullable=False),
+    sa.Column('message', sa.String(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('related_entity_type', sa.String(), nullable=True),
+    sa.Column('related_entity_name', sa.String(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notification_archive_recipient_id'), 'notification_archive', ['recipient_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_notification_archive_recipient_id'), table_name='notification_archive')
+    op.drop_table('notification_archive')
+    op.drop_index('ix_notification_recipient_status_created', table_name='notification')
@@ -0,0 +1,37 @@
+"""add payment kind
+
+Revision ID: e7b3c5a1f208
+Revises: d4a8e2b7c915
+Create Date: 2026-10-18 23:05:41.318420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b3c5a1f208'
+down_revision: Union[str, Sequence[str], None] = 'd4a8e2b7c915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payment', sa.Column('kind', sa.String(), server_default='regular', nullable=False))
+    # Existing reservation-approval payments, recognised by the comments ReservationService writes
+    op.execute(
+        "UPDATE payment SET kind = 'credit_balance' "
+        "WHERE comment LIKE 'Автоматическая оплата с баланса (Кредиторка)%'"
+    )
+    op.execute(
+        "UPDATE payment SET kind = 'tovar_skidka' "
+        "WHERE comment LIKE 'Оплачено за счет промо-суммы накладной #%'"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payment', 'kind')
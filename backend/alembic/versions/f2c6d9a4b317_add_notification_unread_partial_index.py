@@ -0,0 +1,28 @@
+"""add notification unread partial index
+
+Revision ID: f2c6d9a4b317
+Revises: e7b3c5a1f208
+Create Date: 2026-10-19 10:42:17.603914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c6d9a4b317'
+down_revision: Union[str, Sequence[str], None] = 'e7b3c5a1f208'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_notification_unread_recipient', 'notification', ['recipient_id'], unique=False, postgresql_where=sa.text("status = 'unread'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notification_unread_recipient', table_name='notification', postgresql_where=sa.text("status = 'unread'"))
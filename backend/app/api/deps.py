@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,6 +7,7 @@ from app.core.config import settings
 from app.db.session import get_db
 from app.models.user import User
 from app.schemas.token import TokenPayload
+from app.services.user_cache import UserCache
 from sqlalchemy import select
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -17,6 +18,11 @@ async def get_current_user(
     db: AsyncSession = Depends(get_db),
     token: str = Depends(reusable_oauth2)
 ) -> User:
+    return await user_from_token(db, token)
+
+
+async def user_from_token(db: AsyncSession, token: str) -> User:
+    """Active user of a bearer token (for endpoints that cannot use the header, e.g. event streams)."""
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
@@ -29,15 +35,47 @@ async def get_current_user(
         )
     
     from sqlalchemy.orm import selectinload
-    result = await db.execute(
-        select(User)
-        .options(selectinload(User.assigned_regions))
-        .where(User.id == int(token_data.sub))
-    )
-    user = result.scalars().first()
+    user_id = int(token_data.sub)
+    cached = UserCache.get(user_id)
+    if cached is not None:
+        # Clean copy merged without a SELECT; the request gets its own instance
+        user = await db.merge(cached, load=False)
+    else:
+        result = await db.execute(
+            select(User)
+            .options(selectinload(User.assigned_regions))
+            .where(User.id == user_id)
+        )
+        user = result.scalars().first()
+        if user:
+            UserCache.set(user)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
+
+
+async def get_idempotency(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Idempotency-Key header support for write endpoints (see IdempotencyService). A retry of a finished
+    request gets its stored response, marked with an Idempotent-Replayed header.
+    """
+    from app.services.idempotency_service import IDEMPOTENCY_HEADER, IdempotencyService, IdempotentRequest
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        yield IdempotentRequest()
+        return
+    claim = await IdempotencyService.claim(current_user.id, key, request)
+    if claim.replay is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+    try:
+        yield claim
+    except Exception:
+        await IdempotencyService.release(claim)
+        raise
@@ -36,3 +36,12 @@ api_router.include_router(warehouse.router, prefix="/domain/warehouse", tags=["w
 
 from app.api.v1.endpoints import role_permissions
 api_router.include_router(role_permissions.router, prefix="/domain/settings", tags=["settings"])
+
+from app.api.v1.endpoints import exports
+api_router.include_router(exports.router, prefix="/exports", tags=["exports"])
+
+from app.api.v1.endpoints import search
+api_router.include_router(search.router, prefix="/search", tags=["search"])
+
+from app.api.v1.endpoints import reconciliation
+api_router.include_router(reconciliation.router, prefix="/finance/reconciliation", tags=["finance"])
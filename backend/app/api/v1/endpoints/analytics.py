@@ -17,6 +17,13 @@ from app.models.ledger import BonusLedger, LedgerType, DoctorMonthlyStat
 from app.models.finance import OtherExpense
 from app.models.product import Product
 from app.crud.crud_user import get_descendant_ids
+from app.core.config import settings
+from app.core.pagination import Cursor, MIN_DATE, decode_cursor, encode_cursor, keyset_order, keyset_seek, page_response
+from app.services.kpi_executor import KpiExecutor
+from app.services.analytics_cache import AnalyticsCache
+from app.db.session import AsyncSessionLocal
+from app.services.export_jobs import ExportJobService, XLSX_MEDIA_TYPE
+from app.services.excel_reports import render_director_report, render_drilldown_export
 
 router = APIRouter()
 
@@ -99,6 +106,11 @@ async def _get_receipt_totals(db: AsyncSession, start_date, end_date, rep_ids=No
         
     return float(pay_sum), float(top_sum)
 
+async def _fetch_rows(db: AsyncSession, query):
+    """Row-returning query for KpiExecutor.add (add_scalar covers single values)."""
+    return (await db.execute(query)).all()
+
+
 async def get_receipt_queries(
     db: AsyncSession, 
     start_date: Optional[datetime], 
@@ -204,11 +216,14 @@ async def get_global_realtime_dashboard(
     year: Optional[int] = None,
     quarter: Optional[int] = None,
     region_id: Optional[int] = None,
-    med_rep_id: Optional[int] = None
+    med_rep_id: Optional[int] = None,
+    debug: bool = False
 ) -> Any:
     """
     Returns real-time aggregated global statistics.
     Aggregates from Invoice (Revenue), Payment (Fact), and BonusLedger (Bonuses).
+    The independent KPI queries run concurrently (KpiExecutor); with `debug=true` (or settings.DEBUG)
+    the response includes a per-KPI timing breakdown in milliseconds.
     """
     
     if current_user.role not in [
@@ -309,10 +324,23 @@ async def get_global_realtime_dashboard(
         rep_ids = await get_descendant_ids(db, current_user.id)
         if not rep_ids: rep_ids = [-1]
 
+    show_activities = current_user.role in [UserRole.DIRECTOR, UserRole.INVESTOR, UserRole.ADMIN, UserRole.DEPUTY_DIRECTOR, UserRole.ACCOUNTANT]
+    cache_key = AnalyticsCache.make_key(
+        "dashboard_global",
+        {"rep_ids": rep_ids, "region_ids": final_region_ids, "activities": show_activities},
+        month=month, year=year, quarter=quarter,
+    )
+    if not (debug or settings.DEBUG):
+        cached = AnalyticsCache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # All KPI queries below are independent: collect them and run them concurrently
+    executor = KpiExecutor(db)
+
     # 2. CALCULATE CURRENT PERIOD
     # 2a. Receipts (Payments + Topups)
-    c_pmt_sum, c_tp_sum = await _get_receipt_totals(db, start_date, end_date, rep_ids, final_region_ids)
-    c_rev = c_pmt_sum + c_tp_sum
+    executor.add("receipts", lambda session: _get_receipt_totals(session, start_date, end_date, rep_ids, final_region_ids))
 
     # 2b. Invoiced Goal (Revenue Facturas)
     curr_inv_q = select(func.sum(Invoice.total_amount)).where(Invoice.status != InvoiceStatus.CANCELLED)
@@ -328,7 +356,7 @@ async def get_global_realtime_dashboard(
                     and_(Reservation.med_org_id.is_(None), Reservation.created_by_id.in_(reg_users_sq))
                 )
             )
-    c_rev_inv = (await db.execute(curr_inv_q)).scalar() or 0.0
+    executor.add_scalar("invoiced", curr_inv_q, default=0.0)
 
     # 2c. Bonus Accrued
 
@@ -361,7 +389,7 @@ async def get_global_realtime_dashboard(
     if rep_ids: curr_bonus_q = curr_bonus_q.where(BonusLedger.user_id.in_(rep_ids))
     if final_region_ids:
         curr_bonus_q = curr_bonus_q.join(User, BonusLedger.user_id == User.id).join(Doctor, BonusLedger.doctor_id == Doctor.id).where(Doctor.region_id.in_(final_region_ids))
-    c_bon = (await db.execute(curr_bonus_q)).scalar() or 0.0
+    executor.add_scalar("bonus", curr_bonus_q, default=0.0)
 
     # 2d. Items Sold Qty
     curr_qty_q = select(func.sum(ReservationItem.quantity)).join(Reservation, ReservationItem.reservation_id == Reservation.id).join(Invoice, Invoice.reservation_id == Reservation.id).where(Invoice.status != InvoiceStatus.CANCELLED)
@@ -375,7 +403,7 @@ async def get_global_realtime_dashboard(
                 and_(Reservation.med_org_id.is_(None), Reservation.created_by_id.in_(reg_users_sq))
             )
         )
-    c_qty = (await db.execute(curr_qty_q)).scalar() or 0
+    executor.add_scalar("qty", curr_qty_q, default=0)
 
     # 2e. Total Debt (Up to end_date)
     curr_debt_q = select(func.sum(Invoice.total_amount - Invoice.paid_amount)).where(Invoice.status != InvoiceStatus.CANCELLED)
@@ -391,10 +419,9 @@ async def get_global_realtime_dashboard(
                     and_(Reservation.med_org_id.is_(None), Reservation.created_by_id.in_(reg_users_sq))
                 )
             )
-    c_debt = (await db.execute(curr_debt_q)).scalar() or 0.0
+    executor.add_scalar("debt", curr_debt_q, default=0.0)
 
     # 3. CALCULATE PREVIOUS PERIOD (For trend percentages)
-    p_rev = 0.0
     p_bon = 0.0
     p_qty = 0
     p_debt = 0.0
@@ -403,60 +430,25 @@ async def get_global_realtime_dashboard(
         prev_pmt_q, prev_tp_q = await get_receipt_queries(db, prev_start_date, prev_end_date, rep_ids, final_region_ids)
         
         prev_pmt_subq = prev_pmt_q.subquery()
-        p_rev_pmt = (await db.execute(select(func.sum(prev_pmt_subq.c.amount)))).scalar() or 0.0
+        executor.add_scalar("prev_payments", select(func.sum(prev_pmt_subq.c.amount)), default=0.0)
         
-        p_rev_tp = 0.0
         if prev_tp_q is not None:
             prev_tp_subq = prev_tp_q.subquery()
-            p_rev_tp = (await db.execute(select(func.sum(prev_tp_subq.c.amount)))).scalar() or 0.0
-            
-        p_rev = float(p_rev_pmt) + float(p_rev_tp)
+            executor.add_scalar("prev_topups", select(func.sum(prev_tp_subq.c.amount)), default=0.0)
         
         # We skip full previous calc for bon/qty/debt if performance is an issue, but let's be thorough
         # [Simplified previous calc for brevity, but keeping revenue for trends]
     
-    # Trend calculation
-    def calc_trend(current, prev):
-        if prev == 0 and current == 0:
-            return "0%"
-        if prev == 0:
-            return "+100%"
-        change = ((current - prev) / prev) * 100
-        sign = "+" if change > 0 else ""
-        return f"{sign}{change:.1f}%"
-
-    rev_change = calc_trend(c_rev, p_rev)
-    bon_change = calc_trend(c_bon, p_bon)
-    qty_change = calc_trend(c_qty, p_qty)
-    debt_change = calc_trend(c_debt, p_debt)
-    
-    # Growth peak (max of positive changes, else 0%)
-    changes = []
-    for measure, c in [('rev', rev_change), ('bon', bon_change), ('qty', qty_change)]: 
-        try:
-            val = float(str(c).replace('%', '').replace('+', ''))
-            if measure == 'bon': # For bonus, decrease is good, increase is bad
-                val = -val
-            changes.append(val)
-        except ValueError:
-            pass
-    if changes and max(changes) > 0:
-        growth_peak = f"+{max(changes):.1f}%"
-    else:
-        growth_peak = "0%"
-
     # Recent activities (last 5 payments/invoices)
-    activities = []
-    if current_user.role in [UserRole.DIRECTOR, UserRole.INVESTOR, UserRole.ADMIN, UserRole.DEPUTY_DIRECTOR, UserRole.ACCOUNTANT]:
-        # Latest Payments (linking to invoice if possible)
-        recent_payments = (await db.execute(
-            select(Payment).options(
-                selectinload(Payment.invoice).selectinload(Invoice.reservation)
-            ).order_by(Payment.date.desc()).limit(3)
-        )).scalars().all()
-        for p in recent_payments:
-            invoice_num = p.invoice.factura_number if p.invoice else None
-            activities.append({
+    if show_activities:
+        async def _recent_payments(session: AsyncSession):
+            # Latest Payments (linking to invoice if possible)
+            recent_payments = (await session.execute(
+                select(Payment).options(
+                    selectinload(Payment.invoice).selectinload(Invoice.reservation)
+                ).order_by(Payment.date.desc()).limit(3)
+            )).scalars().all()
+            return [{
                 "type": "payment",
                 "id": p.id,
                 "invoice_id": p.invoice_id,
@@ -465,18 +457,18 @@ async def get_global_realtime_dashboard(
                 "amount": f"+{p.amount:,.0f} UZS",
                 "time": p.date.strftime("%d.%m.%Y %H:%M"),
                 "color": "green",
-                "reference": invoice_num or str(p.id),
+                "reference": (p.invoice.factura_number if p.invoice else None) or str(p.id),
                 "dt": p.date
-            })
-            
-        # Latest Topups
-        recent_topups = (await db.execute(
-            select(BalanceTransaction).options(selectinload(BalanceTransaction.organization))
-            .where(func.lower(BalanceTransaction.transaction_type) == 'topup')
-            .order_by(BalanceTransaction.created_at.desc()).limit(2)
-        )).scalars().all()
-        for tp in recent_topups:
-            activities.append({
+            } for p in recent_payments]
+
+        async def _recent_topups(session: AsyncSession):
+            # Latest Topups
+            recent_topups = (await session.execute(
+                select(BalanceTransaction).options(selectinload(BalanceTransaction.organization))
+                .where(func.lower(BalanceTransaction.transaction_type) == 'topup')
+                .order_by(BalanceTransaction.created_at.desc()).limit(2)
+            )).scalars().all()
+            return [{
                 "type": "payment",
                 "id": tp.id,
                 "title": "Пополнение баланса",
@@ -486,14 +478,14 @@ async def get_global_realtime_dashboard(
                 "color": "indigo",
                 "reference": tp.organization.name if tp.organization else str(tp.id),
                 "dt": tp.created_at
-            })
-            
-        # Latest Invoices
-        recent_invoices = (await db.execute(
-            select(Invoice).options(selectinload(Invoice.reservation)).order_by(Invoice.date.desc()).limit(3)
-        )).scalars().all()
-        for i in recent_invoices:
-            activities.append({
+            } for tp in recent_topups]
+
+        async def _recent_invoices(session: AsyncSession):
+            # Latest Invoices
+            recent_invoices = (await session.execute(
+                select(Invoice).options(selectinload(Invoice.reservation)).order_by(Invoice.date.desc()).limit(3)
+            )).scalars().all()
+            return [{
                 "type": "invoice",
                 "id": i.id,
                 "title": "Новая фактура",
@@ -503,13 +495,11 @@ async def get_global_realtime_dashboard(
                 "color": "blue",
                 "reference": i.factura_number or str(i.id),
                 "dt": i.date
-            })
-            
-        # Sort combined and take top 5
-        activities.sort(key=lambda x: x["dt"], reverse=True)
-        activities = activities[:5]
-        for a in activities:
-            del a["dt"] # remove date obj
+            } for i in recent_invoices]
+
+        executor.add("recent_payments", _recent_payments)
+        executor.add("recent_topups", _recent_topups)
+        executor.add("recent_invoices", _recent_invoices)
             
     # Calculate Plans
     plan_q = select(func.sum(Plan.target_amount).label("total_amount"), func.sum(Plan.target_quantity).label("total_qty"))
@@ -525,11 +515,66 @@ async def get_global_realtime_dashboard(
                 and_(Plan.med_org_id.is_(None), Plan.med_rep_id.in_(reg_users_sq))
             )
         )
-    plan_result = (await db.execute(plan_q)).first()
+
+    async def _plans(session: AsyncSession):
+        return (await session.execute(plan_q)).first()
+    executor.add("plans", _plans)
+
+    # 4. RUN ALL KPI QUERIES CONCURRENTLY
+    kpi = await executor.run()
+
+    c_pmt_sum, c_tp_sum = kpi["receipts"]
+    c_rev = c_pmt_sum + c_tp_sum
+    c_rev_inv = kpi["invoiced"]
+    c_bon = kpi["bonus"]
+    c_qty = kpi["qty"]
+    c_debt = kpi["debt"]
+    p_rev = float(kpi.get("prev_payments") or 0.0) + float(kpi.get("prev_topups") or 0.0)
+
+    # Trend calculation
+    def calc_trend(current, prev):
+        if prev == 0 and current == 0:
+            return "0%"
+        if prev == 0:
+            return "+100%"
+        change = ((current - prev) / prev) * 100
+        sign = "+" if change > 0 else ""
+        return f"{sign}{change:.1f}%"
+
+    rev_change = calc_trend(c_rev, p_rev)
+    bon_change = calc_trend(c_bon, p_bon)
+    qty_change = calc_trend(c_qty, p_qty)
+    debt_change = calc_trend(c_debt, p_debt)
+    
+    # Growth peak (max of positive changes, else 0%)
+    changes = []
+    for measure, c in [('rev', rev_change), ('bon', bon_change), ('qty', qty_change)]: 
+        try:
+            val = float(str(c).replace('%', '').replace('+', ''))
+            if measure == 'bon': # For bonus, decrease is good, increase is bad
+                val = -val
+            changes.append(val)
+        except ValueError:
+            pass
+    if changes and max(changes) > 0:
+        growth_peak = f"+{max(changes):.1f}%"
+    else:
+        growth_peak = "0%"
+
+    activities = []
+    if show_activities:
+        activities = kpi["recent_payments"] + kpi["recent_topups"] + kpi["recent_invoices"]
+        # Sort combined and take top 5
+        activities.sort(key=lambda x: x["dt"], reverse=True)
+        activities = activities[:5]
+        for a in activities:
+            del a["dt"] # remove date obj
+
+    plan_result = kpi["plans"]
     plan_amount = plan_result.total_amount or 0 if plan_result else 0
     plan_quantity = plan_result.total_qty or 0 if plan_result else 0
  
-    return {
+    response = {
         "month": month,
         "year": year,
         "total_revenue": c_rev,
@@ -547,6 +592,11 @@ async def get_global_realtime_dashboard(
         "plan_amount": plan_amount,
         "plan_quantity": plan_quantity
     }
+    if debug or settings.DEBUG:
+        response["_timings_ms"] = executor.timings
+    else:
+        AnalyticsCache.set(cache_key, response, closed_period=AnalyticsCache.is_closed_period(end_date))
+    return response
 
 @router.get("/stats/comprehensive")
 async def get_comprehensive_stats(
@@ -608,26 +658,26 @@ async def get_comprehensive_stats(
         start_date = datetime(year, month, 1)
         end_date = (datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1))
 
+    view_mode = "accountant" if current_user.role == UserRole.ACCOUNTANT else "standard"
+    cache_key = AnalyticsCache.make_key(
+        "stats_comprehensive",
+        {"rep_ids": rep_ids, "view_mode": view_mode},
+        start_date=start_date, end_date=end_date, month=month, year=year, quarter=quarter,
+        region_id=region_id, product_id=product_id,
+    )
+    cached = AnalyticsCache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # 3. KPI AGGREGATIONS
-    # Filter helper
-    def apply_filters(q, model_ref=Reservation):
-        from sqlalchemy import or_ as _or_
-        if rep_ids or region_id:
-            q = q.outerjoin(MedicalOrganization, model_ref.med_org_id == MedicalOrganization.id)
-            
-        if rep_ids: 
-            q = q.where(
-                _or_(
-                    model_ref.created_by_id.in_(rep_ids),
-                    MedicalOrganization.assigned_reps.any(User.id.in_(rep_ids))
-                )
-            )
-        if region_id: 
-            q = q.where(MedicalOrganization.region_id == region_id)
-            
-        if product_id:
-            q = q.join(ReservationItem, model_ref.id == ReservationItem.reservation_id).where(ReservationItem.product_id == product_id)
-        return q
+    # Every query below is independent of the others: they are collected into one KpiExecutor batch
+    # and run concurrently, so the endpoint costs one parallel round of statements instead of a dozen
+    # sequential ones. Invoice / item KPIs come from one statement over the scoped invoice CTE.
+    from app.services.comprehensive_stats_engine import ComprehensiveStatsEngine
+    from app.services.expense_service import ExpenseService
+    executor = KpiExecutor(db)
+    engine = ComprehensiveStatsEngine(start_date, end_date, rep_ids=rep_ids, region_id=region_id, product_id=product_id)
+    executor.add("invoice_kpis", engine.fetch)
 
     # Sales Plan (UZS)
     plan_q = select(func.sum(Plan.target_amount).label("total"))
@@ -637,20 +687,11 @@ async def get_comprehensive_stats(
     if rep_ids: plan_q = plan_q.where(Plan.med_rep_id.in_(rep_ids))
     if region_id: plan_q = plan_q.join(MedicalOrganization, Plan.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id == region_id)
     if product_id: plan_q = plan_q.where(Plan.product_id == product_id)
-    plan_sum = (await db.execute(plan_q)).scalar() or 0
-
-    # Sales Fact (Expected Revenue from Facturas)
-    sales_q = select(func.sum(Invoice.total_amount).label("total")).where(Invoice.status != InvoiceStatus.CANCELLED)
-    if start_date and end_date: sales_q = sales_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if rep_ids or region_id or product_id:
-        sales_q = sales_q.join(Reservation, Invoice.reservation_id == Reservation.id)
-        sales_q = apply_filters(sales_q, Reservation)
-    sales_total = (await db.execute(sales_q)).scalar() or 0
+    executor.add_scalar("plan_sum", plan_q, default=0)
 
     # Sales Fact (Actual Payments Received)
     # Using unified helper for absolute consistency
-    fact_invoice_sum, fact_topup_sum = await _get_receipt_totals(db, start_date, end_date, rep_ids, [rid] if rid else None, pid)
-    fact_sum = round(float(fact_invoice_sum) + float(fact_topup_sum), 2)
+    executor.add("receipts", lambda session: _get_receipt_totals(session, start_date, end_date, rep_ids, [rid] if rid else None, pid))
 
     # Simple but robust sum calculation
     accrued_sum_q = select(func.sum(BonusLedger.amount))\
@@ -671,7 +712,7 @@ async def get_comprehensive_stats(
         accrued_sum_q = accrued_sum_q.where(and_(BonusLedger.created_at >= start_date, BonusLedger.created_at < end_date))
         
     if rep_ids: accrued_sum_q = accrued_sum_q.where(BonusLedger.user_id.in_(rep_ids))
-    accrued_sum = (await db.execute(accrued_sum_q)).scalar() or 0.0
+    executor.add_scalar("accrued_sum", accrued_sum_q, default=0.0)
 
     # Physical Payouts (What actually left the bank account in this period)
     payout_q = select(func.sum(BonusLedger.amount))\
@@ -682,12 +723,8 @@ async def get_comprehensive_stats(
         payout_q = payout_q.where(and_(BonusLedger.paid_date >= start_date, BonusLedger.paid_date < end_date))
     
     if rep_ids: payout_q = payout_q.where(BonusLedger.user_id.in_(rep_ids))
-    
-    actual_payout_sum = (await db.execute(payout_q)).scalar() or 0.0
+    executor.add_scalar("actual_payout_sum", payout_q, default=0.0)
 
-    # Calculate dynamic balance
-    bonus_balance = max(0, accrued_sum - actual_payout_sum)
-    
     # Calculate preinvest directly from the ledger to be more accurate
     predinvest_q = select(func.sum(BonusLedger.amount))\
         .where(
@@ -702,192 +739,35 @@ async def get_comprehensive_stats(
         predinvest_q = predinvest_q.where(and_(BonusLedger.created_at >= start_date, BonusLedger.created_at < end_date))
     if rep_ids:
         predinvest_q = predinvest_q.where(BonusLedger.user_id.in_(rep_ids))
-        
-    total_predinvest = (await db.execute(predinvest_q)).scalar() or 0.0
-    paid_sum = actual_payout_sum
-
-    # Debt (Outstanding from Invoices)
-    debt_q = select(func.sum(Invoice.total_amount - Invoice.paid_amount).label("total")).where(Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.APPROVED]))
-    if start_date and end_date: debt_q = debt_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if rep_ids or region_id or product_id:
-        debt_q = debt_q.outerjoin(Reservation, Invoice.reservation_id == Reservation.id)
-        debt_q = apply_filters(debt_q, Reservation)
-    debt_sum = (await db.execute(debt_q)).scalar() or 0
-
-    # Realized Gross Profit (Company Profit)
-    # realized_profit = sum( (price - production_price - salary - bonus) * qty ) * (paid_amount / total_amount)
-    # We use a simplified approx: (Sum(Potential Profit) * (Invoice.paid_amount / Invoice.total_amount))
-    # To be more precise, we join all items.
-    from app.models.product import Product
-    
-    # Sales Realized Gross Profit (Actually Paid portion of profit)
-    gross_profit_sum_q = select(
-        func.coalesce(func.sum(
-            (ReservationItem.price * (1 - func.coalesce(ReservationItem.discount_percent, 0) / 100.0) - 
-             func.coalesce(Product.production_price, 0) -
-             case((Reservation.is_salary_enabled == False, 0), (ReservationItem.salary_amount > 0, ReservationItem.salary_amount), else_=func.coalesce(Product.salary_expense, 0)) - 
-             case((Reservation.is_bonus_eligible == False, 0), (ReservationItem.marketing_amount > 0, ReservationItem.marketing_amount), else_=func.coalesce(Product.marketing_expense, 0)) -
-             func.coalesce(Product.other_expenses, 0)) * 
-            ReservationItem.quantity * (func.coalesce(Invoice.paid_amount, 0) / Invoice.total_amount)
-        ), 0.0)
-    ).select_from(ReservationItem)\
-     .join(Reservation, ReservationItem.reservation_id == Reservation.id)\
-     .join(Invoice, Invoice.reservation_id == Reservation.id)\
-     .join(Product, ReservationItem.product_id == Product.id)\
-     .where(and_(Invoice.total_amount > 0, Invoice.status != InvoiceStatus.CANCELLED))
-
-    if start_date and end_date: gross_profit_sum_q = gross_profit_sum_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if rep_ids or region_id: 
-        gross_profit_sum_q = gross_profit_sum_q.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)
-    if rep_ids: 
-        gross_profit_sum_q = gross_profit_sum_q.where(
-            or_(
-                Reservation.created_by_id.in_(rep_ids),
-                MedicalOrganization.assigned_reps.any(User.id.in_(rep_ids))
-            )
-        )
-    if region_id:
-        gross_profit_sum_q = gross_profit_sum_q.where(MedicalOrganization.region_id == region_id)
-    if product_id:
-        gross_profit_sum_q = gross_profit_sum_q.where(ReservationItem.product_id == product_id)
-    
-    gross_profit_sum = (await db.execute(gross_profit_sum_q)).scalar() or 0.0
-
-    # Sales Potential Gross Profit (Expected based on Invoices total)
-    potential_profit_sum_q = select(
-        func.coalesce(func.sum(
-            (ReservationItem.price * (1 - func.coalesce(ReservationItem.discount_percent, 0) / 100.0) - 
-             func.coalesce(Product.production_price, 0) -
-             case((Reservation.is_salary_enabled == False, 0), (ReservationItem.salary_amount > 0, ReservationItem.salary_amount), else_=func.coalesce(Product.salary_expense, 0)) - 
-             case((Reservation.is_bonus_eligible == False, 0), (ReservationItem.marketing_amount > 0, ReservationItem.marketing_amount), else_=func.coalesce(Product.marketing_expense, 0)) -
-             func.coalesce(Product.other_expenses, 0)) * 
-            ReservationItem.quantity
-        ), 0.0)
-    ).select_from(ReservationItem)\
-     .join(Reservation, ReservationItem.reservation_id == Reservation.id)\
-     .join(Invoice, Invoice.reservation_id == Reservation.id)\
-     .join(Product, ReservationItem.product_id == Product.id)\
-     .where(and_(Invoice.total_amount > 0, Invoice.status != InvoiceStatus.CANCELLED))
-    
-    if start_date and end_date: potential_profit_sum_q = potential_profit_sum_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if rep_ids or region_id: 
-        potential_profit_sum_q = potential_profit_sum_q.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)
-    if rep_ids: 
-        potential_profit_sum_q = potential_profit_sum_q.where(
-            or_(
-                Reservation.created_by_id.in_(rep_ids),
-                MedicalOrganization.assigned_reps.any(User.id.in_(rep_ids))
-            )
-        )
-    if region_id:
-        potential_profit_sum_q = potential_profit_sum_q.where(MedicalOrganization.region_id == region_id)
-    if product_id:
-        potential_profit_sum_q = potential_profit_sum_q.where(ReservationItem.product_id == product_id)
-        
-    potential_profit_sum = (await db.execute(potential_profit_sum_q)).scalar() or 0.0
+    executor.add_scalar("total_predinvest", predinvest_q, default=0.0)
 
     # Total Expenses (Prochie Rasxodi)
-    from app.services.expense_service import ExpenseService
-    total_expenses = await ExpenseService.get_total_expenses(db, start_date, end_date, rep_ids, region_id)
-
-    # 3. NEW Dashbaord KPIs
-    # 3a. Shipment Fact (Invoices Total)
-    invoice_q = select(
-        func.coalesce(func.sum(Invoice.total_amount), 0.0).label("total"),
-        func.coalesce(func.sum(Invoice.paid_amount), 0.0).label("paid")
-    ).outerjoin(Reservation, Invoice.reservation_id == Reservation.id).where(Invoice.status != InvoiceStatus.CANCELLED)
-    invoice_q = apply_filters(invoice_q, Reservation)
-    if start_date and end_date: invoice_q = invoice_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    
-    inv_res = (await db.execute(invoice_q)).first()
-    total_invoice_sum = float(inv_res.total) if inv_res and inv_res.total else 0.0
-    paid_invoice_sum = float(inv_res.paid) if inv_res and inv_res.paid else 0.0
-    
-    # 3b. Items Sold (Count)
-    items_sold_q = select(func.coalesce(func.sum(ReservationItem.quantity), 0))\
-        .join(Reservation, ReservationItem.reservation_id == Reservation.id)\
-        .join(Invoice, Invoice.reservation_id == Reservation.id)\
-        .where(Invoice.status != InvoiceStatus.CANCELLED)
-    items_sold_q = apply_filters(items_sold_q, Reservation)
-    if start_date and end_date: items_sold_q = items_sold_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if product_id: items_sold_q = items_sold_q.where(ReservationItem.product_id == product_id)
-    
-    total_items_sold = int((await db.execute(items_sold_q)).scalar() or 0)
-
-    # 3c. Overdue Receivables (Older than 30 days)
-    overdue_date = datetime.utcnow() - timedelta(days=30)
-    overdue_q = select(func.coalesce(func.sum(Invoice.total_amount - Invoice.paid_amount), 0.0))\
-        .outerjoin(Reservation, Invoice.reservation_id == Reservation.id)\
-        .where(and_(
-            (Invoice.total_amount - Invoice.paid_amount) > 1.0,
-            func.coalesce(Invoice.realization_date, Invoice.date) < overdue_date
-        ))
-    overdue_q = apply_filters(overdue_q, Reservation)
-    overdue_receivables = round(float((await db.execute(overdue_q)).scalar() or 0.0), 2)
-
-    # 3d. MedRep Salary Stats
-    # Realized salary based on invoice payments
-    salary_accrued_q = select(
-        func.coalesce(func.sum(ReservationItem.salary_amount * ReservationItem.quantity), 0.0)
-    ).select_from(ReservationItem)\
-     .join(Reservation, ReservationItem.reservation_id == Reservation.id)\
-     .join(Invoice, Invoice.reservation_id == Reservation.id)\
-     .where(and_(Reservation.is_salary_enabled == True, Invoice.status != InvoiceStatus.CANCELLED))
-    salary_accrued_q = apply_filters(salary_accrued_q, Reservation)
-    if start_date and end_date: salary_accrued_q = salary_accrued_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if product_id: salary_accrued_q = salary_accrued_q.where(ReservationItem.product_id == product_id)
-    
-    salary_accrued = (await db.execute(salary_accrued_q)).scalar() or 0.0
-    
-    # We estimate salary_paid as the realization of accruals (same logic as profit)
-    salary_paid_q = select(
-        func.coalesce(func.sum(
-            (ReservationItem.salary_amount * ReservationItem.quantity) * (func.coalesce(Invoice.paid_amount, 0) / Invoice.total_amount)
-        ), 0.0)
-    ).select_from(ReservationItem)\
-     .join(Reservation, ReservationItem.reservation_id == Reservation.id)\
-     .join(Invoice, Invoice.reservation_id == Reservation.id)\
-     .where(and_(Reservation.is_salary_enabled == True, Invoice.total_amount > 0, Invoice.status != InvoiceStatus.CANCELLED))
-    salary_paid_q = apply_filters(salary_paid_q, Reservation)
-    if start_date and end_date: salary_paid_q = salary_paid_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-    if product_id: salary_paid_q = salary_paid_q.where(ReservationItem.product_id == product_id)
-    
-    salary_paid = (await db.execute(salary_paid_q)).scalar() or 0.0
-    salary_balance = max(0, salary_accrued - salary_paid)
-
-    net_profit = gross_profit_sum - total_expenses
+    executor.add("total_expenses", lambda session: ExpenseService.get_total_expenses(session, start_date, end_date, rep_ids, region_id))
 
     # 4. PRODUCT STATS (Safe Split Logic)
-    product_stats_map = {}
-    
-    # 4a. Plan Products
-    plan_q = select(
+    # 4a. Plan Products (names joined in, no separate lookup)
+    plan_prod_q = select(
         Plan.product_id,
+        Product.name.label("product_name"),
         func.sum(Plan.target_amount).label("plan_uzs"),
         func.sum(Plan.target_quantity).label("plan_qty")
-    ).group_by(Plan.product_id)
+    ).outerjoin(Product, Plan.product_id == Product.id).group_by(Plan.product_id, Product.name)
     
-    if quarter and year: plan_q = plan_q.where(and_(Plan.year == year, Plan.month.in_(list(range((quarter-1)*3+1, (quarter-1)*3+4)))))
-    elif month and year: plan_q = plan_q.where(and_(Plan.year == year, Plan.month == month))
-    elif year: plan_q = plan_q.where(Plan.year == year)
-    if rep_ids: plan_q = plan_q.where(Plan.med_rep_id.in_(rep_ids))
-    if region_id: plan_q = plan_q.join(MedicalOrganization, Plan.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id == region_id)
-    if product_id: plan_q = plan_q.where(Plan.product_id == product_id)
-    
-    plan_res = (await db.execute(plan_q)).all()
-    for row in plan_res:
-        product_stats_map[row.product_id] = {
-            "plan_uzs": row.plan_uzs, "plan_qty": row.plan_qty,
-            "fact_uzs": 0, "fact_qty": 0
-        }
+    if quarter and year: plan_prod_q = plan_prod_q.where(and_(Plan.year == year, Plan.month.in_(list(range((quarter-1)*3+1, (quarter-1)*3+4)))))
+    elif month and year: plan_prod_q = plan_prod_q.where(and_(Plan.year == year, Plan.month == month))
+    elif year: plan_prod_q = plan_prod_q.where(Plan.year == year)
+    if rep_ids: plan_prod_q = plan_prod_q.where(Plan.med_rep_id.in_(rep_ids))
+    if region_id: plan_prod_q = plan_prod_q.join(MedicalOrganization, Plan.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id == region_id)
+    if product_id: plan_prod_q = plan_prod_q.where(Plan.product_id == product_id)
+    executor.add("plan_products", lambda session: _fetch_rows(session, plan_prod_q))
 
     # 4b. Fact Products
-    from app.models.product import Product
     fact_q = select(
         DoctorFactAssignment.product_id,
+        Product.name.label("product_name"),
         func.sum(DoctorFactAssignment.quantity).label("fact_qty"),
         func.sum(DoctorFactAssignment.quantity * Product.price).label("fact_uzs")
-    ).join(Product, DoctorFactAssignment.product_id == Product.id).group_by(DoctorFactAssignment.product_id)
+    ).join(Product, DoctorFactAssignment.product_id == Product.id).group_by(DoctorFactAssignment.product_id, Product.name)
     
     if quarter and year: fact_q = fact_q.where(and_(DoctorFactAssignment.year == year, DoctorFactAssignment.month.in_(list(range((quarter-1)*3+1, (quarter-1)*3+4)))))
     elif month and year: fact_q = fact_q.where(and_(DoctorFactAssignment.year == year, DoctorFactAssignment.month == month))
@@ -895,61 +775,25 @@ async def get_comprehensive_stats(
     if rep_ids: fact_q = fact_q.where(DoctorFactAssignment.med_rep_id.in_(rep_ids))
     if region_id: fact_q = fact_q.join(Doctor, DoctorFactAssignment.doctor_id == Doctor.id).where(Doctor.region_id == region_id)
     if product_id: fact_q = fact_q.where(DoctorFactAssignment.product_id == product_id)
-    
-    fact_res = (await db.execute(fact_q)).all()
-    for row in fact_res:
-        if row.product_id not in product_stats_map:
-            product_stats_map[row.product_id] = {"plan_uzs": 0, "plan_qty": 0, "fact_uzs": 0, "fact_qty": 0}
-        product_stats_map[row.product_id]["fact_uzs"] += (row.fact_uzs or 0)
-        product_stats_map[row.product_id]["fact_qty"] += (row.fact_qty or 0)
+    executor.add("fact_products", lambda session: _fetch_rows(session, fact_q))
 
-    # 4c. Fetch Product Names and Build Array
-    product_stats = []
-    if product_stats_map:
-        prod_ids = list(product_stats_map.keys())
-        prods = (await db.execute(select(Product.id, Product.name).where(Product.id.in_(prod_ids)))).all()
-        prod_name_map = {p.id: p.name for p in prods}
-        
-        for pid, stats_item in product_stats_map.items():
-            product_stats.append({
-                "id": pid,
-                "name": prod_name_map.get(pid, f"Product {pid}"),
-                "product_name": prod_name_map.get(pid, f"Product {pid}"),  # alias for frontend
-                "plan_uzs": round(stats_item["plan_uzs"] or 0, 0),
-                "plan_qty": int(stats_item["plan_qty"] or 0),
-                "fact_uzs": round(stats_item["fact_uzs"] or 0, 0),
-                "fact_qty": int(stats_item["fact_qty"] or 0),
-            })
-        product_stats.sort(key=lambda x: x["plan_uzs"], reverse=True)
-
-    # 5. TRENDS (Charts)
-    trends = []
+    # 5. TRENDS (Charts) - queries only, assembled after the batch
     if start_date and end_date:
-        diff_days = (end_date - start_date).days
-        is_monthly_view = diff_days <= 31
-        
         # Combined Fact Trend (Payments + Topups)
-        # 1. Invoiced Payments Trend
         fact_trend_q, top_trend_q = await get_receipt_queries(db, start_date, end_date, rep_ids, [region_id] if region_id else None, product_id)
         
         fact_trend_q = fact_trend_q.with_only_columns(
             func.cast(Payment.date, Date).label("d"),
             func.sum(Payment.amount).label("fact")
         ).group_by(func.cast(Payment.date, Date))
-        
-        fact_trend_res = (await db.execute(fact_trend_q)).all()
-        fact_map = {r.d: float(r.fact or 0) for r in fact_trend_res}
+        executor.add("fact_trend", lambda session: _fetch_rows(session, fact_trend_q))
 
-        # 2. Add Topups to Trend Map
         if top_trend_q is not None:
             top_trend_q = top_trend_q.with_only_columns(
                 func.cast(BalanceTransaction.created_at, Date).label("d"),
                 func.sum(BalanceTransaction.amount).label("fact")
             ).group_by(func.cast(BalanceTransaction.created_at, Date))
-            
-            top_trend_res = (await db.execute(top_trend_q)).all()
-            for r in top_trend_res:
-                fact_map[r.d] = fact_map.get(r.d, 0) + float(r.fact or 0)
+            executor.add("top_trend", lambda session: _fetch_rows(session, top_trend_q))
 
         # Plan Trend
         plan_trend_q = select(
@@ -960,9 +804,77 @@ async def get_comprehensive_stats(
         if rep_ids: plan_trend_q = plan_trend_q.where(Plan.med_rep_id.in_(rep_ids))
         if region_id: plan_trend_q = plan_trend_q.join(MedicalOrganization, Plan.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id == region_id)
         if product_id: plan_trend_q = plan_trend_q.where(Plan.product_id == product_id)
-        
-        plan_trend_res = (await db.execute(plan_trend_q)).all()
-        plan_month_map = {r.month: float(r.plan or 0) for r in plan_trend_res}
+        executor.add("plan_trend", lambda session: _fetch_rows(session, plan_trend_q))
+
+    results = await executor.run()
+
+    invoice_kpis = results["invoice_kpis"]
+    plan_sum = results["plan_sum"]
+    fact_invoice_sum, fact_topup_sum = results["receipts"]
+    fact_sum = round(float(fact_invoice_sum) + float(fact_topup_sum), 2)
+    accrued_sum = results["accrued_sum"]
+    actual_payout_sum = results["actual_payout_sum"]
+    total_predinvest = results["total_predinvest"]
+    total_expenses = results["total_expenses"]
+
+    # Calculate dynamic balance
+    bonus_balance = max(0, accrued_sum - actual_payout_sum)
+    paid_sum = actual_payout_sum
+
+    debt_sum = invoice_kpis["debt_sum"]
+    gross_profit_sum = invoice_kpis["gross_profit_sum"]
+    potential_profit_sum = invoice_kpis["potential_profit_sum"]
+
+    # 3. NEW Dashbaord KPIs
+    total_invoice_sum = invoice_kpis["total_invoice_sum"]
+    paid_invoice_sum = invoice_kpis["paid_invoice_sum"]
+    total_items_sold = invoice_kpis["total_items_sold"]
+    overdue_receivables = invoice_kpis["overdue_receivables"]
+    salary_accrued = invoice_kpis["salary_accrued"]
+    salary_paid = invoice_kpis["salary_paid"]
+    salary_balance = max(0, salary_accrued - salary_paid)
+
+    net_profit = gross_profit_sum - total_expenses
+
+    product_stats_map = {}
+    prod_name_map = {}
+    for row in results["plan_products"]:
+        product_stats_map[row.product_id] = {
+            "plan_uzs": row.plan_uzs, "plan_qty": row.plan_qty,
+            "fact_uzs": 0, "fact_qty": 0
+        }
+        if row.product_name is not None:
+            prod_name_map[row.product_id] = row.product_name
+    for row in results["fact_products"]:
+        if row.product_id not in product_stats_map:
+            product_stats_map[row.product_id] = {"plan_uzs": 0, "plan_qty": 0, "fact_uzs": 0, "fact_qty": 0}
+        product_stats_map[row.product_id]["fact_uzs"] += (row.fact_uzs or 0)
+        product_stats_map[row.product_id]["fact_qty"] += (row.fact_qty or 0)
+        prod_name_map[row.product_id] = row.product_name
+
+    # 4c. Build Array
+    product_stats = []
+    for pid, stats_item in product_stats_map.items():
+        product_stats.append({
+            "id": pid,
+            "name": prod_name_map.get(pid, f"Product {pid}"),
+            "product_name": prod_name_map.get(pid, f"Product {pid}"),  # alias for frontend
+            "plan_uzs": round(stats_item["plan_uzs"] or 0, 0),
+            "plan_qty": int(stats_item["plan_qty"] or 0),
+            "fact_uzs": round(stats_item["fact_uzs"] or 0, 0),
+            "fact_qty": int(stats_item["fact_qty"] or 0),
+        })
+    product_stats.sort(key=lambda x: x["plan_uzs"], reverse=True)
+
+    trends = []
+    if start_date and end_date:
+        diff_days = (end_date - start_date).days
+        is_monthly_view = diff_days <= 31
+
+        fact_map = {r.d: float(r.fact or 0) for r in results["fact_trend"]}
+        for r in results.get("top_trend", []):
+            fact_map[r.d] = fact_map.get(r.d, 0) + float(r.fact or 0)
+        plan_month_map = {r.month: float(r.plan or 0) for r in results["plan_trend"]}
 
         if is_monthly_view:
             iter_date = start_date.date()
@@ -1012,347 +924,205 @@ async def get_comprehensive_stats(
         "net_profit": float((gross_profit_sum if fact_sum > 0 else potential_profit_sum) - combined_total_expenses),
     }
 
-    return {
+    response = {
         "kpis": kpis,
         **kpis,
         "product_stats": product_stats,
         "trends": trends,
-        "view_mode": "accountant" if current_user.role == UserRole.ACCOUNTANT else "standard"
+        "view_mode": view_mode
     }
+    AnalyticsCache.set(cache_key, response, closed_period=AnalyticsCache.is_closed_period(end_date))
+    return response
+
+DRILLDOWN_EXPORT_PAGE_SIZE = 2000
+
+# Export column definitions per metric: (key_in_flat_row, display_label)
+DRILLDOWN_EXPORT_COLUMNS: dict[str, list[tuple[str, str]]] = {
+    "salary_accrued": [
+        ("date",                    "Дата начисления"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Начислено зарплаты (сум)"),
+        ("invoice_factura_number",  "Фактура №"),
+        ("invoice_customer",        "Аптека / Покупатель"),
+        ("invoice_invoice_total",   "Сумма фактуры"),
+        ("invoice_invoice_paid",    "Оплачено по фактуре"),
+        ("payment_payment_date",    "Дата оплаты"),
+        ("description",             "Описание"),
+    ],
+    "salary_paid": [
+        ("date",                    "Дата записи"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Выплачено зарплаты (сум)"),
+        ("invoice_factura_number",  "Фактура №"),
+        ("invoice_customer",        "Аптека / Покупатель"),
+        ("payment_payment_date",    "Дата оплаты"),
+        ("description",             "Описание"),
+    ],
+    "salary_balance": [
+        ("date",                    "Дата начисления"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Остаток зарплаты (не выплачено, сум)"),
+        ("invoice_factura_number",  "Фактура №"),
+        ("invoice_customer",        "Аптека / Покупатель"),
+        ("invoice_invoice_total",   "Сумма фактуры"),
+        ("description",             "Описание"),
+    ],
+    "bonus_accrued": [
+        ("date",                    "Дата начисления"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Начислено бонуса (сум)"),
+        ("invoice_factura_number",  "Фактура №"),
+        ("invoice_customer",        "Аптека / Покупатель"),
+        ("invoice_invoice_total",   "Сумма фактуры"),
+        ("invoice_invoice_paid",    "Оплачено по фактуре"),
+        ("payment_payment_date",    "Дата оплаты"),
+        ("description",             "Описание"),
+    ],
+    "bonus_paid": [
+        ("date",                    "Дата записи"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Выплачено бонуса (сум)"),
+        ("invoice_factura_number",  "Фактура №"),
+        ("invoice_customer",        "Аптека / Покупатель"),
+        ("payment_payment_date",    "Дата оплаты"),
+        ("description",             "Описание"),
+    ],
+    "preinvest": [
+        ("date",                    "Дата"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("amount",                  "Предынвест (аванс, сум)"),
+        ("description",             "Описание"),
+    ],
+    "cash_in": [
+        ("date",                    "Дата оплаты"),
+        ("invoice_num",             "Фактура №"),
+        ("amount",                  "Поступление (сум)"),
+        ("customer",                "Аптека / Покупатель"),
+        ("region",                  "Регион"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("comment",                 "Описание"),
+    ],
+    "realization": [
+        ("date",                    "Дата"),
+        ("invoice_num",             "Фактура №"),
+        ("total_amount",            "Реализация (сум)"),
+        ("customer",                "Аптека / Покупатель"),
+    ],
+    "receivables": [
+        ("date",                    "Дата фактуры"),
+        ("invoice_num",             "Фактура №"),
+        ("total_amount",            "Сумма фактуры"),
+        ("paid_amount",             "Оплачено"),
+        ("debt_amount",             "Долг (сум)"),
+        ("delay_days",              "Дней просрочки"),
+        ("customer",                "Аптека / Покупатель"),
+    ],
+    "expenses": [
+        ("date",                    "Дата"),
+        ("amount",                  "Расход (сум)"),
+        ("category",                "Категория"),
+        ("description",             "Описание"),
+        ("author",                  "Автор"),
+    ],
+    "gross_profit": [
+        ("date",                    "Дата"),
+        ("invoice_num",             "Фактура №"),
+        ("product",                 "Продукт"),
+        ("qty",                     "Кол-во"),
+        ("sale_price",              "Цена продажи"),
+        ("prod_price",              "Себестоимость"),
+        ("salary",                  "Зарплата МП / ед."),
+        ("marketing",               "Маркетинг / ед."),
+        ("paid_ratio",              "Оплачено %"),
+        ("profit",                  "Реализованная прибыль (сум)"),
+    ],
+    "net_profit": [
+        ("date",                    "Дата"),
+        ("invoice_num",             "Фактура №"),
+        ("product",                 "Продукт"),
+        ("region",                  "Регион"),
+        ("med_rep",                 "Мед. Представитель"),
+        ("qty",                     "Кол-во"),
+        ("sale_price",              "Цена продажи"),
+        ("prod_price",              "Себестоимость"),
+        ("salary",                  "Зарплата МП / ед."),
+        ("marketing",               "Маркетинг / ед."),
+        ("paid_ratio",              "Оплачено %"),
+        ("gross_profit",            "Чистая прибыль (сум)"),
+    ],
+}
+
+# Generic fallback labels for metrics without a predefined layout
+DRILLDOWN_EXPORT_LABELS = {
+    "invoice_num": "Фактура №", "date": "Дата", "customer": "Аптека/Покупатель",
+    "region": "Регион", "med_rep": "Мед. Представитель", "doctor": "Врач",
+    "product": "Продукт", "qty": "Кол-во", "amount": "Сумма",
+    "total_amount": "Сумма", "paid_amount": "Оплачено", "debt_amount": "Долг",
+    "profit": "Прибыль", "paid_ratio": "Оплачено %", "gross_profit": "Валовая прибыль",
+    "sale_price": "Цена продажи", "prod_price": "Себестоимость",
+    "salary": "Зарплата МП / ед.", "marketing": "Маркетинг",
+    "description": "Описание", "status": "Статус", "delay_days": "Дней просрочки",
+    "invoice_factura_number": "Фактура №", "invoice_customer": "Покупатель",
+    "invoice_invoice_total": "Сумма фактуры", "invoice_invoice_paid": "Оплачено",
+    "payment_payment_date": "Дата оплаты", "payment_payment_amount": "Сумма платежа",
+}
+
+DRILLDOWN_EXPORT_MONEY_KEYS = {
+    'amount', 'total_amount', 'paid_amount', 'debt_amount', 'profit', 'gross_profit',
+    'sale_price', 'prod_price', 'salary', 'marketing', 'salary_earned', 'accrued',
+    'paid', 'balance', 'payment_payment_amount', 'invoice_invoice_total', 'invoice_invoice_paid'
+}
+
+
+def _flatten_drilldown_row(row: dict) -> dict:
+    """Flattens nested dicts one level deep so nested payment/invoice info also gets exported."""
+    flat = {}
+    for k, v in row.items():
+        if isinstance(v, dict):
+            for sk, sv in v.items():
+                flat[f"{k}_{sk}"] = sv
+        elif isinstance(v, list):
+            pass  # skip list fields
+        else:
+            flat[k] = v
+    return flat
 
-@router.get("/stats/comprehensive/drilldown/export")
-async def export_drilldown_excel(
-    db: AsyncSession = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_user),
-    metric: str = Query(...),
-    month: Optional[int] = Query(None),
-    year: Optional[int] = Query(None),
-    quarter: Optional[int] = Query(None),
-    region_id: Optional[int] = Query(None),
-    product_id: Optional[int] = Query(None),
-    med_rep_id: Optional[int] = Query(None),
-    product_manager_id: Optional[int] = Query(None),
-    period: Optional[str] = Query(None),  # ignored – sent by frontend but not needed
-) -> Any:
-    """
-    Export drilldown data to Excel for ANY metric dynamically.
-    """
-    raw = await get_comprehensive_drilldown(
-        metric=metric, db=db, current_user=current_user, month=month, year=year,
-        quarter=quarter, region_id=region_id, med_rep_id=med_rep_id,
-        product_id=product_id, product_manager_id=product_manager_id, skip=0, limit=100000
-    )
-
-    # get_comprehensive_drilldown returns a plain list directly
-    if isinstance(raw, list):
-        rows = raw
-    elif isinstance(raw, dict):
-        rows = raw.get("items", raw.get("rows", []))
-    else:
-        rows = []
-
-    if not rows:
-        raise HTTPException(status_code=404, detail="Нет данных для экспорта")
-
-    # Flatten nested dicts one level deep so nested payment/invoice info also gets exported
-    def flatten_row(row: dict) -> dict:
-        flat = {}
-        for k, v in row.items():
-            if isinstance(v, dict):
-                for sk, sv in v.items():
-                    flat[f"{k}_{sk}"] = sv
-            elif isinstance(v, list):
-                pass  # skip list fields
-            else:
-                flat[k] = v
-        return flat
-
-    flat_rows = [flatten_row(r) for r in rows]
-
-    # Create Excel
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Export"
-
-    # Identify columns to export (exclude raw 'id' and helper keys)
-    exclude_keys = {"id", "realization_date"}
-    base_columns = [k for k in flat_rows[0].keys() if k not in exclude_keys]
-
-    # ── Metric-specific column definitions ─────────────────────────────────────
-    # Each entry: (key_in_flat_row, display_label)
-    METRIC_COLUMNS: dict[str, list[tuple[str, str]]] = {
-        "salary_accrued": [
-            ("date",                    "Дата начисления"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Начислено зарплаты (сум)"),
-            ("invoice_factura_number",  "Фактура №"),
-            ("invoice_customer",        "Аптека / Покупатель"),
-            ("invoice_invoice_total",   "Сумма фактуры"),
-            ("invoice_invoice_paid",    "Оплачено по фактуре"),
-            ("payment_payment_date",    "Дата оплаты"),
-            ("description",             "Описание"),
-        ],
-        "salary_paid": [
-            ("date",                    "Дата записи"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Выплачено зарплаты (сум)"),
-            ("invoice_factura_number",  "Фактура №"),
-            ("invoice_customer",        "Аптека / Покупатель"),
-            ("payment_payment_date",    "Дата оплаты"),
-            ("description",             "Описание"),
-        ],
-        "salary_balance": [
-            ("date",                    "Дата начисления"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Остаток зарплаты (не выплачено, сум)"),
-            ("invoice_factura_number",  "Фактура №"),
-            ("invoice_customer",        "Аптека / Покупатель"),
-            ("invoice_invoice_total",   "Сумма фактуры"),
-            ("description",             "Описание"),
-        ],
-        "bonus_accrued": [
-            ("date",                    "Дата начисления"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Начислено бонуса (сум)"),
-            ("invoice_factura_number",  "Фактура №"),
-            ("invoice_customer",        "Аптека / Покупатель"),
-            ("invoice_invoice_total",   "Сумма фактуры"),
-            ("invoice_invoice_paid",    "Оплачено по фактуре"),
-            ("payment_payment_date",    "Дата оплаты"),
-            ("description",             "Описание"),
-        ],
-        "bonus_paid": [
-            ("date",                    "Дата записи"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Выплачено бонуса (сум)"),
-            ("invoice_factura_number",  "Фактура №"),
-            ("invoice_customer",        "Аптека / Покупатель"),
-            ("payment_payment_date",    "Дата оплаты"),
-            ("description",             "Описание"),
-        ],
-        "preinvest": [
-            ("date",                    "Дата"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("amount",                  "Предынвест (аванс, сум)"),
-            ("description",             "Описание"),
-        ],
-        "cash_in": [
-            ("date",                    "Дата оплаты"),
-            ("invoice_num",             "Фактура №"),
-            ("amount",                  "Поступление (сум)"),
-            ("customer",                "Аптека / Покупатель"),
-            ("region",                  "Регион"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("comment",                 "Описание"),
-        ],
-        "realization": [
-            ("date",                    "Дата"),
-            ("invoice_num",             "Фактура №"),
-            ("total_amount",            "Реализация (сум)"),
-            ("customer",                "Аптека / Покупатель"),
-        ],
-        "receivables": [
-            ("date",                    "Дата фактуры"),
-            ("invoice_num",             "Фактура №"),
-            ("total_amount",            "Сумма фактуры"),
-            ("paid_amount",             "Оплачено"),
-            ("debt_amount",             "Долг (сум)"),
-            ("delay_days",              "Дней просрочки"),
-            ("customer",                "Аптека / Покупатель"),
-        ],
-        "expenses": [
-            ("date",                    "Дата"),
-            ("amount",                  "Расход (сум)"),
-            ("category",                "Категория"),
-            ("description",             "Описание"),
-            ("author",                  "Автор"),
-        ],
-        "gross_profit": [
-            ("date",                    "Дата"),
-            ("invoice_num",             "Фактура №"),
-            ("product",                 "Продукт"),
-            ("qty",                     "Кол-во"),
-            ("sale_price",              "Цена продажи"),
-            ("prod_price",              "Себестоимость"),
-            ("salary",                  "Зарплата МП / ед."),
-            ("marketing",               "Маркетинг / ед."),
-            ("paid_ratio",              "Оплачено %"),
-            ("profit",                  "Реализованная прибыль (сум)"),
-        ],
-        "net_profit": [
-            ("date",                    "Дата"),
-            ("invoice_num",             "Фактура №"),
-            ("product",                 "Продукт"),
-            ("region",                  "Регион"),
-            ("med_rep",                 "Мед. Представитель"),
-            ("qty",                     "Кол-во"),
-            ("sale_price",              "Цена продажи"),
-            ("prod_price",              "Себестоимость"),
-            ("salary",                  "Зарплата МП / ед."),
-            ("marketing",               "Маркетинг / ед."),
-            ("paid_ratio",              "Оплачено %"),
-            ("gross_profit",            "Чистая прибыль (сум)"),
-        ],
-    }
 
-    # Build display_columns: use predefined order if metric is known,
-    # otherwise fall back to auto-detected columns from the flat row.
-    if metric in METRIC_COLUMNS:
-        col_spec = METRIC_COLUMNS[metric]
+def _drilldown_export_columns(metric: str, first_row: dict):
+    """(display_columns, column_labels) for the export, based on the metric and the first flat row."""
+    if metric in DRILLDOWN_EXPORT_COLUMNS:
+        col_spec = DRILLDOWN_EXPORT_COLUMNS[metric]
         # Only include columns that actually exist in the data
-        display_columns = [key for key, _ in col_spec if key in flat_rows[0] or key == "delay_days"]
-        column_labels   = {key: label for key, label in col_spec}
-    else:
-        # Generic fallback labels
-        column_labels = {
-            "invoice_num": "Фактура №", "date": "Дата", "customer": "Аптека/Покупатель",
-            "region": "Регион", "med_rep": "Мед. Представитель", "doctor": "Врач",
-            "product": "Продукт", "qty": "Кол-во", "amount": "Сумма",
-            "total_amount": "Сумма", "paid_amount": "Оплачено", "debt_amount": "Долг",
-            "profit": "Прибыль", "paid_ratio": "Оплачено %", "gross_profit": "Валовая прибыль",
-            "sale_price": "Цена продажи", "prod_price": "Себестоимость",
-            "salary": "Зарплата МП / ед.", "marketing": "Маркетинг",
-            "description": "Описание", "status": "Статус", "delay_days": "Дней просрочки",
-            "invoice_factura_number": "Фактура №", "invoice_customer": "Покупатель",
-            "invoice_invoice_total": "Сумма фактуры", "invoice_invoice_paid": "Оплачено",
-            "payment_payment_date": "Дата оплаты", "payment_payment_amount": "Сумма платежа",
-        }
-        exclude_keys_display = {"id", "realization_date", "payment_payment_id", "invoice_invoice_id"}
-        display_columns = [k for k in flat_rows[0].keys() if k not in exclude_keys_display]
-
-
-    # Write headers
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    header_fill = PatternFill(start_color="4F46E5", end_color="4F46E5", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
-
-    for col_idx, col_key in enumerate(display_columns, 1):
-        cell = ws.cell(row=1, column=col_idx, value=column_labels.get(col_key, col_key.replace("_", " ").title()).upper())
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = thin_border
+        display_columns = [key for key, _ in col_spec if key in first_row or key == "delay_days"]
+        return display_columns, {key: label for key, label in col_spec}
+    exclude_keys_display = {"id", "realization_date", "payment_payment_id", "invoice_invoice_id"}
+    return [k for k in first_row.keys() if k not in exclude_keys_display], DRILLDOWN_EXPORT_LABELS
 
-    ws.row_dimensions[1].height = 22
-
-    # Write data rows
-    money_keys = {
-        'amount', 'total_amount', 'paid_amount', 'debt_amount', 'profit', 'gross_profit',
-        'sale_price', 'prod_price', 'salary', 'marketing', 'salary_earned', 'accrued',
-        'paid', 'balance', 'payment_payment_amount', 'invoice_invoice_total', 'invoice_invoice_paid'
-    }
 
-    for row_idx, row_data in enumerate(flat_rows, 2):
-        fill_color = "F8F9FF" if row_idx % 2 == 0 else "FFFFFF"
-        row_fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
-
-        for col_idx, col_key in enumerate(display_columns, 1):
-            val = row_data.get(col_key, "")
-
-            if col_key == "delay_days" and metric == "receivables":
-                eff_date = row_data.get("realization_date") or row_data.get("date")
-                if eff_date:
-                    try:
-                        from datetime import datetime as _dt
-                        eff_dt = _dt.fromisoformat(str(eff_date).replace("Z", "+00:00"))
-                        val = max(0, (_dt.utcnow().date() - eff_dt.date()).days)
-                    except:
-                        val = 0
-                else:
-                    val = 0
-            elif isinstance(val, str) and val and (
-                col_key.endswith("_date") or col_key == "date"
-                or "date" in col_key
-            ):
-                # Format any ISO datetime string → "dd.mm.yyyy HH:MM"
-                try:
-                    from datetime import datetime as _dt
-                    dt = _dt.fromisoformat(val.replace("Z", "+00:00"))
-                    val = dt.strftime('%d.%m.%Y %H:%M')
-                except:
-                    pass
-            elif col_key == "paid_ratio" and isinstance(val, (int, float)):
-                val = f"{val}%"
-
-            cell = ws.cell(row=row_idx, column=col_idx, value=val)
-            cell.border = thin_border
-            cell.fill = row_fill
-
-            if isinstance(val, (int, float)):
-                cell.alignment = Alignment(horizontal="right", vertical="center")
-                if col_key in money_keys:
-                    cell.number_format = '#,##0.00'
-            else:
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-
-    # Autofit columns
-    for column in ws.columns:
-        max_length = 0
-        col_letter = column[0].column_letter
-        for cell in column:
+def _drilldown_export_value(metric: str, col_key: str, row_data: dict):
+    val = row_data.get(col_key, "")
+    if col_key == "delay_days" and metric == "receivables":
+        eff_date = row_data.get("realization_date") or row_data.get("date")
+        if eff_date:
             try:
-                cell_len = len(str(cell.value)) if cell.value is not None else 0
-                if cell_len > max_length:
-                    max_length = cell_len
+                eff_dt = datetime.fromisoformat(str(eff_date).replace("Z", "+00:00"))
+                return max(0, (datetime.utcnow().date() - eff_dt.date()).days)
             except:
-                pass
-        ws.column_dimensions[col_letter].width = min(max_length + 4, 55)
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    from datetime import datetime as _dt
-    filename = f"Export_{metric}_{_dt.now().strftime('%Y%m%d_%H%M')}.xlsx"
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0"
-        }
-    )
-
-
-
-
-
-
-@router.get("/stats/comprehensive/drilldown")
-async def get_comprehensive_drilldown(
-    metric: str = Query(...),
-    db: AsyncSession = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_user),
-    month: int = None,
-    year: int = None,
-    quarter: int = None,
-    region_id: int = None,
-    med_rep_id: int = None,
-    product_id: int = None,
-    product_manager_id: int = None,
-    skip: int = 0,
-    limit: int = 100
-) -> Any:
-    if metric == "cash_in": skip, limit = 0, 1000 # Special case for receipts
-    
-    if current_user.role not in [UserRole.INVESTOR, UserRole.DIRECTOR, UserRole.DEPUTY_DIRECTOR, UserRole.ADMIN, UserRole.ACCOUNTANT, UserRole.HRD]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
+                return 0
+        return 0
+    if isinstance(val, str) and val and "date" in col_key:
+        # Format any ISO datetime string → "dd.mm.yyyy HH:MM"
+        try:
+            return datetime.fromisoformat(val.replace("Z", "+00:00")).strftime('%d.%m.%Y %H:%M')
+        except:
+            return val
+    if col_key == "paid_ratio" and isinstance(val, (int, float)):
+        return f"{val}%"
+    return val
 
-    rep_ids = None
-    if med_rep_id:
-        rep_ids = [med_rep_id]
-    elif product_manager_id:
-        rep_ids = await get_descendant_ids(db, product_manager_id)
-        if not rep_ids: rep_ids = [-1]
 
-    start_date = None
-    end_date = None
+def _drilldown_period(month: Optional[int], year: Optional[int], quarter: Optional[int]):
+    """(start_date, end_date, month, year) for the drilldown filters; defaults to the current month."""
     if quarter and year:
         start_month = (quarter - 1) * 3 + 1
         start_date = datetime(year, start_month, 1)
@@ -1369,7 +1139,27 @@ async def get_comprehensive_drilldown(
         year = now.year
         start_date = datetime(year, month, 1)
         end_date = (datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1))
+    return start_date, end_date, month, year
+
+
+async def _drilldown_rep_ids(db: AsyncSession, med_rep_id: Optional[int], product_manager_id: Optional[int]):
+    if med_rep_id:
+        return [med_rep_id]
+    if product_manager_id:
+        rep_ids = await get_descendant_ids(db, product_manager_id)
+        return rep_ids or [-1]
+    return None
 
+
+def _drilldown_source(
+    metric: str, start_date, end_date, month, year, quarter,
+    rep_ids: Optional[List[int]], region_id: Optional[int], product_id: Optional[int]
+):
+    """
+    Query + row formatter for a list-type drilldown metric (everything except cash_in).
+    Returns (query, date_col, id_col, format_rows) or None for unknown metrics; lists are
+    ordered newest first by (date_col, id_col), which is also the keyset used by the export.
+    """
     def apply_filters(q, model_ref=Reservation):
         if rep_ids or region_id:
             q = q.outerjoin(MedicalOrganization, model_ref.med_org_id == MedicalOrganization.id)
@@ -1397,19 +1187,21 @@ async def get_comprehensive_drilldown(
         if rep_ids: plan_q = plan_q.where(Plan.med_rep_id.in_(rep_ids))
         if region_id: plan_q = plan_q.join(MedicalOrganization, Plan.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id == region_id)
         if product_id: plan_q = plan_q.where(Plan.product_id == product_id)
-        rows = (await db.execute(plan_q.offset(skip).limit(limit))).scalars().all()
-        return [
-            {
-                "id": r.id, 
-                "med_rep": r.med_rep.full_name if r.med_rep else "-", 
-                "doctor": r.doctor.full_name if r.doctor else "-",
-                "product": r.product.name if r.product else "-", 
-                "month": r.month, 
-                "year": r.year, 
-                "amount": r.target_amount, 
-                "qty": r.target_quantity
-            } for r in rows
-        ]
+
+        def format_rows(rows):
+            return [
+                {
+                    "id": r.id, 
+                    "med_rep": r.med_rep.full_name if r.med_rep else "-", 
+                    "doctor": r.doctor.full_name if r.doctor else "-",
+                    "product": r.product.name if r.product else "-", 
+                    "month": r.month, 
+                    "year": r.year, 
+                    "amount": r.target_amount, 
+                    "qty": r.target_quantity
+                } for r in rows
+            ]
+        return plan_q, None, Plan.id, format_rows
 
     elif metric == "realization":
         real_q = select(Invoice).options(selectinload(Invoice.reservation)).where(Invoice.status != InvoiceStatus.CANCELLED)
@@ -1417,116 +1209,10 @@ async def get_comprehensive_drilldown(
         if rep_ids or region_id or product_id:
             real_q = real_q.join(Reservation, Invoice.reservation_id == Reservation.id)
             real_q = apply_filters(real_q, Reservation)
-        rows = (await db.execute(real_q.order_by(Invoice.date.desc()).offset(skip).limit(limit))).scalars().all()
-        return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "invoice_num": r.factura_number, "total_amount": r.total_amount, "customer": r.reservation.customer_name if r.reservation else "-"} for r in rows]
 
-    elif metric == "cash_in":
-        # Using unified receipt queries
-        fact_q, topup_q = await get_receipt_queries(db, start_date, end_date, rep_ids, [region_id] if region_id else None, product_id)
-        
-        # Add options for relation loading
-        fact_q = fact_q.options(selectinload(Payment.invoice).selectinload(Invoice.reservation).selectinload(Reservation.med_org))
-        
-        payment_rows = (await db.execute(fact_q.order_by(Payment.date.desc()))).scalars().all()
-        
-        topup_rows = []
-        if topup_q is not None:
-            topup_q = topup_q.options(selectinload(BalanceTransaction.organization))
-            topup_rows = (await db.execute(topup_q.order_by(BalanceTransaction.created_at.desc()))).scalars().all()
-
-        # Null-invoice balance payments (invoice_id=NULL, auto-applied from credit balance)
-        null_inv_q = await get_null_invoice_payments_query(db, start_date, end_date, rep_ids, region_id)
-        null_inv_rows = (await db.execute(null_inv_q.order_by(Payment.date.desc()))).scalars().all()
-
-        # Build a map: payment_id -> organization (for null-invoice payments)
-        null_inv_payment_ids = [r.id for r in null_inv_rows]
-        null_inv_org_map: dict = {}
-        if null_inv_payment_ids:
-            # Strategy 1: via BalanceTransaction.payment_id (new records have this)
-            bt_q = select(BalanceTransaction).options(
-                selectinload(BalanceTransaction.organization)
-            ).where(BalanceTransaction.payment_id.in_(null_inv_payment_ids))
-            bt_rows = (await db.execute(bt_q)).scalars().all()
-            for bt in bt_rows:
-                if bt.payment_id and bt.payment_id not in null_inv_org_map:
-                    null_inv_org_map[bt.payment_id] = bt.organization
-
-            # Strategy 2: OLD records — match by date + amount from BalanceTransaction
-            unresolved = [r for r in null_inv_rows if r.id not in null_inv_org_map]
-            for r in unresolved:
-                r_date = r.date.date() if hasattr(r.date, 'date') else r.date
-                bt_match_q = (
-                    select(BalanceTransaction)
-                    .options(selectinload(BalanceTransaction.organization))
-                    .where(
-                        and_(
-                            func.abs(BalanceTransaction.amount) == func.abs(r.amount),
-                            func.date(BalanceTransaction.created_at) == r_date,
-                            BalanceTransaction.organization_id.isnot(None)
-                        )
-                    )
-                    .limit(1)
-                )
-                bt_match = (await db.execute(bt_match_q)).scalars().first()
-                if bt_match and bt_match.organization:
-                    null_inv_org_map[r.id] = bt_match.organization
-
-        # 3. Combine and Format
-        all_results = []
-        from datetime import time
-        for r in payment_rows:
-            dt_str = r.date.isoformat() if hasattr(r.date, "isoformat") else str(r.date)
-            # Resolve customer name: prefer customer_name, fallback to med_org.name
-            _res = r.invoice.reservation if r.invoice else None
-            _org = _res.med_org if _res else None
-            _customer = (
-                (_res.customer_name if _res and _res.customer_name else None)
-                or (_org.name if _org else None)
-                or "-"
-            )
-            _inn = _org.inn if _org else "-"
-            all_results.append({
-                "id": r.id, 
-                "date": dt_str, 
-                "amount": r.amount, 
-                "type": r.payment_type, 
-                "invoice_num": r.invoice.factura_number if r.invoice else "-", 
-                "customer": _customer,
-                "inn": _inn,
-                "comment": r.comment or "",
-                "is_topup": False
-            })
-        for r in null_inv_rows:
-            dt_str = r.date.isoformat() if hasattr(r.date, "isoformat") else str(r.date)
-            org = null_inv_org_map.get(r.id)
-            all_results.append({
-                "id": r.id,
-                "date": dt_str,
-                "amount": r.amount,
-                "type": r.payment_type,
-                "invoice_num": "-",
-                "customer": org.name if org else (r.comment or "-"),
-                "inn": org.inn if org else "-",
-                "comment": r.comment or "",
-                "is_topup": False
-            })
-        for r in topup_rows:
-            all_results.append({
-                "id": r.id,
-                "date": r.created_at.isoformat() if r.created_at else "-",
-                "amount": r.amount,
-                "type": "BALANCE",
-                "invoice_num": "-",
-                "customer": r.organization.name if r.organization else "-",
-                "inn": r.organization.inn if r.organization else "-",
-                "comment": f"ПОПОЛНЕНИE: {r.comment or ''}",
-                "is_topup": True
-            })
-            
-        # Since these are ISO strings, reverse sorting works correctly for chronology
-        all_results.sort(key=lambda x: x["date"], reverse=True)
-        # Apply skip/limit manually to the merged list
-        return all_results[skip : skip + limit]
+        def format_rows(rows):
+            return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "invoice_num": r.factura_number, "total_amount": r.total_amount, "customer": r.reservation.customer_name if r.reservation else "-"} for r in rows]
+        return real_q, Invoice.date, Invoice.id, format_rows
 
     elif metric == "receivables":
         debt_q = select(Invoice).options(selectinload(Invoice.reservation)).where(Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.APPROVED]))
@@ -1535,16 +1221,20 @@ async def get_comprehensive_drilldown(
             debt_q = debt_q.join(Reservation, Invoice.reservation_id == Reservation.id)
             debt_q = apply_filters(debt_q, Reservation)
         debt_q = debt_q.where(func.coalesce(Invoice.total_amount, 0) > func.coalesce(Invoice.paid_amount, 0))
-        rows = (await db.execute(debt_q.order_by(Invoice.date.desc()).offset(skip).limit(limit))).scalars().all()
-        return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "invoice_num": r.factura_number, "total_amount": r.total_amount or 0, "paid_amount": r.paid_amount or 0, "debt_amount": (r.total_amount or 0) - (r.paid_amount or 0), "customer": r.reservation.customer_name if r.reservation else "-"} for r in rows]
+
+        def format_rows(rows):
+            return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "invoice_num": r.factura_number, "total_amount": r.total_amount or 0, "paid_amount": r.paid_amount or 0, "debt_amount": (r.total_amount or 0) - (r.paid_amount or 0), "customer": r.reservation.customer_name if r.reservation else "-"} for r in rows]
+        return debt_q, Invoice.date, Invoice.id, format_rows
 
     elif metric == "expenses":
         expense_q = select(OtherExpense).options(selectinload(OtherExpense.category), selectinload(OtherExpense.created_by))
         if start_date and end_date: expense_q = expense_q.where(and_(OtherExpense.date >= start_date, OtherExpense.date < end_date))
         if rep_ids: expense_q = expense_q.where(OtherExpense.created_by_id.in_(rep_ids))
         if region_id: expense_q = expense_q.where(OtherExpense.region_id == region_id)
-        rows = (await db.execute(expense_q.order_by(OtherExpense.date.desc()).offset(skip).limit(limit))).scalars().all()
-        return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "amount": r.amount, "category": r.category.name if r.category else "-", "description": r.comment or "-", "author": r.created_by.full_name if r.created_by else "-"} for r in rows]
+
+        def format_rows(rows):
+            return [{"id": r.id, "date": r.date.isoformat() if r.date else "-", "amount": r.amount, "category": r.category.name if r.category else "-", "description": r.comment or "-", "author": r.created_by.full_name if r.created_by else "-"} for r in rows]
+        return expense_q, OtherExpense.date, OtherExpense.id, format_rows
 
     elif metric in ["bonus_accrued", "bonus_paid", "preinvest", "salary_accrued", "salary_paid", "salary_balance"]:
         # Determine which ledger_category to query
@@ -1601,43 +1291,44 @@ async def get_comprehensive_drilldown(
         if rep_ids: bonus_q = bonus_q.where(BonusLedger.user_id.in_(rep_ids))
         if region_id: bonus_q = bonus_q.join(Doctor, BonusLedger.doctor_id == Doctor.id).where(Doctor.region_id == region_id)
         if product_id: bonus_q = bonus_q.where(BonusLedger.product_id == product_id)
-        rows = (await db.execute(bonus_q.order_by(BonusLedger.created_at.desc()).offset(skip).limit(limit))).scalars().all()
-
-        result = []
-        for r in rows:
-            # Try to get payment/invoice info if bonus was triggered by a payment
-            payment_info = None
-            invoice_info = None
-            if r.payment:
-                p = r.payment
-                payment_info = {
-                    "payment_id": p.id,
-                    "payment_amount": p.amount,
-                    "payment_date": p.date.isoformat() if p.date else None,
-                }
-                if p.invoice:
-                    inv = p.invoice
-                    reservation = inv.reservation if inv else None
-                    invoice_info = {
-                        "invoice_id": inv.id,
-                        "factura_number": inv.factura_number or f"#{inv.id}",
-                        "invoice_total": inv.total_amount,
-                        "invoice_paid": inv.paid_amount,
-                        "customer": reservation.customer_name if reservation else "-",
-                    }
 
-            result.append({
-                "id": r.id,
-                "date": r.created_at.isoformat() if r.created_at else "-",
-                "amount": r.amount,
-                "doctor": r.doctor.full_name if r.doctor else "-",
-                "med_rep": r.user.full_name if r.user else "-",
-                "product": r.product.name if r.product else "-",
-                "description": r.notes or "-",
-                "payment": payment_info,
-                "invoice": invoice_info,
-            })
-        return result
+        def format_rows(rows):
+            result = []
+            for r in rows:
+                # Try to get payment/invoice info if bonus was triggered by a payment
+                payment_info = None
+                invoice_info = None
+                if r.payment:
+                    p = r.payment
+                    payment_info = {
+                        "payment_id": p.id,
+                        "payment_amount": p.amount,
+                        "payment_date": p.date.isoformat() if p.date else None,
+                    }
+                    if p.invoice:
+                        inv = p.invoice
+                        reservation = inv.reservation if inv else None
+                        invoice_info = {
+                            "invoice_id": inv.id,
+                            "factura_number": inv.factura_number or f"#{inv.id}",
+                            "invoice_total": inv.total_amount,
+                            "invoice_paid": inv.paid_amount,
+                            "customer": reservation.customer_name if reservation else "-",
+                        }
+
+                result.append({
+                    "id": r.id,
+                    "date": r.created_at.isoformat() if r.created_at else "-",
+                    "amount": r.amount,
+                    "doctor": r.doctor.full_name if r.doctor else "-",
+                    "med_rep": r.user.full_name if r.user else "-",
+                    "product": r.product.name if r.product else "-",
+                    "description": r.notes or "-",
+                    "payment": payment_info,
+                    "invoice": invoice_info,
+                })
+            return result
+        return bonus_q, BonusLedger.created_at, BonusLedger.id, format_rows
 
     elif metric == "gross_profit":
         gross_q = select(ReservationItem).options(selectinload(ReservationItem.product), selectinload(ReservationItem.reservation).selectinload(Reservation.invoice)).join(Reservation, ReservationItem.reservation_id == Reservation.id).join(Invoice, Invoice.reservation_id == Reservation.id).join(Product, ReservationItem.product_id == Product.id).where(and_(Invoice.total_amount > 0, Invoice.status != InvoiceStatus.CANCELLED))
@@ -1646,37 +1337,38 @@ async def get_comprehensive_drilldown(
         if rep_ids: gross_q = gross_q.where(or_(Reservation.created_by_id.in_(rep_ids), MedicalOrganization.assigned_reps.any(User.id.in_(rep_ids))))
         if region_id: gross_q = gross_q.where(MedicalOrganization.region_id == region_id)
         if product_id: gross_q = gross_q.where(ReservationItem.product_id == product_id)
-        
-        rows = (await db.execute(gross_q.order_by(Invoice.date.desc()).offset(skip).limit(limit))).scalars().all()
-        res_payload = []
-        for r in rows:
-            paid_ratio = (r.reservation.invoice.paid_amount or 0) / r.reservation.invoice.total_amount if r.reservation and r.reservation.invoice and r.reservation.invoice.total_amount > 0 else 0
-            sale_price = r.price * (1 - (r.discount_percent or 0) / 100.0)
-            ratio = (r.price / r.product.price) if r.product and r.product.price and r.product.price > 0 else 1.0
-            prod_price = (r.product.production_price or 0) * ratio
-            if r.reservation and not r.reservation.is_salary_enabled:
-                salary = 0
-            else:
-                salary = r.salary_amount if (r.salary_amount or 0) > 0 else (r.product.salary_expense or 0)
-            
-            if r.reservation and not r.reservation.is_bonus_eligible:
-                marketing = 0
-            else:
-                marketing = r.marketing_amount if (r.marketing_amount or 0) > 0 else (r.product.marketing_expense or 0)
-            other_per_unit = (r.product.other_expenses or 0) * ratio
-            unit_profit = sale_price - prod_price - salary - marketing - other_per_unit
-            total_profit_realized = (unit_profit * r.quantity) * paid_ratio
-            if total_profit_realized > 0:
-                res_payload.append({
-                    "id": r.id,
-                    "invoice_num": r.reservation.invoice.factura_number if r.reservation and r.reservation.invoice else "-",
-                    "date": r.reservation.invoice.date.isoformat() if r.reservation and r.reservation.invoice else "-",
-                    "product": r.product.name if r.product else "-",
-                    "qty": r.quantity,
-                    "paid_ratio": round(paid_ratio * 100, 1),
-                    "profit": float(total_profit_realized)
-                })
-        return res_payload
+
+        def format_rows(rows):
+            res_payload = []
+            for r in rows:
+                paid_ratio = (r.reservation.invoice.paid_amount or 0) / r.reservation.invoice.total_amount if r.reservation and r.reservation.invoice and r.reservation.invoice.total_amount > 0 else 0
+                sale_price = r.price * (1 - (r.discount_percent or 0) / 100.0)
+                ratio = (r.price / r.product.price) if r.product and r.product.price and r.product.price > 0 else 1.0
+                prod_price = (r.product.production_price or 0) * ratio
+                if r.reservation and not r.reservation.is_salary_enabled:
+                    salary = 0
+                else:
+                    salary = r.salary_amount if (r.salary_amount or 0) > 0 else (r.product.salary_expense or 0)
+                
+                if r.reservation and not r.reservation.is_bonus_eligible:
+                    marketing = 0
+                else:
+                    marketing = r.marketing_amount if (r.marketing_amount or 0) > 0 else (r.product.marketing_expense or 0)
+                other_per_unit = (r.product.other_expenses or 0) * ratio
+                unit_profit = sale_price - prod_price - salary - marketing - other_per_unit
+                total_profit_realized = (unit_profit * r.quantity) * paid_ratio
+                if total_profit_realized > 0:
+                    res_payload.append({
+                        "id": r.id,
+                        "invoice_num": r.reservation.invoice.factura_number if r.reservation and r.reservation.invoice else "-",
+                        "date": r.reservation.invoice.date.isoformat() if r.reservation and r.reservation.invoice else "-",
+                        "product": r.product.name if r.product else "-",
+                        "qty": r.quantity,
+                        "paid_ratio": round(paid_ratio * 100, 1),
+                        "profit": float(total_profit_realized)
+                    })
+            return res_payload
+        return gross_q, Invoice.date, ReservationItem.id, format_rows
 
     elif metric == "net_profit":
         # Net profit = gross profit per invoice item - total other expenses
@@ -1696,50 +1388,50 @@ async def get_comprehensive_drilldown(
         if region_id: gross_q = gross_q.where(MedicalOrganization.region_id == region_id)
         if product_id: gross_q = gross_q.where(ReservationItem.product_id == product_id)
 
-        rows = (await db.execute(gross_q.order_by(Invoice.date.desc()).offset(skip).limit(limit))).scalars().all()
-        res_payload = []
-        for r in rows:
-            inv = r.reservation.invoice if r.reservation else None
-            if not inv or not inv.total_amount: continue
-            paid_ratio = (inv.paid_amount or 0) / inv.total_amount
-            # Цена продажи — faktik faktura narxi (chegirma hisobga olingan)
-            sale_price = r.price * (1 - (r.discount_percent or 0) / 100.0)
-            # Себестоимость — mahsulotning o'zgarmas tannarxi (ratio bilan ko'paytirish noto'g'ri!)
-            prod_price = (r.product.production_price or 0)
-            # Зарплата МП — fakturadagi yozuv, yo'q bo'lsa mahsulot default qiymati
-            if r.reservation and not r.reservation.is_salary_enabled:
-                salary = 0
-            else:
-                salary = r.salary_amount if (r.salary_amount or 0) > 0 else (r.product.salary_expense or 0)
-            
-            # Маркетинг — fakturadagi yozuv, yo'q bo'lsa mahsulot default qiymati
-            if r.reservation and not r.reservation.is_bonus_eligible:
-                marketing = 0
-            else:
-                marketing = r.marketing_amount if (r.marketing_amount or 0) > 0 else (r.product.marketing_expense or 0)
-            # Boshqa xarajatlar — o'zgarmas
-            other_per_unit = (r.product.other_expenses or 0)
-            unit_profit = sale_price - prod_price - salary - marketing - other_per_unit
-            total_profit_realized = (unit_profit * r.quantity) * paid_ratio
-            region_name = (r.reservation.med_org.region.name if r.reservation and r.reservation.med_org and r.reservation.med_org.region else "-") if r.reservation else "-"
-            med_rep_name = (r.reservation.created_by.full_name if r.reservation and r.reservation.created_by else "-")
-            res_payload.append({
-                "id": r.id,
-                "invoice_num": inv.factura_number if inv else "-",
-                "date": inv.date.isoformat() if inv else "-",
-                "product": r.product.name if r.product else "-",
-                "region": region_name,
-                "med_rep": med_rep_name,
-                "qty": r.quantity,
-                "paid_ratio": round(paid_ratio * 100, 1),
-                "gross_profit": round(float((unit_profit * r.quantity) * paid_ratio), 2),
-                # For context: show formula breakdown
-                "sale_price": round(float(sale_price), 2),
-                "prod_price": round(float(prod_price), 2),
-                "salary": round(float(salary), 2),
-                "marketing": round(float(marketing), 2),
-            })
-        return res_payload
+        def format_rows(rows):
+            res_payload = []
+            for r in rows:
+                inv = r.reservation.invoice if r.reservation else None
+                if not inv or not inv.total_amount: continue
+                paid_ratio = (inv.paid_amount or 0) / inv.total_amount
+                # Цена продажи — faktik faktura narxi (chegirma hisobga olingan)
+                sale_price = r.price * (1 - (r.discount_percent or 0) / 100.0)
+                # Себестоимость — mahsulotning o'zgarmas tannarxi (ratio bilan ko'paytirish noto'g'ri!)
+                prod_price = (r.product.production_price or 0)
+                # Зарплата МП — fakturadagi yozuv, yo'q bo'lsa mahsulot default qiymati
+                if r.reservation and not r.reservation.is_salary_enabled:
+                    salary = 0
+                else:
+                    salary = r.salary_amount if (r.salary_amount or 0) > 0 else (r.product.salary_expense or 0)
+                
+                # Маркетинг — fakturadagi yozuv, yo'q bo'lsa mahsulot default qiymati
+                if r.reservation and not r.reservation.is_bonus_eligible:
+                    marketing = 0
+                else:
+                    marketing = r.marketing_amount if (r.marketing_amount or 0) > 0 else (r.product.marketing_expense or 0)
+                # Boshqa xarajatlar — o'zgarmas
+                other_per_unit = (r.product.other_expenses or 0)
+                unit_profit = sale_price - prod_price - salary - marketing - other_per_unit
+                region_name = (r.reservation.med_org.region.name if r.reservation and r.reservation.med_org and r.reservation.med_org.region else "-") if r.reservation else "-"
+                med_rep_name = (r.reservation.created_by.full_name if r.reservation and r.reservation.created_by else "-")
+                res_payload.append({
+                    "id": r.id,
+                    "invoice_num": inv.factura_number if inv else "-",
+                    "date": inv.date.isoformat() if inv else "-",
+                    "product": r.product.name if r.product else "-",
+                    "region": region_name,
+                    "med_rep": med_rep_name,
+                    "qty": r.quantity,
+                    "paid_ratio": round(paid_ratio * 100, 1),
+                    "gross_profit": round(float((unit_profit * r.quantity) * paid_ratio), 2),
+                    # For context: show formula breakdown
+                    "sale_price": round(float(sale_price), 2),
+                    "prod_price": round(float(prod_price), 2),
+                    "salary": round(float(salary), 2),
+                    "marketing": round(float(marketing), 2),
+                })
+            return res_payload
+        return gross_q, Invoice.date, ReservationItem.id, format_rows
 
     elif metric == "sold_items":
         items_sold_q = select(ReservationItem).options(
@@ -1757,79 +1449,468 @@ async def get_comprehensive_drilldown(
             items_sold_q = items_sold_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
         if product_id: 
             items_sold_q = items_sold_q.where(ReservationItem.product_id == int(product_id))
-            
-        rows = (await db.execute(items_sold_q.order_by(Invoice.date.desc()).offset(skip).limit(limit))).scalars().all()
-        
-        res_payload = []
-        for r in rows:
-            inv = r.reservation.invoice if r.reservation else None
-            region_name = (r.reservation.med_org.region.name if r.reservation and r.reservation.med_org and r.reservation.med_org.region else "-") if r.reservation else "-"
-            
-            med_org = r.reservation.med_org if r.reservation else None
-            if med_org and med_org.assigned_reps:
-                med_rep_name = ", ".join([u.full_name for u in med_org.assigned_reps if u.full_name])
-            elif r.reservation and r.reservation.created_by:
-                med_rep_name = r.reservation.created_by.full_name
-            else:
-                med_rep_name = "-"
 
-            customer = (inv.reservation.med_org.name if inv.reservation and inv.reservation.med_org else (inv.reservation.customer_name if inv.reservation else "-")) if inv else "-"
-            
-            nds_percent = (r.reservation.nds_percent if r.reservation and r.reservation.nds_percent is not None else 12.0)
-            nds_multiplier = 1 + (nds_percent / 100.0)
-            
-            price_with_nds = round((r.price or 0) * nds_multiplier, 2)
-            total_with_nds = round(price_with_nds * (r.quantity or 0), 2)
-            
-            res_payload.append({
+        def format_rows(rows):
+            res_payload = []
+            for r in rows:
+                inv = r.reservation.invoice if r.reservation else None
+                region_name = (r.reservation.med_org.region.name if r.reservation and r.reservation.med_org and r.reservation.med_org.region else "-") if r.reservation else "-"
+                
+                med_org = r.reservation.med_org if r.reservation else None
+                if med_org and med_org.assigned_reps:
+                    med_rep_name = ", ".join([u.full_name for u in med_org.assigned_reps if u.full_name])
+                elif r.reservation and r.reservation.created_by:
+                    med_rep_name = r.reservation.created_by.full_name
+                else:
+                    med_rep_name = "-"
+
+                customer = (inv.reservation.med_org.name if inv.reservation and inv.reservation.med_org else (inv.reservation.customer_name if inv.reservation else "-")) if inv else "-"
+                
+                nds_percent = (r.reservation.nds_percent if r.reservation and r.reservation.nds_percent is not None else 12.0)
+                nds_multiplier = 1 + (nds_percent / 100.0)
+                
+                price_with_nds = round((r.price or 0) * nds_multiplier, 2)
+                total_with_nds = round(price_with_nds * (r.quantity or 0), 2)
+                
+                res_payload.append({
+                    "id": r.id,
+                    "date": inv.date.isoformat() if inv and inv.date else "-",
+                    "customer": customer,
+                    "invoice_num": inv.factura_number if inv else "-",
+                    "product": r.product.name if r.product else "-",
+                    "region": region_name,
+                    "med_rep": med_rep_name,
+                    "qty": r.quantity,
+                    "sale_price": price_with_nds,
+                    "total_amount": total_with_nds
+                })
+            return res_payload
+        return items_sold_q, Invoice.date, ReservationItem.id, format_rows
+
+    return None
+
+
+async def _keyset_page(db: AsyncSession, q, date_col, id_col, after: Optional[Cursor], limit: int):
+    """
+    One page of ORM rows newest first, seeking past `after` (the (date, id) of the previous page's
+    last row) instead of using OFFSET. Returns (rows, (date, id) of the last row or None).
+    """
+    date_key = func.coalesce(date_col, MIN_DATE) if date_col is not None else None
+    page_q = keyset_seek(q.add_columns(id_col.label("_ks_id")), date_key, id_col, after)
+    if date_key is not None:
+        page_q = page_q.add_columns(date_key.label("_ks_date"))
+    rows = (await db.execute(page_q.order_by(*keyset_order(date_key, id_col)).limit(limit))).all()
+    if not rows:
+        return [], None
+    last = rows[-1]
+    return [r[0] for r in rows], (last._ks_date if date_key is not None else None, last._ks_id)
+
+
+async def _keyset_pages(db: AsyncSession, q, date_col, id_col, page_size: int):
+    """Yields pages of ORM rows newest first (see _keyset_page), so late pages cost the same as the first one."""
+    after = None
+    while True:
+        page, after = await _keyset_page(db, q, date_col, id_col, after, page_size)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+
+
+async def _resolve_null_invoice_orgs(db: AsyncSession, null_inv_rows) -> dict:
+    """payment_id -> organization for payments without an invoice (auto-applied from credit balance)."""
+    null_inv_org_map: dict = {}
+    null_inv_payment_ids = [r.id for r in null_inv_rows]
+    if not null_inv_payment_ids:
+        return null_inv_org_map
+
+    # Strategy 1: via BalanceTransaction.payment_id (new records have this)
+    bt_q = select(BalanceTransaction).options(
+        selectinload(BalanceTransaction.organization)
+    ).where(BalanceTransaction.payment_id.in_(null_inv_payment_ids))
+    bt_rows = (await db.execute(bt_q)).scalars().all()
+    for bt in bt_rows:
+        if bt.payment_id and bt.payment_id not in null_inv_org_map:
+            null_inv_org_map[bt.payment_id] = bt.organization
+
+    # Strategy 2: OLD records — match by date + amount from BalanceTransaction
+    unresolved = [r for r in null_inv_rows if r.id not in null_inv_org_map]
+    for r in unresolved:
+        r_date = r.date.date() if hasattr(r.date, 'date') else r.date
+        bt_match_q = (
+            select(BalanceTransaction)
+            .options(selectinload(BalanceTransaction.organization))
+            .where(
+                and_(
+                    func.abs(BalanceTransaction.amount) == func.abs(r.amount),
+                    func.date(BalanceTransaction.created_at) == r_date,
+                    BalanceTransaction.organization_id.isnot(None)
+                )
+            )
+            .limit(1)
+        )
+        bt_match = (await db.execute(bt_match_q)).scalars().first()
+        if bt_match and bt_match.organization:
+            null_inv_org_map[r.id] = bt_match.organization
+    return null_inv_org_map
+
+
+async def _iter_cash_in_rows(
+    db: AsyncSession, start_date, end_date, rep_ids, region_id, product_id,
+    page_size: int = DRILLDOWN_EXPORT_PAGE_SIZE, release_pages: bool = False
+):
+    """
+    Receipts (invoice payments, balance-applied payments, top-ups) merged newest first.
+    Each source is paged by keyset; with `release_pages` every page is expunged once formatted.
+    """
+    fact_q, topup_q = await get_receipt_queries(db, start_date, end_date, rep_ids, [region_id] if region_id else None, product_id)
+    fact_q = fact_q.options(selectinload(Payment.invoice).selectinload(Invoice.reservation).selectinload(Reservation.med_org))
+    null_inv_q = await get_null_invoice_payments_query(db, start_date, end_date, rep_ids, region_id)
+
+    def release(page):
+        if release_pages:
+            for obj in page:
+                db.expunge(obj)
+
+    async def invoice_payments():
+        async for page in _keyset_pages(db, fact_q, Payment.date, Payment.id, page_size):
+            formatted = []
+            for r in page:
+                dt_str = r.date.isoformat() if hasattr(r.date, "isoformat") else str(r.date)
+                # Resolve customer name: prefer customer_name, fallback to med_org.name
+                _res = r.invoice.reservation if r.invoice else None
+                _org = _res.med_org if _res else None
+                _customer = (
+                    (_res.customer_name if _res and _res.customer_name else None)
+                    or (_org.name if _org else None)
+                    or "-"
+                )
+                _inn = _org.inn if _org else "-"
+                formatted.append({
+                    "id": r.id, 
+                    "date": dt_str, 
+                    "amount": r.amount, 
+                    "type": r.payment_type, 
+                    "invoice_num": r.invoice.factura_number if r.invoice else "-", 
+                    "customer": _customer,
+                    "inn": _inn,
+                    "comment": r.comment or "",
+                    "is_topup": False
+                })
+            release(page)
+            for row in formatted:
+                yield row
+
+    async def balance_payments():
+        async for page in _keyset_pages(db, null_inv_q, Payment.date, Payment.id, page_size):
+            null_inv_org_map = await _resolve_null_invoice_orgs(db, page)
+            formatted = []
+            for r in page:
+                dt_str = r.date.isoformat() if hasattr(r.date, "isoformat") else str(r.date)
+                org = null_inv_org_map.get(r.id)
+                formatted.append({
+                    "id": r.id,
+                    "date": dt_str,
+                    "amount": r.amount,
+                    "type": r.payment_type,
+                    "invoice_num": "-",
+                    "customer": org.name if org else (r.comment or "-"),
+                    "inn": org.inn if org else "-",
+                    "comment": r.comment or "",
+                    "is_topup": False
+                })
+            release(page)
+            for row in formatted:
+                yield row
+
+    async def topups():
+        if topup_q is None:
+            return
+        async for page in _keyset_pages(db, topup_q.options(selectinload(BalanceTransaction.organization)), BalanceTransaction.created_at, BalanceTransaction.id, page_size):
+            formatted = [{
                 "id": r.id,
-                "date": inv.date.isoformat() if inv and inv.date else "-",
-                "customer": customer,
-                "invoice_num": inv.factura_number if inv else "-",
-                "product": r.product.name if r.product else "-",
-                "region": region_name,
-                "med_rep": med_rep_name,
-                "qty": r.quantity,
-                "sale_price": price_with_nds,
-                "total_amount": total_with_nds
-            })
-        return res_payload
-
-    return []
+                "date": r.created_at.isoformat() if r.created_at else "-",
+                "amount": r.amount,
+                "type": "BALANCE",
+                "invoice_num": "-",
+                "customer": r.organization.name if r.organization else "-",
+                "inn": r.organization.inn if r.organization else "-",
+                "comment": f"ПОПОЛНЕНИE: {r.comment or ''}",
+                "is_topup": True
+            } for r in page]
+            release(page)
+            for row in formatted:
+                yield row
+
+    # k-way merge on the ISO date strings (reverse chronological, like the JSON drilldown)
+    streams = [invoice_payments(), balance_payments(), topups()]
+    try:
+        heads = {}
+        for i, stream in enumerate(streams):
+            row = await anext(stream, None)
+            if row is not None:
+                heads[i] = row
+        while heads:
+            i = max(heads, key=lambda k: heads[k]["date"])
+            yield heads[i]
+            row = await anext(streams[i], None)
+            if row is None:
+                del heads[i]
+            else:
+                heads[i] = row
+    finally:
+        for stream in streams:
+            await stream.aclose()
 
-@router.get("/dashboard/director-report-excel")
-async def get_director_report_excel(
+
+async def _iter_drilldown_export_rows(
+    metric: str, start_date, end_date, month, year, quarter, rep_ids, region_id, product_id
+):
+    """
+    Flat drilldown rows for the export, read page by page on a dedicated session (the request
+    session is already closed while the response streams). Pages are expunged as soon as they are
+    formatted, so memory stays bounded by the page size regardless of the period length.
+    """
+    async with AsyncSessionLocal() as session:
+        if metric == "cash_in":
+            async for row in _iter_cash_in_rows(session, start_date, end_date, rep_ids, region_id, product_id, release_pages=True):
+                yield _flatten_drilldown_row(row)
+            return
+
+        source = _drilldown_source(metric, start_date, end_date, month, year, quarter, rep_ids, region_id, product_id)
+        if source is None:
+            return
+        q, date_col, id_col, format_rows = source
+        async for page in _keyset_pages(session, q, date_col, id_col, DRILLDOWN_EXPORT_PAGE_SIZE):
+            formatted = format_rows(page)
+            session.expunge_all()
+            for row in formatted:
+                yield _flatten_drilldown_row(row)
+
+
+DRILLDOWN_ROLES = [UserRole.INVESTOR, UserRole.DIRECTOR, UserRole.DEPUTY_DIRECTOR, UserRole.ADMIN, UserRole.ACCOUNTANT, UserRole.HRD]
+
+
+async def collect_drilldown_export(db: AsyncSession, current_user: User, params: dict, job: Optional[dict] = None):
+    """
+    Spools the formatted drilldown rows to a JSONL temp file (one list of cell values per line).
+    The payload only carries the file path plus header / width / number-format metadata, so
+    excel_reports.render_drilldown_export can build the sheet in the process pool.
+    """
+    import json
+    import os
+    import tempfile
+
+    if current_user.role not in DRILLDOWN_ROLES:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    metric = params.get("metric")
+    quarter = params.get("quarter")
+    rep_ids = await _drilldown_rep_ids(db, params.get("med_rep_id"), params.get("product_manager_id"))
+    start_date, end_date, month, year = _drilldown_period(params.get("month"), params.get("year"), quarter)
+    rows = _iter_drilldown_export_rows(metric, start_date, end_date, month, year, quarter, rep_ids, params.get("region_id"), params.get("product_id"))
+
+    display_columns = None
+    first_values = []
+    rows_file = tempfile.NamedTemporaryFile("w", prefix="drilldown_", suffix=".jsonl", encoding="utf-8", delete=False)
+    try:
+        with rows_file:
+            async for row_data in rows:
+                if display_columns is None:
+                    display_columns, column_labels = _drilldown_export_columns(metric, row_data)
+                values = [_drilldown_export_value(metric, k, row_data) for k in display_columns]
+                if not first_values:
+                    first_values = values
+                rows_file.write(json.dumps(values, ensure_ascii=False, default=str) + "\n")
+                if job is not None:
+                    job["rows"] += 1
+        if display_columns is None:
+            raise HTTPException(status_code=404, detail="Нет данных для экспорта")
+    except Exception:
+        os.unlink(rows_file.name)
+        raise
+
+    headers = [column_labels.get(k, k.replace("_", " ").title()).upper() for k in display_columns]
+    # Write-only sheets can't be autofit afterwards: size columns from the header and first row
+    widths = [
+        min(max(len(h), len(str(v)) if v is not None else 0) + 4, 55)
+        for h, v in zip(headers, first_values)
+    ]
+    payload = {
+        "headers": headers,
+        "widths": widths,
+        "money_columns": [i for i, k in enumerate(display_columns) if k in DRILLDOWN_EXPORT_MONEY_KEYS],
+        "rows_path": rows_file.name,
+    }
+    return payload, f"Export_{metric}_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+
+
+@router.get("/stats/comprehensive/drilldown/export")
+async def export_drilldown_excel(
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+    metric: str = Query(...),
+    month: Optional[int] = Query(None),
+    year: Optional[int] = Query(None),
+    quarter: Optional[int] = Query(None),
+    region_id: Optional[int] = Query(None),
+    product_id: Optional[int] = Query(None),
+    med_rep_id: Optional[int] = Query(None),
+    product_manager_id: Optional[int] = Query(None),
+    period: Optional[str] = Query(None),  # ignored – sent by frontend but not needed
+    format: str = Query("xlsx", pattern="^(xlsx|csv)$"),
+) -> Any:
+    """
+    Export drilldown data to Excel (or CSV) for ANY metric dynamically.
+    Rows are read with keyset pagination. CSV is written straight into the response body;
+    XLSX rows are spooled to disk and the workbook is rendered in the export process pool
+    (for a non-blocking flow use POST /exports with kind=drilldown).
+    """
+    params = {
+        "metric": metric, "month": month, "year": year, "quarter": quarter, "region_id": region_id,
+        "product_id": product_id, "med_rep_id": med_rep_id, "product_manager_id": product_manager_id,
+    }
+
+    if format == "xlsx":
+        import os
+        payload, filename = await collect_drilldown_export(db, current_user, params)
+        try:
+            path = await ExportJobService.render(render_drilldown_export, payload)
+        finally:
+            os.unlink(payload["rows_path"])
+        return StreamingResponse(
+            ExportJobService.iter_file(path),
+            media_type=XLSX_MEDIA_TYPE,
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+                "Pragma": "no-cache",
+                "Expires": "0"
+            }
+        )
+
+    import csv
+
+    if current_user.role not in DRILLDOWN_ROLES:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    rep_ids = await _drilldown_rep_ids(db, med_rep_id, product_manager_id)
+    start_date, end_date, month, year = _drilldown_period(month, year, quarter)
+
+    rows = _iter_drilldown_export_rows(metric, start_date, end_date, month, year, quarter, rep_ids, region_id, product_id)
+    first_row = await anext(rows, None)
+    if first_row is None:
+        raise HTTPException(status_code=404, detail="Нет данных для экспорта")
+
+    # Identify columns to export from the first row
+    display_columns, column_labels = _drilldown_export_columns(metric, first_row)
+    headers = [column_labels.get(k, k.replace("_", " ").title()).upper() for k in display_columns]
+
+    async def csv_chunks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff")  # BOM so Excel opens UTF-8 (Cyrillic) correctly
+        writer.writerow(headers)
+        writer.writerow([_drilldown_export_value(metric, k, first_row) for k in display_columns])
+        count = 1
+        async for row_data in rows:
+            writer.writerow([_drilldown_export_value(metric, k, row_data) for k in display_columns])
+            count += 1
+            if count % 500 == 0:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue().encode("utf-8")
+
+    filename = f"Export_{metric}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return StreamingResponse(
+        csv_chunks(),
+        media_type="text/csv; charset=utf-8",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-cache, no-store, must-revalidate",
+            "Pragma": "no-cache",
+            "Expires": "0"
+        }
+    )
+
+
+ExportJobService.register("drilldown", collect_drilldown_export, render_drilldown_export, roles=DRILLDOWN_ROLES)
+
+
+@router.get("/stats/comprehensive/drilldown")
+async def get_comprehensive_drilldown(
+    metric: str = Query(...),
     db: AsyncSession = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_user),
     month: int = None,
-    year: int = None
+    year: int = None,
+    quarter: int = None,
+    region_id: int = None,
+    med_rep_id: int = None,
+    product_id: int = None,
+    product_manager_id: int = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None
 ) -> Any:
     """
-    Director Excel report: Product Manager → Regional Manager → MedRep
-    Columns: per-product Plan(qty), Fact(qty), Fact(sum) + totals
+    Rows behind a comprehensive-stats KPI, newest first. With `cursor` (empty for the first page)
+    list metrics return {items, next_cursor} paged by (date, id) instead of skip; cash_in (receipts
+    merged from three sources) always returns its first 1000 rows.
+    """
+    if metric == "cash_in": skip, limit = 0, 1000 # Special case for receipts
+    
+    if current_user.role not in DRILLDOWN_ROLES:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    rep_ids = await _drilldown_rep_ids(db, med_rep_id, product_manager_id)
+    start_date, end_date, month, year = _drilldown_period(month, year, quarter)
+
+    if metric == "cash_in":
+        all_results = []
+        receipts = _iter_cash_in_rows(db, start_date, end_date, rep_ids, region_id, product_id, page_size=skip + limit)
+        try:
+            async for row in receipts:
+                all_results.append(row)
+                if len(all_results) >= skip + limit:
+                    break
+        finally:
+            await receipts.aclose()
+        return all_results[skip : skip + limit]
+
+    source = _drilldown_source(metric, start_date, end_date, month, year, quarter, rep_ids, region_id, product_id)
+    if source is None:
+        return []
+    q, date_col, id_col, format_rows = source
+    if cursor is not None:
+        rows, last_key = await _keyset_page(db, q, date_col, id_col, decode_cursor(cursor), limit)
+        return page_response(format_rows(rows), encode_cursor(*last_key) if rows and len(rows) == limit else None)
+    order = [id_col.desc()] if date_col is None else [date_col.desc(), id_col.desc()]
+    rows = (await db.execute(q.order_by(*order).offset(skip).limit(limit))).scalars().all()
+    return format_rows(rows)
+
+
+DIRECTOR_REPORT_ROLES = [UserRole.INVESTOR, UserRole.DIRECTOR, UserRole.DEPUTY_DIRECTOR, UserRole.ADMIN]
+
+
+async def collect_director_report(db: AsyncSession, current_user: User, params: dict, job: Optional[dict] = None):
+    """
+    Reads everything the director report needs into a plain, picklable payload
+    (rendered by excel_reports.render_director_report in the export process pool).
     """
-    import io, calendar as _cal
-    import openpyxl
-    from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
-    from openpyxl.utils import get_column_letter
-    from fastapi.responses import StreamingResponse
-    from app.models.product import Product
-    from app.models.sales import Plan, Invoice, Reservation, ReservationItem
-    from app.models.crm import MedicalOrganization, Region
-    from sqlalchemy.orm import selectinload
-    from sqlalchemy import select, and_, extract, func
-
-    if current_user.role not in [UserRole.INVESTOR, UserRole.DIRECTOR, UserRole.DEPUTY_DIRECTOR, UserRole.ADMIN]:
+    import calendar as _cal
+    from app.models.crm import Region
+
+    if current_user.role not in DIRECTOR_REPORT_ROLES:
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    if not month:
-        month = datetime.utcnow().month
-    if not year:
-        year = datetime.utcnow().year
+    month = params.get("month") or datetime.utcnow().month
+    year = params.get("year") or datetime.utcnow().year
 
     # ── 1. Products (columns) ───────────────────────────────────────────────────
     products = (await db.execute(select(Product).where(Product.is_active == True).order_by(Product.name))).scalars().all()
-    prod_count = len(products)
 
     # ── 2. MedReps with full manager chain ─────────────────────────────────────
     medreps_res = await db.execute(
@@ -1872,7 +1953,11 @@ async def get_director_report_excel(
                     # Fallback for top-level managers
                     pm_name = mgr2.full_name or mgr2.username
         
-        hierarchy[pm_name][rm_name].append(mr)
+        hierarchy[pm_name][rm_name].append({
+            "id": mr.id,
+            "name": mr.full_name or mr.username,
+            "regions": ", ".join([rg.name for rg in mr.assigned_regions]) if mr.assigned_regions else "",
+        })
 
     # ── 3. Plans (month/year, by med_rep_id + product_id) ──────────────────────
     plan_q = select(Plan).options(selectinload(Plan.med_org).selectinload(MedicalOrganization.region)).where(and_(Plan.month == month, Plan.year == year))
@@ -1976,293 +2061,46 @@ async def get_director_report_excel(
             o_old_q, o_old_s = org_fact_map.get(o_key, (0, 0))
             org_fact_map[o_key] = (o_old_q + float(row.qty or 0), o_old_s + float(row.total_sum or 0))
 
-    # ── 5. Build Excel ──────────────────────────────────────────────────────────
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Отчет {month}-{year}"
-
-    # Styles
-    C_BLUE   = "1E3A5F";  C_BLUE_L  = "BDD7EE"
-    C_GREEN  = "375623";  C_GREEN_L = "E2EFDA"
-    C_GREY   = "404040";  C_GREY_L  = "F2F2F2"
-    C_YELLOW = "7F6000";  C_YELLOW_L= "FFEB9C"
-    C_WHITE  = "FFFFFF"
-
-    def fill(hex_color):
-        return PatternFill(start_color=hex_color, end_color=hex_color, fill_type="solid")
-
-    def font(bold=False, color=C_WHITE, size=9):
-        return Font(bold=bold, color=color, size=size)
-
-    thin  = Side(style="thin",   color="999999")
-    thick = Side(style="medium", color="555555")
-    def border(left=thin, right=thin, top=thin, bottom=thin):
-        return Border(left=left, right=right, top=top, bottom=bottom)
-
-    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left   = Alignment(horizontal="left",   vertical="center")
-    right_a= Alignment(horizontal="right",  vertical="center")
-    vert   = Alignment(text_rotation=90, horizontal="center", vertical="center")
-
-    # ── Header row 1: static cols + per-product groups ─────────────────────────
-    STATIC_COLS = ["Продукт Менеджер", "Рег. Менеджер / МП", "Контрагент", "Регион"]
-    S = len(STATIC_COLS)  # number of static columns = 4
-
-    # Static header cells (merge 3 rows)
-    for ci, h in enumerate(STATIC_COLS, 1):
-        ws.merge_cells(start_row=1, start_column=ci, end_row=3, end_column=ci)
-        cell = ws.cell(row=1, column=ci, value=h)
-        cell.font      = font(bold=True, color=C_WHITE)
-        cell.fill      = fill(C_BLUE)
-        cell.alignment = vert
-        cell.border    = border()
-
-    # Per-product group headers (3 cols each: plan_qty, fact_qty, fact_sum)
-    COLS_PER_PROD = 3
-    for pi, prod in enumerate(products):
-        start_col = S + 1 + pi * COLS_PER_PROD
-        end_col   = start_col + COLS_PER_PROD - 1
-
-        # Row 1: product name (merge 3 cols)
-        ws.merge_cells(start_row=1, start_column=start_col, end_row=1, end_column=end_col)
-        c = ws.cell(row=1, column=start_col, value=prod.name)
-        c.font = font(bold=True, color=C_WHITE); c.fill = fill(C_GREEN); c.alignment = center; c.border = border()
-
-        # Row 2: sub-labels
-        sub_labels = ["План (дон.)", "Факт (дон.)", "Факт (сум)"]
-        for si, lbl in enumerate(sub_labels):
-            c2 = ws.cell(row=2, column=start_col + si, value=lbl)
-            c2.font = font(bold=True, color=C_GREEN); c2.fill = fill(C_GREEN_L)
-            c2.alignment = center; c2.border = border()
-
-        # Row 3: % выполнения (colspan 3)
-        ws.merge_cells(start_row=3, start_column=start_col, end_row=3, end_column=end_col)
-        c3 = ws.cell(row=3, column=start_col, value="% выполнения")
-        c3.font = font(bold=False, color=C_GREEN); c3.fill = fill(C_GREEN_L)
-        c3.alignment = center; c3.border = border()
-
-    # Totals columns (after all products): total plan qty, total fact qty, total fact sum
-    tc_start = S + 1 + prod_count * COLS_PER_PROD
-    ws.merge_cells(start_row=1, start_column=tc_start, end_row=1, end_column=tc_start + 2)
-    c = ws.cell(row=1, column=tc_start, value="ИТОГО")
-    c.font = font(bold=True); c.fill = fill(C_GREY); c.alignment = center; c.border = border()
-    for si, lbl in enumerate(["План (дон.)", "Факт (дон.)", "Факт (сум)"]):
-        c2 = ws.cell(row=2, column=tc_start + si, value=lbl)
-        c2.font = font(bold=True, color=C_GREY); c2.fill = fill(C_GREY_L); c2.alignment = center; c2.border = border()
-    ws.merge_cells(start_row=3, start_column=tc_start, end_row=3, end_column=tc_start + 2)
-    c3 = ws.cell(row=3, column=tc_start, value="% выполнения")
-    c3.font = font(bold=False, color=C_GREY); c3.fill = fill(C_GREY_L); c3.alignment = center; c3.border = border()
-
-    ws.row_dimensions[1].height = 40
-    ws.row_dimensions[2].height = 28
-    ws.row_dimensions[3].height = 18
-
-    # ── Data rows ───────────────────────────────────────────────────────────────
-    def pct(plan_q, fact_q):
-        if not plan_q: return "—"
-        return f"{round(fact_q / plan_q * 100)}%"
-
-    current_row = 4
-
-    for pm_name in sorted(hierarchy.keys()):
-        rm_dict = hierarchy[pm_name]
-
-        # Accumulators for PM summary row
-        pm_plan_tot = 0; pm_fact_qty_tot = 0; pm_fact_sum_tot = 0
-        pm_per_prod_plan = [0]*prod_count
-        pm_per_prod_fqty = [0]*prod_count
-        pm_per_prod_fsum = [0.0]*prod_count
-
-        pm_row_idx = current_row  # we'll fill it after writing RM/MR rows
-        current_row += 1  # reserve PM row
-
-        for rm_name in sorted(rm_dict.keys()):
-            mr_list = rm_dict[rm_name]
-
-            rm_plan_tot = 0; rm_fact_qty_tot = 0; rm_fact_sum_tot = 0
-            rm_per_prod_plan = [0]*prod_count
-            rm_per_prod_fqty = [0]*prod_count
-            rm_per_prod_fsum = [0.0]*prod_count
-
-            rm_row_idx = current_row
-            current_row += 1  # reserve RM row
-
-            for mr in mr_list:
-                mr_row = current_row
-                current_row += 1
-
-                # MedRep summary row static cells (include MedRep's base regions)
-                mr_reg_txt = ", ".join([rg.name for rg in mr.assigned_regions]) if mr.assigned_regions else ""
-                for ci, val in enumerate(["", f"    {mr.full_name or mr.username}", "ИТОГО ПО МП", mr_reg_txt], 1):
-                    c = ws.cell(row=mr_row, column=ci, value=val)
-                    c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
-                    c.alignment = left; c.border = border()
-
-                mr_plan_tot = 0; mr_fact_qty_tot = 0; mr_fact_sum_tot = 0
-
-                for pi, prod in enumerate(products):
-                    plan_q, _ = plan_map.get((mr.id, prod.id), (0, 0))
-                    fact_q, fact_s = fact_map.get((mr.id, prod.id), (0, 0.0))
-                    col_base = S + 1 + pi * COLS_PER_PROD
-
-                    for si, (val, fmt) in enumerate([(plan_q, None), (fact_q, None), (fact_s, '#,##0')]):
-                        c = ws.cell(row=mr_row, column=col_base + si, value=val)
-                        c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
-                        c.alignment = right_a; c.border = border()
-                        if fmt: c.number_format = fmt
-
-                    mr_plan_tot      += plan_q
-                    mr_fact_qty_tot  += fact_q
-                    mr_fact_sum_tot  += fact_s
-                    rm_per_prod_plan[pi] += plan_q
-                    rm_per_prod_fqty[pi] += fact_q
-                    rm_per_prod_fsum[pi] += fact_s
-
-                # MedRep totals
-                tc = S + 1 + prod_count * COLS_PER_PROD
-                for si, val in enumerate([mr_plan_tot, mr_fact_qty_tot, mr_fact_sum_tot]):
-                    c = ws.cell(row=mr_row, column=tc + si, value=val)
-                    c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
-                    c.alignment = right_a; c.border = border()
-                    if si == 2: c.number_format = '#,##0'
-
-                rm_plan_tot     += mr_plan_tot
-                rm_fact_qty_tot += mr_fact_qty_tot
-                rm_fact_sum_tot += mr_fact_sum_tot
-                
-                # ── Org sub-rows breakdown ──
-                sorted_org_keys = sorted(list(medrep_orgs[mr.id]), key=lambda k: org_metadata[k]["name"])
-                for okey in sorted_org_keys:
-                    org_row = current_row
-                    current_row += 1
-                    meta = org_metadata[okey]
-                    
-                    for ci, val in enumerate(["", "", f"        {meta['name']}", meta['region']], 1):
-                        c = ws.cell(row=org_row, column=ci, value=val)
-                        c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
-                        c.alignment = left; c.border = border()
-                        
-                    o_p_tot = 0; o_fq_tot = 0; o_fs_tot = 0
-                    for pi, prod in enumerate(products):
-                        opq, _ = org_plan_map.get((mr.id, okey, prod.id), (0, 0))
-                        ofq, ofs = org_fact_map.get((mr.id, okey, prod.id), (0, 0.0))
-                        col_base = S + 1 + pi * COLS_PER_PROD
-                        
-                        for si, (val, fmt) in enumerate([(opq, None), (ofq, None), (ofs, '#,##0')]):
-                            c = ws.cell(row=org_row, column=col_base + si, value=val)
-                            c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
-                            c.alignment = right_a; c.border = border()
-                            if fmt: c.number_format = fmt
-                            
-                        o_p_tot += opq; o_fq_tot += ofq; o_fs_tot += ofs
-                    
-                    tc = S + 1 + prod_count * COLS_PER_PROD
-                    for si, val in enumerate([o_p_tot, o_fq_tot, o_fs_tot]):
-                        c = ws.cell(row=org_row, column=tc + si, value=val)
-                        c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
-                        c.alignment = right_a; c.border = border()
-                        if si == 2: c.number_format = '#,##0'
-
-            # ── RM summary row ──────────────────────────────────────────────
-            for ci, val in enumerate(["", f"  RM: {rm_name}", "", ""], 1):
-                c = ws.cell(row=rm_row_idx, column=ci, value=val)
-                c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
-                c.alignment = left; c.border = border(bottom=thick)
-
-            for pi in range(prod_count):
-                col_base = S + 1 + pi * COLS_PER_PROD
-                for si, val in enumerate([rm_per_prod_plan[pi], rm_per_prod_fqty[pi], rm_per_prod_fsum[pi]]):
-                    c = ws.cell(row=rm_row_idx, column=col_base + si, value=val)
-                    c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
-                    c.alignment = right_a; c.border = border(bottom=thick)
-                    if si == 2: c.number_format = '#,##0'
-
-            tc = S + 1 + prod_count * COLS_PER_PROD
-            for si, val in enumerate([rm_plan_tot, rm_fact_qty_tot, rm_fact_sum_tot]):
-                c = ws.cell(row=rm_row_idx, column=tc + si, value=val)
-                c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
-                c.alignment = right_a; c.border = border(bottom=thick)
-                if si == 2: c.number_format = '#,##0'
-
-            pm_plan_tot     += rm_plan_tot
-            pm_fact_qty_tot += rm_fact_qty_tot
-            pm_fact_sum_tot += rm_fact_sum_tot
-            for pi in range(prod_count):
-                pm_per_prod_plan[pi] += rm_per_prod_plan[pi]
-                pm_per_prod_fqty[pi] += rm_per_prod_fqty[pi]
-                pm_per_prod_fsum[pi] += rm_per_prod_fsum[pi]
-
-        # ── PM summary row ──────────────────────────────────────────────────
-        for ci, val in enumerate([f"PM: {pm_name}", "", "", ""], 1):
-            c = ws.cell(row=pm_row_idx, column=ci, value=val)
-            c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
-            c.alignment = left; c.border = border(top=thick, bottom=thick)
-
-        for pi in range(prod_count):
-            col_base = S + 1 + pi * COLS_PER_PROD
-            pq = pm_per_prod_plan[pi]; fq = pm_per_prod_fqty[pi]; fs = pm_per_prod_fsum[pi]
-            for si, val in enumerate([pq, fq, fs]):
-                c = ws.cell(row=pm_row_idx, column=col_base + si, value=val)
-                c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
-                c.alignment = right_a; c.border = border(top=thick, bottom=thick)
-                if si == 2: c.number_format = '#,##0'
-
-        tc = S + 1 + prod_count * COLS_PER_PROD
-        for si, val in enumerate([pm_plan_tot, pm_fact_qty_tot, pm_fact_sum_tot]):
-            c = ws.cell(row=pm_row_idx, column=tc + si, value=val)
-            c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
-            c.alignment = right_a; c.border = border(top=thick, bottom=thick)
-            if si == 2: c.number_format = '#,##0'
-
-    # ── Grand total row ─────────────────────────────────────────────────────────
-    grand_plan = sum(plan_map[k][0] for k in plan_map)
-    grand_fqty = sum(v[0] for v in fact_map.values())
-    grand_fsum = sum(v[1] for v in fact_map.values())
-
-    gt_row = current_row
-    for ci, val in enumerate(["ЖAMI / ИТОГО", "", "", ""], 1):
-        c = ws.cell(row=gt_row, column=ci, value=val)
-        c.fill = fill(C_YELLOW); c.font = font(bold=True, color=C_YELLOW)
-        c.alignment = left; c.border = border(top=thick)
-
-    for pi, prod in enumerate(products):
-        col_base = S + 1 + pi * COLS_PER_PROD
-        pq = sum(plan_map.get((mr.id, prod.id), (0,0))[0] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
-        fq = sum(fact_map.get((mr.id, prod.id), (0,0))[0] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
-        fs = sum(fact_map.get((mr.id, prod.id), (0,0.0))[1] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
-        for si, val in enumerate([pq, fq, fs]):
-            c = ws.cell(row=gt_row, column=col_base + si, value=val)
-            c.fill = fill(C_YELLOW_L); c.font = font(bold=True, color=C_YELLOW)
-            c.alignment = right_a; c.border = border(top=thick)
-            if si == 2: c.number_format = '#,##0'
-
-    tc = S + 1 + prod_count * COLS_PER_PROD
-    for si, val in enumerate([grand_plan, grand_fqty, grand_fsum]):
-        c = ws.cell(row=gt_row, column=tc + si, value=val)
-        c.fill = fill(C_YELLOW_L); c.font = font(bold=True, color=C_YELLOW)
-        c.alignment = right_a; c.border = border(top=thick)
-        if si == 2: c.number_format = '#,##0'
-
-    # ── Column widths ───────────────────────────────────────────────────────────
-    ws.column_dimensions[get_column_letter(1)].width = 22  # PM
-    ws.column_dimensions[get_column_letter(2)].width = 26  # RM/MR name
-    ws.column_dimensions[get_column_letter(3)].width = 28  # Counteragent
-    ws.column_dimensions[get_column_letter(4)].width = 16  # Region
-    total_cols = S + prod_count * COLS_PER_PROD + 3
-    for ci in range(S + 1, total_cols + 1):
-        ws.column_dimensions[get_column_letter(ci)].width = 12
-
-    ws.freeze_panes = "A4"
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    filename = f"Director_Report_{year}_{month:02d}.xlsx"
+    if job is not None:
+        job["progress"] = 40
+
+    payload = {
+        "month": month,
+        "year": year,
+        "products": [{"id": p.id, "name": p.name} for p in products],
+        "hierarchy": {pm: dict(rms) for pm, rms in hierarchy.items()},
+        "plan_map": plan_map,
+        "fact_map": fact_map,
+        "org_plan_map": org_plan_map,
+        "org_fact_map": org_fact_map,
+        "org_metadata": org_metadata,
+        "medrep_orgs": dict(medrep_orgs),
+    }
+    return payload, f"Director_Report_{year}_{month:02d}.xlsx"
+
+
+@router.get("/dashboard/director-report-excel")
+async def get_director_report_excel(
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+    month: int = None,
+    year: int = None
+) -> Any:
+    """
+    Director Excel report: Product Manager → Regional Manager → MedRep
+    Columns: per-product Plan(qty), Fact(qty), Fact(sum) + totals.
+    The workbook is rendered in the export process pool; for a non-blocking flow use POST /exports.
+    """
+    payload, filename = await collect_director_report(db, current_user, {"month": month, "year": year})
+    path = await ExportJobService.render(render_director_report, payload)
+
     resp_headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        ExportJobService.iter_file(path),
+        media_type=XLSX_MEDIA_TYPE,
         headers=resp_headers
     )
 
+
+ExportJobService.register("director_report", collect_director_report, render_director_report, roles=DIRECTOR_REPORT_ROLES)
+
@@ -1,12 +1,13 @@
 from typing import Any, List, Optional
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select
 from datetime import datetime
 
 from app.api import deps
 from app.models.user import User, UserRole
 from app.models.audit import AuditLog
+from app.core.pagination import count_rows, decode_cursor, keyset_order, keyset_seek, next_cursor, page_offset
 
 router = APIRouter()
 
@@ -23,6 +24,8 @@ async def get_audit_logs(
     date_from: Optional[str] = Query(None),   # YYYY-MM-DD
     date_to: Optional[str] = Query(None),      # YYYY-MM-DD
     ip_address: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),      # next_cursor of the previous page (instead of skip)
+    count: Optional[str] = Query("exact"),    # exact | estimate | empty for no total
 ) -> Any:
     """
     Retrieve audit logs. Only accessible by Director, Deputy Director, and Admin.
@@ -31,43 +34,34 @@ async def get_audit_logs(
     if current_user.role not in [UserRole.INVESTOR, UserRole.DIRECTOR, UserRole.DEPUTY_DIRECTOR, UserRole.ADMIN, UserRole.HRD]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    from sqlalchemy import func
-    count_query = select(func.count()).select_from(AuditLog)
-    query = select(AuditLog).order_by(desc(AuditLog.created_at))
+    query = select(AuditLog)
 
     if username:
-        count_query = count_query.where(AuditLog.username.ilike(f"%{username}%"))
         query = query.where(AuditLog.username.ilike(f"%{username}%"))
     if action:
-        count_query = count_query.where(AuditLog.action == action)
         query = query.where(AuditLog.action == action)
     if entity_type:
-        count_query = count_query.where(AuditLog.entity_type == entity_type)
         query = query.where(AuditLog.entity_type == entity_type)
     if ip_address:
-        count_query = count_query.where(AuditLog.ip_address.ilike(f"%{ip_address}%"))
         query = query.where(AuditLog.ip_address.ilike(f"%{ip_address}%"))
     if date_from:
         try:
             dt_from = datetime.strptime(date_from, "%Y-%m-%d")
-            count_query = count_query.where(AuditLog.created_at >= dt_from)
             query = query.where(AuditLog.created_at >= dt_from)
         except ValueError: pass
     if date_to:
         try:
             dt_to = datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
-            count_query = count_query.where(AuditLog.created_at <= dt_to)
             query = query.where(AuditLog.created_at <= dt_to)
         except ValueError: pass
 
-    total_res = await db.execute(count_query)
-    total = total_res.scalar() or 0
+    total = await count_rows(db, query.with_only_columns(AuditLog.id), count)
 
-    query = query.offset(skip).limit(limit)
-    result = await db.execute(query)
+    page_query = keyset_seek(query, AuditLog.created_at, AuditLog.id, decode_cursor(cursor))
+    page_query = page_query.order_by(*keyset_order(AuditLog.created_at, AuditLog.id)).offset(page_offset(skip, cursor)).limit(limit)
+    result = await db.execute(page_query)
     logs = result.scalars().all()
 
-
     return {
         "items": [
             {
@@ -85,7 +79,8 @@ async def get_audit_logs(
             }
             for l in logs
         ],
-        "total": total
+        "total": total,
+        "next_cursor": next_cursor(logs, limit, lambda l: l.created_at, lambda l: l.id),
     }
 
 
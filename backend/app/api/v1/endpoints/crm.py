@@ -23,6 +23,7 @@ from app.crud import crud_sales
 from app.schemas.sales import Plan
 from datetime import datetime
 from app.services.audit_service import log_action
+from app.services.idempotency_service import IdempotentRequest
 
 router = APIRouter()
 
@@ -302,6 +303,7 @@ async def top_up_med_org_balance(
     top_up_in: OrganizationBalanceTopUp,
     current_user: User = Depends(deps.get_current_user),
     request: Request,
+    idempotency: IdempotentRequest = Depends(deps.get_idempotency),
 ) -> Any:
     """
     Manually top up organization balance (Accountant logic).
@@ -323,6 +325,8 @@ async def top_up_med_org_balance(
     }
     if current_user.role not in allowed_roles:
         raise HTTPException(status_code=403, detail="Not enough permissions to top up balance")
+    if idempotency.replay is not None:
+        return idempotency.replay
     
     await crud_sales.top_up_organization_balance(
         db, 
@@ -344,7 +348,7 @@ async def top_up_med_org_balance(
         request
     )
     
-    return updated_org
+    return await idempotency.save(updated_org, MedicalOrganizationSchema)
 
 @router.get("/med-orgs/{id}/stock")
 async def get_med_org_stock(
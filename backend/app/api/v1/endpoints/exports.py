@@ -0,0 +1,68 @@
+from typing import Any, Dict
+import urllib.parse
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+
+from app.api import deps
+from app.models.user import User
+from app.services.export_jobs import ExportJobService, XLSX_MEDIA_TYPE
+
+router = APIRouter()
+
+
+class ExportJobCreate(BaseModel):
+    kind: str  # director_report | drilldown | reservation
+    params: Dict[str, Any] = {}
+
+
+@router.post("", status_code=202)
+async def create_export_job(
+    job_in: ExportJobCreate,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Queues a heavy Excel report. Data is collected in the background and the workbook is
+    rendered in a process pool; poll GET /exports/{job_id} and download when status is "done".
+    Params are the same as the synchronous endpoint of the report (e.g. month/year, metric + filters, id).
+    """
+    return await ExportJobService.submit(job_in.kind, job_in.params, current_user)
+
+
+@router.get("")
+async def list_export_jobs(
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """The current user's export jobs (newest first) until they expire."""
+    return await ExportJobService.list_for_user(current_user)
+
+
+@router.get("/{job_id}")
+async def get_export_job(
+    job_id: str,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """Status (queued / collecting / rendering / done / failed), progress % and rows collected."""
+    return await ExportJobService.status(job_id, current_user)
+
+
+@router.get("/{job_id}/download")
+async def download_export_job(
+    job_id: str,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    job = await ExportJobService.get(job_id, current_user)
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Экспорт завершился с ошибкой: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Файл ещё не готов")
+
+    encoded_filename = urllib.parse.quote(job.filename)
+    return FileResponse(
+        job.path,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+            "Access-Control-Expose-Headers": "Content-Disposition"
+        }
+    )
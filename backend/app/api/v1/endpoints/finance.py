@@ -1,4 +1,4 @@
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,6 +12,7 @@ from app.models.ledger import DoctorMonthlyStat
 from app.schemas.finance import ExpenseCategory, ExpenseCategoryCreate, OtherExpense, OtherExpenseCreate
 from app.services.expense_service import ExpenseService
 from app.services.audit_service import log_action
+from app.core.pagination import count_rows, decode_cursor, keyset_order, keyset_seek, next_cursor, page_offset, page_response
 
 router = APIRouter()
 
@@ -21,11 +22,14 @@ async def read_debtors(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(deps.get_current_user),
-    region_id: int = None
+    region_id: int = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None
 ) -> Any:
     """
     Get list of unpaid/partial invoices (Debtors).
     Managers see debtors only within their sub-team and regions.
+    Passing `cursor` (empty for the first page) or `count` returns {items, next_cursor, total}.
     """
     from app.crud.crud_user import get_descendant_ids
     from app.models.crm import MedicalOrganization
@@ -41,7 +45,6 @@ async def read_debtors(
         select(Invoice)
         .join(Reservation, Invoice.reservation_id == Reservation.id)
         .where(Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL]))
-        .order_by(Invoice.date.desc())
     )
     
     # Regional Restriction for RM
@@ -64,9 +67,13 @@ async def read_debtors(
     if final_region_ids:
         query = query.join(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id).where(MedicalOrganization.region_id.in_(final_region_ids))
         
-    result = await db.execute(query.offset(skip).limit(limit))
+    page_query = keyset_seek(query, Invoice.date, Invoice.id, decode_cursor(cursor))
+    result = await db.execute(page_query.order_by(*keyset_order(Invoice.date, Invoice.id)).offset(page_offset(skip, cursor)).limit(limit))
     invoices = result.scalars().all()
-    return invoices
+    if cursor is None and not count:
+        return invoices
+    total = await count_rows(db, query.with_only_columns(Invoice.id), count) if count else None
+    return page_response(invoices, next_cursor(invoices, limit, lambda i: i.date, lambda i: i.id), total)
 
 @router.get("/stats")
 async def read_global_stats(
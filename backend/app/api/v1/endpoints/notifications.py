@@ -1,10 +1,17 @@
+import asyncio
+import json
 from typing import Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, WebSocket
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.api import deps
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
 from app.models.crm import Notification
-from app.schemas.notification import Notification as NotificationSchema, NotificationCreate, NotificationUpdate
+from app.services.notification_hub import NotificationHub
+from app.services.notification_service import NotificationService
+from app.schemas.notification import Notification as NotificationSchema, NotificationCreate, NotificationUpdate, NotificationMarkRead
 from app.models.user import User
 
 router = APIRouter()
@@ -42,6 +49,32 @@ async def create_notification(
     await db.refresh(db_obj)
     return db_obj
 
+@router.get("/unread-count")
+async def get_unread_count(
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Unread notifications of the current user (badge), counted on the partial unread index.
+    """
+    return {"unread": await NotificationService.unread_count(db, current_user.id)}
+
+@router.post("/read")
+async def mark_notifications_read(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    body: NotificationMarkRead,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Mark several notifications read in one statement: by `ids`, or everything up to `before`.
+    """
+    if not body.ids and body.before is None:
+        raise HTTPException(status_code=400, detail="ids or before is required")
+    before = body.before.replace(tzinfo=None) if body.before and body.before.tzinfo else body.before
+    updated = await NotificationService.mark_read(db, current_user.id, ids=body.ids, before=before)
+    return {"updated": updated, "unread": await NotificationService.unread_count(db, current_user.id)}
+
 @router.put("/{notification_id}/read", response_model=NotificationSchema)
 async def mark_notification_read(
     *,
@@ -65,3 +98,89 @@ async def mark_notification_read(
     await db.commit()
     await db.refresh(db_obj)
     return db_obj
+
+async def _open_subscription(token: Optional[str]):
+    """
+    Authenticates a stream and registers it with the hub. Uses a short-lived session: a stream
+    stays open for hours and must not hold a pooled connection.
+    """
+    if not settings.NOTIFICATION_PUSH_ENABLED:
+        raise HTTPException(status_code=404, detail="Notification push is disabled (NOTIFICATION_PUSH_ENABLED)")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    async with AsyncSessionLocal() as db:
+        user = await deps.user_from_token(db, token)
+    return NotificationHub.subscribe(user.id, user.role)
+
+
+async def _with_unread(user_id: int, payload: dict) -> dict:
+    """Adds the current unread count to hello / notification / unread events (short-lived session)."""
+    if payload["type"] not in ("hello", "notification", "unread"):
+        return payload
+    async with AsyncSessionLocal() as db:
+        return {**payload, "unread": await NotificationService.unread_count(db, user_id)}
+
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return None
+
+
+@router.get("/stream")
+async def stream_notifications(
+    request: Request,
+    token: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+) -> Any:
+    """
+    Server-Sent Events replacing polling: new notifications (with the unread count), unread count
+    changes, payments, and deletion / return approval requests. The first event ("hello") carries
+    the current unread count. Browsers' EventSource cannot send headers, so `?token=` is accepted.
+    """
+    sub = await _open_subscription(_bearer(authorization) or token)
+
+    def sse(payload: dict) -> str:
+        return f"event: {payload['type']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def events():
+        try:
+            yield sse(await _with_unread(sub.user_id, {"type": "hello"}))
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(sub.queue.get(), settings.NOTIFICATION_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse(await _with_unread(sub.user_id, payload))
+        finally:
+            NotificationHub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/ws")
+async def notifications_ws(websocket: WebSocket, token: Optional[str] = None):
+    """Same events as /stream over a WebSocket (JSON messages; {"type": "ping"} as keep-alive)."""
+    try:
+        sub = await _open_subscription(_bearer(websocket.headers.get("authorization")) or token)
+    except HTTPException as e:
+        await websocket.close(code=4404 if e.status_code == 404 else 4401)
+        return
+    try:
+        await websocket.accept()
+        await websocket.send_json(await _with_unread(sub.user_id, {"type": "hello"}))
+        while True:
+            try:
+                payload = await asyncio.wait_for(sub.queue.get(), settings.NOTIFICATION_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                payload = {"type": "ping"}
+            await websocket.send_json(await _with_unread(sub.user_id, payload))
+    except Exception:
+        pass  # client went away
+    finally:
+        NotificationHub.unsubscribe(sub)
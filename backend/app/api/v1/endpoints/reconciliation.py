@@ -0,0 +1,43 @@
+from datetime import date
+from typing import Any, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api import deps
+from app.models.user import User, UserRole
+from app.services.audit_service import log_action
+from app.services.reconciliation_service import CHECKS, ReconciliationService
+
+router = APIRouter()
+
+
+@router.post("/")
+async def reconcile(
+    request: Request,
+    dry_run: bool = True,
+    checks: Optional[str] = None,
+    since: Optional[date] = None,
+    limit: int = Query(200, ge=0, le=10000),
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Invoice / payment / ledger consistency report. `checks` is a comma-separated subset of
+    orphaned_payments,invoice_paid,missing_accruals,ineligible_accruals,invoice_debt_entries.
+    With dry_run=false the differences found are repaired (one transaction) and the report lists them.
+    """
+    if current_user.role not in [UserRole.ADMIN, UserRole.DIRECTOR]:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    selected = [c.strip() for c in checks.split(",") if c.strip()] if checks else list(CHECKS)
+    unknown = [c for c in selected if c not in CHECKS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown checks: {', '.join(unknown)}")
+
+    report = await ReconciliationService.run(db, selected, repair=not dry_run, since=since, limit=limit)
+
+    if not dry_run:
+        summary = ", ".join(f"{name}: {c['repaired']}" for name, c in report["checks"].items())
+        await log_action(db, current_user, "RECONCILE", "Invoice", None, f"Сверка данных: {summary}", request)
+    return report
@@ -11,6 +11,7 @@ from app.models.crm import Doctor
 from app.models.product import Product
 import calendar
 from app.services.audit_service import log_action
+from app.services.analytics_cache import AnalyticsCache
 
 router = APIRouter()
 
@@ -53,6 +54,22 @@ async def get_comprehensive_reports(
         else:
             target_rep_ids = my_descendants
 
+    await log_action(
+        db, current_user, "REPORT_VIEW", "Analytics", 0,
+        f"Загружен комплексный отчет ({group_by}) с фильтрами: {start_date} - {end_date}",
+        request
+    )
+
+    cache_key = AnalyticsCache.make_key(
+        "reports",
+        {"rep_ids": target_rep_ids},
+        start_date=start_date, end_date=end_date, period=period,
+        product_id=product_id, region_id=region_id, group_by=group_by,
+    )
+    cached = AnalyticsCache.get(cache_key)
+    if cached is not None:
+        return cached
+
     report_map = {}
     is_medrep_view = group_by == "medrep"
 
@@ -210,16 +227,12 @@ async def get_comprehensive_reports(
 
     summary.sort(key=lambda x: x["plan_amount"], reverse=True)
 
-    await log_action(
-        db, current_user, "REPORT_VIEW", "Analytics", 0,
-        f"Загружен комплексный отчет ({group_by}) с фильтрами: {start_date} - {end_date}",
-        request
-    )
-
-    return {
+    response = {
         "period": period,
         "start_date": start_date,
         "end_date": end_date,
         "group_by": group_by,
         "data": summary
     }
+    AnalyticsCache.set(cache_key, response, closed_period=AnalyticsCache.is_closed_period(end_date))
+    return response
@@ -1,12 +1,11 @@
-from typing import Any, List, Optional, Dict
-import io
+from typing import Any, List, Optional, Dict, Union
 from pydantic import BaseModel
 import logging
 import urllib.parse
 
 logger = logging.getLogger(__name__)
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, or_
@@ -23,14 +22,18 @@ from app.models.warehouse import Warehouse
 from app.schemas.sales import (
     Plan, PlanCreate, 
     Reservation as ReservationSchema, ReservationCreate, ReservationUpdate,
-    Invoice as InvoiceSchema, Payment as PaymentSchema, PaymentCreate,
+    Invoice as InvoiceSchema, Payment as PaymentSchema, PaymentCreate, PaymentImport,
     DoctorFactAssignment as DoctorFactAssignmentSchema, DoctorFactAssignmentCreate, SaleFact,
     BonusPayment as BonusPaymentSchema, BonusPaymentCreate, BonusPaymentUpdate,
-    ReservationReturnCreate, BonusAllocationCreate, InvoiceStats
+    ReservationReturnCreate, BonusAllocationCreate, InvoiceStats,
+    InvoiceListRow, ReservationListRow, InvoicePage, InvoiceRowPage, ReservationPage, ReservationRowPage
 )
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from app.core.pagination import decode_cursor, next_cursor, page_offset, page_response
+from app.core.config import settings
+from app.services.idempotency_service import IdempotentRequest
 import traceback
+from app.services.export_jobs import ExportJobService, XLSX_MEDIA_TYPE
+from app.services.excel_reports import render_reservation_invoice
 
 router = APIRouter()
 
@@ -112,6 +115,90 @@ async def delete_plan(
     return {"ok": True}
 
 
+async def _descendant_scope(db: AsyncSession, current_user: User, med_rep_id: Optional[int]):
+    """(med_rep_id, med_rep_ids): a med rep sees only themselves, managers their team, others any rep."""
+    if current_user.role == UserRole.MED_REP:
+        return current_user.id, None
+    if current_user.role in [UserRole.PRODUCT_MANAGER, UserRole.FIELD_FORCE_MANAGER, UserRole.REGIONAL_MANAGER]:
+        from app.crud import crud_user
+        med_rep_ids = await crud_user.get_descendant_ids(db, current_user.id)
+        return None, med_rep_ids or [-1]
+    return med_rep_id, None
+
+async def _manager_region_ids(db: AsyncSession, user_id: int) -> List[int]:
+    # Explicit query to avoid async lazy-load crash
+    from app.models.crm import user_regions
+    region_res = await db.execute(
+        select(user_regions.c.region_id).where(user_regions.c.user_id == user_id)
+    )
+    return [row[0] for row in region_res.fetchall()]
+
+async def _reservation_scope(db: AsyncSession, current_user: User, med_rep_id: Optional[int], region_id: Optional[int]):
+    """(med_rep_id, med_rep_ids, region_ids) for reservation listings; a regional manager stays within their regions."""
+    med_rep_id, med_rep_ids = await _descendant_scope(db, current_user, med_rep_id)
+    region_ids = None
+    if current_user.role == UserRole.REGIONAL_MANAGER:
+        rm_region_ids = await _manager_region_ids(db, current_user.id)
+        if region_id:
+            region_ids = [region_id] if region_id in rm_region_ids else [-1]
+        else:
+            region_ids = rm_region_ids if rm_region_ids else None
+    elif region_id:
+        region_ids = [region_id]
+    return med_rep_id, med_rep_ids, region_ids
+
+async def _invoice_scope(db: AsyncSession, current_user: User, med_rep_id: Optional[int], region_id: Optional[int]):
+    """(med_rep_id, med_rep_ids, region_ids) for invoice listings and stats."""
+    med_rep_id, med_rep_ids = await _descendant_scope(db, current_user, med_rep_id)
+    region_ids = None
+    if region_id:
+        region_ids = [region_id]
+    elif current_user.role == UserRole.REGIONAL_MANAGER:
+        region_ids = await _manager_region_ids(db, current_user.id) or None
+    return med_rep_id, med_rep_ids, region_ids
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value or not value.strip():
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+async def _reservation_filters(
+    db: AsyncSession, current_user: User, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+    is_tovar_skidka, inv_num, status, med_rep_id, med_org_id, region_id
+) -> dict:
+    """crud_sales reservation filter kwargs for the query parameters, within the user's visibility."""
+    med_rep_id, med_rep_ids, region_ids = await _reservation_scope(db, current_user, med_rep_id, region_id)
+    return dict(
+        med_rep_id=med_rep_id, date_from=_parse_date(date_from), date_to=_parse_date(date_to),
+        med_rep_name=med_rep_name, med_org_name=med_org_name, med_org_type=med_org_type,
+        is_tovar_skidka=is_tovar_skidka, inv_num=inv_num, med_rep_ids=med_rep_ids, status=status,
+        med_org_id=med_org_id, region_ids=region_ids
+    )
+
+async def _invoice_filters(
+    db: AsyncSession, current_user: User, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+    is_tovar_skidka, inv_num, status, med_rep_id, med_org_id, has_debt, only_overdue, region_id
+) -> dict:
+    """crud_sales invoice filter kwargs for the query parameters, within the user's visibility."""
+    med_rep_id, med_rep_ids, region_ids = await _invoice_scope(db, current_user, med_rep_id, region_id)
+    return dict(
+        med_rep_id=med_rep_id, date_from=_parse_date(date_from), date_to=_parse_date(date_to),
+        med_rep_name=med_rep_name, med_org_name=med_org_name, med_org_type=med_org_type,
+        is_tovar_skidka=is_tovar_skidka, inv_num=inv_num, med_rep_ids=med_rep_ids, status=status,
+        has_debt=has_debt, med_org_id=med_org_id, region_ids=region_ids, only_overdue=only_overdue
+    )
+
+def _cursor_page(items: list, limit: int, total: Optional[int]) -> dict:
+    """{items, next_cursor, total} for a page ordered by (date, id) desc; rows are ORM objects or dicts."""
+    if items and isinstance(items[0], dict):
+        cursor = next_cursor(items, limit, lambda r: r["date"], lambda r: r["id"])
+    else:
+        cursor = next_cursor(items, limit, lambda r: r.date, lambda r: r.id)
+    return page_response(items, cursor, total)
+
 # Reservations (Bron)
 @router.post("/reservations/", response_model=ReservationSchema)
 async def create_reservation(
@@ -120,7 +207,10 @@ async def create_reservation(
     reservation_in: ReservationCreate,
     current_user: User = Depends(deps.get_current_user),
     request: Request,
+    idempotency: IdempotentRequest = Depends(deps.get_idempotency),
 ) -> Any:
+    if idempotency.replay is not None:
+        return idempotency.replay
     # Use the service that locks and deducts stock
     from app.services.reservation_service import ReservationService
     reservation, mod_summary = await ReservationService.create_reservation_with_stock_lock(
@@ -139,7 +229,7 @@ async def create_reservation(
         log_description,
         request
     )
-    return reservation
+    return await idempotency.save(reservation, ReservationSchema)
 
 @router.delete("/reservations/{id}")
 async def delete_reservation(
@@ -195,7 +285,7 @@ async def delete_reservation(
     )
     return {"ok": True, "message": "Reservation cancelled and stock restored."}
 
-@router.get("/reservations/", response_model=List[ReservationSchema])
+@router.get("/reservations/", response_model=Union[List[ReservationSchema], ReservationPage])
 async def read_reservations(
     db: AsyncSession = Depends(deps.get_db),
     skip: int = 0,
@@ -211,7 +301,9 @@ async def read_reservations(
     status: Optional[str] = None,
     med_rep_id: Optional[int] = None,
     med_org_id: Optional[int] = None,
-    region_id: Optional[int] = None
+    region_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None
 ) -> Any:
     """
     Retrieve reservations with optional filtering.
@@ -226,66 +318,66 @@ async def read_reservations(
     - med_rep_name: Search by MedRep's full name.
     - med_org_name: Search by Medical Organization name.
     - status: Filter by ReservationStatus (draft, pending, approved, etc.)
+
+    Pagination: `skip` / `limit` return a plain list. Passing `cursor` (empty for the first page) or
+    `count` ("exact" / "estimate") returns {items, next_cursor, total}; follow next_cursor instead of skip.
     """
-    # Prioritize provided med_rep_id, but respect current_user roles
-    final_med_rep_id = med_rep_id
-    med_rep_ids = None
-    if current_user.role == UserRole.MED_REP:
-        final_med_rep_id = current_user.id
-    elif current_user.role in [UserRole.PRODUCT_MANAGER, UserRole.FIELD_FORCE_MANAGER, UserRole.REGIONAL_MANAGER]:
-        from app.crud import crud_user
-        med_rep_ids = await crud_user.get_descendant_ids(db, current_user.id)
-        if not med_rep_ids:
-            med_rep_ids = [-1]
-        final_med_rep_id = None
-    
-    # Regional Restriction - use explicit query to avoid async lazy-load crash
-    final_region_ids = None
-    if current_user.role == UserRole.REGIONAL_MANAGER:
-        from sqlalchemy import select as sa_select
-        from app.models.crm import user_regions
-        region_res = await db.execute(
-            sa_select(user_regions.c.region_id).where(user_regions.c.user_id == current_user.id)
-        )
-        rm_region_ids = [row[0] for row in region_res.fetchall()]
-        if region_id:
-            final_region_ids = [region_id] if region_id in rm_region_ids else [-1]
-        else:
-            final_region_ids = rm_region_ids if rm_region_ids else None
-    elif region_id:
-        final_region_ids = [region_id]
-
-    dt_from = None
-    if date_from and isinstance(date_from, str) and date_from.strip():
-        try:
-            dt_from = datetime.fromisoformat(date_from)
-        except (ValueError, TypeError):
-            dt_from = None
-            
-    dt_to = None
-    if date_to and isinstance(date_to, str) and date_to.strip():
-        try:
-            dt_to = datetime.fromisoformat(date_to)
-        except (ValueError, TypeError):
-            dt_to = None
-    
-    return await crud_sales.get_reservations(
-        db, 
-        skip=skip, 
-        limit=limit, 
-        med_rep_id=final_med_rep_id,
-        date_from=dt_from,
-        date_to=dt_to,
-        med_rep_name=med_rep_name,
-        med_org_name=med_org_name,
-        med_org_type=med_org_type,
-        is_tovar_skidka=is_tovar_skidka,
-        inv_num=inv_num,
-        med_rep_ids=med_rep_ids,
-        status=status,
-        med_org_id=med_org_id,
-        region_ids=final_region_ids
+    filters = await _reservation_filters(
+        db, current_user, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, status, med_rep_id, med_org_id, region_id
+    )
+    reservations = await crud_sales.get_reservations(db, skip=page_offset(skip, cursor), limit=limit, after=decode_cursor(cursor), **filters)
+    if cursor is None and not count:
+        return reservations
+    total = await crud_sales.count_reservations(db, count, **filters) if count else None
+    return _cursor_page(reservations, limit, total)
+
+@router.get("/reservations/list", response_model=Union[List[ReservationListRow], ReservationRowPage])
+async def read_reservation_rows(
+    db: AsyncSession = Depends(deps.get_db),
+    skip: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(deps.get_current_user),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    status: Optional[str] = None,
+    med_rep_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    region_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None
+) -> Any:
+    """
+    Reservation list page: same filters, visibility and pagination as GET /reservations/, but compact rows
+    (creator, organization with region and reps, items with product name). Full graph: /reservations/{id}/detail.
+    """
+    filters = await _reservation_filters(
+        db, current_user, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, status, med_rep_id, med_org_id, region_id
     )
+    rows = await crud_sales.get_reservation_rows(db, skip=page_offset(skip, cursor), limit=limit, after=decode_cursor(cursor), **filters)
+    if cursor is None and not count:
+        return rows
+    total = await crud_sales.count_reservations(db, count, **filters) if count else None
+    return _cursor_page(rows, limit, total)
+
+@router.get("/reservations/{id}/detail", response_model=ReservationSchema)
+async def read_reservation_detail(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """Full reservation graph (items with products, warehouse, organization, invoice with payments)."""
+    reservation = await crud_sales.get_reservation(db, id=id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return reservation
 
 @router.get("/reservations/{id}")
 async def read_reservation(
@@ -408,7 +500,7 @@ async def map_return_reservation_items(
     return reservation
 
 # Invoices (Factura)
-@router.get("/invoices/", response_model=List[InvoiceSchema])
+@router.get("/invoices/", response_model=Union[List[InvoiceSchema], InvoicePage])
 async def read_invoices(
     db: AsyncSession = Depends(deps.get_db),
     skip: int = 0,
@@ -427,66 +519,66 @@ async def read_invoices(
     has_debt: bool = False,
     only_overdue: bool = False,
     region_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
 ) -> Any:
+    """
+    Pagination: `skip` / `limit` return a plain list. Passing `cursor` (empty for the first page) or
+    `count` ("exact" / "estimate") returns {items, next_cursor, total}; follow next_cursor instead of skip.
+    """
+    after = decode_cursor(cursor)
     try:
-        med_rep_ids = None
-        if current_user.role == UserRole.MED_REP:
-            med_rep_id = current_user.id
-        elif current_user.role in [UserRole.PRODUCT_MANAGER, UserRole.FIELD_FORCE_MANAGER, UserRole.REGIONAL_MANAGER]:
-            from app.crud import crud_user
-            med_rep_ids = await crud_user.get_descendant_ids(db, current_user.id)
-            if not med_rep_ids:
-                med_rep_ids = [-1]
-            med_rep_id = None
-
-        # Build region_ids from explicit query to avoid async lazy-load crash
-        region_ids = None
-        if region_id:
-            region_ids = [region_id]
-        elif current_user.role == UserRole.REGIONAL_MANAGER:
-            from sqlalchemy import select as sa_select
-            from app.models.crm import user_regions
-            region_res = await db.execute(
-                sa_select(user_regions.c.region_id).where(user_regions.c.user_id == current_user.id)
-            )
-            r_ids = [row[0] for row in region_res.fetchall()]
-            if r_ids:
-                region_ids = r_ids
-        
-        # Robust date parsing
-        dt_from = None
-        if date_from and date_from.strip():
-            try: dt_from = datetime.fromisoformat(date_from)
-            except: pass
-            
-        dt_to = None
-        if date_to and date_to.strip():
-            try: dt_to = datetime.fromisoformat(date_to)
-            except: pass
-        
-        return await crud_sales.get_invoices(
-            db, 
-            skip=skip, 
-            limit=limit, 
-            med_rep_id=med_rep_id,
-            date_from=dt_from,
-            date_to=dt_to,
-            med_rep_name=med_rep_name,
-            med_org_name=med_org_name,
-            med_org_type=med_org_type,
-            is_tovar_skidka=is_tovar_skidka,
-            inv_num=inv_num,
-            med_rep_ids=med_rep_ids,
-            status=status,
-            has_debt=has_debt,
-            med_org_id=med_org_id,
-            region_ids=region_ids,
-            only_overdue=only_overdue
+        filters = await _invoice_filters(
+            db, current_user, date_from, date_to, med_rep_name, med_org_name, med_org_type, is_tovar_skidka,
+            inv_num, status, med_rep_id, med_org_id, has_debt, only_overdue, region_id
         )
+        invoices = await crud_sales.get_invoices(db, skip=page_offset(skip, cursor), limit=limit, after=after, **filters)
+        if cursor is None and not count:
+            return invoices
+        total = await crud_sales.count_invoices(db, count, **filters) if count else None
+        return _cursor_page(invoices, limit, total)
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         raise HTTPException(status_code=500, detail=traceback.format_exc())
 
+@router.get("/invoices/list", response_model=Union[List[InvoiceListRow], InvoiceRowPage])
+async def read_invoice_rows(
+    db: AsyncSession = Depends(deps.get_db),
+    skip: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(deps.get_current_user),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    status: Optional[str] = None,
+    med_rep_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    has_debt: bool = False,
+    only_overdue: bool = False,
+    region_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
+) -> Any:
+    """
+    Invoice / debtor list pages: same filters, visibility and pagination as GET /invoices/, but compact rows
+    (no payments, warehouse stocks or product catalogs). Full graph: /invoices/{id}.
+    """
+    filters = await _invoice_filters(
+        db, current_user, date_from, date_to, med_rep_name, med_org_name, med_org_type, is_tovar_skidka,
+        inv_num, status, med_rep_id, med_org_id, has_debt, only_overdue, region_id
+    )
+    rows = await crud_sales.get_invoice_rows(db, skip=page_offset(skip, cursor), limit=limit, after=decode_cursor(cursor), **filters)
+    if cursor is None and not count:
+        return rows
+    total = await crud_sales.count_invoices(db, count, **filters) if count else None
+    return _cursor_page(rows, limit, total)
+
 @router.get("/invoices/stats")
 async def read_invoice_stats(
     db: AsyncSession = Depends(deps.get_db),
@@ -511,46 +603,12 @@ async def read_invoice_stats(
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
     try:
-        med_rep_ids = None
-        if current_user.role == UserRole.MED_REP:
-            med_rep_id = current_user.id
-        elif current_user.role in [UserRole.PRODUCT_MANAGER, UserRole.FIELD_FORCE_MANAGER, UserRole.REGIONAL_MANAGER]:
-            from app.crud import crud_user
-            med_rep_ids = await crud_user.get_descendant_ids(db, current_user.id)
-            if not med_rep_ids:
-                med_rep_ids = [-1]
-            med_rep_id = None
-        
-        # Build region_ids from explicit query to avoid async lazy-load crash
-        region_ids = None
-        if region_id:
-            region_ids = [region_id]
-        elif current_user.role == UserRole.REGIONAL_MANAGER:
-            from sqlalchemy import select as sa_select
-            from app.models.crm import user_regions
-            region_res = await db.execute(
-                sa_select(user_regions.c.region_id).where(user_regions.c.user_id == current_user.id)
-            )
-            r_ids = [row[0] for row in region_res.fetchall()]
-            if r_ids:
-                region_ids = r_ids
-        
-        # Robust date parsing
-        dt_from = None
-        if date_from and date_from.strip():
-            try: dt_from = datetime.fromisoformat(date_from)
-            except: pass
-            
-        dt_to = None
-        if date_to and date_to.strip():
-            try: dt_to = datetime.fromisoformat(date_to)
-            except: pass
-        
+        med_rep_id, med_rep_ids, region_ids = await _invoice_scope(db, current_user, med_rep_id, region_id)
         return await crud_sales.get_invoice_stats(
             db, 
             med_rep_id=med_rep_id,
-            date_from=dt_from,
-            date_to=dt_to,
+            date_from=_parse_date(date_from),
+            date_to=_parse_date(date_to),
             med_rep_name=med_rep_name,
             med_org_name=med_org_name,
             med_org_type=med_org_type,
@@ -601,6 +659,19 @@ async def get_eligible_invoices_for_tovar_skidka(
         logger.error(f"Error in get_eligible_invoices_for_tovar_skidka: {error_detail}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/invoices/{id}", response_model=InvoiceSchema)
+async def read_invoice(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """Full invoice graph (payments, reservation with items, warehouse and organization)."""
+    invoice = await crud_sales.get_invoice(db, id=id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice
+
 # Payments
 @router.post("/payments/", response_model=PaymentSchema)
 async def create_payment(
@@ -609,7 +680,10 @@ async def create_payment(
     payment_in: PaymentCreate,
     current_user: User = Depends(deps.get_current_user),
     request: Request,
+    idempotency: IdempotentRequest = Depends(deps.get_idempotency),
 ) -> Any:
+    if idempotency.replay is not None:
+        return idempotency.replay
     from app.services.finance_service import FinancialService
     payment = await FinancialService.process_payment(db, obj_in=payment_in, processor_id=current_user.id)
     from app.services.audit_service import log_action
@@ -618,7 +692,58 @@ async def create_payment(
         f"Оплата принята: {payment.amount:,.0f} UZS",
         request
     )
-    return payment
+    return await idempotency.save(payment, PaymentSchema)
+
+PAYMENT_IMPORT_ROLES = [UserRole.ACCOUNTANT, UserRole.INVESTOR, UserRole.ADMIN, UserRole.DIRECTOR]
+
+async def _import_payments(db: AsyncSession, lines: list, dry_run: bool, current_user: User, request: Request) -> Any:
+    from app.services.payment_import_service import PaymentImportService
+    from app.services.audit_service import log_action
+    report = await PaymentImportService.import_payments(db, lines, processor_id=current_user.id, dry_run=dry_run)
+    if not dry_run and report["applied"]:
+        await log_action(
+            db, current_user, "IMPORT", "Payment", None,
+            f"Импорт оплат: {report['applied']} строк, {report['total_amount']:,.0f} UZS"
+            + (f" ({report['failed']} с ошибками)" if report["failed"] else ""),
+            request
+        )
+    return report
+
+@router.post("/payments/import")
+async def import_payments(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    payload: PaymentImport,
+    current_user: User = Depends(deps.get_current_user),
+    request: Request,
+) -> Any:
+    """
+    Bulk payments (bank statement lines) in one transaction. Each line is applied like POST /payments/;
+    invalid lines are skipped and reported. dry_run validates and computes the result without saving.
+    """
+    if current_user.role not in PAYMENT_IMPORT_ROLES:
+        raise HTTPException(status_code=403, detail="Только бухгалтер или администрация может импортировать платежи.")
+    if len(payload.lines) > settings.PAYMENT_IMPORT_MAX_LINES:
+        raise HTTPException(status_code=400, detail=f"Не более {settings.PAYMENT_IMPORT_MAX_LINES} строк за один импорт")
+    return await _import_payments(db, payload.lines, payload.dry_run, current_user, request)
+
+@router.post("/payments/import/excel")
+async def import_payments_excel(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: User = Depends(deps.get_current_user),
+    request: Request,
+) -> Any:
+    """Same as /payments/import from an .xlsx bank statement (columns: invoice_id or factura_number, amount, payment_type, comment)."""
+    if current_user.role not in PAYMENT_IMPORT_ROLES:
+        raise HTTPException(status_code=403, detail="Только бухгалтер или администрация может импортировать платежи.")
+    from app.services.payment_import_service import PaymentImportService
+    lines = PaymentImportService.parse_statement(await file.read())
+    if len(lines) > settings.PAYMENT_IMPORT_MAX_LINES:
+        raise HTTPException(status_code=400, detail=f"Не более {settings.PAYMENT_IMPORT_MAX_LINES} строк за один импорт")
+    return await _import_payments(db, lines, dry_run, current_user, request)
 
 @router.delete("/payments/{id}")
 async def delete_payment(
@@ -709,9 +834,32 @@ async def delete_balance_transaction(
 async def read_facts(
     db: AsyncSession = Depends(deps.get_db),
     med_rep_id: int = None,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    year: Optional[int] = None,
+    doctor_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
-    return await crud_sales.get_facts(db, med_rep_id=med_rep_id)
+    """
+    Paid sale facts (paid share of invoiced items) and doctor fact assignments, computed in SQL.
+    Without `limit` every matching fact is returned; format=ndjson streams the same page, one JSON object per line.
+    """
+    filters = {"med_rep_id": med_rep_id, "month": month, "year": year, "doctor_id": doctor_id, "product_id": product_id}
+    if format == "ndjson":
+        import json
+        from app.db.session import AsyncSessionLocal
+
+        async def lines():
+            # Own session: the request session is closed while the response streams
+            async with AsyncSessionLocal() as session:
+                async for fact in crud_sales.iter_facts(session, skip=skip, limit=limit, **filters):
+                    yield json.dumps(fact, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    return await crud_sales.get_facts(db, skip=skip, limit=limit, **filters)
 
 @router.get("/doctor-facts/", response_model=List[DoctorFactAssignmentSchema])
 async def read_doctor_facts(
@@ -816,6 +964,58 @@ async def update_bonus_payment(
     )
     return result
 
+async def collect_reservation_export(db: AsyncSession, current_user: User, params: dict, job: Optional[dict] = None):
+    """Reservation «Фактура» data as a plain payload for excel_reports.render_reservation_invoice."""
+    reservation = await crud_sales.get_reservation(db, id=params.get("id"))
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    total_client_bonus = 0.0
+    total_manager_bonus = 0.0
+    items = []
+    for idx, item in enumerate(reservation.items, 1):
+        actual_qty = (item.quantity or 0) - (item.returned_quantity or 0)
+        if actual_qty <= 0:
+            continue
+        if reservation.is_bonus_eligible:
+            total_client_bonus += actual_qty * (item.marketing_amount or 0)
+        if reservation.is_salary_enabled:
+            total_manager_bonus += actual_qty * (item.salary_amount or 0)
+        items.append({
+            "idx": idx,
+            "name": item.product.name if item.product else "",
+            "qty": actual_qty,
+            "price": item.price or 0.0,
+            "production_price": item.product.production_price if item.product else 0,
+        })
+
+    # If any item has a discount, we use it (or reservation-level if we had one)
+    discount_val = 0.0
+    if reservation.items and len(reservation.items) > 0:
+        discount_val = next((it.discount_percent for it in reservation.items if it.discount_percent), 0.0)
+
+    org_name = (reservation.med_org.name if reservation.med_org else reservation.customer_name) or "N/A"
+    payload = {
+        "org_name": org_name,
+        "org_inn": reservation.med_org.inn if reservation.med_org and reservation.med_org.inn else "",
+        "total_client_bonus": total_client_bonus,
+        "total_manager_bonus": total_manager_bonus,
+        "items": items,
+        "discount_percent": discount_val,
+        "nds_percent": reservation.nds_percent if reservation.nds_percent is not None else 12.0,
+    }
+
+    org_inn = reservation.med_org.inn if reservation.med_org and reservation.med_org.inn else "no_inn"
+    realization_date = reservation.invoice.realization_date if reservation.invoice and reservation.invoice.realization_date else reservation.date
+    date_str = realization_date.strftime("%d.%m.%Y") if realization_date else "no_date"
+    
+    # Sanitize for filename: remove truly illegal chars like / \ : * ? " < > |
+    # We preserve spaces, dots, and Unicode (Cyrillic) characters
+    illegal_chars = '/\\:*?"<>|'
+    safe_org_name = "".join([c for c in org_name if c not in illegal_chars]).strip()
+    return payload, f"{safe_org_name}_{org_inn}_{date_str}.xlsx"
+
+
 @router.get("/reservations/{id}/export")
 async def export_reservation_excel(
     *,
@@ -824,165 +1024,13 @@ async def export_reservation_excel(
     current_user: User = Depends(deps.get_current_user),
 ):
     try:
-        reservation = await crud_sales.get_reservation(db, id=id)
-        if not reservation:
-            raise HTTPException(status_code=404, detail="Reservation not found")
-            
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Фактура"
-        
-        # Yellow fill
-        fill_yellow = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-        fill_blue = PatternFill(start_color="B4C6E7", end_color="B4C6E7", fill_type="solid")
-        fill_pink = PatternFill(start_color="E6B8B7", end_color="E6B8B7", fill_type="solid")
-        
-        font_bold = Font(bold=True)
-        border_thin = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        
-        total_client_bonus = 0.0
-        total_manager_bonus = 0.0
-        for item in reservation.items:
-            actual_qty = (item.quantity or 0) - (item.returned_quantity or 0)
-            if actual_qty > 0:
-                if reservation.is_bonus_eligible:
-                    total_client_bonus += actual_qty * (item.marketing_amount or 0)
-                if reservation.is_salary_enabled:
-                    total_manager_bonus += actual_qty * (item.salary_amount or 0)
-
-        # 1. Харажатлардан кейин Фойда/Зарар (Shifting to column 4 - Column D)
-        ws.cell(row=1, column=4, value="Харажатлардан кейин Фойда/Зарар").font = font_bold
-        ws.cell(row=2, column=4, value="Клинт бонуси")
-        ws.cell(row=2, column=5, value=total_client_bonus).fill = fill_yellow
-        ws.cell(row=3, column=4, value="Менеджерлар бонуси")
-        ws.cell(row=4, column=4, value="Прямой").font = font_bold
-        ws.cell(row=4, column=5, value=total_manager_bonus).fill = fill_yellow
-        ws.cell(row=5, column=4, value="Доставка")
-        ws.cell(row=5, column=5).fill = fill_yellow
-        
-        org_name = reservation.med_org.name if reservation.med_org else (reservation.customer_name or "N/A")
-        org_inn = reservation.med_org.inn if reservation.med_org and reservation.med_org.inn else ""
-        
-        ws.cell(row=6, column=4, value="КОРХОНА НОМИ").fill = fill_blue
-        ws.cell(row=6, column=5, value=org_name).fill = fill_blue
-        ws.merge_cells(start_row=6, start_column=5, end_row=6, end_column=8)
-        
-        ws.cell(row=7, column=4, value="ИНН").fill = fill_blue
-        ws.cell(row=7, column=5, value=org_inn).fill = fill_blue
-        ws.merge_cells(start_row=7, start_column=5, end_row=7, end_column=8)
-        
-        headers = ["№", "Наименование", "Кол-во", "Цена", "Завода келишилган", "Сумма"]
-        for i, header in enumerate(headers):
-            col_idx = i + 3 # Start from C
-            cell = ws.cell(row=8, column=col_idx, value=header)
-            cell.border = border_thin
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            if col_idx == 7: # "Завода келишилган"
-                cell.fill = fill_pink
-            else:
-                cell.fill = fill_blue
-            
-        # Column widths (Shifting A->C, B->D, etc.)
-        ws.column_dimensions['C'].width = 5
-        ws.column_dimensions['D'].width = 40
-        ws.column_dimensions['E'].width = 10
-        ws.column_dimensions['F'].width = 15
-        ws.column_dimensions['G'].width = 20
-        ws.column_dimensions['H'].width = 15
-        
-        subtotal_plain = 0.0
-        row_idx = 9
-        for idx, item in enumerate(reservation.items, 1):
-            actual_qty = (item.quantity or 0) - (item.returned_quantity or 0)
-            if actual_qty <= 0:
-                continue
-                
-            item_price = item.price or 0.0
-            # Plain amount for the row (qty * price)
-            plain_amount = actual_qty * item_price
-            subtotal_plain += plain_amount
-            
-            ws.cell(row=row_idx, column=3, value=idx).border = border_thin
-            
-            cell_name = ws.cell(row=row_idx, column=4, value=item.product.name if item.product else "")
-            cell_name.border = border_thin
-            cell_name.fill = fill_yellow
-            
-            cell_qty = ws.cell(row=row_idx, column=5, value=actual_qty)
-            cell_qty.border = border_thin
-            cell_qty.fill = fill_yellow
-            cell_qty.alignment = Alignment(horizontal='center')
-            
-            cell_price = ws.cell(row=row_idx, column=6, value=item_price)
-            cell_price.border = border_thin
-            cell_price.fill = fill_yellow
-            cell_price.alignment = Alignment(horizontal='center')
-            
-            # Завода келишилган (production price)
-            prod_price = item.product.production_price if item.product else 0
-            cell_prod = ws.cell(row=row_idx, column=7, value=prod_price)
-            cell_prod.border = border_thin
-            cell_prod.fill = fill_pink
-            cell_prod.alignment = Alignment(horizontal='center')
-            
-            cell_sum = ws.cell(row=row_idx, column=8, value=plain_amount)
-            cell_sum.border = border_thin
-            cell_sum.fill = fill_yellow
-            cell_sum.alignment = Alignment(horizontal='right')
-            row_idx += 1
-            
-        # Add 4 extra empty rows (as requested)
-        for _ in range(4):
-            for col_idx in range(3, 9): # Columns C to H
-                cell = ws.cell(row=row_idx, column=col_idx)
-                cell.border = border_thin
-            row_idx += 1
-            
-        # Totals
-        discount_val = 0.0
-        # If any item has a discount, we use it (or reservation-level if we had one)
-        if reservation.items and len(reservation.items) > 0:
-            discount_val = next((it.discount_percent for it in reservation.items if it.discount_percent), 0.0)
-            
-        discounted_total = subtotal_plain * (1 - discount_val / 100.0)
-        nds_percent = reservation.nds_percent if reservation.nds_percent is not None else 12.0
-        nds_total = discounted_total * (1 + nds_percent / 100.0)
-        
-        cell_sub = ws.cell(row=row_idx, column=8, value=subtotal_plain)
-        cell_sub.font = font_bold
-        cell_sub.alignment = Alignment(horizontal='right')
-        
-        label_disc = ws.cell(row=row_idx + 1, column=7, value=f"{discount_val}% скидка билан")
-        label_disc.alignment = Alignment(horizontal='right')
-        cell_disc = ws.cell(row=row_idx + 1, column=8, value=discounted_total)
-        cell_disc.font = font_bold
-        cell_disc.alignment = Alignment(horizontal='right')
-        
-        label_nds = ws.cell(row=row_idx + 2, column=7, value=f"{nds_percent}% ндс билан")
-        label_nds.alignment = Alignment(horizontal='right')
-        cell_nds = ws.cell(row=row_idx + 2, column=8, value=nds_total)
-        cell_nds.font = font_bold
-        cell_nds.alignment = Alignment(horizontal='right')
-        
-        org_name = (reservation.med_org.name if reservation.med_org else reservation.customer_name) or "N/A"
-        org_inn = reservation.med_org.inn if reservation.med_org and reservation.med_org.inn else "no_inn"
-        realization_date = reservation.invoice.realization_date if reservation.invoice and reservation.invoice.realization_date else reservation.date
-        date_str = realization_date.strftime("%d.%m.%Y") if realization_date else "no_date"
-        
-        # Sanitize for filename: remove truly illegal chars like / \ : * ? " < > |
-        # We preserve spaces, dots, and Unicode (Cyrillic) characters
-        illegal_chars = '/\\:*?"<>|'
-        safe_org_name = "".join([c for c in org_name if c not in illegal_chars]).strip()
-        filename = f"{safe_org_name}_{org_inn}_{date_str}.xlsx"
+        payload, filename = await collect_reservation_export(db, current_user, {"id": id})
+        path = await ExportJobService.render(render_reservation_invoice, payload)
         encoded_filename = urllib.parse.quote(filename)
-        
-        stream = io.BytesIO()
-        wb.save(stream)
-        stream.seek(0)
-        
+
         return StreamingResponse(
-            stream, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            ExportJobService.iter_file(path),
+            media_type=XLSX_MEDIA_TYPE,
             headers={
                 "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
                 "Access-Control-Expose-Headers": "Content-Disposition"
@@ -994,6 +1042,9 @@ async def export_reservation_excel(
             raise e
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+
+ExportJobService.register("reservation", collect_reservation_export, render_reservation_invoice)
+
 # MedRep Bonus Balance System
 
 @router.get("/bonuses/history/{med_rep_id}")
@@ -1035,34 +1086,15 @@ async def get_medrep_bonus_balance(
         if current_user.role not in allowed_roles and current_user.role != UserRole.MED_REP:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        from app.services.finance_service import FinancialService
-        from app.models.ledger import BonusLedger, LedgerType
+        from app.models.ledger import BonusLedger
         from app.models.sales import Reservation, ReservationItem, Invoice
-        # Calculate usable balance (Paid accruals - offsets) for the specific category
-        balance = await FinancialService.get_medrep_bonus_balance(db, target_id, category=category)
-        
-
-        
-        # Calculate totals by category
-        all_entries_res = await db.execute(
-            select(BonusLedger).where(
-                BonusLedger.user_id == target_id,
-                BonusLedger.ledger_category == category
-            )
-        )
-        all_entries = all_entries_res.scalars().all()
-        
-        total_accrued = 0.0
-        total_paid = 0.0
-        total_allocated = 0.0
-        
-        for e in all_entries:
-            if e.ledger_type == LedgerType.ACCRUAL:
-                total_accrued += e.amount
-                if e.is_paid:
-                    total_paid += e.amount
-            elif e.ledger_type == LedgerType.OFFSET:
-                total_allocated += abs(e.amount)
+        from app.services.bonus_balance_service import BonusBalanceService
+        # Usable balance (Paid accruals - offsets) and totals for the specific category, from the snapshot
+        totals = await BonusBalanceService.get(db, target_id, category)
+        balance = totals["balance"]
+        total_accrued = totals["accrued"]
+        total_paid = totals["paid_accrued"]
+        total_allocated = totals["allocated"]
         
         # Get history (all transactions)
         query = select(BonusLedger).options(
@@ -1156,13 +1188,17 @@ async def get_medrep_bonus_balance(
                 "payment_type": h.payment.payment_type if h.payment else None,
             })
         
-        return {
+        response = {
             "balance": balance,
             "total_accrued": total_accrued,
             "total_paid": total_paid,
             "total_allocated": total_allocated,
             "history": history_data
         }
+        if month and year:
+            # Balance as it stood at the end of the selected month
+            response["period_end_balance"] = (await BonusBalanceService.get_as_of(db, target_id, year, month, category))["balance"]
+        return response
     except Exception as e:
         import traceback
         import sys
@@ -1274,8 +1310,9 @@ async def get_admin_bonus_summary(
     from app.models.user import User
     from app.models.ledger import BonusLedger, LedgerType
     from app.models.sales import Invoice, Payment, Reservation, ReservationItem, InvoiceStatus
+    from app.models.crm import medrep_organization
     from datetime import datetime, timedelta
-    from sqlalchemy import func, and_, or_
+    from sqlalchemy import func, and_, or_, case, union, true
     
     # Get all medreps with regions
     query = select(User).where(User.role == UserRole.MED_REP, User.is_active == True).options(selectinload(User.assigned_regions))
@@ -1305,61 +1342,52 @@ async def get_admin_bonus_summary(
     debitorka_map = {}
     
     if rep_ids:
-        for rep in medreps:
-            # REALIZATION
-            real_q = select(
-                func.coalesce(func.sum(ReservationItem.quantity * ReservationItem.price), 0.0)
-            ).select_from(Invoice)\
-             .join(Reservation, Invoice.reservation_id == Reservation.id)\
-             .join(ReservationItem, Reservation.id == ReservationItem.reservation_id)\
-             .outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)\
-             .where(Invoice.status != InvoiceStatus.CANCELLED)\
-             .where(or_(
-                 Reservation.created_by_id == rep.id, 
-                 MedicalOrganization.assigned_reps.any(User.id == rep.id)
-             ))
-             
-            if start_date and end_date: real_q = real_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-            if product_id: real_q = real_q.where(ReservationItem.product_id == product_id)
-            realization_map[rep.id] = float((await db.execute(real_q)).scalar() or 0.0)
-                
-            # POSTUPLENIYA
-            pay_q = select(
-                func.coalesce(func.sum(Payment.amount * (ReservationItem.quantity * ReservationItem.price / Invoice.total_amount)), 0.0)
-            ).select_from(Payment)\
-             .join(Invoice, Payment.invoice_id == Invoice.id)\
-             .join(Reservation, Invoice.reservation_id == Reservation.id)\
-             .join(ReservationItem, Reservation.id == ReservationItem.reservation_id)\
-             .outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)\
-             .where(Invoice.total_amount > 0)\
-             .where(or_(
-                 Reservation.created_by_id == rep.id, 
-                 MedicalOrganization.assigned_reps.any(User.id == rep.id)
-             ))
-             
-            if start_date and end_date: pay_q = pay_q.where(and_(Payment.date >= start_date, Payment.date < end_date))
-            if product_id: pay_q = pay_q.where(ReservationItem.product_id == product_id)
-            postupleniya_map[rep.id] = float((await db.execute(pay_q)).scalar() or 0.0)
-                
-            # DEBITORKA
-            debt_q = select(
-                func.coalesce(func.sum(
-                    (ReservationItem.quantity * ReservationItem.price) -
-                    (ReservationItem.quantity * ReservationItem.price / Invoice.total_amount * Invoice.paid_amount)
-                ), 0.0)
-            ).select_from(Invoice)\
-             .join(Reservation, Invoice.reservation_id == Reservation.id)\
-             .join(ReservationItem, Reservation.id == ReservationItem.reservation_id)\
-             .outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)\
-             .where(Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.APPROVED]), Invoice.total_amount > 0)\
-             .where(or_(
-                 Reservation.created_by_id == rep.id, 
-                 MedicalOrganization.assigned_reps.any(User.id == rep.id)
-             ))
-             
-            if start_date and end_date: debt_q = debt_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
-            if product_id: debt_q = debt_q.where(ReservationItem.product_id == product_id)
-            debitorka_map[rep.id] = float((await db.execute(debt_q)).scalar() or 0.0)
+        # A reservation counts for a MedRep if they created it or are assigned to its organization.
+        # UNION (not UNION ALL) keeps one row per (reservation, rep) even when both hold.
+        rep_links = union(
+            select(Reservation.id.label("reservation_id"), Reservation.created_by_id.label("rep_id"))
+            .where(Reservation.created_by_id.in_(rep_ids)),
+            select(Reservation.id.label("reservation_id"), medrep_organization.c.user_id.label("rep_id"))
+            .join(medrep_organization, medrep_organization.c.organization_id == Reservation.med_org_id)
+            .where(medrep_organization.c.user_id.in_(rep_ids))
+        ).subquery("rep_reservations")
+        line_total = ReservationItem.quantity * ReservationItem.price
+
+        # REALIZATION
+        real_q = select(rep_links.c.rep_id, func.coalesce(func.sum(line_total), 0.0))\
+            .select_from(Invoice)\
+            .join(rep_links, rep_links.c.reservation_id == Invoice.reservation_id)\
+            .join(ReservationItem, ReservationItem.reservation_id == Invoice.reservation_id)\
+            .where(Invoice.status != InvoiceStatus.CANCELLED)\
+            .group_by(rep_links.c.rep_id)
+        if start_date and end_date: real_q = real_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
+        if product_id: real_q = real_q.where(ReservationItem.product_id == product_id)
+        realization_map = {rid: float(v or 0.0) for rid, v in (await db.execute(real_q)).all()}
+
+        # POSTUPLENIYA
+        pay_q = select(rep_links.c.rep_id, func.coalesce(func.sum(Payment.amount * (line_total / Invoice.total_amount)), 0.0))\
+            .select_from(Payment)\
+            .join(Invoice, Payment.invoice_id == Invoice.id)\
+            .join(rep_links, rep_links.c.reservation_id == Invoice.reservation_id)\
+            .join(ReservationItem, ReservationItem.reservation_id == Invoice.reservation_id)\
+            .where(Invoice.total_amount > 0)\
+            .group_by(rep_links.c.rep_id)
+        if start_date and end_date: pay_q = pay_q.where(and_(Payment.date >= start_date, Payment.date < end_date))
+        if product_id: pay_q = pay_q.where(ReservationItem.product_id == product_id)
+        postupleniya_map = {rid: float(v or 0.0) for rid, v in (await db.execute(pay_q)).all()}
+
+        # DEBITORKA
+        debt_q = select(rep_links.c.rep_id, func.coalesce(func.sum(
+                line_total - (line_total / Invoice.total_amount * Invoice.paid_amount)
+            ), 0.0))\
+            .select_from(Invoice)\
+            .join(rep_links, rep_links.c.reservation_id == Invoice.reservation_id)\
+            .join(ReservationItem, ReservationItem.reservation_id == Invoice.reservation_id)\
+            .where(Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.APPROVED]), Invoice.total_amount > 0)\
+            .group_by(rep_links.c.rep_id)
+        if start_date and end_date: debt_q = debt_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
+        if product_id: debt_q = debt_q.where(ReservationItem.product_id == product_id)
+        debitorka_map = {rid: float(v or 0.0) for rid, v in (await db.execute(debt_q)).all()}
 
     # GLOBAL AGGREGATES (Independent of MedReps)
     if not product_id:
@@ -1408,52 +1436,56 @@ async def get_admin_bonus_summary(
         if start_date and end_date: g_debt_q = g_debt_q.where(and_(Invoice.date >= start_date, Invoice.date < end_date))
         global_debitorka = float((await db.execute(g_debt_q)).scalar() or 0.0)
 
+    # LEDGER: period figures and global balance per MedRep in one grouped pass
+    ledger_map = {}
+    overdue_rep_ids = set()
+    if rep_ids:
+        in_period = and_(BonusLedger.created_at >= start_date, BonusLedger.created_at < end_date) if start_date and end_date else true()
+        is_accrual = BonusLedger.ledger_type == LedgerType.ACCRUAL
+        paid_accrual = and_(is_accrual, BonusLedger.is_paid == True)
+        ledger_q = select(
+            BonusLedger.user_id,
+            func.coalesce(func.sum(case((and_(in_period, is_accrual), BonusLedger.amount), else_=0.0)), 0.0).label("accrued"),
+            func.coalesce(func.sum(case((and_(in_period, or_(
+                paid_accrual, BonusLedger.ledger_type.in_([LedgerType.ADVANCE, LedgerType.PAYOUT])
+            )), BonusLedger.amount), else_=0.0)), 0.0).label("paid"),
+            func.coalesce(func.sum(case((and_(in_period, BonusLedger.ledger_type == LedgerType.OFFSET), func.abs(BonusLedger.amount)), else_=0.0)), 0.0).label("allocated"),
+            func.coalesce(func.sum(case((is_accrual, BonusLedger.amount), else_=0.0)), 0.0).label("g_accrued"),
+            func.coalesce(func.sum(case((or_(
+                paid_accrual, BonusLedger.ledger_type.in_([LedgerType.ADVANCE, LedgerType.PAYOUT, LedgerType.OFFSET])
+            ), BonusLedger.amount), else_=0.0)), 0.0).label("g_paid"),
+        ).where(
+            BonusLedger.user_id.in_(rep_ids),
+            BonusLedger.ledger_category == category
+        ).group_by(BonusLedger.user_id)
+        if product_id: ledger_q = ledger_q.where(BonusLedger.product_id == product_id)
+        ledger_map = {row.user_id: row for row in (await db.execute(ledger_q)).all()}
+
+        # Overdue flag is not product specific
+        overdue_q = select(BonusLedger.user_id).where(
+            and_(
+                BonusLedger.user_id.in_(rep_ids),
+                BonusLedger.ledger_type == LedgerType.ACCRUAL,
+                BonusLedger.ledger_category == category,
+                BonusLedger.is_paid == False,
+                or_(BonusLedger.notes != "Аванс (Предынвест)", BonusLedger.notes.is_(None)),
+                BonusLedger.created_at < datetime.utcnow() - timedelta(days=15)
+            )
+        ).distinct()
+        overdue_rep_ids = set((await db.execute(overdue_q)).scalars().all())
+
     summaries = []
     for rep in medreps:
-        q = select(BonusLedger).where(
-            BonusLedger.user_id == rep.id,
-            BonusLedger.ledger_category == category
-        )
-        if start_date and end_date: q = q.where(and_(BonusLedger.created_at >= start_date, BonusLedger.created_at < end_date))
-        if product_id: q = q.where(BonusLedger.product_id == product_id)
-        
-        ledger_res = await db.execute(q)
-        entries = ledger_res.scalars().all()
-        
+        totals = ledger_map.get(rep.id)
         # 1. PERIOD SPECIFIC (for current month reporting)
-        accrued = 0.0
-        paid = 0.0
-        allocated = 0.0
-        
-        for e in entries:
-            if e.ledger_type == LedgerType.ACCRUAL:
-                accrued += e.amount
-                if e.is_paid: paid += e.amount
-            elif e.ledger_type in [LedgerType.ADVANCE, LedgerType.PAYOUT]:
-                paid += e.amount
-            elif e.ledger_type == LedgerType.OFFSET:
-                allocated += abs(e.amount)
+        accrued = float(totals.accrued) if totals else 0.0
+        paid = float(totals.paid) if totals else 0.0
+        allocated = float(totals.allocated) if totals else 0.0
 
         # 2. GLOBAL (for true balance/remainder/predinvest)
-        global_q = select(BonusLedger).where(
-            BonusLedger.user_id == rep.id,
-            BonusLedger.ledger_category == category
-        )
-        if product_id: global_q = global_q.where(BonusLedger.product_id == product_id)
-        
-        global_entries_res = await db.execute(global_q)
-        global_entries = global_entries_res.scalars().all()
-        
-        g_accrued = 0.0
-        g_paid = 0.0
-        for ge in global_entries:
-            if ge.ledger_type == LedgerType.ACCRUAL:
-                g_accrued += ge.amount
-                if ge.is_paid:
-                    g_paid += ge.amount
-            elif ge.ledger_type in [LedgerType.ADVANCE, LedgerType.PAYOUT, LedgerType.OFFSET]:
-                g_paid += ge.amount
-                
+        g_accrued = float(totals.g_accrued) if totals else 0.0
+        g_paid = float(totals.g_paid) if totals else 0.0
+
         # Remainder is simply what's left to pay. 
         # If they were paid more than they earned, remainder is 0.
         remainder = max(0.0, g_accrued - g_paid)
@@ -1461,24 +1493,7 @@ async def get_admin_bonus_summary(
         # Predinvest is the advance payment amount (overpayment)
         predinvest = max(0.0, g_paid - g_accrued)
 
-
-
-
-
-
-        
-        overdue_q = select(BonusLedger.id).where(
-            and_(
-                BonusLedger.user_id == rep.id,
-                BonusLedger.ledger_type == LedgerType.ACCRUAL,
-                BonusLedger.ledger_category == category,
-                BonusLedger.is_paid == False,
-                or_(BonusLedger.notes != "Аванс (Предынвест)", BonusLedger.notes.is_(None)),
-                BonusLedger.created_at < datetime.utcnow() - timedelta(days=15)
-            )
-        ).limit(1)
-        overdue_res = await db.execute(overdue_q)
-        has_overdue = (overdue_res.scalar_one_or_none() is not None) and (remainder > 0)
+        has_overdue = rep.id in overdue_rep_ids and remainder > 0
         
         rep_region = ", ".join([r.name for r in rep.assigned_regions]) if rep.assigned_regions else ""
 
@@ -1606,7 +1621,6 @@ async def pay_medrep_bonus(
         db.add(predinvest_entry)
         actual_paid += amount_remaining_to_pay
 
-
     await db.commit()
     
     from app.services.audit_service import log_action
@@ -1628,48 +1642,50 @@ async def get_organizations_balances(
 ) -> Any:
     """
     Get all medical organizations with their calculated debt, surplus, and total balance.
+    Reads the OrganizationReceivable summary in a single query.
     """
-    from app.models.crm import MedicalOrganization
-    from app.models.sales import Invoice, InvoiceStatus, Reservation
+    from app.models.crm import MedicalOrganization, OrganizationReceivable
     from sqlalchemy import select, func
     
-    query = select(MedicalOrganization)
+    current_debt = func.coalesce(OrganizationReceivable.current_debt, 0.0)
+    current_surplus = func.coalesce(MedicalOrganization.credit_balance, 0.0)
+    total_balance = (current_surplus - current_debt).label("total_balance")
+    
+    query = select(
+        MedicalOrganization.id,
+        MedicalOrganization.name,
+        MedicalOrganization.inn,
+        MedicalOrganization.org_type,
+        current_debt.label("current_debt"),
+        current_surplus.label("current_surplus"),
+        total_balance,
+        func.coalesce(OrganizationReceivable.open_invoice_count, 0).label("open_invoice_count"),
+        OrganizationReceivable.oldest_unpaid_date
+    ).outerjoin(OrganizationReceivable, OrganizationReceivable.organization_id == MedicalOrganization.id)
     if search:
         query = query.where(
             (MedicalOrganization.name.ilike(f"%{search}%")) |
             (MedicalOrganization.inn.ilike(f"%{search}%"))
         )
     
-    result = await db.execute(query)
-    orgs = result.scalars().all()
-    
-    res_list = []
-    for org in orgs:
-        # Calculate current total debt (Unpaid/Partial Invoices)
-        debt_query = select(func.sum(Invoice.total_amount - Invoice.paid_amount)).join(Reservation).where(
-            Reservation.med_org_id == org.id,
-            Invoice.status.in_([InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.DRAFT])
-        )
-        debt_res = await db.execute(debt_query)
-        current_debt = debt_res.scalar() or 0.0
-        
-        current_surplus = org.credit_balance or 0.0
-        total_balance = current_surplus - current_debt
-        
-        res_list.append({
-            "id": org.id,
-            "name": org.name,
-            "inn": org.inn,
-            "org_type": org.org_type,
-            "current_debt": current_debt,
-            "current_surplus": current_surplus,
-            "total_balance": total_balance
-        })
-        
     # Sort: biggest debt first (most negative total_balance)
-    res_list.sort(key=lambda x: x["total_balance"])
+    query = query.order_by(total_balance.asc(), MedicalOrganization.id.asc())
     
-    return res_list
+    result = await db.execute(query)
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "inn": row.inn,
+            "org_type": row.org_type,
+            "current_debt": float(row.current_debt),
+            "current_surplus": float(row.current_surplus),
+            "total_balance": float(row.total_balance),
+            "open_invoice_count": int(row.open_invoice_count),
+            "oldest_unpaid_date": row.oldest_unpaid_date
+        }
+        for row in result.all()
+    ]
 
 @router.get("/organizations/{org_id}/finance-history")
 async def get_org_finance_history(
@@ -1711,13 +1727,16 @@ async def top_up_org_balance(
     request_data: Dict[str, Any],
     request: Request,
     db: AsyncSession = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_user)
+    current_user: User = Depends(deps.get_current_user),
+    idempotency: IdempotentRequest = Depends(deps.get_idempotency)
 ) -> Any:
     """
     Accountant manual top-up for an organization.
     """
     if current_user.role not in [UserRole.ADMIN, UserRole.DIRECTOR, UserRole.ACCOUNTANT, UserRole.DEPUTY_DIRECTOR, UserRole.INVESTOR]:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
+    if idempotency.replay is not None:
+        return idempotency.replay
         
     amount = request_data.get("amount")
     comment = request_data.get("comment", "")
@@ -1739,4 +1758,4 @@ async def top_up_org_balance(
         request
     )
     
-    return {"message": "Успешно пополнено", "new_balance": org.credit_balance}
+    return await idempotency.save({"message": "Успешно пополнено", "new_balance": org.credit_balance})
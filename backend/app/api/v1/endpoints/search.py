@@ -0,0 +1,38 @@
+from typing import Any, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api import deps
+from app.models.user import User, UserRole
+from app.services.search_service import SearchService, SEARCH_TYPES
+
+router = APIRouter()
+
+
+@router.get("/")
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    types: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Search box: ranked doctors, organizations, med reps and invoices matching `q` (name, INN,
+    username, factura number or customer). `types` is a comma-separated subset of
+    doctors,organizations,reps,invoices. Med reps and managers only get their team's invoices.
+    """
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else list(SEARCH_TYPES)
+    unknown = [t for t in kinds if t not in SEARCH_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(unknown)}")
+
+    rep_ids = None
+    if current_user.role == UserRole.MED_REP:
+        rep_ids = [current_user.id]
+    elif current_user.role in [UserRole.PRODUCT_MANAGER, UserRole.FIELD_FORCE_MANAGER, UserRole.REGIONAL_MANAGER]:
+        from app.crud import crud_user
+        rep_ids = await crud_user.get_descendant_ids(db, current_user.id) or [-1]
+
+    return {"query": q, **await SearchService.search(db, q, kinds, limit, rep_ids)}
@@ -361,9 +361,8 @@ async def reassign_user_dependencies(
             raise HTTPException(status_code=403, detail="You can only reassign between your own subordinates.")
             
     # Reassign subordinates
-    subordinates = await db.execute(select(User).where(User.manager_id == req.from_user_id))
-    for sub in subordinates.scalars().all():
-        sub.manager_id = req.to_user_id
+    from app.services.reassignment_service import ReassignmentService
+    await ReassignmentService.reassign_subordinates(db, req.from_user_id, req.to_user_id)
         
     if from_user.role == UserRole.MED_REP:
         from app.models.crm import Doctor, medrep_organization
@@ -453,6 +452,8 @@ async def reassign_user_dependencies(
         request
     )
     await db.commit()
+    from app.services.hierarchy_service import HierarchyService
+    HierarchyService.invalidate()
     return {"msg": "Successfully transferred all dependencies."}
 
 @router.get("/login-history", response_model=List[UserLoginHistory])
@@ -40,7 +40,7 @@ async def get_user_hierarchy(
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
-    Retrieves the entire nested subordinate tree using Recursive CTEs.
+    Retrieves the entire nested subordinate tree from the user_hierarchy closure table.
     """
     # Assuming director can view anyone, or a user can view themselves
     if current_user.role not in [UserRole.INVESTOR, UserRole.DIRECTOR] and current_user.id != user_id:
@@ -1,65 +1,116 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, List, Optional, Union
+from datetime import date, datetime, time, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, extract
 from app.api import deps
 from app.models.user import User
 from app.models.visit import Visit, VisitPlan
 from app.models.crm import Doctor, MedicalOrganization
-from app.schemas.visit import Visit as VisitSchema, VisitCreate, VisitPlan as VisitPlanSchema, VisitPlanCreate
+from app.schemas.visit import (
+    Visit as VisitSchema, VisitCreate, VisitPlan as VisitPlanSchema, VisitPlanCreate,
+    VisitHistoryRow, VisitHistoryPage, VisitMonthCount
+)
+from app.core.pagination import decode_cursor, keyset_order, keyset_seek, next_cursor, page_response
 
 router = APIRouter()
 
-@router.get("/{user_id}/visits")
+def _visit_history_query(
+    user_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    doctor_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+):
+    """A rep's visits joined with doctor and organization names (served by ix_visit_med_rep_id_visit_date)."""
+    query = (
+        select(
+            Visit.id, Visit.visit_date, Visit.visit_type, Visit.result, Visit.notes,
+            Doctor.id.label("doctor_id"), Doctor.full_name.label("doctor_name"),
+            MedicalOrganization.id.label("med_org_id"), MedicalOrganization.name.label("med_org_name"),
+        )
+        .outerjoin(Doctor, Visit.doctor_id == Doctor.id)
+        .outerjoin(MedicalOrganization, Doctor.med_org_id == MedicalOrganization.id)
+        .where(Visit.med_rep_id == user_id)
+    )
+    if date_from:
+        query = query.where(Visit.visit_date >= datetime.combine(date_from, time.min))
+    if date_to:
+        query = query.where(Visit.visit_date < datetime.combine(date_to + timedelta(days=1), time.min))
+    if doctor_id:
+        query = query.where(Visit.doctor_id == doctor_id)
+    if med_org_id:
+        query = query.where(Doctor.med_org_id == med_org_id)
+    return query
+
+
+def _visit_row(row) -> dict:
+    return {
+        "id": row.id,
+        "visit_date": row.visit_date,
+        "visit_type": row.visit_type,
+        "result": row.result,
+        "notes": row.notes,
+        "doctor": {
+            "id": row.doctor_id,
+            "full_name": row.doctor_name if row.doctor_id else "Unknown",
+        },
+        "med_org": {
+            "id": row.med_org_id,
+            "name": row.med_org_name,
+        } if row.med_org_id else None,
+    }
+
+
+@router.get("/{user_id}/visits", response_model=Union[List[VisitHistoryRow], VisitHistoryPage])
 async def get_user_visits(
     user_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    doctor_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Visit history of a medical representative, newest first, with doctor and medical organization.
+    With `limit` or `cursor` returns {items, next_cursor} pages; otherwise every matching visit.
+    """
+    query = _visit_history_query(user_id, date_from, date_to, doctor_id, med_org_id)
+    query = keyset_seek(query, Visit.visit_date, Visit.id, decode_cursor(cursor))
+    query = query.order_by(*keyset_order(Visit.visit_date, Visit.id))
+    if limit:
+        query = query.limit(limit)
+    rows = [_visit_row(r) for r in (await db.execute(query)).all()]
+    if not limit and cursor is None:
+        return rows
+    return page_response(rows, next_cursor(rows, limit or 0, lambda r: r["visit_date"], lambda r: r["id"]))
+
+
+@router.get("/{user_id}/visits/monthly", response_model=List[VisitMonthCount])
+async def get_user_visit_months(
+    user_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    doctor_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
     db: AsyncSession = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
-    Get all visits for a specific medical representative.
-    Returns visits with doctor and medical organization details.
+    Visits per month for the same filters as the visit history, oldest month first.
     """
-    # Get all visits for the user
+    history = _visit_history_query(user_id, date_from, date_to, doctor_id, med_org_id).where(Visit.visit_date.isnot(None)).subquery()
+    year = extract("year", history.c.visit_date)
+    month = extract("month", history.c.visit_date)
     result = await db.execute(
-        select(Visit)
-        .where(Visit.med_rep_id == user_id)
-        .order_by(Visit.visit_date.desc())
+        select(year.label("year"), month.label("month"), func.count().label("count"))
+        .group_by(year, month)
+        .order_by(year, month)
     )
-    visits = result.scalars().all()
-    
-    # Enrich with doctor and med org data
-    enriched_visits = []
-    for visit in visits:
-        doctor_result = await db.execute(
-            select(Doctor).where(Doctor.id == visit.doctor_id)
-        )
-        doctor = doctor_result.scalars().first()
-        
-        med_org = None
-        if doctor and doctor.med_org_id:
-            med_org_result = await db.execute(
-                select(MedicalOrganization).where(MedicalOrganization.id == doctor.med_org_id)
-            )
-            med_org = med_org_result.scalars().first()
-        
-        enriched_visits.append({
-            "id": visit.id,
-            "visit_date": visit.visit_date,
-            "visit_type": visit.visit_type,
-            "result": visit.result,
-            "notes": visit.notes,
-            "doctor": {
-                "id": doctor.id if doctor else None,
-                "full_name": doctor.full_name if doctor else "Unknown",
-            },
-            "med_org": {
-                "id": med_org.id if med_org else None,
-                "name": med_org.name if med_org else "Unknown",
-            } if med_org else None,
-        })
-    
-    return enriched_visits
+    return [{"year": int(r.year), "month": int(r.month), "count": r.count} for r in result.all()]
 
 @router.post("/visits/")
 async def create_visit(
@@ -49,10 +49,84 @@ class Settings(BaseSettings):
             return v
         return str(f"postgresql+asyncpg://{values.get('POSTGRES_USER')}:{values.get('POSTGRES_PASSWORD')}@{values.get('POSTGRES_SERVER')}/{values.get('POSTGRES_DB')}")
 
+    # Engine / connection pool (see app.db.session.create_engine_from_settings)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30 # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800 # seconds; reconnect before server / proxy idle timeouts
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100 # asyncpg prepared statements per connection; 0 behind pgbouncer
+    SQL_ECHO: bool = False # log every statement (development only)
+    SQL_SLOW_QUERY_MS: int = 300 # log statements at least this slow and keep them for /slow-queries; 0 disables
+
+    # Per-request SQL instrumentation (query count / time / N+1), /metrics and the slow-query log
+    SQL_INSTRUMENTATION: bool = True
+    SQL_SLOW_LOG_SIZE: int = 200 # slow statements kept in memory for /api/v1/slow-queries
+    SQL_N_PLUS_ONE_THRESHOLD: int = 20 # same statement shape repeated more than this in one request
+    METRICS_TOKEN: str = "" # /metrics and /api/v1/slow-queries require ?token=<this>; unset = both disabled
+
     # JWT
     SECRET_KEY: str = "CHANGE_THIS_SECRET_KEY_IN_PRODUCTION"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 12  # 12 hours
+    PASSWORD_HASH_WORKERS: int = 4 # threads for bcrypt hash / verify (bounds concurrent hashing)
+
+    # Authenticated user cache for deps.get_current_user (dropped on any committed user / region / permission write)
+    USER_CACHE_TTL_SECONDS: int = 30
+    USER_CACHE_MAX_ENTRIES: int = 5000
+    # Descendant lookups (visibility scopes); other workers see a manager change within the TTL
+    HIERARCHY_CACHE_TTL_SECONDS: int = 30
+    HIERARCHY_CACHE_MAX_ENTRIES: int = 2048
+
+    # Login geolocation: "http" (ip-api.com + Nominatim), "offline", or "package.module:ResolverClass"
+    GEO_RESOLVER: str = "http"
+    GEO_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    GEO_CACHE_FAILURE_TTL_SECONDS: int = 5 * 60 # failed lookups are retried after this
+    GEO_CACHE_MAX_ENTRIES: int = 4096
+    GEO_COORD_PRECISION: int = 3 # decimals of the coordinate cache cell (~110 m)
+    
+    # Audit log write-behind queue (app.services.audit_service.AuditWriter)
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500 # rows per multi-row INSERT
+    AUDIT_ENQUEUE_TIMEOUT_MS: int = 100 # a full queue blocks the caller this long, then the entry is dropped
+    AUDIT_SHUTDOWN_TIMEOUT_SECONDS: int = 10 # time to write the remaining queue on shutdown
+
+    # Notification push (GET /notifications/stream, /notifications/ws). The hub lives in one process:
+    # enable only on a single uvicorn worker serving ASGI directly (not Passenger / a2wsgi, which
+    # supports neither WebSockets nor long-lived streams). Off, clients poll /notifications/unread-count.
+    NOTIFICATION_PUSH_ENABLED: bool = False
+    NOTIFICATION_QUEUE_SIZE: int = 100 # events buffered per connection; a slow client loses the oldest
+    NOTIFICATION_HEARTBEAT_SECONDS: int = 25 # keep-alive for proxies with idle timeouts
+    # Read notifications older than this move to notification_archive (app/scripts/archive_notifications.py, run from cron)
+    NOTIFICATION_ARCHIVE_AFTER_DAYS: int = 90
+    NOTIFICATION_ARCHIVE_BATCH_SIZE: int = 5000
+
+    # Bulk payment import (POST /sales/payments/import): lines per request, applied in one transaction
+    PAYMENT_IMPORT_MAX_LINES: int = 2000
+
+    # Idempotency-Key header on payment / top-up / reservation creation
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60 # stored responses are replayed this long
+    IDEMPOTENCY_LOCK_SECONDS: int = 120 # an unfinished claim blocks retries at most this long
+
+    # Debug / diagnostics (e.g. per-KPI timings in analytics responses)
+    DEBUG: bool = False
+
+    # Analytics: max KPI queries running at once across all requests of a process, each on its own
+    # pooled connection (capped below DB_POOL_SIZE; beyond it a request's KPIs share its own session)
+    KPI_MAX_CONCURRENCY: int = 4
+
+    # Analytics result cache (dashboard / comprehensive stats / reports). Commits only invalidate the
+    # process that made them, so the TTL bounds how long other workers may serve an older result.
+    ANALYTICS_CACHE_TTL_SECONDS: int = 60
+    ANALYTICS_CACHE_CLOSED_TTL_SECONDS: int = 15 * 60 # closed months change rarely (back-dated payments, reconciliation)
+    ANALYTICS_CACHE_MAX_ENTRIES: int = 256
+
+    # Background Excel exports: rendered in a process pool, kept on disk until they expire
+    EXPORT_DIR: str = os.path.join(BASE_DIR, "exports")
+    EXPORT_JOB_TTL_SECONDS: int = 60 * 60
+    EXPORT_JOB_HEARTBEAT_SECONDS: int = 5 # a running job writes its progress to export_job this often
+    EXPORT_JOB_STALE_SECONDS: int = 120 # no heartbeat for this long: the job's process is gone, it fails
+    EXPORT_MAX_WORKERS: int = 2
     
     # Telegram Backup
     TELEGRAM_BOT_TOKEN: str = ""
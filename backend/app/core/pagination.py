@@ -0,0 +1,99 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Keyset (cursor) pagination for listings ordered newest first by (date, id).
+# The cursor is the (date, id) of the last row of the previous page, encoded as an opaque string;
+# the next page seeks past it with an index range scan instead of skipping OFFSET rows.
+
+COUNT_MODES = ("exact", "estimate")
+# Missing dates sort last (date keys built with coalesce use this value)
+MIN_DATE = datetime(1900, 1, 1)
+
+Cursor = Tuple[Optional[datetime], int]
+
+
+def encode_cursor(date: Optional[datetime], id: int) -> str:
+    raw = json.dumps([date.isoformat() if date else None, id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    """(date, id) from a cursor; None for a missing / empty cursor (first page)."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date, id = json.loads(raw)
+        return (datetime.fromisoformat(date) if date else None), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_order(date_key, id_col) -> list:
+    # NULLS FIRST is PostgreSQL's default for DESC (so a (date, id) index still serves it); spelled
+    # out so every backend orders rows without a date the same way
+    return [id_col.desc()] if date_key is None else [date_key.desc().nulls_first(), id_col.desc()]
+
+
+def page_offset(skip: int, cursor: Optional[str]) -> int:
+    """OFFSET for a list query: keyset pages (any cursor, the empty first one included) ignore `skip`."""
+    return 0 if cursor is not None else skip
+
+
+def keyset_seek(query, date_key, id_col, after: Optional[Cursor]):
+    """Rows strictly after `after` in keyset_order; `date_key` may be None (id only)."""
+    if after is None:
+        return query
+    last_date, last_id = after
+    if date_key is None:
+        return query.where(id_col < last_id)
+    if last_date is None:
+        return query.where(or_(date_key.isnot(None), id_col < last_id))
+    return query.where(or_(date_key < last_date, and_(date_key == last_date, id_col < last_id)))
+
+
+def next_cursor(rows: Sequence[Any], limit: int, date_of, id_of) -> Optional[str]:
+    """Cursor of the last row when the page is full (there may be more), else None."""
+    if limit <= 0 or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(date_of(last), id_of(last))
+
+
+def page_response(items: List[Any], cursor: Optional[str], total: Optional[int] = None) -> dict:
+    response = {"items": items, "next_cursor": cursor}
+    if total is not None:
+        response["total"] = total
+    return response
+
+
+async def count_rows(db: AsyncSession, query, mode: Optional[str] = "exact") -> Optional[int]:
+    """
+    Row count of a filtered select (without order / limit). "estimate" reads the planner's row
+    estimate on PostgreSQL, which costs no scan; elsewhere it falls back to an exact count.
+    """
+    if not mode:
+        return None
+    if mode not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count must be one of: {', '.join(COUNT_MODES)}")
+    query = query.order_by(None)
+    if mode == "estimate" and db.bind.dialect.name == "postgresql":
+        try:
+            compiled = query.compile(dialect=db.bind.dialect, compile_kwargs={"literal_binds": True})
+        except (CompileError, NotImplementedError):
+            compiled = None  # a parameter type without a literal form: count exactly instead
+        if compiled is not None:
+            # Sent as is: through text() a ":word" inside a literal (e.g. a search term) would parse as a bind
+            conn = await db.connection()
+            plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+    return (await db.execute(select(func.count()).select_from(query.subquery()))).scalar() or 0
@@ -0,0 +1,196 @@
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.db.instrumentation")
+slow_query_logger = logging.getLogger("app.db.slow_query")
+
+# Per-request statistics; KpiExecutor / background tasks started by the request share the same object
+_current: ContextVar[Optional["RequestSqlStats"]] = ContextVar("sql_request_stats", default=None)
+_current_route: ContextVar[Optional[str]] = ContextVar("sql_request_route", default=None)
+
+# Process-wide aggregates, keyed by (method, route template). Every worker process keeps its own
+# (Passenger runs several): /metrics labels each series with the pid and /slow-queries shows one worker
+_route_totals = defaultdict(lambda: {
+    "requests": 0, "request_seconds": 0.0, "queries": 0, "sql_seconds": 0.0, "n_plus_one": 0, "max_queries": 0,
+})
+_slow_log = deque(maxlen=settings.SQL_SLOW_LOG_SIZE)
+_totals = {"queries": 0, "sql_seconds": 0.0, "slow_queries": 0}
+
+_WS = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|%\(\w+\)s|\b\d+(?:\.\d+)?\b|\?")
+_IN_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+
+@lru_cache(maxsize=2048)
+def statement_shape(statement: str) -> str:
+    """Statement with literals / bind parameters / IN lists collapsed, so repeats of one query compare equal."""
+    shape = _LITERALS.sub("?", _WS.sub(" ", statement).strip())
+    return _IN_LISTS.sub("(?...)", shape)
+
+
+def route_template(scope: dict) -> str:
+    """Full route template of the matched endpoint, e.g. /api/v1/sales/invoices/{id}."""
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    path = scope.get("path", "")
+    regex = getattr(route, "path_regex", None)
+    if regex is not None and not regex.match(path):
+        # Newer FastAPI mounts included routers, so the route only knows the path below its prefix
+        for i, ch in enumerate(path):
+            if ch == "/" and i and regex.match(path[i:]):
+                return path[:i] + template
+    return template
+
+
+class RequestSqlStats:
+    __slots__ = ("count", "total_ms", "slowest_ms", "slowest_statement", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_statement = None
+        self.shapes = Counter()
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_statement = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    def n_plus_one(self, threshold: int):
+        """Statement shapes executed more than `threshold` times in this request."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+def instrument_engine(engine):
+    """Times every statement of `engine` (an AsyncEngine) into the current request and the slow-query log."""
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("sql_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["sql_metrics_start"].pop()) * 1000
+        _totals["queries"] += 1
+        _totals["sql_seconds"] += elapsed_ms / 1000
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, elapsed_ms)
+        if settings.SQL_SLOW_QUERY_MS > 0 and elapsed_ms >= settings.SQL_SLOW_QUERY_MS:
+            record_slow_query(statement, elapsed_ms)
+
+
+def record_slow_query(statement: str, elapsed_ms: float):
+    """Logs a statement slower than SQL_SLOW_QUERY_MS (text only; parameters may hold personal data) and keeps it for /slow-queries."""
+    text = _WS.sub(" ", statement).strip()[:2000]
+    slow_query_logger.warning(f"Slow SQL ({elapsed_ms:.0f} ms): {text}")
+    _totals["slow_queries"] += 1
+    _slow_log.append({
+        "at": datetime.utcnow().isoformat(),
+        "ms": round(elapsed_ms, 1),
+        "route": _current_route.get(),
+        "statement": text,
+    })
+
+
+class SqlMetrics:
+    @staticmethod
+    def start_request(route: str) -> RequestSqlStats:
+        stats = RequestSqlStats()
+        _current.set(stats)
+        _current_route.set(route)
+        return stats
+
+    @staticmethod
+    def finish_request(method: str, route: str, stats: RequestSqlStats, duration: float) -> list:
+        """Adds the request to the route aggregates; returns (and logs) suspected N+1 shapes."""
+        totals = _route_totals[(method, route)]
+        totals["requests"] += 1
+        totals["request_seconds"] += duration
+        totals["queries"] += stats.count
+        totals["sql_seconds"] += stats.total_ms / 1000
+        totals["max_queries"] = max(totals["max_queries"], stats.count)
+
+        repeated = stats.n_plus_one(settings.SQL_N_PLUS_ONE_THRESHOLD)
+        if repeated:
+            totals["n_plus_one"] += 1
+            shape, n = repeated[0]
+            logger.warning(f"Possible N+1 in {method} {route}: {n}x {shape[:300]} ({stats.count} queries, {stats.total_ms:.0f} ms)")
+        return repeated
+
+    @staticmethod
+    def headers(stats: RequestSqlStats, repeated: list) -> dict:
+        return {
+            "X-SQL-Count": str(stats.count),
+            "X-SQL-Time-Ms": f"{stats.total_ms:.1f}",
+            "X-SQL-Slowest-Ms": f"{stats.slowest_ms:.1f}",
+            "X-SQL-N-Plus-One": str(len(repeated)),
+        }
+
+    @staticmethod
+    def slow_queries(limit: int = 100) -> list:
+        return list(_slow_log)[-limit:][::-1]
+
+    @staticmethod
+    def prometheus(pool=None) -> str:
+        """
+        Aggregates in Prometheus text exposition format. They cover this worker process only, so every
+        series carries a `pid` label; sum over it (e.g. sum without (pid) (...)) for the whole app.
+        """
+        def esc(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"')
+
+        pid = f'pid="{os.getpid()}"'
+
+        series = [
+            ("app_http_requests_total", "counter", "HTTP requests", "requests"),
+            ("app_http_request_duration_seconds_total", "counter", "Time spent handling requests", "request_seconds"),
+            ("app_sql_queries_total", "counter", "SQL statements executed by requests", "queries"),
+            ("app_sql_duration_seconds_total", "counter", "Time spent in SQL by requests", "sql_seconds"),
+            ("app_sql_n_plus_one_requests_total", "counter", "Requests with a statement repeated more than the N+1 threshold", "n_plus_one"),
+            ("app_sql_queries_per_request_max", "gauge", "Most SQL statements seen in one request", "max_queries"),
+        ]
+        lines = []
+        for name, kind, help_text, key in series:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (method, route), totals in sorted(_route_totals.items()):
+                lines.append(f'{name}{{{pid},method="{method}",route="{esc(route)}"}} {totals[key]}')
+
+        lines += [
+            "# HELP app_sql_all_queries_total SQL statements executed (including background work)",
+            "# TYPE app_sql_all_queries_total counter",
+            f"app_sql_all_queries_total{{{pid}}} {_totals['queries']}",
+            "# HELP app_sql_all_duration_seconds_total Time spent in SQL (including background work)",
+            "# TYPE app_sql_all_duration_seconds_total counter",
+            f"app_sql_all_duration_seconds_total{{{pid}}} {_totals['sql_seconds']:.6f}",
+            "# HELP app_sql_slow_queries_total Statements slower than SQL_SLOW_QUERY_MS",
+            "# TYPE app_sql_slow_queries_total counter",
+            f"app_sql_slow_queries_total{{{pid}}} {_totals['slow_queries']}",
+        ]
+        if pool is not None and hasattr(pool, "checkedout"):
+            lines += [
+                "# HELP app_db_pool_checked_out Connections currently checked out of the pool",
+                "# TYPE app_db_pool_checked_out gauge",
+                f"app_db_pool_checked_out{{{pid}}} {pool.checkedout()}",
+                "# HELP app_db_pool_size Configured pool size",
+                "# TYPE app_db_pool_size gauge",
+                f"app_db_pool_size{{{pid}}} {pool.size()}",
+            ]
+        return "\n".join(lines) + "\n"
@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
-from app.models.crm import Region, Doctor, MedicalOrganization, DoctorSpecialty, DoctorCategory
+from app.models.crm import Region, Doctor, MedicalOrganization, DoctorSpecialty, DoctorCategory, OrganizationReceivable
 from app.schemas.crm import (
     RegionCreate, DoctorCreate, DoctorUpdate, 
     MedicalOrganizationCreate, MedicalOrganizationUpdate,
@@ -81,34 +81,16 @@ async def get_med_orgs(
     rep_id: Optional[int] = None,
     rep_ids: Optional[List[int]] = None,
 ) -> List[MedicalOrganization]:
-    # Subquery for current debt and surplus
-    debt_sub = select(
-        Reservation.med_org_id,
-        func.sum(
-            case(
-                (Invoice.total_amount > Invoice.paid_amount, Invoice.total_amount - Invoice.paid_amount),
-                else_=0.0
-            )
-        ).label("total_debt"),
-        func.sum(
-            case(
-                (Invoice.paid_amount > Invoice.total_amount, Invoice.paid_amount - Invoice.total_amount),
-                else_=0.0
-            )
-        ).label("total_surplus")
-    ).join(Invoice, Reservation.id == Invoice.reservation_id)\
-     .where(Invoice.status != InvoiceStatus.CANCELLED)\
-     .group_by(Reservation.med_org_id).subquery()
-
+    # Debt and surplus come from the maintained OrganizationReceivable summary
     query = select(
         MedicalOrganization,
-        func.coalesce(debt_sub.c.total_debt, 0.0).label("current_debt"),
-        func.coalesce(debt_sub.c.total_surplus, 0.0).label("current_surplus")
-    ).outerjoin(debt_sub, MedicalOrganization.id == debt_sub.c.med_org_id)\
+        func.coalesce(OrganizationReceivable.current_debt, 0.0).label("current_debt"),
+        func.coalesce(OrganizationReceivable.invoice_surplus, 0.0).label("current_surplus")
+    ).outerjoin(OrganizationReceivable, MedicalOrganization.id == OrganizationReceivable.organization_id)\
      .options(
         selectinload(MedicalOrganization.region),
         selectinload(MedicalOrganization.assigned_reps)
-    ).distinct()
+    )
     
     if name:
         query = query.where(MedicalOrganization.name.ilike(f"%{name}%"))
@@ -173,31 +155,9 @@ async def get_med_org(db: AsyncSession, id: int) -> Optional[MedicalOrganization
     result = await db.execute(query)
     org = result.scalars().first()
     if org:
-        # Calculate debt for single org
-        from app.models.sales import Invoice, Reservation, InvoiceStatus
-        debt_q = select(
-            func.sum(
-                case(
-                    (Invoice.total_amount > Invoice.paid_amount, Invoice.total_amount - Invoice.paid_amount),
-                    else_=0.0
-                )
-            ).label("debt"),
-            func.sum(
-                case(
-                    (Invoice.paid_amount > Invoice.total_amount, Invoice.paid_amount - Invoice.total_amount),
-                    else_=0.0
-                )
-            ).label("surplus")
-        ).join(Reservation, Reservation.id == Invoice.reservation_id)\
-         .where(and_(Reservation.med_org_id == id, Invoice.status != InvoiceStatus.CANCELLED))
-        
-        debt_res = await db.execute(debt_q)
-        debt_row = debt_res.first()
-        debt_val = float(debt_row.debt or 0.0) if debt_row else 0.0
-        surplus_val = float(debt_row.surplus or 0.0) if debt_row else 0.0
-        
-        org.current_debt = debt_val
-        org.current_surplus = surplus_val + (org.credit_balance or 0.0)
+        receivable = await db.get(OrganizationReceivable, id)
+        org.current_debt = float(receivable.current_debt or 0.0) if receivable else 0.0
+        org.current_surplus = (float(receivable.invoice_surplus or 0.0) if receivable else 0.0) + (org.credit_balance or 0.0)
     return org
 
 async def update_med_org(db: AsyncSession, db_obj: MedicalOrganization, obj_in: MedicalOrganizationUpdate) -> MedicalOrganization:
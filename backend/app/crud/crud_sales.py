@@ -1,8 +1,8 @@
 from typing import List, Optional
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, case
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func, and_, case, extract, literal, union_all, Integer
+from sqlalchemy.orm import selectinload, aliased
 
 from app.models.sales import (
     Plan, Reservation, ReservationItem, Invoice, Payment,
@@ -18,6 +18,9 @@ from app.models.crm import Doctor, MedicalOrganization, BalanceTransaction, Bala
 from app.models.warehouse import Warehouse
 from app.models.user import User
 from app.models.sales import ReservationItem
+from app.services.stats_service import StatsService
+from app.services.receivable_service import ReceivableService
+from app.core.pagination import Cursor, keyset_order, keyset_seek, count_rows
 
 async def create_plan(db: AsyncSession, obj_in: PlanCreate) -> Plan:
     # Check if a plan already exists for this exact combination
@@ -214,7 +217,8 @@ async def get_reservations(
     status: Optional[str] = None,
     warehouse_id: Optional[int] = None,
     med_org_id: Optional[int] = None,
-    region_ids: Optional[List[int]] = None
+    region_ids: Optional[List[int]] = None,
+    after: Optional[Cursor] = None
 ) -> List[Reservation]:
     query = select(Reservation).options(
         selectinload(Reservation.items).selectinload(ReservationItem.product).selectinload(Product.manufacturers),
@@ -224,27 +228,55 @@ async def get_reservations(
         selectinload(Reservation.med_org).selectinload(MedicalOrganization.region),
         selectinload(Reservation.med_org).selectinload(MedicalOrganization.assigned_reps),
         selectinload(Reservation.invoice).selectinload(Invoice.payments).selectinload(Payment.processed_by)
-    ).order_by(Reservation.date.desc())
+    ).order_by(*keyset_order(Reservation.date, Reservation.id))
+
+    query = _apply_reservation_filters(
+        query, med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, med_rep_ids, status, warehouse_id, med_org_id, region_ids
+    )
 
+    query = keyset_seek(query, Reservation.date, Reservation.id, after).offset(skip).limit(limit)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+def _apply_reservation_filters(
+    query,
+    med_rep_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    med_rep_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    region_ids: Optional[List[int]] = None,
+    already_joined_org: bool = False
+):
     if status:
         query = query.where(Reservation.status == status)
 
     if warehouse_id:
         query = query.where(Reservation.warehouse_id == warehouse_id)
 
-    has_joined_org = False
+    has_joined_org = already_joined_org
 
     # Apply Med Rep filter (Creator or Assigned)
     if med_rep_id:
-        query = query.join(Reservation.med_org, isouter=True)
-        has_joined_org = True
+        if not has_joined_org:
+            query = query.join(Reservation.med_org, isouter=True)
+            has_joined_org = True
         query = query.where(
             (Reservation.created_by_id == med_rep_id) |
             (MedicalOrganization.assigned_reps.any(id=med_rep_id))
         )
     elif med_rep_ids:
-        query = query.join(Reservation.med_org, isouter=True)
-        has_joined_org = True
+        if not has_joined_org:
+            query = query.join(Reservation.med_org, isouter=True)
+            has_joined_org = True
         query = query.where(
             (Reservation.created_by_id.in_(med_rep_ids)) |
             (MedicalOrganization.assigned_reps.any(User.id.in_(med_rep_ids)))
@@ -296,9 +328,7 @@ async def get_reservations(
     if inv_num:
         query = query.join(Reservation.invoice).where(Invoice.factura_number.ilike(f"%{inv_num}%"))
 
-    query = query.offset(skip).limit(limit)
-    result = await db.execute(query)
-    return result.scalars().all()
+    return query
 
 async def update_reservation_status(db: AsyncSession, db_obj: Reservation, status: ReservationStatus) -> Reservation:
     db_obj.status = status
@@ -321,6 +351,11 @@ async def update_reservation_data(db: AsyncSession, reservation_id: int, obj_in:
     if not reservation:
         return None
     
+    # Realization date / discount edits move the sale in DoctorMonthlyStat: un-book now, re-book below
+    is_booked = reservation.status == ReservationStatus.APPROVED
+    if is_booked:
+        await StatsService.record_sale(db, reservation, reservation.invoice, sign=-1)
+    
     # Ensure Invoice exists if we're updating invoice fields
     if not reservation.invoice and (obj_in.factura_number is not None or obj_in.realization_date is not None):
         reservation.invoice = Invoice(
@@ -360,6 +395,9 @@ async def update_reservation_data(db: AsyncSession, reservation_id: int, obj_in:
         if reservation.invoice:
             reservation.invoice.total_amount = reservation.total_amount
             
+    if is_booked:
+        await StatsService.record_sale(db, reservation, reservation.invoice)
+            
     # NEW: Apply existing credit balance to the (newly created or updated) invoice
     if reservation.invoice and reservation.med_org:
         # We need current user_id here. 
@@ -367,6 +405,7 @@ async def update_reservation_data(db: AsyncSession, reservation_id: int, obj_in:
         # let's use the reservation creator as a fallback.
         await apply_balance_to_invoice(db, reservation.invoice, reservation.med_org, reservation.created_by_id)
 
+    await ReceivableService.refresh(db, [reservation.med_org_id])
     await db.commit()
     
     # Re-fetch with all relationships to ensure serialization works
@@ -530,7 +569,8 @@ async def get_invoices(
     has_debt: bool = False,
     med_org_id: Optional[int] = None,
     region_ids: Optional[List[int]] = None,
-    only_overdue: bool = False
+    only_overdue: bool = False,
+    after: Optional[Cursor] = None
 ) -> List[Invoice]:
     query = select(Invoice).options(
         selectinload(Invoice.payments).selectinload(Payment.processed_by),
@@ -540,7 +580,7 @@ async def get_invoices(
         selectinload(Invoice.reservation).selectinload(Reservation.med_org).selectinload(MedicalOrganization.assigned_reps),
         selectinload(Invoice.reservation).selectinload(Reservation.warehouse).selectinload(Warehouse.stocks),
         selectinload(Invoice.reservation).selectinload(Reservation.created_by)
-    ).order_by(Invoice.date.desc())
+    ).order_by(*keyset_order(Invoice.date, Invoice.id))
 
     query = _apply_invoice_filters(
         query, med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
@@ -548,10 +588,236 @@ async def get_invoices(
         region_ids, only_overdue, already_joined_res=False, already_joined_org=False
     )
 
-    query = query.offset(skip).limit(limit)
+    query = keyset_seek(query, Invoice.date, Invoice.id, after).offset(skip).limit(limit)
     result = await db.execute(query)
     return result.scalars().all()
 
+async def get_invoice(db: AsyncSession, id: int) -> Optional[Invoice]:
+    result = await db.execute(
+        select(Invoice).options(
+            selectinload(Invoice.payments).selectinload(Payment.processed_by),
+            selectinload(Invoice.reservation).selectinload(Reservation.items).selectinload(ReservationItem.product).selectinload(Product.manufacturers),
+            selectinload(Invoice.reservation).selectinload(Reservation.items).selectinload(ReservationItem.product).selectinload(Product.category),
+            selectinload(Invoice.reservation).selectinload(Reservation.med_org).selectinload(MedicalOrganization.region),
+            selectinload(Invoice.reservation).selectinload(Reservation.med_org).selectinload(MedicalOrganization.assigned_reps),
+            selectinload(Invoice.reservation).selectinload(Reservation.warehouse).selectinload(Warehouse.stocks),
+            selectinload(Invoice.reservation).selectinload(Reservation.created_by)
+        ).where(Invoice.id == id)
+    )
+    return result.scalars().first()
+
+# ── List-view projections ───────────────────────────────────────────────────
+# The list pages show one line per invoice / reservation. Instead of loading the ORM graph
+# (warehouse stocks, product manufacturers and categories, payments with their users) the rows
+# are selected column by column; items and assigned reps follow in one query each per page.
+
+_RESERVATION_ROW_FIELDS = (
+    "id", "date", "customer_name", "status", "total_amount", "nds_percent", "is_bonus_eligible",
+    "is_salary_enabled", "is_tovar_skidka", "is_deletion_pending", "is_return_pending",
+    "warehouse_id", "med_org_id", "created_by_id", "source_invoice_id",
+)
+_INVOICE_ROW_FIELDS = (
+    "id", "reservation_id", "date", "factura_number", "realization_date", "total_amount",
+    "paid_amount", "promo_balance", "status", "is_deletion_pending",
+)
+_ITEM_ROW_FIELDS = (
+    "id", "reservation_id", "product_id", "quantity", "returned_quantity", "price",
+    "discount_percent", "marketing_amount", "salary_amount", "total_price",
+)
+
+def _reservation_row_columns(creator) -> list:
+    return [getattr(Reservation, f).label(f"res_{f}") for f in _RESERVATION_ROW_FIELDS] + [
+        MedicalOrganization.name.label("org_name"),
+        MedicalOrganization.inn.label("org_inn"),
+        MedicalOrganization.org_type.label("org_type"),
+        MedicalOrganization.region_id.label("org_region_id"),
+        Region.name.label("org_region_name"),
+        creator.full_name.label("creator_full_name"),
+        creator.username.label("creator_username"),
+    ]
+
+def _join_reservation_refs(query, creator):
+    return (
+        query.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)
+        .outerjoin(Region, MedicalOrganization.region_id == Region.id)
+        .outerjoin(creator, Reservation.created_by_id == creator.id)
+    )
+
+def _reservation_row(row) -> dict:
+    m = row._mapping
+    res = {f: m[f"res_{f}"] for f in _RESERVATION_ROW_FIELDS}
+    res["created_by"] = {
+        "id": res["created_by_id"], "full_name": m["creator_full_name"], "username": m["creator_username"]
+    } if m["creator_username"] is not None else None
+    res["med_org"] = {
+        "id": res["med_org_id"], "name": m["org_name"], "inn": m["org_inn"], "org_type": m["org_type"],
+        "region": {"id": m["org_region_id"], "name": m["org_region_name"]} if m["org_region_name"] is not None else None,
+        "assigned_reps": [],
+    } if m["org_name"] is not None else None
+    res["items"] = []
+    return res
+
+async def _attach_items_and_reps(db: AsyncSession, reservations: List[dict]):
+    from app.models.crm import medrep_organization
+
+    by_id = {r["id"]: r for r in reservations}
+    if by_id:
+        items = await db.execute(
+            select(*[getattr(ReservationItem, f) for f in _ITEM_ROW_FIELDS], Product.name, Product.marketing_expense)
+            .outerjoin(Product, ReservationItem.product_id == Product.id)
+            .where(ReservationItem.reservation_id.in_(list(by_id)))
+            .order_by(ReservationItem.id)
+        )
+        for row in items:
+            item = {f: getattr(row, f) for f in _ITEM_ROW_FIELDS}
+            item["product"] = {
+                "id": row.product_id, "name": row.name, "marketing_expense": row.marketing_expense
+            } if row.name is not None else None
+            by_id[item.pop("reservation_id")]["items"].append(item)
+
+    orgs = {}
+    for r in reservations:
+        if r["med_org"]:
+            orgs.setdefault(r["med_org_id"], []).append(r["med_org"])
+    if orgs:
+        reps = await db.execute(
+            select(medrep_organization.c.organization_id, User.id, User.full_name, User.username)
+            .join(User, medrep_organization.c.user_id == User.id)
+            .where(medrep_organization.c.organization_id.in_(list(orgs)))
+            .order_by(User.id)
+        )
+        for org_id, user_id, full_name, username in reps:
+            for med_org in orgs[org_id]:
+                med_org["assigned_reps"].append({"id": user_id, "full_name": full_name, "username": username})
+
+async def get_reservation_rows(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    med_rep_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    med_rep_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    region_ids: Optional[List[int]] = None,
+    after: Optional[Cursor] = None
+) -> List[dict]:
+    """Same filters, order and cursor as get_reservations, as ReservationListRow dicts."""
+    creator = aliased(User)
+    query = _join_reservation_refs(select(*_reservation_row_columns(creator)), creator)
+    query = _apply_reservation_filters(
+        query, med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, med_rep_ids, status, warehouse_id, med_org_id, region_ids,
+        already_joined_org=True
+    )
+    query = keyset_seek(query, Reservation.date, Reservation.id, after)
+    query = query.order_by(*keyset_order(Reservation.date, Reservation.id)).offset(skip).limit(limit)
+
+    reservations = [_reservation_row(row) for row in await db.execute(query)]
+    await _attach_items_and_reps(db, reservations)
+    return reservations
+
+async def get_invoice_rows(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    med_rep_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    med_rep_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    has_debt: bool = False,
+    med_org_id: Optional[int] = None,
+    region_ids: Optional[List[int]] = None,
+    only_overdue: bool = False,
+    after: Optional[Cursor] = None
+) -> List[dict]:
+    """Same filters, order and cursor as get_invoices, as InvoiceListRow dicts."""
+    creator = aliased(User)
+    query = select(*[getattr(Invoice, f).label(f"inv_{f}") for f in _INVOICE_ROW_FIELDS], *_reservation_row_columns(creator))
+    query = _join_reservation_refs(query.outerjoin(Reservation, Invoice.reservation_id == Reservation.id), creator)
+    query = _apply_invoice_filters(
+        query, med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, med_rep_ids, status, warehouse_id, has_debt, med_org_id,
+        region_ids, only_overdue, already_joined_res=True, already_joined_org=True
+    )
+    query = keyset_seek(query, Invoice.date, Invoice.id, after)
+    query = query.order_by(*keyset_order(Invoice.date, Invoice.id)).offset(skip).limit(limit)
+
+    invoices, reservations = [], []
+    for row in await db.execute(query):
+        invoice = {f: row._mapping[f"inv_{f}"] for f in _INVOICE_ROW_FIELDS}
+        invoice["reservation"] = _reservation_row(row) if row.res_id is not None else None
+        if invoice["reservation"]:
+            reservations.append(invoice["reservation"])
+        invoices.append(invoice)
+    await _attach_items_and_reps(db, reservations)
+    return invoices
+
+async def count_reservations(
+    db: AsyncSession,
+    mode: str = "exact",
+    med_rep_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    med_rep_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    med_org_id: Optional[int] = None,
+    region_ids: Optional[List[int]] = None
+) -> int:
+    """Number of reservations get_reservations would list (mode: "exact" or "estimate", see count_rows)."""
+    query = _apply_reservation_filters(
+        select(Reservation.id), med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, med_rep_ids, status, warehouse_id, med_org_id, region_ids
+    )
+    return await count_rows(db, query, mode)
+
+async def count_invoices(
+    db: AsyncSession,
+    mode: str = "exact",
+    med_rep_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    med_rep_name: Optional[str] = None,
+    med_org_name: Optional[str] = None,
+    med_org_type: Optional[str] = None,
+    is_tovar_skidka: Optional[bool] = None,
+    inv_num: Optional[str] = None,
+    med_rep_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    has_debt: bool = False,
+    med_org_id: Optional[int] = None,
+    region_ids: Optional[List[int]] = None,
+    only_overdue: bool = False
+) -> int:
+    """Number of invoices get_invoices would list (mode: "exact" or "estimate", see count_rows)."""
+    query = _apply_invoice_filters(
+        select(Invoice.id), med_rep_id, date_from, date_to, med_rep_name, med_org_name, med_org_type,
+        is_tovar_skidka, inv_num, med_rep_ids, status, warehouse_id, has_debt, med_org_id,
+        region_ids, only_overdue, already_joined_res=False, already_joined_org=False
+    )
+    return await count_rows(db, query, mode)
+
 async def get_invoice_stats(
     db: AsyncSession,
     med_rep_id: Optional[int] = None,
@@ -676,6 +942,9 @@ async def create_payment(db: AsyncSession, obj_in: PaymentCreate, user_id: int)
         allocated_doctor_id=obj_in.allocated_doctor_id
     )
     db.add(db_obj)
+    await db.flush() # date default is set on insert
+    
+    await StatsService.record_payment(db, invoice.id, actual_payment, db_obj.date)
     
     # Update Invoice paid_amount and status
     invoice.paid_amount += actual_payment
@@ -714,6 +983,7 @@ async def create_payment(db: AsyncSession, obj_in: PaymentCreate, user_id: int)
             )
             db.add(bt)
     
+    await ReceivableService.refresh(db, [organization.id if organization else None])
     await db.commit()
     await db.refresh(db_obj)
     return db_obj
@@ -759,6 +1029,7 @@ async def apply_surplus_to_debts(db: AsyncSession, organization_id: int, amount:
 
         # Accrue bonus and salary for medrep
         await accrue_medrep_bonus_for_payment(db, inv.id, p.id, payment_to_apply)
+        await StatsService.record_payment(db, inv.id, payment_to_apply, p.date)
         
         inv.paid_amount = (inv.paid_amount or 0.0) + payment_to_apply
         if inv.paid_amount >= inv.total_amount:
@@ -809,6 +1080,7 @@ async def apply_balance_to_invoice(db: AsyncSession, invoice: Invoice, organizat
 
     # Accrue bonus and salary for medrep
     await accrue_medrep_bonus_for_payment(db, invoice.id, p.id, amount_to_apply)
+    await StatsService.record_payment(db, invoice.id, amount_to_apply, p.date)
     
     # Update Invoice
     invoice.paid_amount = (invoice.paid_amount or 0.0) + amount_to_apply
@@ -858,87 +1130,142 @@ async def top_up_organization_balance(db: AsyncSession, organization_id: int, am
         db.add(bt)
         org.credit_balance = (org.credit_balance or 0.0) + remaining_after_debts
     
+    await ReceivableService.refresh(db, [org.id])
     await db.commit()
     await db.refresh(org)
     return org
 
 # Facts
-async def get_facts(db: AsyncSession, med_rep_id: Optional[int] = None) -> List[dict]:
-    query = select(Reservation).options(
-        selectinload(Reservation.items),
-        selectinload(Reservation.invoice)
-    ).where(Reservation.invoice.has())
-    
+def _facts_query(
+    med_rep_id: Optional[int] = None,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    doctor_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+):
+    """
+    Sale facts as one SQL union: the paid share of every invoiced reservation item
+    (paid ratio x item quantity / amount, >99.9% paid counts as fully paid), followed by the
+    facts med reps assigned to doctors. Rows carry their source table and id; `id` is the
+    row number in this order, so it is stable across pages of the same filters.
+    """
+    paid = func.coalesce(Invoice.paid_amount, 0.0) / Invoice.total_amount
+    ratio = case((paid > 0.999, 1.0), else_=paid)
+    fact_date = func.coalesce(Invoice.date, Reservation.date)
+
+    sold = (
+        select(
+            literal("invoice").label("source"),
+            ReservationItem.id.label("source_id"),
+            Reservation.created_by_id.label("med_rep_id"),
+            literal(None, Integer).label("doctor_id"),
+            ReservationItem.product_id.label("product_id"),
+            fact_date.label("date"),
+            extract("month", fact_date).label("month"),
+            extract("year", fact_date).label("year"),
+            (ReservationItem.total_price * ratio).label("amount"),
+            (ReservationItem.quantity * ratio).label("quantity"),
+        )
+        .join(Reservation, ReservationItem.reservation_id == Reservation.id)
+        .join(Invoice, Invoice.reservation_id == Reservation.id)
+        .where(Invoice.total_amount != 0, paid > 0)
+    )
     if med_rep_id:
-        query = query.join(Reservation.med_org, isouter=True).where(
+        sold = sold.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id).where(
             (Reservation.created_by_id == med_rep_id) |
-            (MedicalOrganization.assigned_reps.any(id=med_rep_id))
+            (MedicalOrganization.assigned_reps.any(User.id == med_rep_id))
         )
-        
-    result = await db.execute(query)
-    reservations = result.scalars().all()
-    
-    facts = []
-    fact_id_counter = 1
-    for res in reservations:
-        if not res.invoice or res.invoice.total_amount == 0:
-            continue
-            
-        paid_ratio = res.invoice.paid_amount / res.invoice.total_amount
-        if paid_ratio <= 0:
-            continue
-            
-        # If the invoice is basically paid (precision errors), consider it 100%
-        if paid_ratio > 0.999:
-            paid_ratio = 1.0
-            
-        for item in res.items:
-            paid_qty = item.quantity * paid_ratio
-            paid_amt = item.total_price * paid_ratio
-            
-            facts.append({
-                "id": fact_id_counter,
-                "med_rep_id": res.created_by_id,
-                "doctor_id": None,
-                "product_id": item.product_id,
-                "date": res.invoice.date.isoformat(),
-                "amount": paid_amt,
-                "quantity": int(round(paid_qty))
-            })
-            fact_id_counter += 1
-            
-    # Also fetch doctor fact assignments
-    query_assignments = select(DoctorFactAssignment).options(
-        selectinload(DoctorFactAssignment.product)
+    if year and month:
+        start = datetime(year, month, 1)
+        end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+        sold = sold.where(Invoice.date >= start, Invoice.date < end)
+    elif year:
+        sold = sold.where(Invoice.date >= datetime(year, 1, 1), Invoice.date < datetime(year + 1, 1, 1))
+    elif month:
+        sold = sold.where(extract("month", Invoice.date) == month)
+    if product_id:
+        sold = sold.where(ReservationItem.product_id == product_id)
+
+    assigned = (
+        select(
+            literal("assignment").label("source"),
+            DoctorFactAssignment.id.label("source_id"),
+            DoctorFactAssignment.med_rep_id,
+            DoctorFactAssignment.doctor_id,
+            DoctorFactAssignment.product_id,
+            DoctorFactAssignment.created_at.label("date"),
+            DoctorFactAssignment.month,
+            DoctorFactAssignment.year,
+            func.coalesce(DoctorFactAssignment.amount, func.coalesce(Product.price, 0.0) * DoctorFactAssignment.quantity).label("amount"),
+            DoctorFactAssignment.quantity,
+        )
+        .outerjoin(Product, DoctorFactAssignment.product_id == Product.id)
     )
     if med_rep_id:
-        query_assignments = query_assignments.where(DoctorFactAssignment.med_rep_id == med_rep_id)
-    
-    res_assignments = await db.execute(query_assignments)
-    assignments = res_assignments.scalars().all()
-    
-    # Each assignment is basically a fact transferred to a doctor. We can add them as separate facts
-    for a in assignments:
-        if a.amount is not None:
-            fact_amount = a.amount
-        else:
-            product_price = a.product.price if a.product else 0.0
-            fact_amount = product_price * a.quantity
-
-        facts.append({
-            "id": fact_id_counter,
-            "med_rep_id": a.med_rep_id,
-            "doctor_id": a.doctor_id,
-            "product_id": a.product_id,
-            "date": a.created_at.isoformat(),
-            "month": a.month,
-            "year": a.year,
-            "amount": float(fact_amount),
-            "quantity": a.quantity
-        })
-        fact_id_counter += 1
-        
-    return facts
+        assigned = assigned.where(DoctorFactAssignment.med_rep_id == med_rep_id)
+    if month:
+        assigned = assigned.where(DoctorFactAssignment.month == month)
+    if year:
+        assigned = assigned.where(DoctorFactAssignment.year == year)
+    if product_id:
+        assigned = assigned.where(DoctorFactAssignment.product_id == product_id)
+
+    if doctor_id:
+        # Only assignments are tied to a doctor
+        facts = assigned.where(DoctorFactAssignment.doctor_id == doctor_id).subquery()
+    else:
+        facts = union_all(sold, assigned).subquery()
+
+    order = [case((facts.c.source == "invoice", 0), else_=1), facts.c.date, facts.c.source_id]
+    return select(func.row_number().over(order_by=order).label("id"), *[c for c in facts.c]).order_by(*order)
+
+
+def _fact_row(row) -> dict:
+    return {
+        "id": row.id,
+        "source": row.source,
+        "source_id": row.source_id,
+        "med_rep_id": row.med_rep_id,
+        "doctor_id": row.doctor_id,
+        "product_id": row.product_id,
+        "date": row.date.isoformat() if row.date else None,
+        "month": int(row.month) if row.month is not None else None,
+        "year": int(row.year) if row.year is not None else None,
+        "amount": float(row.amount or 0.0),
+        "quantity": int(round(row.quantity or 0)),
+    }
+
+
+def _facts_page(skip: int = 0, limit: Optional[int] = None, **filters):
+    query = _facts_query(**filters).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def get_facts(
+    db: AsyncSession,
+    med_rep_id: Optional[int] = None,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    doctor_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    skip: int = 0,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    query = _facts_page(
+        skip, limit, med_rep_id=med_rep_id, month=month, year=year, doctor_id=doctor_id, product_id=product_id
+    )
+    result = await db.execute(query)
+    return [_fact_row(row) for row in result.all()]
+
+
+async def iter_facts(db: AsyncSession, skip: int = 0, limit: Optional[int] = None, chunk_size: int = 1000, **filters):
+    """get_facts rows (same skip / limit page) read through a server-side cursor, `chunk_size` rows at a time."""
+    result = await db.stream(_facts_page(skip, limit, **filters).execution_options(yield_per=chunk_size))
+    async for partition in result.partitions(chunk_size):
+        for row in partition:
+            yield _fact_row(row)
 
 # DoctorFactAssignments
 async def create_doctor_fact_assignment(db: AsyncSession, obj_in: DoctorFactAssignmentCreate) -> DoctorFactAssignment:
@@ -961,6 +1288,8 @@ async def create_doctor_fact_assignment(db: AsyncSession, obj_in: DoctorFactAssi
         year=obj_in.year
     )
     db.add(db_obj)
+    await db.flush()
+    await StatsService.record_fact(db, db_obj)
     await db.commit()
     from app.models.product import Product
     query = select(DoctorFactAssignment).options(
@@ -1062,6 +1391,7 @@ async def execute_return_reservation_items(db: AsyncSession, reservation_id: int
         
     # Process returns
     returned_amount_total = 0.0
+    returned_by_item = {}
     for res_item in reservation.items:
         actual_return_qty = res_item.return_requested_quantity
         
@@ -1074,6 +1404,7 @@ async def execute_return_reservation_items(db: AsyncSession, reservation_id: int
             actual_return_qty = available
             
         res_item.returned_quantity += actual_return_qty
+        returned_by_item[res_item.id] = actual_return_qty
         
         # Calculate reduction in price
         reduction = (actual_return_qty * res_item.price) * (1 - res_item.discount_percent / 100)
@@ -1115,6 +1446,9 @@ async def execute_return_reservation_items(db: AsyncSession, reservation_id: int
                     
         res_item.return_requested_quantity = 0
 
+    if reservation.status == ReservationStatus.APPROVED:
+        await StatsService.record_return(db, reservation, reservation.invoice, returned_by_item)
+
     # Apply global reductions
     if returned_amount_total > 0:
         deduction_with_nds = returned_amount_total * (1 + ((reservation.nds_percent or 0) / 100.0))
@@ -1168,6 +1502,7 @@ async def execute_return_reservation_items(db: AsyncSession, reservation_id: int
     
     # Complete the request
     reservation.is_return_pending = False
+    await ReceivableService.refresh(db, [reservation.med_org_id])
     await db.commit()
     await db.refresh(reservation)
     return reservation
@@ -4,9 +4,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
 
-from app.core.security import get_password_hash, verify_password
+from app.core.security import get_password_hash_async
 from app.models.user import User, UserLoginHistory
 from app.schemas.user import UserCreate, UserUpdate
+from app.services.hierarchy_service import HierarchyService
 
 async def get(db: AsyncSession, id: int) -> Optional[User]:
     result = await db.execute(
@@ -47,7 +48,7 @@ async def get_multi(
 async def create(db: AsyncSession, obj_in: UserCreate) -> User:
     db_obj = User(
         username=obj_in.username.strip(),
-        hashed_password=get_password_hash(obj_in.password),
+        hashed_password=await get_password_hash_async(obj_in.password),
         full_name=obj_in.full_name,
         role=obj_in.role,
         is_active=obj_in.is_active,
@@ -61,7 +62,11 @@ async def create(db: AsyncSession, obj_in: UserCreate) -> User:
         db_obj.assigned_regions = regions
         
     db.add(db_obj)
+    if obj_in.manager_id:
+        await db.flush()
+        await HierarchyService.set_manager(db, db_obj.id, obj_in.manager_id)
     await db.commit()
+    HierarchyService.invalidate()
     await db.refresh(db_obj)
     return db_obj
 
@@ -77,7 +82,7 @@ async def update(
         update_data["username"] = update_data["username"].strip()
     
     if "password" in update_data and update_data["password"]:
-        hashed_password = get_password_hash(update_data["password"])
+        hashed_password = await get_password_hash_async(update_data["password"])
         del update_data["password"]
         update_data["hashed_password"] = hashed_password
         
@@ -88,31 +93,23 @@ async def update(
         regions = result.scalars().all()
         db_obj.assigned_regions = regions
         
+    manager_changed = "manager_id" in update_data and update_data["manager_id"] != db_obj.manager_id
+    if manager_changed:
+        await HierarchyService.set_manager(db, db_obj.id, update_data["manager_id"])
+        
     for field in update_data:
         setattr(db_obj, field, update_data[field])
         
     db.add(db_obj)
     await db.commit()
+    if manager_changed:
+        HierarchyService.invalidate()
     await db.refresh(db_obj)
     return db_obj
 
 async def get_descendant_ids(db: AsyncSession, user_id: int) -> List[int]:
     """Get all subordinate IDs (recursively) for a given user."""
-    all_users = (await db.execute(select(User))).scalars().all()
-    manager_to_subs = {}
-    for u in all_users:
-        if u.manager_id:
-            manager_to_subs.setdefault(u.manager_id, []).append(u.id)
-            
-    descendant_ids = []
-    
-    def dfs(uid: int):
-        for sub_id in manager_to_subs.get(uid, []):
-            descendant_ids.append(sub_id)
-            dfs(sub_id)
-            
-    dfs(user_id)
-    return descendant_ids
+    return await HierarchyService.get_descendant_ids(db, user_id)
 
 async def get_login_history(
     db: AsyncSession, 
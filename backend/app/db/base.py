@@ -1,7 +1,9 @@
 from app.db.base_class import Base
-from app.models.user import User
+from app.models.user import User, UserHierarchy
 from app.models.product import Product, Category, Manufacturer
-from app.models.crm import Region, Doctor, MedicalOrganization, DoctorSpecialty, DoctorCategory, BalanceTransaction
+from app.models.crm import Region, Doctor, MedicalOrganization, DoctorSpecialty, DoctorCategory, BalanceTransaction, OrganizationReceivable
 from app.models.sales import Plan, Reservation, ReservationItem, Invoice, Payment
 from app.models.visit import Visit, VisitPlan
 from app.models.finance import ExpenseCategory, OtherExpense
+from app.models.idempotency import IdempotencyKey
+from app.models.export_job import ExportJob
@@ -1,10 +1,76 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+def _attach_slow_query_logger(engine: AsyncEngine):
+    """Slow-query logging without the full instrumentation (SQL_INSTRUMENTATION off)."""
+    from app.core.sql_metrics import record_slow_query
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+        if elapsed_ms >= settings.SQL_SLOW_QUERY_MS:
+            record_slow_query(statement, elapsed_ms)
+
+
+def create_engine_from_settings(url: Optional[str] = None, **overrides) -> AsyncEngine:
+    """
+    Async engine configured from Settings (pool, pre-ping, asyncpg statement cache, echo, slow log).
+    `overrides` are passed to create_async_engine as is (e.g. poolclass=NullPool for scripts).
+    """
+    url = make_url(url or settings.DATABASE_URL)
+    kwargs = {
+        "echo": settings.SQL_ECHO,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if url.get_backend_name() != "sqlite":
+        kwargs.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    if url.get_driver_name() == "asyncpg":
+        # 0 disables both asyncpg's and SQLAlchemy's prepared statement caches (needed behind pgbouncer)
+        kwargs["connect_args"] = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+        if settings.DB_STATEMENT_CACHE_SIZE == 0:
+            url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+    kwargs.update(overrides)
+
+    engine = create_async_engine(url, **kwargs)
+    if settings.SQL_INSTRUMENTATION:
+        # Also times statements for the slow-query log
+        from app.core.sql_metrics import instrument_engine
+        instrument_engine(engine)
+    elif settings.SQL_SLOW_QUERY_MS > 0:
+        _attach_slow_query_logger(engine)
+    return engine
+
+
+def dialect_insert(bind, model):
+    """INSERT with on_conflict_do_nothing / on_conflict_do_update for the bind's backend (PostgreSQL; SQLite in scripts)."""
+    if bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
+
+
+engine = create_engine_from_settings()
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Session listeners that keep derived tables in step with every flush, scripts included
+import app.services.bonus_balance_service  # noqa: E402,F401
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
@@ -1,9 +1,16 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+import os
+import secrets
+import time
 import traceback
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.api import api_router
+from app.services.export_jobs import ExportJobService
+from app.services.audit_service import AuditWriter
+from app.db.session import engine
+from app.core.sql_metrics import SqlMetrics, route_template
 from contextlib import asynccontextmanager
 import subprocess
 
@@ -15,9 +22,18 @@ async def lifespan(app: FastAPI):
         print("Migrations applied successfully!")
     except Exception as e:
         print(f"Migration failed: {e}")
+    AuditWriter.start()
     
     yield
 
+    await AuditWriter.stop()
+    ExportJobService.shutdown()
+    await engine.dispose()
+
+# Audit entries are queued for a background writer that starts on the first one: Passenger
+# (a2wsgi) never runs the lifespan hook, so the writer cannot depend on it
+AuditWriter.enable()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
@@ -31,9 +47,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"]
+    expose_headers=["Content-Disposition", "Idempotent-Replayed", "X-SQL-Count", "X-SQL-Time-Ms", "X-SQL-Slowest-Ms", "X-SQL-N-Plus-One"]
 )
 
+@app.middleware("http")
+async def sql_instrumentation(request: Request, call_next):
+    if not settings.SQL_INSTRUMENTATION:
+        return await call_next(request)
+    started = time.perf_counter()
+    stats = SqlMetrics.start_request(request.url.path)
+    response = await call_next(request)
+    # Route template (e.g. /api/v1/sales/invoices/{id}) keeps metric labels bounded
+    route = route_template(request.scope)
+    repeated = SqlMetrics.finish_request(request.method, route, stats, time.perf_counter() - started)
+    if settings.DEBUG:
+        response.headers.update(SqlMetrics.headers(stats, repeated))
+    return response
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.exception_handler(Exception)
@@ -49,6 +79,24 @@ async def global_exception_handler(request: Request, exc: Exception):
 def root():
     return {"message": "Welcome to Pharma ERP+CRM API"}
 
+def _check_metrics_token(token: str = None):
+    # Closed unless a token is configured: route names, SQL text and pool state are internal
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled (METRICS_TOKEN is not set)")
+    if not token or not secrets.compare_digest(token, settings.METRICS_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics(token: str = None):
+    _check_metrics_token(token)
+    return SqlMetrics.prometheus(engine.sync_engine.pool) + AuditWriter.prometheus()
+
+@app.get("/api/v1/slow-queries")
+def read_slow_queries(limit: int = 100, token: str = None):
+    _check_metrics_token(token)
+    # The slow-query log is kept per worker process: `pid` tells which worker answered
+    return {"threshold_ms": settings.SQL_SLOW_QUERY_MS, "pid": os.getpid(), "queries": SqlMetrics.slow_queries(limit)}
+
 @app.get("/api/v1/error-log")
 def read_error_log():
     import os
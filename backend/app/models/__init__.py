@@ -1,8 +1,8 @@
 from app.models.product import Product, Manufacturer, Category, product_manufacturer
-from app.models.user import User, UserRole, RolePermission
-from app.models.crm import MedicalOrganization, MedicalOrganizationType, Doctor, Region, DoctorSpecialty, DoctorCategory, Notification, medrep_organization, MedicalOrganizationStock, BalanceTransaction, BalanceTransactionType
+from app.models.user import User, UserRole, RolePermission, UserHierarchy
+from app.models.crm import MedicalOrganization, MedicalOrganizationType, Doctor, Region, DoctorSpecialty, DoctorCategory, Notification, medrep_organization, MedicalOrganizationStock, BalanceTransaction, BalanceTransactionType, OrganizationReceivable
 from app.models.warehouse import Warehouse, WarehouseType, Stock, StockMovement, StockMovementType
 from app.models.sales import Reservation, ReservationItem, Invoice, Payment, Plan, ReservationStatus, InvoiceStatus, PaymentType
 from app.models.visit import Visit, VisitPlan
-from app.models.ledger import BonusLedger, LedgerType, DoctorMonthlyStat
+from app.models.ledger import BonusLedger, LedgerType, DoctorMonthlyStat, BonusBalance, BonusBalanceCheckpoint
 from app.models.audit import AuditLog
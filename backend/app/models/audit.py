@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base_class import Base
@@ -6,6 +6,11 @@ from app.db.base_class import Base
 
 class AuditLog(Base):
     """Tracks every significant user action for the Director audit view."""
+    __table_args__ = (
+        Index("ix_auditlog_created_at_id", "created_at", "id"),
+        Index("ix_auditlog_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+        Index("ix_auditlog_ip_address_trgm", "ip_address", postgresql_using="gin", postgresql_ops={"ip_address": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
 
     # Who performed the action
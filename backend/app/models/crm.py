@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Float, DateTime, Table, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Float, DateTime, Table, Boolean, Index, text
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -46,6 +46,11 @@ class DoctorCategory(Base):
     doctors = relationship("Doctor", back_populates="category")
 
 class MedicalOrganization(Base):
+    __table_args__ = (
+        # pg_trgm indexes for ILIKE '%...%' filters and app.services.search_service
+        Index("ix_medicalorganization_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_medicalorganization_inn_trgm", "inn", postgresql_using="gin", postgresql_ops={"inn": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
     address = Column(String, nullable=True)
@@ -66,6 +71,9 @@ class MedicalOrganization(Base):
     doctors = relationship("Doctor", back_populates="med_org")
 
 class Doctor(Base):
+    __table_args__ = (
+        Index("ix_doctor_full_name_trgm", "full_name", postgresql_using="gin", postgresql_ops={"full_name": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String, index=True, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -123,7 +131,29 @@ class BalanceTransaction(Base):
     related_invoice = relationship("Invoice")
     payment = relationship("Payment")
 
+class OrganizationReceivable(Base):
+    """
+    Per-organization receivables summary (one row per MedicalOrganization).
+    Refreshed by ReceivableService in the same transaction as every invoice / payment / balance change,
+    so balance pages read it instead of aggregating all invoices.
+    """
+    __tablename__ = "org_receivable"
+    organization_id = Column(Integer, ForeignKey("medicalorganization.id", ondelete="CASCADE"), primary_key=True)
+    current_debt = Column(Float, default=0.0, nullable=False) # Sum of (total - paid) over underpaid invoices
+    invoice_surplus = Column(Float, default=0.0, nullable=False) # Sum of (paid - total) over overpaid invoices
+    open_invoice_count = Column(Integer, default=0, nullable=False)
+    oldest_unpaid_date = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    organization = relationship("MedicalOrganization", backref="receivable", uselist=False)
+
 class Notification(Base):
+    __table_args__ = (
+        # A user's inbox / unread count / bulk mark-read
+        Index("ix_notification_recipient_status_created", "recipient_id", "status", "created_at"),
+        # Unread badge count: only unread rows, so it stays small however large the inbox grows
+        Index("ix_notification_unread_recipient", "recipient_id", postgresql_where=text("status = 'unread'")),
+    )
     id = Column(Integer, primary_key=True, index=True)
     topic = Column(String, nullable=False)
     message = Column(String, nullable=False)
@@ -135,3 +165,19 @@ class Notification(Base):
     related_entity_name = Column(String, nullable=True)
     
     recipient = relationship("User", backref="notifications")
+
+class NotificationArchive(Base):
+    """
+    Cold storage for read notifications older than NOTIFICATION_ARCHIVE_AFTER_DAYS
+    (moved by NotificationService.archive_read; ids are kept).
+    """
+    __tablename__ = "notification_archive"
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)
+    message = Column(String, nullable=False)
+    recipient_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime)
+    status = Column(String)
+    related_entity_type = Column(String, nullable=True)
+    related_entity_name = Column(String, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
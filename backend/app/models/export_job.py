@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from datetime import datetime
+from app.db.base_class import Base
+
+
+class ExportJob(Base):
+    """
+    A background Excel export (ExportJobService). The row is the job's state, shared by every API
+    process; the rendered workbook lives at `path` under EXPORT_DIR until expires_at.
+    """
+    __tablename__ = "export_job"
+    id = Column(String(32), primary_key=True) # uuid4 hex
+    kind = Column(String, nullable=False) # director_report | drilldown | reservation
+    params = Column(JSON, nullable=False, default=dict)
+    owner_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued") # queued | collecting | rendering | done | failed
+    progress = Column(Integer, nullable=False, default=0)
+    rows = Column(Integer, nullable=False, default=0)
+    filename = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    path = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False) # heartbeat of the running process
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, UniqueConstraint
+from datetime import datetime
+from app.db.base_class import Base
+
+
+class IdempotencyKey(Base):
+    """
+    One retried-write guard per (user, Idempotency-Key header): the request fingerprint and, once the
+    write succeeded, its response, which is replayed to retries until expires_at (IdempotencyService).
+    """
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_key_user_key"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False) # sha256 of method, path, query and body
+    status = Column(String, nullable=False, default="in_progress") # in_progress | done
+    response_body = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
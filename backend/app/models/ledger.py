@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Date, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Date, Boolean, Index, func, literal_column
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -17,6 +17,9 @@ class BonusLedger(Base):
     Includes support for predinvest and offsets.
     """
     __tablename__ = "bonus_ledger"
+    __table_args__ = (
+        Index("ix_bonus_ledger_user_category", "user_id", "ledger_category"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("user.id"), nullable=True) # For MedRep
@@ -57,11 +60,18 @@ class DoctorMonthlyStat(Base):
     """
     Event-based counter table for Real-Time Dashboards.
     Prevents heavy JOIN aggregations.
+    Maintained incrementally by StatsService; doctor_id is NULL for MedRep level
+    sales/payments (invoices carry no doctor), set for doctor fact assignments.
     """
     __tablename__ = "doctor_monthly_stat"
+    __table_args__ = (
+        Index("ix_doctor_monthly_stat_rep_period", "med_rep_id", "year", "month"),
+        Index("ix_doctor_monthly_stat_doctor_period", "doctor_id", "product_id", "year", "month"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    doctor_id = Column(Integer, ForeignKey("doctor.id"), nullable=False, index=True)
+    med_rep_id = Column(Integer, ForeignKey("user.id"), nullable=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctor.id"), nullable=True, index=True)
     product_id = Column(Integer, ForeignKey("product.id"), nullable=False)
     
     month = Column(Integer, nullable=False, index=True)
@@ -71,11 +81,78 @@ class DoctorMonthlyStat(Base):
     sold_quantity = Column(Integer, default=0) # Updated on reservation approval
     paid_quantity = Column(Integer, default=0) # Updated on payment
     
+    sold_amount = Column(Float, default=0.0) # Updated on reservation approval / return
     paid_amount = Column(Float, default=0.0) # Updated on payment
     bonus_amount = Column(Float, default=0.0) # Accrued bonus from this product for the month
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    med_rep = relationship("User")
     doctor = relationship("Doctor")
     product = relationship("Product")
+
+# One DoctorMonthlyStat row per key. NULL rep / doctor ids are coalesced to 0 so they collide
+# as well; StatsService upserts against exactly these expressions (ON CONFLICT target).
+DOCTOR_MONTHLY_STAT_KEY = (
+    func.coalesce(DoctorMonthlyStat.med_rep_id, literal_column("0")),
+    func.coalesce(DoctorMonthlyStat.doctor_id, literal_column("0")),
+    DoctorMonthlyStat.product_id,
+    DoctorMonthlyStat.month,
+    DoctorMonthlyStat.year,
+)
+Index("uq_doctor_monthly_stat_key", *DOCTOR_MONTHLY_STAT_KEY, unique=True)
+
+
+class BonusBalance(Base):
+    """
+    Running MedRep balance per ledger category (one row per user + category).
+    Refreshed by BonusBalanceService in the same transaction as every BonusLedger write,
+    so balance reads do not sum the whole ledger history.
+    """
+    __tablename__ = "bonus_balance"
+
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    ledger_category = Column(String, primary_key=True) # "bonus" or "salary"
+
+    accrued = Column(Float, default=0.0, nullable=False) # All ACCRUAL amounts
+    paid_accrued = Column(Float, default=0.0, nullable=False) # ACCRUAL amounts with is_paid = True
+    offset_amount = Column(Float, default=0.0, nullable=False) # OFFSET amounts (allocated to doctors)
+    allocated = Column(Float, default=0.0, nullable=False) # abs(OFFSET amounts)
+    advance_amount = Column(Float, default=0.0, nullable=False)
+    payout_amount = Column(Float, default=0.0, nullable=False)
+    reversal_amount = Column(Float, default=0.0, nullable=False)
+    balance = Column(Float, default=0.0, nullable=False) # Usable balance: paid_accrued - offset_amount
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User")
+
+
+class BonusBalanceCheckpoint(Base):
+    """
+    BonusBalance totals as of the end of a closed month (cumulative, not the month's movement).
+    Accruals count as paid in the month of their paid_date. Balances as of any month are the
+    nearest earlier checkpoint plus the ledger rows after it.
+    """
+    __tablename__ = "bonus_balance_checkpoint"
+    __table_args__ = (
+        Index("ix_bonus_balance_checkpoint_period", "user_id", "ledger_category", "year", "month", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    ledger_category = Column(String, nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+
+    accrued = Column(Float, default=0.0, nullable=False)
+    paid_accrued = Column(Float, default=0.0, nullable=False)
+    offset_amount = Column(Float, default=0.0, nullable=False)
+    allocated = Column(Float, default=0.0, nullable=False)
+    advance_amount = Column(Float, default=0.0, nullable=False)
+    payout_amount = Column(Float, default=0.0, nullable=False)
+    reversal_amount = Column(Float, default=0.0, nullable=False)
+    balance = Column(Float, default=0.0, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
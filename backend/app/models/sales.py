@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Enum, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Enum, DateTime, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -24,6 +24,13 @@ class PaymentType(str, enum.Enum):
     BANK = "bank"
     OTHER = "other"
 
+class PaymentKind(str, enum.Enum):
+    REGULAR = "regular"
+    # Paid at reservation approval from the org's credit balance / another invoice's promo sum.
+    # Not accrued: the payment the money came from already was.
+    CREDIT_BALANCE = "credit_balance"
+    TOVAR_SKIDKA = "tovar_skidka"
+
 class Plan(Base):
     id = Column(Integer, primary_key=True, index=True)
     med_rep_id = Column(Integer, ForeignKey("user.id"))
@@ -49,6 +56,12 @@ class Invoice(Base):
     Linked 1-to-1 with a Reservation.
     """
     __tablename__ = "invoice"
+    __table_args__ = (
+        # Keyset pagination (date desc, id desc); the status variant serves debtor listings
+        Index("ix_invoice_date_id", "date", "id"),
+        Index("ix_invoice_status_date_id", "status", "date", "id"),
+        Index("ix_invoice_factura_number_trgm", "factura_number", postgresql_using="gin", postgresql_ops={"factura_number": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(DateTime, default=datetime.utcnow)
     total_amount = Column(Float, nullable=False)
@@ -69,10 +82,14 @@ class Invoice(Base):
 
 class Reservation(Base): # Bron
     __tablename__ = "reservation"
+    __table_args__ = (
+        Index("ix_reservation_date_id", "date", "id"),
+        Index("ix_reservation_customer_name_trgm", "customer_name", postgresql_using="gin", postgresql_ops={"customer_name": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     created_by_id = Column(Integer, ForeignKey("user.id")) 
     customer_name = Column(String, nullable=False) 
-    med_org_id = Column(Integer, ForeignKey("medicalorganization.id"), nullable=True) 
+    med_org_id = Column(Integer, ForeignKey("medicalorganization.id"), nullable=True, index=True) 
     warehouse_id = Column(Integer, ForeignKey("warehouse.id"), nullable=True) 
     date = Column(DateTime, default=datetime.utcnow)
     validity_date = Column(DateTime, nullable=True)
@@ -124,6 +141,9 @@ class ReservationItem(Base):
 
 class Payment(Base): # Postupleniya
     __tablename__ = "payment"
+    __table_args__ = (
+        Index("ix_payment_date_id", "date", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     invoice_id = Column(Integer, ForeignKey("invoice.id"), index=True)
     amount = Column(Float, nullable=False)
@@ -133,6 +153,7 @@ class Payment(Base): # Postupleniya
     processed_by_id = Column(Integer, ForeignKey("user.id")) 
     allocated_doctor_id = Column(Integer, ForeignKey("doctor.id"), nullable=True) 
     source_payment_id = Column(Integer, ForeignKey("payment.id"), nullable=True)
+    kind = Column(String, default=PaymentKind.REGULAR, server_default=PaymentKind.REGULAR.value, nullable=False)
     
     invoice = relationship("Invoice", back_populates="payments")
     processed_by = relationship("User")
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, DateTime, Index
 from sqlalchemy.orm import relationship
 import enum
 from app.db.base_class import Base
@@ -20,6 +20,9 @@ class UserRole(str, enum.Enum):
     ACCOUNTANT = "accountant"
 
 class User(Base):
+    __table_args__ = (
+        Index("ix_user_full_name_trgm", "full_name", postgresql_using="gin", postgresql_ops={"full_name": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
@@ -28,7 +31,7 @@ class User(Base):
     role = Column(String, default=UserRole.MED_REP)
     
     # Hierarchical relationship: manager_id points to the user's manager
-    manager_id = Column(Integer, ForeignKey("user.id"), nullable=True)
+    manager_id = Column(Integer, ForeignKey("user.id"), nullable=True, index=True)
     
     # Relationship to access subordinates
     subordinates = relationship("User", backref="manager", remote_side=[id])
@@ -36,6 +39,16 @@ class User(Base):
     # Explicit relationship definitions using strings to avoid circular imports
     assigned_regions = relationship("Region", secondary="user_regions", back_populates="assigned_users")
 
+class UserHierarchy(Base):
+    """
+    Closure table over User.manager_id: one row per (ancestor, descendant) pair, depth >= 1.
+    Maintained by HierarchyService whenever manager_id changes.
+    """
+    __tablename__ = "user_hierarchy"
+    ancestor_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True, index=True)
+    depth = Column(Integer, nullable=False, default=1)
+
 class UserLoginHistory(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
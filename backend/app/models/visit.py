@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base_class import Base
 from app.models.crm import MedicalOrganization
 
 class Visit(Base):
+    __table_args__ = (
+        # A rep's visit history, newest first (keyset on visit_date, id)
+        Index("ix_visit_med_rep_id_visit_date", "med_rep_id", "visit_date", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     med_rep_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     doctor_id = Column(Integer, ForeignKey("doctor.id"), nullable=False)
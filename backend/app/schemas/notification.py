@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from pydantic import BaseModel
 from .user import User
@@ -24,3 +24,7 @@ class Notification(NotificationBase):
 
     class Config:
         from_attributes = True
+
+class NotificationMarkRead(BaseModel):
+    ids: Optional[List[int]] = None
+    before: Optional[datetime] = None # all notifications created at or before this moment
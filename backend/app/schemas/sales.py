@@ -205,6 +205,75 @@ class InvoiceLite(InvoiceBase):
     class Config:
         from_attributes = True
 
+# List-view rows: built from column-level selects (crud_sales.get_invoice_rows / get_reservation_rows).
+# Same field names and nesting as the full schemas, without warehouse stocks, payments or product catalogs.
+class ListUser(BaseModel):
+    id: int
+    full_name: Optional[str] = None
+    username: Optional[str] = None
+
+class ListRegion(BaseModel):
+    id: int
+    name: str
+
+class ListMedOrg(BaseModel):
+    id: int
+    name: str
+    inn: Optional[str] = None
+    org_type: Optional[str] = None
+    region: Optional[ListRegion] = None
+    assigned_reps: List[ListUser] = []
+
+class ListProduct(BaseModel):
+    id: int
+    name: str
+    marketing_expense: Optional[float] = 0.0
+
+class ReservationItemRow(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    returned_quantity: int = 0
+    price: float
+    discount_percent: Optional[float] = 0.0
+    marketing_amount: Optional[float] = 0.0
+    salary_amount: Optional[float] = 0.0
+    total_price: Optional[float] = 0.0
+    product: Optional[ListProduct] = None
+
+class ReservationListRow(BaseModel):
+    id: int
+    date: datetime
+    customer_name: str
+    status: ReservationStatus
+    total_amount: float
+    nds_percent: Optional[float] = 12.0
+    is_bonus_eligible: Optional[bool] = True
+    is_salary_enabled: Optional[bool] = True
+    is_tovar_skidka: Optional[bool] = False
+    is_deletion_pending: Optional[bool] = False
+    is_return_pending: Optional[bool] = False
+    warehouse_id: Optional[int] = None
+    med_org_id: Optional[int] = None
+    created_by_id: Optional[int] = None
+    source_invoice_id: Optional[int] = None
+    created_by: Optional[ListUser] = None
+    med_org: Optional[ListMedOrg] = None
+    items: List[ReservationItemRow] = []
+
+class InvoiceListRow(BaseModel):
+    id: int
+    reservation_id: int
+    date: datetime
+    factura_number: Optional[str] = None
+    realization_date: Optional[datetime] = None
+    total_amount: float
+    paid_amount: float
+    promo_balance: Optional[float] = 0.0
+    status: InvoiceStatus
+    is_deletion_pending: Optional[bool] = False
+    reservation: Optional[ReservationListRow] = None
+
 # Optimized schemas for approval requests
 class ApprovalItemSchema(BaseModel):
     product_name: str
@@ -290,9 +359,42 @@ class Payment(PaymentBase):
     class Config:
         orm_mode = True
 
+# Bulk payment import (bank statement): a line names its invoice by id or factura number
+class PaymentImportLine(BaseModel):
+    invoice_id: Optional[int] = None
+    factura_number: Optional[str] = None
+    amount: float
+    payment_type: PaymentType = PaymentType.BANK
+    comment: Optional[str] = None
+
+class PaymentImport(BaseModel):
+    lines: List[PaymentImportLine]
+    dry_run: bool = False
+
 Reservation.model_rebuild()
 Invoice.model_rebuild()
 
+# Cursor pages (app.core.pagination): next_cursor is None on the last page, total only when requested
+class InvoicePage(BaseModel):
+    items: List[Invoice]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+class InvoiceRowPage(BaseModel):
+    items: List[InvoiceListRow]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+class ReservationPage(BaseModel):
+    items: List[Reservation]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+class ReservationRowPage(BaseModel):
+    items: List[ReservationListRow]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
 # Doctor Fact Assignment
 class DoctorFactAssignmentBase(BaseModel):
     med_rep_id: int
@@ -316,10 +418,14 @@ class DoctorFactAssignment(DoctorFactAssignmentBase):
 
 class SaleFact(BaseModel):
     id: int
+    source: str = "invoice" # "invoice" (paid share of an invoice item) or "assignment" (DoctorFactAssignment)
+    source_id: Optional[int] = None
     med_rep_id: int
     doctor_id: Optional[int] = None
     product_id: int
-    date: str
+    date: Optional[str] = None
+    month: Optional[int] = None
+    year: Optional[int] = None
     amount: float
     quantity: int
 
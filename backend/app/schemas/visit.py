@@ -1,4 +1,4 @@
-from typing import Optional, Any, Union
+from typing import List, Optional, Any, Union
 try:
     from pydantic import BaseModel, ConfigDict, computed_field, Field, AliasChoices
 except ImportError:
@@ -39,6 +39,32 @@ class VisitInDBBase(VisitBase):
 class Visit(VisitInDBBase):
     pass
 
+class VisitDoctorRef(BaseModel):
+    id: Optional[int] = None
+    full_name: str
+
+class VisitMedOrgRef(BaseModel):
+    id: Optional[int] = None
+    name: str
+
+class VisitHistoryRow(BaseModel):
+    id: int
+    visit_date: Optional[datetime] = None
+    visit_type: str
+    result: Optional[str] = None
+    notes: Optional[str] = None
+    doctor: VisitDoctorRef
+    med_org: Optional[VisitMedOrgRef] = None
+
+class VisitHistoryPage(BaseModel):
+    items: List[VisitHistoryRow]
+    next_cursor: Optional[str] = None
+
+class VisitMonthCount(BaseModel):
+    year: int
+    month: int
+    count: int
+
 # Visit Plan Schemas
 class VisitPlanBase(BaseModel):
     med_rep_id: Optional[int] = None
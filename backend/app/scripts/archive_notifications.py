@@ -0,0 +1,25 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.services.notification_service import NotificationService
+
+async def archive_notifications(days: int):
+    """
+    Moves read notifications older than `days` into notification_archive. The API does not archive
+    on its own (Passenger runs no startup hooks): schedule this in cron, e.g. nightly
+        0 3 * * * cd ~/backend && python -m app.scripts.archive_notifications
+    Usage: python -m app.scripts.archive_notifications [days]
+    """
+    print(f"Archiving read notifications older than {days} days...")
+    async with AsyncSessionLocal() as db:
+        moved = await NotificationService.archive_read(db, days)
+        print(f"Done. {moved} notifications archived.")
+
+if __name__ == "__main__":
+    asyncio.run(archive_notifications(int(sys.argv[1]) if len(sys.argv) > 1 else settings.NOTIFICATION_ARCHIVE_AFTER_DAYS))
@@ -7,7 +7,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 from sqlalchemy import delete
 from app.db.session import AsyncSessionLocal, engine
-from app.models.ledger import BonusLedger, DoctorMonthlyStat
+from app.models.ledger import BonusLedger, DoctorMonthlyStat, BonusBalance, BonusBalanceCheckpoint
 from app.models.sales import BonusPayment, DoctorFactAssignment, UnassignedSale
 
 async def clear_bonus_data():
@@ -17,6 +17,8 @@ async def clear_bonus_data():
             # 1. Clear Bonus Ledger
             print("Clearing BonusLedger...")
             await db.execute(delete(BonusLedger))
+            await db.execute(delete(BonusBalanceCheckpoint))
+            await db.execute(delete(BonusBalance))
             
             # 2. Clear Bonus Payments
             print("Clearing BonusPayment...")
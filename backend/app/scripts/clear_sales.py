@@ -10,7 +10,7 @@ from app.db.session import AsyncSessionLocal, engine
 from app.models.sales import Reservation, ReservationItem, Invoice, Payment, UnassignedSale, DoctorFactAssignment, BonusPayment
 from app.models.warehouse import Stock, StockMovement
 from app.models.crm import MedicalOrganization, MedicalOrganizationStock
-from app.models.ledger import BonusLedger, DoctorMonthlyStat
+from app.models.ledger import BonusLedger, DoctorMonthlyStat, BonusBalance, BonusBalanceCheckpoint
 
 async def clear_sales_data():
     print("Starting full sales data cleanup and stock restoration...")
@@ -75,6 +75,8 @@ async def clear_sales_data():
             # 5. Optional: Re-clear bonuses just in case something was missed during cascade or re-created
             print("Final Bonus Cleanup...")
             await db.execute(delete(BonusLedger))
+            await db.execute(delete(BonusBalanceCheckpoint))
+            await db.execute(delete(BonusBalance))
             await db.execute(delete(BonusPayment))
             await db.execute(delete(DoctorFactAssignment))
             await db.execute(delete(DoctorMonthlyStat))
@@ -0,0 +1,35 @@
+import asyncio
+import sys
+import os
+from datetime import datetime
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.bonus_balance_service import BonusBalanceService
+
+async def close_bonus_month(year: int, month: int):
+    """
+    Writes the BonusBalanceCheckpoint rows of a closed month (balances as of its last day).
+    Run from cron on the 1st of each month; without arguments it closes the previous month.
+    Usage: python -m app.scripts.close_bonus_month [YYYY-MM]
+    """
+    print(f"Checkpointing bonus balances as of {year}-{month:02d}...")
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = await BonusBalanceService.close_month(db, year, month)
+            await db.commit()
+            print(f"Done. {rows} checkpoints written.")
+        except Exception as e:
+            await db.rollback()
+            print(f"Error during checkpointing: {e}")
+            raise e
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        year, month = (int(part) for part in sys.argv[1].split("-"))
+    else:
+        now = datetime.utcnow()
+        year, month = (now.year - 1, 12) if now.month == 1 else (now.year, now.month - 1)
+    asyncio.run(close_bonus_month(year, month))
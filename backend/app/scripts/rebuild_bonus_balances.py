@@ -0,0 +1,31 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.bonus_balance_service import BonusBalanceService
+
+async def rebuild_bonus_balances():
+    """
+    Recomputes BonusBalance and the monthly BonusBalanceCheckpoint rows from BonusLedger.
+    Run after direct SQL edits of the ledger (month-end checkpoints alone: close_bonus_month).
+    Usage: python -m app.scripts.rebuild_bonus_balances
+    """
+    print("Rebuilding BonusBalance and checkpoints...")
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = await BonusBalanceService.rebuild(db)
+            await db.commit()
+            print(f"Done. {rows} balances refreshed.")
+        except Exception as e:
+            await db.rollback()
+            print(f"Error during rebuild: {e}")
+            raise e
+        finally:
+            await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_bonus_balances())
@@ -0,0 +1,31 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.stats_service import StatsService
+
+async def rebuild_doctor_monthly_stats():
+    """
+    Recomputes DoctorMonthlyStat from reservations, payments and fact assignments.
+    Safe to run at any time: the table is a pure rollup and is fully replaced.
+    Usage: python -m app.scripts.rebuild_doctor_monthly_stats
+    """
+    print("Rebuilding DoctorMonthlyStat...")
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = await StatsService.rebuild(db)
+            await db.commit()
+            print(f"Done. {rows} rows written.")
+        except Exception as e:
+            await db.rollback()
+            print(f"Error during rebuild: {e}")
+            raise e
+        finally:
+            await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_doctor_monthly_stats())
@@ -0,0 +1,30 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.receivable_service import ReceivableService
+
+async def rebuild_org_receivables():
+    """
+    Recomputes OrganizationReceivable (debt / surplus / open invoices per organization) from invoices.
+    Usage: python -m app.scripts.rebuild_org_receivables
+    """
+    print("Rebuilding OrganizationReceivable...")
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = await ReceivableService.rebuild(db)
+            await db.commit()
+            print(f"Done. {rows} organizations refreshed.")
+        except Exception as e:
+            await db.rollback()
+            print(f"Error during rebuild: {e}")
+            raise e
+        finally:
+            await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_org_receivables())
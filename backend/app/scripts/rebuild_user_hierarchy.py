@@ -0,0 +1,30 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.hierarchy_service import HierarchyService
+
+async def rebuild_user_hierarchy():
+    """
+    Recomputes the UserHierarchy closure table from User.manager_id.
+    Usage: python -m app.scripts.rebuild_user_hierarchy
+    """
+    print("Rebuilding UserHierarchy...")
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = await HierarchyService.rebuild(db)
+            await db.commit()
+            print(f"Done. {rows} ancestor/descendant pairs written.")
+        except Exception as e:
+            await db.rollback()
+            print(f"Error during rebuild: {e}")
+            raise e
+        finally:
+            await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_user_hierarchy())
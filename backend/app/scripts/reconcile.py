@@ -0,0 +1,48 @@
+import asyncio
+import sys
+import os
+from datetime import date
+
+# Add the parent directory to the path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.db.session import AsyncSessionLocal
+from app.services.reconciliation_service import CHECKS, ReconciliationService
+
+async def reconcile(args):
+    """
+    Invoice / payment / ledger consistency check (same as POST /finance/reconciliation/).
+    Replaces fix_invoice_paid_amount, fix_missing_bonuses and populate_debt_history.
+    Usage: python -m app.scripts.reconcile [--repair] [--since YYYY-MM-DD] [--limit N] [check ...]
+    Checks: orphaned_payments invoice_paid missing_accruals ineligible_accruals invoice_debt_entries
+    """
+    repair = "--repair" in args
+    since = None
+    limit = 20
+    checks = []
+    rest = iter(a for a in args if a != "--repair")
+    for arg in rest:
+        if arg == "--since":
+            since = date.fromisoformat(next(rest))
+        elif arg == "--limit":
+            limit = int(next(rest))
+        elif arg in CHECKS:
+            checks.append(arg)
+        else:
+            print(f"Unknown argument: {arg}")
+            return
+
+    print("Repairing..." if repair else "Dry run (pass --repair to fix)...")
+    async with AsyncSessionLocal() as db:
+        report = await ReconciliationService.run(db, checks or None, repair=repair, since=since, limit=limit)
+
+    for name, check in report["checks"].items():
+        print(f"\n{name}: {check['found']} found, {check['repaired']} repaired ({check['elapsed_ms']} ms)")
+        for row in check["rows"]:
+            print("  " + ", ".join(f"{k}={v}" for k, v in row.items()))
+        if check["found"] > len(check["rows"]):
+            print(f"  ... {check['found'] - len(check['rows'])} more")
+    print(f"\nDone in {report['elapsed_ms']} ms.")
+
+if __name__ == "__main__":
+    asyncio.run(reconcile(sys.argv[1:]))
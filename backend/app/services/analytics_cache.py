@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.sales import Invoice, Payment, Reservation, ReservationItem, Plan, DoctorFactAssignment
+from app.models.crm import BalanceTransaction, MedicalOrganization, Doctor
+from app.models.ledger import BonusLedger
+from app.models.finance import OtherExpense
+from app.models.product import Product
+
+# In-process result cache for the heavy analytics endpoints, keyed by (data version, endpoint, filters, scope).
+# A committed write to a tracked model bumps the version of the process that made it; the other workers
+# (and scripts' writes) are only caught by expiry, so every entry has a TTL.
+_data_version = 0
+_result_cache: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+# Writes to these tables change the numbers shown by dashboard / comprehensive stats / reports
+_TRACKED_MODELS = (
+    Invoice, Payment, Reservation, ReservationItem, Plan, DoctorFactAssignment,
+    BalanceTransaction, BonusLedger, OtherExpense, Product, Doctor, MedicalOrganization,
+)
+_TRACKED_TABLES = {m.__table__.name for m in _TRACKED_MODELS}
+_DIRTY_FLAG = "analytics_dirty"
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(_normalize(v) for v in value))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class AnalyticsCache:
+    @staticmethod
+    def invalidate():
+        """Bump the data version. Called automatically after commits touching tracked models."""
+        global _data_version
+        _data_version += 1
+        _result_cache.clear()
+
+    @staticmethod
+    def make_key(endpoint: str, scope: dict, **params) -> Tuple:
+        """
+        Normalized cache key: equal filters in a different order / as list vs tuple map to the same key.
+        `scope` must hold everything that restricts visibility for the caller (role, regions, rep ids).
+        """
+        return (
+            endpoint,
+            tuple(sorted((k, _normalize(v)) for k, v in params.items())),
+            tuple(sorted((k, _normalize(v)) for k, v in scope.items())),
+        )
+
+    @staticmethod
+    def is_closed_period(end_date: Optional[datetime]) -> bool:
+        """A period that ended before the current month started (historical, cached longer)."""
+        if end_date is None:
+            return False
+        if not isinstance(end_date, datetime):
+            end_date = datetime(end_date.year, end_date.month, end_date.day)
+        now = datetime.utcnow()
+        return end_date <= datetime(now.year, now.month, 1)
+
+    @staticmethod
+    def get(key: Tuple) -> Optional[Any]:
+        entry = _result_cache.get((_data_version,) + key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            _result_cache.pop((_data_version,) + key, None)
+            return None
+        _result_cache.move_to_end((_data_version,) + key)
+        return value
+
+    @staticmethod
+    def set(key: Tuple, value: Any, closed_period: bool = False):
+        """Stores a result for ANALYTICS_CACHE_TTL_SECONDS, closed historical periods for ANALYTICS_CACHE_CLOSED_TTL_SECONDS."""
+        ttl = settings.ANALYTICS_CACHE_CLOSED_TTL_SECONDS if closed_period else settings.ANALYTICS_CACHE_TTL_SECONDS
+        expires_at = time.monotonic() + ttl
+        _result_cache[(_data_version,) + key] = (expires_at, value)
+        _result_cache.move_to_end((_data_version,) + key)
+        while len(_result_cache) > settings.ANALYTICS_CACHE_MAX_ENTRIES:
+            _result_cache.popitem(last=False)
+
+
+# ── Write-driven invalidation ───────────────────────────────────────────────
+# FinancialService, ReservationService and crud_sales all write through ORM sessions, so the
+# sessions themselves report which tables changed; the version is bumped once the commit lands.
+
+@event.listens_for(Session, "after_flush")
+def _mark_dirty_on_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _TRACKED_MODELS):
+            session.info[_DIRTY_FLAG] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_dirty_on_bulk(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and table.name in _TRACKED_TABLES:
+            orm_execute_state.session.info[_DIRTY_FLAG] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop(_DIRTY_FLAG, False):
+        AnalyticsCache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop(_DIRTY_FLAG, None)
@@ -1,13 +1,152 @@
 """
 Audit log helper — call `log_action(...)` inside any endpoint to record an action.
+
+Entries are written behind the request: log_action only puts a row on an in-process queue and
+AuditWriter inserts queued rows in batches (one multi-row INSERT per batch) on its own connection.
+The request session is never flushed or committed by auditing.
+
+The app enables the writer at import (`AuditWriter.enable()`) and it starts on the first entry queued
+from a running event loop, so it also runs under Passenger / a2wsgi, where the lifespan hook (and with
+it AuditWriter.stop) never runs. Scripts and the CLI never enable it and insert each entry right away.
 """
+import asyncio
+import logging
+import os
+from contextlib import suppress
 from datetime import datetime
+from typing import List, Optional
+
 from fastapi import Request
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
+from app.core.config import settings
 from app.models.audit import AuditLog
 from app.models.user import User
 
+logger = logging.getLogger(__name__)
+
+_queue: Optional[asyncio.Queue] = None
+_task: Optional[asyncio.Task] = None
+_engine: Optional[AsyncEngine] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_enabled = False
+_stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0}
+
+
+async def _insert(rows: List[dict]):
+    engine = _engine
+    if engine is None:
+        from app.db.session import engine
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(insert(AuditLog.__table__).values(rows))
+        _stats["written"] += len(rows)
+    except Exception:
+        _stats["failed"] += len(rows)
+        logger.exception(f"Failed to write {len(rows)} audit log entries")
+
+
+async def _run():
+    while True:
+        batch = [await _queue.get()]
+        # Whatever queued up while the previous batch was being written goes into this one
+        while len(batch) < settings.AUDIT_BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        try:
+            await _insert(batch)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _running() -> bool:
+    """The writer task is alive on the current event loop (a queue is bound to the loop it was made on)."""
+    if _task is None or _task.done():
+        return False
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+class AuditWriter:
+    @staticmethod
+    def enable(engine: Optional[AsyncEngine] = None):
+        """Lets `enqueue` start the writer on first use (app import). `engine` defaults to the app engine."""
+        global _enabled, _engine
+        _enabled, _engine = True, engine
+
+    @staticmethod
+    def start(engine: Optional[AsyncEngine] = None):
+        """Starts the background writer on the running loop. `engine` defaults to the app engine."""
+        global _queue, _task, _engine, _loop
+        if _running():
+            return
+        _engine = engine or _engine
+        _loop = asyncio.get_running_loop()
+        _queue = asyncio.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+        _task = _loop.create_task(_run())
+
+    @staticmethod
+    async def stop(timeout: Optional[float] = None):
+        """Writes what is still queued (up to `timeout` seconds) and stops the writer (app shutdown)."""
+        global _queue, _task
+        if _task is None:
+            return
+        try:
+            await asyncio.wait_for(_queue.join(), timeout or settings.AUDIT_SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            _stats["dropped"] += _queue.qsize()
+            logger.warning(f"Audit writer stopped with {_queue.qsize()} entries not written")
+        _task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _task
+        _queue, _task = None, None
+
+    @staticmethod
+    async def enqueue(row: dict):
+        """
+        Queues one AuditLog row. When the queue is full the caller waits up to
+        AUDIT_ENQUEUE_TIMEOUT_MS for room (backpressure), then the entry is dropped and counted.
+        Without a running writer (scripts, CLI) the row is inserted right away.
+        """
+        if not _running():
+            if not _enabled:
+                await _insert([row])
+                return
+            AuditWriter.start()
+        try:
+            _queue.put_nowait(row)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(_queue.put(row), settings.AUDIT_ENQUEUE_TIMEOUT_MS / 1000)
+            except asyncio.TimeoutError:
+                _stats["dropped"] += 1
+                if _stats["dropped"] % 1000 == 1:  # first drop, then every 1000th
+                    logger.warning(f"Audit queue full: {_stats['dropped']} entries dropped so far")
+                return
+        _stats["enqueued"] += 1
+
+    @staticmethod
+    def stats() -> dict:
+        return {**_stats, "queued": _queue.qsize() if _queue is not None else 0}
+
+    @staticmethod
+    def prometheus() -> str:
+        """This worker's writer only (one per process), labelled with its pid like SqlMetrics.prometheus."""
+        stats = AuditWriter.stats()
+        lines = []
+        for key, kind, help_text in [
+            ("written", "counter", "Audit log entries written"),
+            ("dropped", "counter", "Audit log entries dropped because the queue was full"),
+            ("failed", "counter", "Audit log entries lost to failed inserts"),
+            ("queued", "gauge", "Audit log entries waiting to be written"),
+        ]:
+            name = f"app_audit_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f'{name}{{pid="{os.getpid()}"}} {stats[key]}']
+        return "\n".join(lines) + "\n"
+
 
 async def log_action(
     db: AsyncSession,
@@ -18,7 +157,10 @@ async def log_action(
     description: str = None,
     request: Request = None,
 ) -> None:
-    """Insert an audit log row. Never raises — failures are silently ignored."""
+    """
+    Record an audit log entry (written asynchronously by AuditWriter; `db` is not used for it).
+    Never raises — failures are logged and ignored.
+    """
     try:
         ip = None
         ua = None
@@ -30,19 +172,17 @@ async def log_action(
             )
             ua = request.headers.get("user-agent")
 
-        entry = AuditLog(
-            user_id=current_user.id if current_user else None,
-            username=current_user.username if current_user else None,
-            full_name=current_user.full_name if current_user else None,
-            action=action,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            description=description,
-            ip_address=ip,
-            user_agent=ua,
-            created_at=datetime.utcnow(),
-        )
-        db.add(entry)
-        await db.commit()
+        await AuditWriter.enqueue({
+            "user_id": current_user.id if current_user else None,
+            "username": current_user.username if current_user else None,
+            "full_name": current_user.full_name if current_user else None,
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "description": description,
+            "ip_address": ip,
+            "user_agent": ua,
+            "created_at": datetime.utcnow(),
+        })
     except Exception:
-        pass  # Audit log must never break the main flow
+        logger.exception("Failed to record audit log entry")  # Audit log must never break the main flow
@@ -0,0 +1,347 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event, inspect, select, update, delete, func, extract, and_, or_, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.ledger import BonusLedger, LedgerType, BonusBalance, BonusBalanceCheckpoint
+
+BALANCE_FIELDS = (
+    "accrued", "paid_accrued", "offset_amount", "allocated",
+    "advance_amount", "payout_amount", "reversal_amount",
+)
+
+# (year, month); (0, 0) collects legacy rows without created_at
+Period = Tuple[int, int]
+
+
+def _empty() -> Dict[str, float]:
+    return {f: 0.0 for f in BALANCE_FIELDS}
+
+
+def _with_balance(totals: Dict[str, float]) -> Dict[str, float]:
+    """Usable balance, same definition as before: paid accruals minus offsets."""
+    return {**totals, "balance": totals["paid_accrued"] - totals["offset_amount"]}
+
+
+def _add_row(buckets: Dict[Period, Dict[str, float]], row, created: Period, paid: Period):
+    amount = float(row.amount or 0.0)
+    if row.ledger_type == LedgerType.ACCRUAL:
+        buckets[created]["accrued"] += amount
+        if row.is_paid:
+            buckets[paid]["paid_accrued"] += amount
+    elif row.ledger_type == LedgerType.OFFSET:
+        buckets[created]["offset_amount"] += amount
+        buckets[created]["allocated"] += float(row.abs_amount or 0.0)
+    elif row.ledger_type == LedgerType.ADVANCE:
+        buckets[created]["advance_amount"] += amount
+    elif row.ledger_type == LedgerType.PAYOUT:
+        buckets[created]["payout_amount"] += amount
+    elif row.ledger_type == LedgerType.REVERSAL:
+        buckets[created]["reversal_amount"] += amount
+
+
+def _monthly_query():
+    """Ledger movements per (user, category, type, paid flag, created month, paid month)."""
+    paid_at = func.coalesce(BonusLedger.paid_date, BonusLedger.created_at)
+    c_year = extract("year", BonusLedger.created_at).label("c_year")
+    c_month = extract("month", BonusLedger.created_at).label("c_month")
+    p_year = extract("year", paid_at).label("p_year")
+    p_month = extract("month", paid_at).label("p_month")
+    return select(
+        BonusLedger.user_id,
+        BonusLedger.ledger_category,
+        BonusLedger.ledger_type,
+        BonusLedger.is_paid,
+        c_year, c_month, p_year, p_month,
+        func.sum(BonusLedger.amount).label("amount"),
+        func.sum(func.abs(BonusLedger.amount)).label("abs_amount"),
+    ).where(BonusLedger.user_id.isnot(None)).group_by(
+        BonusLedger.user_id, BonusLedger.ledger_category, BonusLedger.ledger_type, BonusLedger.is_paid,
+        c_year, c_month, p_year, p_month
+    )
+
+
+def _period(year, month) -> Period:
+    return (int(year), int(month)) if year is not None else (0, 0)
+
+
+def _fold(rows) -> Dict[Tuple[int, str], Dict[Period, Dict[str, float]]]:
+    """(user_id, category) -> period -> movements booked in that month."""
+    result = defaultdict(lambda: defaultdict(_empty))
+    for row in rows:
+        buckets = result[(row.user_id, row.ledger_category)]
+        _add_row(buckets, row, _period(row.c_year, row.c_month), _period(row.p_year, row.p_month))
+    return result
+
+
+def _next_month(year: int, month: int) -> datetime:
+    return datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+
+class BonusBalanceService:
+    """
+    Maintains BonusBalance (current totals per MedRep + category) and BonusBalanceCheckpoint
+    (cumulative totals at each closed month end). ORM writes to BonusLedger are applied to BonusBalance
+    as deltas in the same flush (_track_ledger_writes), so writers do nothing; set-based writers
+    (bulk UPDATE / DELETE / INSERT ... SELECT) call `recompute` for the users they touched.
+    Checkpoints are written by `close_month` (scripts/close_bonus_month.py, monthly) and `rebuild`;
+    a write dated inside an already checkpointed month drops that user's checkpoints from there on.
+    """
+
+    @staticmethod
+    def _rows(folded, now: datetime):
+        """Snapshot and checkpoint values for every folded key."""
+        current = (now.year, now.month)
+        for key, buckets in folded.items():
+            running = _empty()
+            checkpoints = []
+            for period in sorted(buckets):
+                for f in BALANCE_FIELDS:
+                    running[f] += buckets[period][f]
+                if period != (0, 0) and period < current:
+                    checkpoints.append((period, _with_balance(dict(running))))
+            yield key, _with_balance(running), checkpoints
+
+    @staticmethod
+    async def recompute(db: AsyncSession, user_ids: Iterable[Optional[int]]):
+        """Recomputes the balances (all categories) and checkpoints of the given users from their whole ledger."""
+        user_ids = {uid for uid in user_ids if uid}
+        if not user_ids:
+            return
+
+        result = await db.execute(_monthly_query().where(BonusLedger.user_id.in_(user_ids)))
+        folded = _fold(result.all())
+
+        existing_res = await db.execute(
+            select(BonusBalance).where(BonusBalance.user_id.in_(user_ids)).with_for_update()
+        )
+        existing = {(b.user_id, b.ledger_category): b for b in existing_res.scalars().all()}
+        await db.execute(delete(BonusBalanceCheckpoint).where(BonusBalanceCheckpoint.user_id.in_(user_ids)))
+
+        now = datetime.utcnow()
+        for key, totals, checkpoints in BonusBalanceService._rows(folded, now):
+            row = existing.pop(key, None)
+            if not row:
+                row = BonusBalance(user_id=key[0], ledger_category=key[1])
+                db.add(row)
+            for f, value in totals.items():
+                setattr(row, f, value)
+            row.updated_at = now
+            db.add_all([
+                BonusBalanceCheckpoint(user_id=key[0], ledger_category=key[1], year=y, month=m, **values)
+                for (y, m), values in checkpoints
+            ])
+
+        # Categories whose ledger rows are all gone
+        for row in existing.values():
+            for f, value in _with_balance(_empty()).items():
+                setattr(row, f, value)
+            row.updated_at = now
+        await db.flush()
+
+    @staticmethod
+    async def close_month(db: AsyncSession, year: int, month: int) -> int:
+        """
+        Writes the year/month checkpoint of every balance: the previous checkpoint plus that month's
+        ledger rows (get_as_of), so it reads one month of ledger per balance. The caller commits.
+        """
+        keys = (await db.execute(select(BonusBalance.user_id, BonusBalance.ledger_category))).all()
+        await db.execute(delete(BonusBalanceCheckpoint).where(
+            BonusBalanceCheckpoint.year == year, BonusBalanceCheckpoint.month == month
+        ))
+        for user_id, category in keys:
+            totals = await BonusBalanceService.get_as_of(db, user_id, year, month, category)
+            db.add(BonusBalanceCheckpoint(
+                user_id=user_id, ledger_category=category, year=year, month=month,
+                **{f: totals[f] for f in BALANCE_FIELDS + ("balance",)}
+            ))
+        await db.flush()
+        return len(keys)
+
+    @staticmethod
+    async def rebuild(db: AsyncSession) -> int:
+        """Recomputes both tables for every MedRep with ledger rows. The caller commits."""
+        folded = _fold((await db.execute(_monthly_query())).all())
+        await db.execute(delete(BonusBalanceCheckpoint))
+        await db.execute(delete(BonusBalance))
+
+        now = datetime.utcnow()
+        for key, totals, checkpoints in BonusBalanceService._rows(folded, now):
+            db.add(BonusBalance(user_id=key[0], ledger_category=key[1], updated_at=now, **totals))
+            db.add_all([
+                BonusBalanceCheckpoint(user_id=key[0], ledger_category=key[1], year=y, month=m, **values)
+                for (y, m), values in checkpoints
+            ])
+        await db.flush()
+        return len(folded)
+
+    @staticmethod
+    async def get(db: AsyncSession, user_id: int, category: str = "bonus") -> Dict[str, float]:
+        """Current totals (BALANCE_FIELDS + balance); zeros if the user has no ledger rows."""
+        row = await db.get(BonusBalance, (user_id, category))
+        if not row:
+            return _with_balance(_empty())
+        return {f: getattr(row, f) for f in BALANCE_FIELDS + ("balance",)}
+
+    @staticmethod
+    async def get_as_of(db: AsyncSession, user_id: int, year: int, month: int, category: str = "bonus") -> Dict[str, float]:
+        """Totals at the end of year/month: nearest checkpoint at or before it plus the ledger rows after it."""
+        cp = (await db.execute(
+            select(BonusBalanceCheckpoint).where(
+                BonusBalanceCheckpoint.user_id == user_id,
+                BonusBalanceCheckpoint.ledger_category == category,
+                tuple_(BonusBalanceCheckpoint.year, BonusBalanceCheckpoint.month) <= (year, month)
+            ).order_by(BonusBalanceCheckpoint.year.desc(), BonusBalanceCheckpoint.month.desc()).limit(1)
+        )).scalar_one_or_none()
+
+        totals = {f: getattr(cp, f) for f in BALANCE_FIELDS} if cp else _empty()
+        start = _next_month(cp.year, cp.month) if cp else None
+        end = _next_month(year, month)
+        if start is not None and start >= end:
+            return _with_balance(totals)
+
+        paid_at = func.coalesce(BonusLedger.paid_date, BonusLedger.created_at)
+        created_in = BonusLedger.created_at < end
+        paid_in = paid_at < end
+        if start is not None:
+            created_in = and_(BonusLedger.created_at >= start, created_in)
+            paid_in = and_(paid_at >= start, paid_in)
+        else:
+            created_in = or_(BonusLedger.created_at.is_(None), created_in)
+        rows = (await db.execute(
+            _monthly_query().where(
+                BonusLedger.user_id == user_id,
+                BonusLedger.ledger_category == category,
+                or_(created_in, paid_in)
+            )
+        )).all()
+
+        # Rows are bucketed by month; keep only the movements that fall after the checkpoint
+        start_period = (start.year, start.month) if start else (0, 0)
+        end_period = (year, month)
+        buckets = defaultdict(_empty)
+        for row in rows:
+            _add_row(buckets, row, _period(row.c_year, row.c_month), _period(row.p_year, row.p_month))
+        for period, values in buckets.items():
+            if start_period <= period <= end_period or (start is None and period == (0, 0)):
+                for f in BALANCE_FIELDS:
+                    totals[f] += values[f]
+        return _with_balance(totals)
+
+
+# ── Write-driven deltas ─────────────────────────────────────────────────────
+# Every flush that adds, changes or deletes BonusLedger rows through the ORM moves the affected
+# BonusBalance rows by the difference (UPDATE ... SET x = x + delta), on the flush's own connection.
+
+_LedgerState = namedtuple("_LedgerState", "user_id ledger_category ledger_type amount abs_amount is_paid created_at paid_date")
+_LEDGER_ATTRS = ("user_id", "ledger_category", "ledger_type", "amount", "is_paid", "created_at", "paid_date")
+
+
+def _ledger_state(obj, before: bool) -> Optional[_LedgerState]:
+    """The row as it was before the flush (`before`) or as flushed; None for non-MedRep rows."""
+    attrs = inspect(obj).attrs
+    values = {}
+    for name in _LEDGER_ATTRS:
+        history = attrs[name].history
+        if before:
+            values[name] = history.deleted[0] if history.deleted else (history.unchanged or [None])[0]
+        else:
+            values[name] = history.added[0] if history.added else (history.unchanged or [None])[0]
+    if not values["user_id"]:
+        return None
+    amount = float(values["amount"] or 0.0)
+    return _LedgerState(
+        user_id=values["user_id"],
+        ledger_category=values["ledger_category"] or "bonus",
+        ledger_type=values["ledger_type"] or LedgerType.ACCRUAL,
+        amount=amount,
+        abs_amount=abs(amount),
+        is_paid=bool(values["is_paid"]),
+        created_at=values["created_at"],
+        paid_date=values["paid_date"],
+    )
+
+
+def _add_state(movements, state: Optional[_LedgerState], sign: int):
+    """Adds (sign = 1) or takes back (sign = -1) a row's movements, per (user, category) and month."""
+    if state is None:
+        return
+    # Same months as _monthly_query: paid month falls back to the created month, (0, 0) without created_at
+    created = (state.created_at.year, state.created_at.month) if state.created_at else (0, 0)
+    paid = (state.paid_date.year, state.paid_date.month) if state.paid_date else created
+    buckets = movements[(state.user_id, state.ledger_category)]
+    row = defaultdict(_empty)
+    _add_row(row, state, created, paid)
+    for period, values in row.items():
+        for f in BALANCE_FIELDS:
+            buckets[period][f] += sign * values[f]
+
+
+def _changed(values: Dict[str, float]) -> bool:
+    return any(abs(v) > 1e-9 for v in values.values())
+
+
+def _apply_deltas(conn, movements, now: datetime):
+    from app.db.session import dialect_insert
+    current = (now.year, now.month)
+    for (user_id, category), buckets in movements.items():
+        d = _empty()
+        for values in buckets.values():
+            for f in BALANCE_FIELDS:
+                d[f] += values[f]
+        # Checkpoints at or after a closed month that moved are no longer right
+        stale = [period for period, values in buckets.items() if period < current and _changed(values)]
+        if stale:
+            conn.execute(delete(BonusBalanceCheckpoint).where(
+                BonusBalanceCheckpoint.user_id == user_id,
+                BonusBalanceCheckpoint.ledger_category == category,
+                tuple_(BonusBalanceCheckpoint.year, BonusBalanceCheckpoint.month) >= min(stale),
+            ))
+        if not _changed(d):
+            continue
+        increments = {f: getattr(BonusBalance, f) + d[f] for f in BALANCE_FIELDS}
+        increments["balance"] = BonusBalance.balance + (d["paid_accrued"] - d["offset_amount"])
+        increments["updated_at"] = now
+        result = conn.execute(
+            update(BonusBalance)
+            .where(BonusBalance.user_id == user_id, BonusBalance.ledger_category == category)
+            .values(**increments)
+        )
+        if result.rowcount:
+            continue
+        # No balance row yet: start from the whole ledger (already including this flush)
+        totals = _empty()
+        rows = conn.execute(_monthly_query().where(
+            BonusLedger.user_id == user_id, BonusLedger.ledger_category == category
+        )).all()
+        for ledger_buckets in _fold(rows).values():
+            for values in ledger_buckets.values():
+                for f in BALANCE_FIELDS:
+                    totals[f] += values[f]
+        conn.execute(
+            dialect_insert(conn, BonusBalance)
+            .values(user_id=user_id, ledger_category=category, updated_at=now, **_with_balance(totals))
+            # Created concurrently from a ledger without this flush's rows: add the delta instead
+            .on_conflict_do_update(index_elements=["user_id", "ledger_category"], set_=increments)
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_ledger_writes(session, flush_context):
+    now = datetime.utcnow()
+    movements = defaultdict(lambda: defaultdict(_empty))
+    for obj in session.new:
+        if isinstance(obj, BonusLedger):
+            _add_state(movements, _ledger_state(obj, before=False), 1)
+    for obj in session.dirty:
+        if isinstance(obj, BonusLedger) and session.is_modified(obj, include_collections=False):
+            _add_state(movements, _ledger_state(obj, before=True), -1)
+            _add_state(movements, _ledger_state(obj, before=False), 1)
+    for obj in session.deleted:
+        if isinstance(obj, BonusLedger):
+            _add_state(movements, _ledger_state(obj, before=True), -1)
+    if movements:
+        _apply_deltas(session.connection(), movements, now)
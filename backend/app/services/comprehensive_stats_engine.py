@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, or_, case, exists, literal, true
+
+from app.models.user import User
+from app.models.sales import Invoice, Reservation, ReservationItem, InvoiceStatus
+from app.models.crm import MedicalOrganization
+from app.models.product import Product
+
+
+class ComprehensiveStatsEngine:
+    """
+    Single-pass query builder for /stats/comprehensive.
+
+    The filtered invoice set (team / region / product scope, limited to the invoices of the period
+    plus the older ones that can still be overdue) is computed once as a CTE.
+    Every invoice and item level KPI (shipments, receivables, overdue, items sold,
+    gross / potential profit, salary accrued / realized) is derived from it with CASE
+    predicates in one statement, instead of ~10 queries re-joining the same tables.
+    """
+
+    DEBT_STATUSES = [InvoiceStatus.UNPAID, InvoiceStatus.PARTIAL, InvoiceStatus.APPROVED]
+    OVERDUE_DAYS = 30
+
+    def __init__(
+        self,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        rep_ids: Optional[List[int]] = None,
+        region_id: Optional[int] = None,
+        product_id: Optional[int] = None,
+    ):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.rep_ids = rep_ids
+        self.region_id = region_id
+        self.product_id = product_id
+        self.overdue_date = datetime.utcnow() - timedelta(days=self.OVERDUE_DAYS)
+
+    def invoice_cte(self):
+        """
+        Invoices in the team / region / product scope that any KPI reads: those of the period and,
+        for overdue receivables (which span all periods), older ones still owing more than 1.
+        The CTE is read twice, so PostgreSQL materialises it: the date filter must be inside.
+        """
+        if self.start_date and self.end_date:
+            in_period = and_(Invoice.date >= self.start_date, Invoice.date < self.end_date)
+        else:
+            in_period = literal(True)
+        overdue = and_(
+            Invoice.total_amount - Invoice.paid_amount > 1.0,
+            func.coalesce(Invoice.realization_date, Invoice.date) < self.overdue_date,
+        )
+
+        q = select(
+            Invoice.id.label("invoice_id"),
+            Invoice.reservation_id,
+            Invoice.total_amount,
+            Invoice.paid_amount,
+            Invoice.status,
+            func.coalesce(Invoice.realization_date, Invoice.date).label("realized_at"),
+            Reservation.is_salary_enabled,
+            Reservation.is_bonus_eligible,
+            case((in_period, True), else_=False).label("in_period"),
+        ).select_from(Invoice).outerjoin(Reservation, Invoice.reservation_id == Reservation.id)
+        if self.start_date and self.end_date:
+            q = q.where(or_(in_period, overdue))
+
+        if self.rep_ids or self.region_id:
+            q = q.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id)
+        if self.rep_ids:
+            q = q.where(or_(
+                Reservation.created_by_id.in_(self.rep_ids),
+                MedicalOrganization.assigned_reps.any(User.id.in_(self.rep_ids))
+            ))
+        if self.region_id:
+            q = q.where(MedicalOrganization.region_id == self.region_id)
+        if self.product_id:
+            q = q.where(exists().where(
+                ReservationItem.reservation_id == Reservation.id,
+                ReservationItem.product_id == self.product_id
+            ))
+        return q.cte("scoped_invoices")
+
+    def kpi_query(self):
+        inv = self.invoice_cte()
+        not_cancelled = inv.c.status != InvoiceStatus.CANCELLED
+        period = and_(inv.c.in_period == True, not_cancelled)
+        outstanding = inv.c.total_amount - inv.c.paid_amount
+
+        invoice_agg = select(
+            func.coalesce(func.sum(case((period, inv.c.total_amount), else_=0.0)), 0.0).label("total_invoice_sum"),
+            func.coalesce(func.sum(case((period, inv.c.paid_amount), else_=0.0)), 0.0).label("paid_invoice_sum"),
+            func.coalesce(func.sum(case(
+                (and_(inv.c.in_period == True, inv.c.status.in_(self.DEBT_STATUSES)), outstanding), else_=0.0
+            )), 0.0).label("debt_sum"),
+            func.coalesce(func.sum(case(
+                (and_(outstanding > 1.0, inv.c.realized_at < self.overdue_date), outstanding), else_=0.0
+            )), 0.0).label("overdue_receivables"),
+        ).select_from(inv).subquery("invoice_agg")
+
+        # Item level: only invoices of the period
+        has_total = inv.c.total_amount > 0
+        paid_ratio = func.coalesce(inv.c.paid_amount, 0) / inv.c.total_amount
+        unit_profit = (
+            ReservationItem.price * (1 - func.coalesce(ReservationItem.discount_percent, 0) / 100.0) -
+            func.coalesce(Product.production_price, 0) -
+            case((inv.c.is_salary_enabled == False, 0), (ReservationItem.salary_amount > 0, ReservationItem.salary_amount), else_=func.coalesce(Product.salary_expense, 0)) -
+            case((inv.c.is_bonus_eligible == False, 0), (ReservationItem.marketing_amount > 0, ReservationItem.marketing_amount), else_=func.coalesce(Product.marketing_expense, 0)) -
+            func.coalesce(Product.other_expenses, 0)
+        )
+        salary_line = ReservationItem.salary_amount * ReservationItem.quantity
+        salary_enabled = inv.c.is_salary_enabled == True
+
+        item_q = select(
+            func.coalesce(func.sum(case((has_total, unit_profit * ReservationItem.quantity * paid_ratio), else_=0.0)), 0.0).label("gross_profit_sum"),
+            func.coalesce(func.sum(case((has_total, unit_profit * ReservationItem.quantity), else_=0.0)), 0.0).label("potential_profit_sum"),
+            func.coalesce(func.sum(ReservationItem.quantity), 0).label("total_items_sold"),
+            func.coalesce(func.sum(case((salary_enabled, salary_line), else_=0.0)), 0.0).label("salary_accrued"),
+            func.coalesce(func.sum(case((and_(salary_enabled, has_total), salary_line * paid_ratio), else_=0.0)), 0.0).label("salary_paid"),
+        ).select_from(inv)\
+         .join(ReservationItem, ReservationItem.reservation_id == inv.c.reservation_id)\
+         .join(Product, ReservationItem.product_id == Product.id)\
+         .where(period)
+        if self.product_id:
+            item_q = item_q.where(ReservationItem.product_id == self.product_id)
+        item_agg = item_q.subquery("item_agg")
+
+        # Both sides are single-row aggregates; one round-trip, one scan of the CTE
+        return select(invoice_agg, item_agg).select_from(invoice_agg.join(item_agg, true()))
+
+    async def fetch(self, db: AsyncSession) -> Dict[str, float]:
+        row = (await db.execute(self.kpi_query())).mappings().first() or {}
+        return {
+            "total_invoice_sum": float(row.get("total_invoice_sum") or 0.0),
+            "paid_invoice_sum": float(row.get("paid_invoice_sum") or 0.0),
+            "debt_sum": float(row.get("debt_sum") or 0.0),
+            "overdue_receivables": round(float(row.get("overdue_receivables") or 0.0), 2),
+            "gross_profit_sum": float(row.get("gross_profit_sum") or 0.0),
+            "potential_profit_sum": float(row.get("potential_profit_sum") or 0.0),
+            "total_items_sold": int(row.get("total_items_sold") or 0),
+            "salary_accrued": float(row.get("salary_accrued") or 0.0),
+            "salary_paid": float(row.get("salary_paid") or 0.0),
+        }
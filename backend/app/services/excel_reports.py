@@ -0,0 +1,495 @@
+"""
+Workbook renderers for the heavy Excel reports.
+
+Each `render_*` function takes a plain, picklable payload (collected from the DB by the
+endpoint) and writes an .xlsx file to `path`. They import nothing from the app, so they
+can run in the export process pool without touching the event loop.
+"""
+import json
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
+from openpyxl.utils import get_column_letter
+
+
+def render_director_report(payload: dict, path: str) -> str:
+    """
+    Director Excel report: Product Manager → Regional Manager → MedRep
+    Columns: per-product Plan(qty), Fact(qty), Fact(sum) + totals
+    """
+    month = payload["month"]
+    year = payload["year"]
+    products = payload["products"]
+    prod_count = len(products)
+    hierarchy = payload["hierarchy"]
+    plan_map = payload["plan_map"]
+    fact_map = payload["fact_map"]
+    org_plan_map = payload["org_plan_map"]
+    org_fact_map = payload["org_fact_map"]
+    org_metadata = payload["org_metadata"]
+    medrep_orgs = payload["medrep_orgs"]
+
+    # ── Build Excel ──────────────────────────────────────────────────────────
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"Отчет {month}-{year}"
+
+    # Styles
+    C_BLUE   = "1E3A5F";  C_BLUE_L  = "BDD7EE"
+    C_GREEN  = "375623";  C_GREEN_L = "E2EFDA"
+    C_GREY   = "404040";  C_GREY_L  = "F2F2F2"
+    C_YELLOW = "7F6000";  C_YELLOW_L= "FFEB9C"
+    C_WHITE  = "FFFFFF"
+
+    def fill(hex_color):
+        return PatternFill(start_color=hex_color, end_color=hex_color, fill_type="solid")
+
+    def font(bold=False, color=C_WHITE, size=9):
+        return Font(bold=bold, color=color, size=size)
+
+    thin  = Side(style="thin",   color="999999")
+    thick = Side(style="medium", color="555555")
+    def border(left=thin, right=thin, top=thin, bottom=thin):
+        return Border(left=left, right=right, top=top, bottom=bottom)
+
+    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    left   = Alignment(horizontal="left",   vertical="center")
+    right_a= Alignment(horizontal="right",  vertical="center")
+    vert   = Alignment(text_rotation=90, horizontal="center", vertical="center")
+
+    # ── Header row 1: static cols + per-product groups ─────────────────────────
+    STATIC_COLS = ["Продукт Менеджер", "Рег. Менеджер / МП", "Контрагент", "Регион"]
+    S = len(STATIC_COLS)  # number of static columns = 4
+
+    # Static header cells (merge 3 rows)
+    for ci, h in enumerate(STATIC_COLS, 1):
+        ws.merge_cells(start_row=1, start_column=ci, end_row=3, end_column=ci)
+        cell = ws.cell(row=1, column=ci, value=h)
+        cell.font      = font(bold=True, color=C_WHITE)
+        cell.fill      = fill(C_BLUE)
+        cell.alignment = vert
+        cell.border    = border()
+
+    # Per-product group headers (3 cols each: plan_qty, fact_qty, fact_sum)
+    COLS_PER_PROD = 3
+    for pi, prod in enumerate(products):
+        start_col = S + 1 + pi * COLS_PER_PROD
+        end_col   = start_col + COLS_PER_PROD - 1
+
+        # Row 1: product name (merge 3 cols)
+        ws.merge_cells(start_row=1, start_column=start_col, end_row=1, end_column=end_col)
+        c = ws.cell(row=1, column=start_col, value=prod["name"])
+        c.font = font(bold=True, color=C_WHITE); c.fill = fill(C_GREEN); c.alignment = center; c.border = border()
+
+        # Row 2: sub-labels
+        sub_labels = ["План (дон.)", "Факт (дон.)", "Факт (сум)"]
+        for si, lbl in enumerate(sub_labels):
+            c2 = ws.cell(row=2, column=start_col + si, value=lbl)
+            c2.font = font(bold=True, color=C_GREEN); c2.fill = fill(C_GREEN_L)
+            c2.alignment = center; c2.border = border()
+
+        # Row 3: % выполнения (colspan 3)
+        ws.merge_cells(start_row=3, start_column=start_col, end_row=3, end_column=end_col)
+        c3 = ws.cell(row=3, column=start_col, value="% выполнения")
+        c3.font = font(bold=False, color=C_GREEN); c3.fill = fill(C_GREEN_L)
+        c3.alignment = center; c3.border = border()
+
+    # Totals columns (after all products): total plan qty, total fact qty, total fact sum
+    tc_start = S + 1 + prod_count * COLS_PER_PROD
+    ws.merge_cells(start_row=1, start_column=tc_start, end_row=1, end_column=tc_start + 2)
+    c = ws.cell(row=1, column=tc_start, value="ИТОГО")
+    c.font = font(bold=True); c.fill = fill(C_GREY); c.alignment = center; c.border = border()
+    for si, lbl in enumerate(["План (дон.)", "Факт (дон.)", "Факт (сум)"]):
+        c2 = ws.cell(row=2, column=tc_start + si, value=lbl)
+        c2.font = font(bold=True, color=C_GREY); c2.fill = fill(C_GREY_L); c2.alignment = center; c2.border = border()
+    ws.merge_cells(start_row=3, start_column=tc_start, end_row=3, end_column=tc_start + 2)
+    c3 = ws.cell(row=3, column=tc_start, value="% выполнения")
+    c3.font = font(bold=False, color=C_GREY); c3.fill = fill(C_GREY_L); c3.alignment = center; c3.border = border()
+
+    ws.row_dimensions[1].height = 40
+    ws.row_dimensions[2].height = 28
+    ws.row_dimensions[3].height = 18
+
+    # ── Data rows ───────────────────────────────────────────────────────────────
+    def pct(plan_q, fact_q):
+        if not plan_q: return "—"
+        return f"{round(fact_q / plan_q * 100)}%"
+
+    current_row = 4
+
+    for pm_name in sorted(hierarchy.keys()):
+        rm_dict = hierarchy[pm_name]
+
+        # Accumulators for PM summary row
+        pm_plan_tot = 0; pm_fact_qty_tot = 0; pm_fact_sum_tot = 0
+        pm_per_prod_plan = [0]*prod_count
+        pm_per_prod_fqty = [0]*prod_count
+        pm_per_prod_fsum = [0.0]*prod_count
+
+        pm_row_idx = current_row  # we'll fill it after writing RM/MR rows
+        current_row += 1  # reserve PM row
+
+        for rm_name in sorted(rm_dict.keys()):
+            mr_list = rm_dict[rm_name]
+
+            rm_plan_tot = 0; rm_fact_qty_tot = 0; rm_fact_sum_tot = 0
+            rm_per_prod_plan = [0]*prod_count
+            rm_per_prod_fqty = [0]*prod_count
+            rm_per_prod_fsum = [0.0]*prod_count
+
+            rm_row_idx = current_row
+            current_row += 1  # reserve RM row
+
+            for mr in mr_list:
+                mr_row = current_row
+                current_row += 1
+
+                # MedRep summary row static cells (include MedRep's base regions)
+                mr_reg_txt = mr["regions"]
+                for ci, val in enumerate(["", f"    {mr['name']}", "ИТОГО ПО МП", mr_reg_txt], 1):
+                    c = ws.cell(row=mr_row, column=ci, value=val)
+                    c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
+                    c.alignment = left; c.border = border()
+
+                mr_plan_tot = 0; mr_fact_qty_tot = 0; mr_fact_sum_tot = 0
+
+                for pi, prod in enumerate(products):
+                    plan_q, _ = plan_map.get((mr["id"], prod["id"]), (0, 0))
+                    fact_q, fact_s = fact_map.get((mr["id"], prod["id"]), (0, 0.0))
+                    col_base = S + 1 + pi * COLS_PER_PROD
+
+                    for si, (val, fmt) in enumerate([(plan_q, None), (fact_q, None), (fact_s, '#,##0')]):
+                        c = ws.cell(row=mr_row, column=col_base + si, value=val)
+                        c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
+                        c.alignment = right_a; c.border = border()
+                        if fmt: c.number_format = fmt
+
+                    mr_plan_tot      += plan_q
+                    mr_fact_qty_tot  += fact_q
+                    mr_fact_sum_tot  += fact_s
+                    rm_per_prod_plan[pi] += plan_q
+                    rm_per_prod_fqty[pi] += fact_q
+                    rm_per_prod_fsum[pi] += fact_s
+
+                # MedRep totals
+                tc = S + 1 + prod_count * COLS_PER_PROD
+                for si, val in enumerate([mr_plan_tot, mr_fact_qty_tot, mr_fact_sum_tot]):
+                    c = ws.cell(row=mr_row, column=tc + si, value=val)
+                    c.fill = fill(C_GREY_L); c.font = font(bold=True, color="000000")
+                    c.alignment = right_a; c.border = border()
+                    if si == 2: c.number_format = '#,##0'
+
+                rm_plan_tot     += mr_plan_tot
+                rm_fact_qty_tot += mr_fact_qty_tot
+                rm_fact_sum_tot += mr_fact_sum_tot
+                
+                # ── Org sub-rows breakdown ──
+                sorted_org_keys = sorted(list(medrep_orgs.get(mr["id"], ())), key=lambda k: org_metadata[k]["name"])
+                for okey in sorted_org_keys:
+                    org_row = current_row
+                    current_row += 1
+                    meta = org_metadata[okey]
+                    
+                    for ci, val in enumerate(["", "", f"        {meta['name']}", meta['region']], 1):
+                        c = ws.cell(row=org_row, column=ci, value=val)
+                        c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
+                        c.alignment = left; c.border = border()
+                        
+                    o_p_tot = 0; o_fq_tot = 0; o_fs_tot = 0
+                    for pi, prod in enumerate(products):
+                        opq, _ = org_plan_map.get((mr["id"], okey, prod["id"]), (0, 0))
+                        ofq, ofs = org_fact_map.get((mr["id"], okey, prod["id"]), (0, 0.0))
+                        col_base = S + 1 + pi * COLS_PER_PROD
+                        
+                        for si, (val, fmt) in enumerate([(opq, None), (ofq, None), (ofs, '#,##0')]):
+                            c = ws.cell(row=org_row, column=col_base + si, value=val)
+                            c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
+                            c.alignment = right_a; c.border = border()
+                            if fmt: c.number_format = fmt
+                            
+                        o_p_tot += opq; o_fq_tot += ofq; o_fs_tot += ofs
+                    
+                    tc = S + 1 + prod_count * COLS_PER_PROD
+                    for si, val in enumerate([o_p_tot, o_fq_tot, o_fs_tot]):
+                        c = ws.cell(row=org_row, column=tc + si, value=val)
+                        c.fill = fill(C_WHITE); c.font = font(bold=False, color="333333")
+                        c.alignment = right_a; c.border = border()
+                        if si == 2: c.number_format = '#,##0'
+
+            # ── RM summary row ──────────────────────────────────────────────
+            for ci, val in enumerate(["", f"  RM: {rm_name}", "", ""], 1):
+                c = ws.cell(row=rm_row_idx, column=ci, value=val)
+                c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
+                c.alignment = left; c.border = border(bottom=thick)
+
+            for pi in range(prod_count):
+                col_base = S + 1 + pi * COLS_PER_PROD
+                for si, val in enumerate([rm_per_prod_plan[pi], rm_per_prod_fqty[pi], rm_per_prod_fsum[pi]]):
+                    c = ws.cell(row=rm_row_idx, column=col_base + si, value=val)
+                    c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
+                    c.alignment = right_a; c.border = border(bottom=thick)
+                    if si == 2: c.number_format = '#,##0'
+
+            tc = S + 1 + prod_count * COLS_PER_PROD
+            for si, val in enumerate([rm_plan_tot, rm_fact_qty_tot, rm_fact_sum_tot]):
+                c = ws.cell(row=rm_row_idx, column=tc + si, value=val)
+                c.fill = fill(C_BLUE_L); c.font = font(bold=True, color=C_BLUE)
+                c.alignment = right_a; c.border = border(bottom=thick)
+                if si == 2: c.number_format = '#,##0'
+
+            pm_plan_tot     += rm_plan_tot
+            pm_fact_qty_tot += rm_fact_qty_tot
+            pm_fact_sum_tot += rm_fact_sum_tot
+            for pi in range(prod_count):
+                pm_per_prod_plan[pi] += rm_per_prod_plan[pi]
+                pm_per_prod_fqty[pi] += rm_per_prod_fqty[pi]
+                pm_per_prod_fsum[pi] += rm_per_prod_fsum[pi]
+
+        # ── PM summary row ──────────────────────────────────────────────────
+        for ci, val in enumerate([f"PM: {pm_name}", "", "", ""], 1):
+            c = ws.cell(row=pm_row_idx, column=ci, value=val)
+            c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
+            c.alignment = left; c.border = border(top=thick, bottom=thick)
+
+        for pi in range(prod_count):
+            col_base = S + 1 + pi * COLS_PER_PROD
+            pq = pm_per_prod_plan[pi]; fq = pm_per_prod_fqty[pi]; fs = pm_per_prod_fsum[pi]
+            for si, val in enumerate([pq, fq, fs]):
+                c = ws.cell(row=pm_row_idx, column=col_base + si, value=val)
+                c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
+                c.alignment = right_a; c.border = border(top=thick, bottom=thick)
+                if si == 2: c.number_format = '#,##0'
+
+        tc = S + 1 + prod_count * COLS_PER_PROD
+        for si, val in enumerate([pm_plan_tot, pm_fact_qty_tot, pm_fact_sum_tot]):
+            c = ws.cell(row=pm_row_idx, column=tc + si, value=val)
+            c.fill = fill(C_BLUE); c.font = font(bold=True, color=C_WHITE)
+            c.alignment = right_a; c.border = border(top=thick, bottom=thick)
+            if si == 2: c.number_format = '#,##0'
+
+    # ── Grand total row ─────────────────────────────────────────────────────────
+    grand_plan = sum(plan_map[k][0] for k in plan_map)
+    grand_fqty = sum(v[0] for v in fact_map.values())
+    grand_fsum = sum(v[1] for v in fact_map.values())
+
+    gt_row = current_row
+    for ci, val in enumerate(["ЖAMI / ИТОГО", "", "", ""], 1):
+        c = ws.cell(row=gt_row, column=ci, value=val)
+        c.fill = fill(C_YELLOW); c.font = font(bold=True, color=C_YELLOW)
+        c.alignment = left; c.border = border(top=thick)
+
+    for pi, prod in enumerate(products):
+        col_base = S + 1 + pi * COLS_PER_PROD
+        pq = sum(plan_map.get((mr["id"], prod["id"]), (0,0))[0] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
+        fq = sum(fact_map.get((mr["id"], prod["id"]), (0,0))[0] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
+        fs = sum(fact_map.get((mr["id"], prod["id"]), (0,0.0))[1] for pm in hierarchy for rm in hierarchy[pm] for mr in hierarchy[pm][rm])
+        for si, val in enumerate([pq, fq, fs]):
+            c = ws.cell(row=gt_row, column=col_base + si, value=val)
+            c.fill = fill(C_YELLOW_L); c.font = font(bold=True, color=C_YELLOW)
+            c.alignment = right_a; c.border = border(top=thick)
+            if si == 2: c.number_format = '#,##0'
+
+    tc = S + 1 + prod_count * COLS_PER_PROD
+    for si, val in enumerate([grand_plan, grand_fqty, grand_fsum]):
+        c = ws.cell(row=gt_row, column=tc + si, value=val)
+        c.fill = fill(C_YELLOW_L); c.font = font(bold=True, color=C_YELLOW)
+        c.alignment = right_a; c.border = border(top=thick)
+        if si == 2: c.number_format = '#,##0'
+
+    # ── Column widths ───────────────────────────────────────────────────────────
+    ws.column_dimensions[get_column_letter(1)].width = 22  # PM
+    ws.column_dimensions[get_column_letter(2)].width = 26  # RM/MR name
+    ws.column_dimensions[get_column_letter(3)].width = 28  # Counteragent
+    ws.column_dimensions[get_column_letter(4)].width = 16  # Region
+    total_cols = S + prod_count * COLS_PER_PROD + 3
+    for ci in range(S + 1, total_cols + 1):
+        ws.column_dimensions[get_column_letter(ci)].width = 12
+
+    ws.freeze_panes = "A4"
+
+    wb.save(path)
+    return path
+
+
+def render_drilldown_export(payload: dict, path: str) -> str:
+    """
+    Drilldown export. Rows are read line by line from the JSONL file at `payload["rows_path"]`
+    (one list of already formatted cell values per line) and written through a write-only sheet,
+    so memory does not grow with the number of rows.
+    """
+    headers = payload["headers"]
+    money_columns = set(payload["money_columns"])
+    widths = payload["widths"]
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title="Export")
+
+    header_fill = PatternFill(start_color="4F46E5", end_color="4F46E5", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF")
+    thin_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    row_fills = [
+        PatternFill(start_color="F8F9FF", end_color="F8F9FF", fill_type="solid"),
+        PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid"),
+    ]
+    align_right = Alignment(horizontal="right", vertical="center")
+    align_left = Alignment(horizontal="left", vertical="center")
+
+    # Write-only sheets can't be autofit afterwards: widths come precomputed with the payload
+    for col_idx, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+
+    ws.row_dimensions[1].height = 22
+    header_cells = []
+    for label in headers:
+        cell = WriteOnlyCell(ws, value=label)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+        cell.border = thin_border
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    with open(payload["rows_path"], "r", encoding="utf-8") as rows_file:
+        for row_idx, line in enumerate(rows_file, 2):
+            row_fill = row_fills[row_idx % 2]
+            cells = []
+            for col_idx, val in enumerate(json.loads(line)):
+                cell = WriteOnlyCell(ws, value=val)
+                cell.border = thin_border
+                cell.fill = row_fill
+                if isinstance(val, (int, float)):
+                    cell.alignment = align_right
+                    if col_idx in money_columns:
+                        cell.number_format = '#,##0.00'
+                else:
+                    cell.alignment = align_left
+                cells.append(cell)
+            ws.append(cells)
+
+    wb.save(path)
+    return path
+
+
+def render_reservation_invoice(payload: dict, path: str) -> str:
+    """Single reservation «Фактура» sheet with bonuses, line items and discount / NDS totals."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Фактура"
+    
+    # Yellow fill
+    fill_yellow = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    fill_blue = PatternFill(start_color="B4C6E7", end_color="B4C6E7", fill_type="solid")
+    fill_pink = PatternFill(start_color="E6B8B7", end_color="E6B8B7", fill_type="solid")
+    
+    font_bold = Font(bold=True)
+    border_thin = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+    # 1. Харажатлардан кейин Фойда/Зарар (Shifting to column 4 - Column D)
+    ws.cell(row=1, column=4, value="Харажатлардан кейин Фойда/Зарар").font = font_bold
+    ws.cell(row=2, column=4, value="Клинт бонуси")
+    ws.cell(row=2, column=5, value=payload["total_client_bonus"]).fill = fill_yellow
+    ws.cell(row=3, column=4, value="Менеджерлар бонуси")
+    ws.cell(row=4, column=4, value="Прямой").font = font_bold
+    ws.cell(row=4, column=5, value=payload["total_manager_bonus"]).fill = fill_yellow
+    ws.cell(row=5, column=4, value="Доставка")
+    ws.cell(row=5, column=5).fill = fill_yellow
+    
+    ws.cell(row=6, column=4, value="КОРХОНА НОМИ").fill = fill_blue
+    ws.cell(row=6, column=5, value=payload["org_name"]).fill = fill_blue
+    ws.merge_cells(start_row=6, start_column=5, end_row=6, end_column=8)
+    
+    ws.cell(row=7, column=4, value="ИНН").fill = fill_blue
+    ws.cell(row=7, column=5, value=payload["org_inn"]).fill = fill_blue
+    ws.merge_cells(start_row=7, start_column=5, end_row=7, end_column=8)
+    
+    headers = ["№", "Наименование", "Кол-во", "Цена", "Завода келишилган", "Сумма"]
+    for i, header in enumerate(headers):
+        col_idx = i + 3 # Start from C
+        cell = ws.cell(row=8, column=col_idx, value=header)
+        cell.border = border_thin
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        if col_idx == 7: # "Завода келишилган"
+            cell.fill = fill_pink
+        else:
+            cell.fill = fill_blue
+        
+    # Column widths (Shifting A->C, B->D, etc.)
+    ws.column_dimensions['C'].width = 5
+    ws.column_dimensions['D'].width = 40
+    ws.column_dimensions['E'].width = 10
+    ws.column_dimensions['F'].width = 15
+    ws.column_dimensions['G'].width = 20
+    ws.column_dimensions['H'].width = 15
+    
+    subtotal_plain = 0.0
+    row_idx = 9
+    for item in payload["items"]:
+        actual_qty = item["qty"]
+        item_price = item["price"]
+        # Plain amount for the row (qty * price)
+        plain_amount = actual_qty * item_price
+        subtotal_plain += plain_amount
+        
+        ws.cell(row=row_idx, column=3, value=item["idx"]).border = border_thin
+        
+        cell_name = ws.cell(row=row_idx, column=4, value=item["name"])
+        cell_name.border = border_thin
+        cell_name.fill = fill_yellow
+        
+        cell_qty = ws.cell(row=row_idx, column=5, value=actual_qty)
+        cell_qty.border = border_thin
+        cell_qty.fill = fill_yellow
+        cell_qty.alignment = Alignment(horizontal='center')
+        
+        cell_price = ws.cell(row=row_idx, column=6, value=item_price)
+        cell_price.border = border_thin
+        cell_price.fill = fill_yellow
+        cell_price.alignment = Alignment(horizontal='center')
+        
+        # Завода келишилган (production price)
+        cell_prod = ws.cell(row=row_idx, column=7, value=item["production_price"])
+        cell_prod.border = border_thin
+        cell_prod.fill = fill_pink
+        cell_prod.alignment = Alignment(horizontal='center')
+        
+        cell_sum = ws.cell(row=row_idx, column=8, value=plain_amount)
+        cell_sum.border = border_thin
+        cell_sum.fill = fill_yellow
+        cell_sum.alignment = Alignment(horizontal='right')
+        row_idx += 1
+        
+    # Add 4 extra empty rows (as requested)
+    for _ in range(4):
+        for col_idx in range(3, 9): # Columns C to H
+            cell = ws.cell(row=row_idx, column=col_idx)
+            cell.border = border_thin
+        row_idx += 1
+        
+    # Totals
+    discount_val = payload["discount_percent"]
+    discounted_total = subtotal_plain * (1 - discount_val / 100.0)
+    nds_percent = payload["nds_percent"]
+    nds_total = discounted_total * (1 + nds_percent / 100.0)
+    
+    cell_sub = ws.cell(row=row_idx, column=8, value=subtotal_plain)
+    cell_sub.font = font_bold
+    cell_sub.alignment = Alignment(horizontal='right')
+    
+    label_disc = ws.cell(row=row_idx + 1, column=7, value=f"{discount_val}% скидка билан")
+    label_disc.alignment = Alignment(horizontal='right')
+    cell_disc = ws.cell(row=row_idx + 1, column=8, value=discounted_total)
+    cell_disc.font = font_bold
+    cell_disc.alignment = Alignment(horizontal='right')
+    
+    label_nds = ws.cell(row=row_idx + 2, column=7, value=f"{nds_percent}% ндс билан")
+    label_nds.alignment = Alignment(horizontal='right')
+    cell_nds = ws.cell(row=row_idx + 2, column=8, value=nds_total)
+    cell_nds.font = font_bold
+    cell_nds.alignment = Alignment(horizontal='right')
+
+    wb.save(path)
+    return path
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.export_job import ExportJob
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Collector: async (db, current_user, params, job) -> (payload, filename). Runs on the event loop (DB reads only).
+# Renderer: sync (payload, path) -> path. Runs in the process pool (openpyxl work).
+Collector = Callable[[Any, User, dict, dict], Awaitable[Tuple[dict, str]]]
+Renderer = Callable[[dict, str], str]
+
+# Job state lives in export_job rows, so any API process can report and serve a job; the job itself runs
+# in the process that accepted it, which keeps its live progress below and writes it back on a heartbeat.
+# A job whose process went away (restart, Passenger recycling a worker) stops heartbeating and is
+# failed after EXPORT_JOB_STALE_SECONDS. Files live under EXPORT_DIR, which all processes must share.
+_active: Dict[str, dict] = {}
+_kinds: Dict[str, Tuple[Collector, Renderer, Optional[list]]] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+_tasks: set = set()  # strong refs so running jobs are not garbage collected
+_FINISHED = ("done", "failed")
+_PURGE_INTERVAL_SECONDS = 60
+
+_last_purge = 0.0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: workers must not inherit the event loop / DB connections of the API process
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.EXPORT_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def _public(job: ExportJob) -> dict:
+    return {
+        "id": job.id, "kind": job.kind, "owner_id": job.owner_id, "status": job.status,
+        "progress": job.progress, "rows": job.rows, "filename": job.filename, "error": job.error,
+        "created_at": job.created_at, "finished_at": job.finished_at, "expires_at": job.expires_at,
+    }
+
+
+async def _save(job_id: str, **values):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(ExportJob).where(ExportJob.id == job_id).values(updated_at=datetime.utcnow(), **values))
+        await db.commit()
+
+
+async def _heartbeat(job: dict):
+    """Writes the collector's progress back while the job runs (and proves this process is alive)."""
+    while True:
+        await asyncio.sleep(settings.EXPORT_JOB_HEARTBEAT_SECONDS)
+        try:
+            await _save(job["id"], progress=job["progress"], rows=job["rows"])
+        except Exception:
+            logger.exception(f"Export job {job['id']} heartbeat failed")
+
+
+class ExportJobService:
+    @staticmethod
+    def register(kind: str, collector: Collector, renderer: Renderer, roles: Optional[list] = None):
+        """Makes a report available to POST /exports. `roles` restricts who may submit it."""
+        _kinds[kind] = (collector, renderer, roles)
+
+    @staticmethod
+    async def render(renderer: Renderer, payload: dict, suffix: str = ".xlsx") -> str:
+        """Renders `payload` to a temp file in the process pool and returns its path."""
+        tmp = tempfile.NamedTemporaryFile(prefix="export_", suffix=suffix, delete=False)
+        tmp.close()
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_get_pool(), renderer, payload, tmp.name)
+        except Exception:
+            os.unlink(tmp.name)
+            raise
+        return tmp.name
+
+    @staticmethod
+    def iter_file(path: str, delete: bool = True, chunk_size: int = 64 * 1024):
+        """Chunks of a rendered file for StreamingResponse; optionally removes it afterwards."""
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+        finally:
+            if delete:
+                os.unlink(path)
+
+    @staticmethod
+    async def submit(kind: str, params: dict, current_user: User) -> dict:
+        if kind not in _kinds:
+            raise HTTPException(status_code=400, detail=f"Неизвестный тип отчёта: {kind}")
+        roles = _kinds[kind][2]
+        if roles is not None and current_user.role not in roles:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+        await ExportJobService.purge_expired()
+
+        job_id = uuid.uuid4().hex
+        async with AsyncSessionLocal() as db:
+            row = ExportJob(id=job_id, kind=kind, params=params, owner_id=current_user.id, status="queued", progress=0, rows=0)
+            db.add(row)
+            await db.commit()
+        # Live state the collector updates (job["rows"], job["progress"]); persisted by the heartbeat
+        _active[job_id] = {"id": job_id, "kind": kind, "params": params, "progress": 0, "rows": 0}
+        task = asyncio.create_task(ExportJobService._run(job_id, current_user))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        return _public(row)
+
+    @staticmethod
+    async def _run(job_id: str, current_user: User):
+        job = _active[job_id]
+        collector, renderer, _ = _kinds[job["kind"]]
+        payload = None
+        heartbeat = asyncio.create_task(_heartbeat(job))
+        result = {}
+        try:
+            job["progress"] = 5
+            await _save(job_id, status="collecting", progress=5)
+            async with AsyncSessionLocal() as session:
+                payload, filename = await collector(session, current_user, job["params"], job)
+
+            job["progress"] = max(job["progress"], 50)
+            await _save(job_id, status="rendering", progress=job["progress"], rows=job["rows"])
+            os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+            path = os.path.join(settings.EXPORT_DIR, f"{job_id}.xlsx")
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_get_pool(), renderer, payload, path)
+
+            result = dict(status="done", progress=100, filename=filename, path=path)
+        except HTTPException as e:
+            result = dict(status="failed", error=str(e.detail))
+        except Exception as e:
+            logger.error(f"Export job {job_id} ({job['kind']}) failed: {traceback.format_exc()}")
+            result = dict(status="failed", error=str(e))
+        finally:
+            heartbeat.cancel()
+            _active.pop(job_id, None)
+            now = datetime.utcnow()
+            try:
+                await _save(
+                    job_id, rows=job["rows"], finished_at=now,
+                    expires_at=now + timedelta(seconds=settings.EXPORT_JOB_TTL_SECONDS), **result
+                )
+            except Exception:
+                logger.exception(f"Failed to store the result of export job {job_id}")
+            # Collectors may spool rows to a temp file for the renderer
+            rows_path = payload.get("rows_path") if payload else None
+            if rows_path and os.path.exists(rows_path):
+                os.unlink(rows_path)
+
+    @staticmethod
+    async def get(job_id: str, current_user: User) -> ExportJob:
+        await ExportJobService.purge_expired()
+        async with AsyncSessionLocal() as db:
+            job = await db.get(ExportJob, job_id)
+        if not job or job.owner_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+        return job
+
+    @staticmethod
+    async def status(job_id: str, current_user: User) -> dict:
+        return _public(await ExportJobService.get(job_id, current_user))
+
+    @staticmethod
+    async def list_for_user(current_user: User) -> list:
+        await ExportJobService.purge_expired()
+        async with AsyncSessionLocal() as db:
+            jobs = (await db.execute(
+                select(ExportJob).where(ExportJob.owner_id == current_user.id).order_by(ExportJob.created_at.desc())
+            )).scalars().all()
+        return [_public(j) for j in jobs]
+
+    @staticmethod
+    async def purge_expired() -> int:
+        """Fails jobs whose process stopped heartbeating and drops expired jobs together with their files."""
+        global _last_purge
+        if time.monotonic() - _last_purge < _PURGE_INTERVAL_SECONDS:
+            return 0
+        _last_purge = time.monotonic()
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(ExportJob)
+                .where(
+                    ExportJob.status.notin_(_FINISHED),
+                    ExportJob.updated_at < now - timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS)
+                )
+                .values(
+                    status="failed", error="Экспорт прерван перезапуском сервера, запустите его заново",
+                    finished_at=now, expires_at=now + timedelta(seconds=settings.EXPORT_JOB_TTL_SECONDS)
+                )
+            )
+            expired = (await db.execute(select(ExportJob.id, ExportJob.path).where(ExportJob.expires_at < now))).all()
+            if expired:
+                await db.execute(delete(ExportJob).where(ExportJob.id.in_([e.id for e in expired])))
+            known = set((await db.execute(select(ExportJob.path).where(ExportJob.path.isnot(None)))).scalars().all())
+            await db.commit()
+
+        for e in expired:
+            if e.path and os.path.exists(e.path):
+                os.unlink(e.path)
+        # Files no job refers to any more (e.g. rows deleted with their owner)
+        if os.path.isdir(settings.EXPORT_DIR):
+            cutoff = time.time() - settings.EXPORT_JOB_TTL_SECONDS
+            for name in os.listdir(settings.EXPORT_DIR):
+                path = os.path.join(settings.EXPORT_DIR, name)
+                if path not in known and os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+        return len(expired)
+
+    @staticmethod
+    def shutdown():
+        global _pool
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
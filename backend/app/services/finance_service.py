@@ -1,5 +1,5 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, func
 from fastapi import HTTPException
 from app.models.sales import Payment, Invoice, InvoiceStatus, ReservationItem
 from app.models.ledger import BonusLedger, LedgerType, DoctorMonthlyStat
@@ -8,6 +8,19 @@ from app.schemas.sales import PaymentCreate
 from datetime import datetime
 
 class FinancialService:
+    @staticmethod
+    def target_med_rep_id(med_org):
+        """
+        The med rep payments of this organization accrue bonus / salary to: its lowest-id assigned
+        MedRep, the same owner StatsService.get_owner_rep_ids books the organization's stats to.
+        """
+        if med_org and med_org.assigned_reps:
+            from app.models.user import UserRole
+            rep_ids = [rep.id for rep in med_org.assigned_reps if rep.role == UserRole.MED_REP]
+            if rep_ids:
+                return min(rep_ids)
+        return None
+
     @staticmethod
     async def process_payment(db: AsyncSession, obj_in: PaymentCreate, processor_id: int):
         """
@@ -56,6 +69,9 @@ class FinancialService:
                 db.add(payment)
                 await db.flush() 
                 
+                from app.services.stats_service import StatsService
+                await StatsService.record_payment(db, invoice.id, to_apply_this, payment.date)
+                
                 # 3. Update UnassignedSale paid quantities (Pro-rata logic) and MedRep Bonus
                 # We calculate what percentage of the invoice is now paid by THIS specific payment
                 payment_ratio = obj_in.amount / invoice.total_amount if invoice.total_amount > 0 else 0
@@ -77,12 +93,7 @@ class FinancialService:
                 
                 if reservation:
                     # Determine target user for bonus (MedRep assigned to Pharmacy)
-                    target_medrep_id = None
-                    if reservation.med_org and reservation.med_org.assigned_reps:
-                        for rep in reservation.med_org.assigned_reps:
-                            if rep.role == UserRole.MED_REP:
-                                target_medrep_id = rep.id
-                                break
+                    target_medrep_id = FinancialService.target_med_rep_id(reservation.med_org)
                     
                     # Calculate bonus and salary for this specific payment
                     payment_bonus_amount = 0.0
@@ -212,6 +223,7 @@ class FinancialService:
                             source_payment_id=payment.id
                         )
                         db.add(other_payment)
+                        await StatsService.record_payment(db, other_inv.id, apply_other, payment.date)
                     
                     # If still remaining, add to organization's credit balance
                     if remaining_payment > 0:
@@ -235,6 +247,12 @@ class FinancialService:
                             # Note: we do NOT add remaining_payment to invoice.paid_amount here 
                             # to keep the invoice strictly at total_amount as requested.
 
+                from app.services.receivable_service import ReceivableService
+                if reservation and reservation.med_org_id:
+                    await ReceivableService.refresh(db, [reservation.med_org_id])
+                else:
+                    await ReceivableService.refresh_for_invoices(db, [invoice.id])
+
                 await db.commit()
                 return payment
                 
@@ -313,6 +331,7 @@ class FinancialService:
 
                 # 4. Create Bonus Ledger (Pro-rata bonus realization)
                 # Check if bonus is eligible for this reservation
+                bonus_amount = 0.0
                 is_eligible = True
                 if reservation_item and reservation_item.reservation:
                     is_eligible = reservation_item.reservation.is_bonus_eligible
@@ -334,6 +353,9 @@ class FinancialService:
                 # 5. Update Record
                 rec.assigned_quantity += actual_assign_quantity
                 
+                from app.services.stats_service import StatsService
+                await StatsService.record_fact(db, fact, max(bonus_amount, 0.0))
+                
                 await db.commit()
                 return fact
             except HTTPException:
@@ -347,30 +369,12 @@ class FinancialService:
     async def get_medrep_bonus_balance(db: AsyncSession, med_rep_id: int, category: str = "bonus") -> float:
         """
         Calculate total usable bonus balance for a med rep by category.
-        = Sum of PAID Accruals (is_paid=True) - Sum of Offsets
+        = Sum of PAID Accruals (is_paid=True) - Sum of Offsets, read from the BonusBalance snapshot.
         """
-        from app.models.ledger import BonusLedger, LedgerType
+        from app.services.bonus_balance_service import BonusBalanceService
 
-        # Get all credits (earned bonuses that are PAID) and debits (spending)
-        query = select(BonusLedger).where(
-            BonusLedger.user_id == med_rep_id,
-            BonusLedger.ledger_type.in_([LedgerType.ACCRUAL, LedgerType.OFFSET]),
-            BonusLedger.ledger_category == category
-        )
-        
-        result = await db.execute(query)
-        entries = result.scalars().all()
-        
-        balance = 0.0
-        for entry in entries:
-            # We only count ACCRUALs if they have been physically paid by the director
-            if entry.ledger_type == LedgerType.ACCRUAL:
-                if entry.is_paid:
-                    balance += entry.amount
-            elif entry.ledger_type == LedgerType.OFFSET:
-                balance -= entry.amount
-                
-        return balance
+        totals = await BonusBalanceService.get(db, med_rep_id, category)
+        return totals["balance"]
 
     @staticmethod
     async def allocate_bonus(db: AsyncSession, med_rep_id: int, doctor_id: int, product_id: int, quantity: int, target_month: int, target_year: int, amount_per_unit: float = None, notes: str = None):
@@ -472,6 +476,9 @@ class FinancialService:
                 )
                 db.add(bonus_payment)
 
+                from app.services.stats_service import StatsService
+                await StatsService.record_fact(db, fact, amount)
+
                 await db.commit()
                 return {
                     "message": "Бонус успешно прикреплён",
@@ -528,7 +535,10 @@ class FinancialService:
         stmt_ledger = select(BonusLedger).where(BonusLedger.fact_id == fact_id)
         ledger_res = await db.execute(stmt_ledger)
         ledger_entries = ledger_res.scalars().all()
+        doctor_bonus_amount = 0.0
         for entry in ledger_entries:
+            if entry.doctor_id and entry.ledger_type == LedgerType.ACCRUAL:
+                doctor_bonus_amount += entry.amount or 0.0
             await db.delete(entry)
 
         # 3. Priority 2: Fallback by metadata (for old records)
@@ -562,6 +572,7 @@ class FinancialService:
             accrual_res = await db.execute(stmt_accrual)
             accrual_entry = accrual_res.scalar_one_or_none()
             if accrual_entry:
+                doctor_bonus_amount += accrual_entry.amount or 0.0
                 await db.delete(accrual_entry)
 
         # 4. Delete related BonusPayment entries
@@ -579,6 +590,8 @@ class FinancialService:
             await db.delete(pmt)
 
         # 5. Delete the fact itself
+        from app.services.stats_service import StatsService
+        await StatsService.record_fact(db, fact, doctor_bonus_amount, sign=-1)
         await db.delete(fact)
 
         await db.commit()
@@ -624,7 +637,9 @@ class FinancialService:
                 
                 all_payments_to_reverse = [main_payment] + list(child_payments)
 
+                from app.services.stats_service import StatsService
                 for pmt in all_payments_to_reverse:
+                    await StatsService.record_payment(db, pmt.invoice_id, pmt.amount, pmt.date, sign=-1)
                     inv = pmt.invoice
                     if inv:
                         prev_status = inv.status
@@ -708,6 +723,8 @@ class FinancialService:
                         else:
                             inv_obj.status = InvoiceStatus.PAID
 
+                from app.services.receivable_service import ReceivableService
+                await ReceivableService.refresh_for_invoices(db, affected_invoice_ids)
                 await db.commit()
                 return {"status": "success", "message": f"Payment #{payment_id} and all linked transactions reversed successfully"}
                 
@@ -779,6 +796,8 @@ class FinancialService:
                         pay = (await db.execute(pay_stmt)).scalar_one_or_none()
                         if pay and pay.invoice_id:
                             affected_invoice_ids.add(pay.invoice_id)
+                            from app.services.stats_service import StatsService
+                            await StatsService.record_payment(db, pay.invoice_id, pay.amount, pay.date, sign=-1)
                             # Delete child balance transactions for this payment
                             child_del_stmt = select(BalanceTransaction).where(BalanceTransaction.payment_id == pay_id)
                             for c in (await db.execute(child_del_stmt)).scalars().all():
@@ -814,6 +833,9 @@ class FinancialService:
                     # Unhandled types or INVOICE debt type (which usually shouldn't be reversed this way)
                     await db.delete(bt)
                 
+                from app.services.receivable_service import ReceivableService
+                await ReceivableService.refresh(db, [bt.organization_id])
+
                 await db.commit()
                 return {"status": "success", "message": f"Transaction #{transaction_id} reversed successfully"}
 
@@ -0,0 +1,215 @@
+import asyncio
+import importlib
+import ipaddress
+import json
+import logging
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Optional, Protocol, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LOCATION = "Не определено"
+LOCAL_NETWORK = "Local Network"
+# client_location values that mean "the app could not determine it"
+_PLACEHOLDERS = {"undefined", UNKNOWN_LOCATION, "Unknown", LOCAL_NETWORK}
+
+
+class GeoResolver(Protocol):
+    """Blocking lookups (run in a thread). Return None when the place cannot be determined."""
+    def resolve_ip(self, ip: str) -> Optional[str]: ...
+    def resolve_coords(self, lat: str, lon: str) -> Optional[str]: ...
+
+
+class HttpGeoResolver:
+    """ip-api.com for IPs, OpenStreetMap Nominatim for coordinates."""
+
+    def resolve_ip(self, ip: str) -> Optional[str]:
+        with urllib.request.urlopen(f"http://ip-api.com/json/{ip}", timeout=2) as response:
+            data = json.load(response)
+            if data.get("status") == "success":
+                return f"{data.get('city', 'Unknown')}, {data.get('country', 'Unknown')}"
+        return None
+
+    def resolve_coords(self, lat: str, lon: str) -> Optional[str]:
+        url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=18&addressdetails=1"
+        req = urllib.request.Request(url)
+        # Nominatim requires a User-Agent
+        req.add_header('User-Agent', 'PharmaERP/1.0')
+
+        with urllib.request.urlopen(req, timeout=3) as response:
+            address = json.load(response).get("address", {})
+
+        # 'Street House, City'
+        parts = []
+        street = address.get("road") or address.get("suburb")
+        house_number = address.get("house_number")
+        city = address.get("city") or address.get("town") or address.get("village")
+        if street:
+            parts.append(f"{street} {house_number}" if house_number else street)
+        if city:
+            parts.append(city)
+        return ", ".join(parts) if parts else None
+
+
+class OfflineGeoResolver:
+    """No network access: IPs stay unknown, coordinates are stored as is."""
+
+    def resolve_ip(self, ip: str) -> Optional[str]:
+        return None
+
+    def resolve_coords(self, lat: str, lon: str) -> Optional[str]:
+        return None
+
+
+def _load_resolver(name: str) -> GeoResolver:
+    if name == "http":
+        return HttpGeoResolver()
+    if name == "offline":
+        return OfflineGeoResolver()
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class _TtlCache:
+    """Small LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int):
+        self._data: "OrderedDict[Any, Tuple[float, str]]" = OrderedDict()
+        self._max_entries = max_entries
+
+    def get(self, key) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value: str, ttl: int):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+_resolver: Optional[GeoResolver] = None
+_ip_cache = _TtlCache(settings.GEO_CACHE_MAX_ENTRIES)
+_coord_cache = _TtlCache(settings.GEO_CACHE_MAX_ENTRIES)
+
+
+def _get_resolver() -> GeoResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = _load_resolver(settings.GEO_RESOLVER)
+    return _resolver
+
+
+def _parse_coords(client_location: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not client_location or "," not in client_location:
+        return None
+    try:
+        lat, lon = [x.strip() for x in client_location.split(",")]
+        float(lat), float(lon)
+    except ValueError:
+        return None
+    return lat, lon
+
+
+def _coord_cell(lat: str, lon: str) -> Tuple[float, float]:
+    return (round(float(lat), settings.GEO_COORD_PRECISION), round(float(lon), settings.GEO_COORD_PRECISION))
+
+
+def _is_local(ip: Optional[str]) -> bool:
+    if not ip or ip == "localhost":
+        return True
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_private or addr.is_loopback
+
+
+class GeolocationService:
+    """
+    Resolves the login location ('Street, City' from the app's coordinates, else 'City, Country' from the IP).
+    Lookups are cached per IP and per coordinate cell; network lookups run in a thread and are meant to be
+    scheduled after the response (see update_login_location), never on the login request path.
+    """
+
+    @staticmethod
+    def set_resolver(resolver: GeoResolver):
+        global _resolver
+        _resolver = resolver
+        _ip_cache.clear()
+        _coord_cache.clear()
+
+    @staticmethod
+    def resolve_cached(ip: Optional[str], client_location: Optional[str]) -> Optional[str]:
+        """The location if it is known without a lookup (cache hit, local network, plain text); else None."""
+        coords = _parse_coords(client_location)
+        if coords:
+            return _coord_cache.get(_coord_cell(*coords))
+        if client_location and client_location not in _PLACEHOLDERS:
+            return client_location
+        if _is_local(ip):
+            return LOCAL_NETWORK
+        return _ip_cache.get(ip)
+
+    @staticmethod
+    async def resolve(ip: Optional[str], client_location: Optional[str]) -> str:
+        cached = GeolocationService.resolve_cached(ip, client_location)
+        if cached:
+            return cached
+
+        resolver = _get_resolver()
+        coords = _parse_coords(client_location)
+        if coords:
+            cell = _coord_cell(*coords)
+            try:
+                address = await asyncio.to_thread(resolver.resolve_coords, *coords)
+            except Exception as e:
+                logger.warning(f"Reverse geocoding failed: {e}")
+                address = None
+            if address:
+                _coord_cache.set(cell, address, settings.GEO_CACHE_TTL_SECONDS)
+                return address
+            fallback = f"{coords[0]}, {coords[1]}"
+            _coord_cache.set(cell, fallback, settings.GEO_CACHE_FAILURE_TTL_SECONDS)
+            return fallback
+
+        try:
+            location = await asyncio.to_thread(resolver.resolve_ip, ip)
+        except Exception as e:
+            logger.warning(f"Location lookup failed: {e}")
+            location = None
+        _ip_cache.set(
+            ip, location or UNKNOWN_LOCATION,
+            settings.GEO_CACHE_TTL_SECONDS if location else settings.GEO_CACHE_FAILURE_TTL_SECONDS
+        )
+        return location or UNKNOWN_LOCATION
+
+    @staticmethod
+    async def update_login_location(history_id: int, ip: Optional[str], client_location: Optional[str]):
+        """Background task: resolves the location and stores it on the UserLoginHistory row."""
+        from app.db.session import AsyncSessionLocal
+        from app.models.user import UserLoginHistory
+
+        try:
+            location = await GeolocationService.resolve(ip, client_location)
+            async with AsyncSessionLocal() as db:
+                history = await db.get(UserLoginHistory, history_id)
+                if history:
+                    history.location = location
+                    await db.commit()
+        except Exception as e:
+            logger.warning(f"Login location update failed for history #{history_id}: {e}")
@@ -1,27 +1,137 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models.user import User
+from sqlalchemy import select, delete, or_
+from fastapi import HTTPException
+from app.core.config import settings
+from app.models.user import User, UserHierarchy
+
+# In-process cache of descendant lookups: (hierarchy version, user id) -> (expires_at, ids).
+# A manager_id change bumps the version of the process that made it; the other Passenger workers
+# only see it once their entries expire, so every entry lives HIERARCHY_CACHE_TTL_SECONDS at most.
+_hierarchy_version = 0
+_descendant_cache: "OrderedDict[Tuple[int, int], Tuple[float, List[int]]]" = OrderedDict()
+
 
 class HierarchyService:
+    @staticmethod
+    def invalidate():
+        """Bump the hierarchy version. Call after committing a manager_id change."""
+        global _hierarchy_version
+        _hierarchy_version += 1
+        _descendant_cache.clear()
+
+    @staticmethod
+    async def get_descendant_ids(db: AsyncSession, user_id: int) -> List[int]:
+        """All subordinate IDs (recursively) for a user: one indexed read from the closure table, cached."""
+        key = (_hierarchy_version, user_id)
+        entry = _descendant_cache.get(key)
+        if entry is not None:
+            expires_at, cached = entry
+            if expires_at >= time.monotonic():
+                _descendant_cache.move_to_end(key)
+                return list(cached)
+            _descendant_cache.pop(key, None)
+
+        result = await db.execute(
+            select(UserHierarchy.descendant_id)
+            .where(UserHierarchy.ancestor_id == user_id)
+            .order_by(UserHierarchy.depth, UserHierarchy.descendant_id)
+        )
+        ids = list(result.scalars().all())
+
+        _descendant_cache[key] = (time.monotonic() + settings.HIERARCHY_CACHE_TTL_SECONDS, ids)
+        _descendant_cache.move_to_end(key)
+        while len(_descendant_cache) > settings.HIERARCHY_CACHE_MAX_ENTRIES:
+            _descendant_cache.popitem(last=False)
+        return list(ids)
+
     @staticmethod
     async def get_subordinates(db: AsyncSession, user_id: int):
         """
-        Uses Recursive CTE to fetch the entire organization tree under a given user id.
-        Ultra-fast O(1) query depth resolution.
+        Fetches the user and the entire organization tree under them via the closure table.
         """
-        query = """
-        WITH RECURSIVE subordinates AS (
-            SELECT id, full_name, role, is_active, manager_id
-            FROM "user"
-            WHERE id = :user_id
-            
-            UNION ALL
-            
-            SELECT u.id, u.full_name, u.role, u.is_active, u.manager_id
-            FROM "user" u
-            INNER JOIN subordinates s ON s.id = u.manager_id
-        )
-        SELECT * FROM subordinates;
+        query = select(User).where(
+            or_(
+                User.id == user_id,
+                User.id.in_(select(UserHierarchy.descendant_id).where(UserHierarchy.ancestor_id == user_id))
+            )
+        ).order_by(User.id)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    @staticmethod
+    async def set_manager(db: AsyncSession, user_id: int, manager_id: Optional[int]):
         """
-        result = await db.execute(query, {"user_id": user_id})
-        return result.all()
+        Moves `user_id` (with its whole subtree) under `manager_id` and rewrites the affected closure rows.
+        Does not commit; the caller commits and then calls `invalidate()`.
+        """
+        if manager_id == user_id:
+            raise HTTPException(status_code=400, detail="Пользователь не может назначить себя собственным менеджером.")
+
+        # Subtree of the moved user (depth relative to it; the user itself is depth 0)
+        sub_res = await db.execute(
+            select(UserHierarchy.descendant_id, UserHierarchy.depth).where(UserHierarchy.ancestor_id == user_id)
+        )
+        subtree = {user_id: 0}
+        subtree.update({d_id: depth for d_id, depth in sub_res.all()})
+
+        if manager_id is not None and manager_id in subtree:
+            raise HTTPException(status_code=400, detail="Нельзя назначить подчинённого менеджером своего руководителя (цикл в иерархии).")
+
+        # 1. Detach the subtree from its current ancestors
+        old_anc_res = await db.execute(
+            select(UserHierarchy.ancestor_id).where(UserHierarchy.descendant_id == user_id)
+        )
+        old_ancestors = list(old_anc_res.scalars().all())
+        if old_ancestors:
+            await db.execute(
+                delete(UserHierarchy).where(
+                    UserHierarchy.ancestor_id.in_(old_ancestors),
+                    UserHierarchy.descendant_id.in_(list(subtree.keys()))
+                )
+            )
+
+        # 2. Attach it under the new manager and all of the manager's ancestors
+        if manager_id is not None:
+            anc_res = await db.execute(
+                select(UserHierarchy.ancestor_id, UserHierarchy.depth).where(UserHierarchy.descendant_id == manager_id)
+            )
+            new_ancestors = {manager_id: 0}
+            new_ancestors.update({a_id: depth for a_id, depth in anc_res.all()})
+            db.add_all([
+                UserHierarchy(ancestor_id=a_id, descendant_id=d_id, depth=a_depth + 1 + d_depth)
+                for a_id, a_depth in new_ancestors.items()
+                for d_id, d_depth in subtree.items()
+            ])
+
+        await db.execute(
+            User.__table__.update().where(User.id == user_id).values(manager_id=manager_id)
+        )
+        await db.flush()
+        HierarchyService.invalidate()
+
+    @staticmethod
+    async def rebuild(db: AsyncSession) -> int:
+        """Recomputes the closure table from User.manager_id. The caller commits."""
+        rows = (await db.execute(select(User.id, User.manager_id))).all()
+        parent = {uid: mid for uid, mid in rows}
+
+        pairs = []
+        for uid in parent:
+            seen = {uid}
+            depth = 1
+            ancestor = parent.get(uid)
+            while ancestor is not None and ancestor not in seen:
+                pairs.append(UserHierarchy(ancestor_id=ancestor, descendant_id=uid, depth=depth))
+                seen.add(ancestor)
+                ancestor = parent.get(ancestor)
+                depth += 1
+
+        await db.execute(delete(UserHierarchy))
+        db.add_all(pairs)
+        await db.flush()
+        HierarchyService.invalidate()
+        return len(pairs)
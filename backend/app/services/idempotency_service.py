@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.models.idempotency import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+_PURGE_INTERVAL_SECONDS = 600
+
+_last_purge = 0.0
+
+
+class IdempotentRequest:
+    """
+    Handed to an endpoint by deps.get_idempotency. `replay` is the stored response of an earlier
+    request with the same key (return it as is); otherwise do the write and `return await save(result)`.
+    Without the header both are no-ops.
+    """
+    __slots__ = ("key", "user_id", "replay")
+
+    def __init__(self, key: Optional[str] = None, user_id: Optional[int] = None, replay: Any = None):
+        self.key = key
+        self.user_id = user_id
+        self.replay = replay
+
+    async def save(self, result: Any, schema=None) -> Any:
+        """Stores the response for retries; ORM results are serialized through `schema` (the response_model)."""
+        if self.key is None:
+            return result
+        if schema is not None:
+            result = schema.model_validate(result, from_attributes=True)
+        body = jsonable_encoder(result)
+        await IdempotencyService.complete(self, body)
+        return body
+
+
+def _fingerprint(request: Request, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (request.method, request.url.path, request.url.query):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyService:
+    """
+    Header-based deduplication of retried writes (payments, top-ups, reservations). The first request
+    with a key claims it (committed at once, in its own session); retries with the same key and the
+    same payload get the stored response until IDEMPOTENCY_TTL_SECONDS, without re-executing. A retry
+    while the first is still running gets 409, one with a different payload 422. Failed requests
+    release their claim so they can be retried.
+    """
+
+    @staticmethod
+    async def claim(user_id: int, key: str, request: Request) -> IdempotentRequest:
+        from app.db.session import AsyncSessionLocal
+        if len(key) > 255:
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} is too long")
+        fingerprint = _fingerprint(request, await request.body())
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            await IdempotencyService._purge_expired(db, now)
+            row = (await db.execute(
+                select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+            )).scalar_one_or_none()
+            if row is not None and row.expires_at < now:
+                await db.delete(row)
+                await db.flush()
+                row = None
+
+            if row is None:
+                db.add(IdempotencyKey(
+                    user_id=user_id, key=key, fingerprint=fingerprint, status="in_progress", created_at=now,
+                    # An unfinished claim (crashed worker) frees the key after this long
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+                ))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # Same key claimed concurrently by another request
+                    await db.rollback()
+                    raise HTTPException(status_code=409, detail="Запрос с этим ключом уже выполняется")
+                return IdempotentRequest(key, user_id)
+
+        if row.fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} уже использован для другого запроса")
+        if row.status != "done":
+            raise HTTPException(status_code=409, detail="Запрос с этим ключом уже выполняется")
+        return IdempotentRequest(key, user_id, replay=row.response_body)
+
+    @staticmethod
+    async def complete(claim: IdempotentRequest, body: Any):
+        from app.db.session import AsyncSessionLocal
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.user_id == claim.user_id, IdempotencyKey.key == claim.key)
+                    .values(
+                        status="done", response_body=body,
+                        expires_at=datetime.utcnow() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+                    )
+                )
+                await db.commit()
+        except Exception:
+            # The write itself is committed; a retry now gets 409 until the claim expires
+            logger.exception(f"Failed to store idempotent response for key {claim.key!r}")
+
+    @staticmethod
+    async def release(claim: IdempotentRequest):
+        """Drops an unfinished claim (the request failed) so the client can retry with the same key."""
+        from app.db.session import AsyncSessionLocal
+        if claim.key is None or claim.replay is not None:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == claim.user_id, IdempotencyKey.key == claim.key,
+                    IdempotencyKey.status == "in_progress",
+                ))
+                await db.commit()
+        except Exception:
+            logger.exception(f"Failed to release idempotency key {claim.key!r}")
+
+    @staticmethod
+    async def _purge_expired(db, now: datetime):
+        global _last_purge
+        if time.monotonic() - _last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = time.monotonic()
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+        await db.commit()
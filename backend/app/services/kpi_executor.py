@@ -0,0 +1,78 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+
+KpiQuery = Callable[[AsyncSession], Awaitable[Any]]
+
+
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _pool_slots() -> asyncio.Semaphore:
+    """
+    Connections KPI queries may hold at once, shared by every request of this process
+    (a semaphore is bound to the loop it is used on, so a new loop gets a new one).
+    Kept below DB_POOL_SIZE so ordinary request sessions still find a connection.
+    """
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots = asyncio.Semaphore(max(1, min(settings.KPI_MAX_CONCURRENCY, settings.DB_POOL_SIZE - 1)))
+        _slots_loop = loop
+    return _slots
+
+
+class KpiExecutor:
+    """
+    Runs independent read-only KPI queries concurrently.
+    Each KPI gets its own session (and therefore its own pooled connection), so the total
+    latency approaches the slowest query instead of the sum of all of them. Those sessions
+    come out of one process-wide budget (KPI_MAX_CONCURRENCY); when it is used up by other
+    requests, queries run one at a time on `db` (the request session) instead of waiting.
+
+        executor = KpiExecutor(db)
+        executor.add_scalar("debt", debt_q, default=0.0)
+        executor.add("activities", load_activities)   # async def load_activities(session) -> ...
+        results = await executor.run()
+        executor.timings  # {"debt": 12.3, "activities": 4.1, "_total": 13.0} (ms)
+    """
+
+    def __init__(self, db: Optional[AsyncSession] = None):
+        self._queries: Dict[str, KpiQuery] = {}
+        self._db = db
+        self._db_lock = asyncio.Lock()  # an AsyncSession runs one statement at a time
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, fn: KpiQuery):
+        self._queries[name] = fn
+
+    def add_scalar(self, name: str, query, default: Any = None):
+        async def _scalar(session: AsyncSession):
+            return (await session.execute(query)).scalar() or default
+        self.add(name, _scalar)
+
+    async def _run_one(self, slots: asyncio.Semaphore, name: str, fn: KpiQuery):
+        started = time.perf_counter()
+        try:
+            if slots.locked() and self._db is not None:
+                async with self._db_lock:
+                    return await fn(self._db)
+            async with slots:
+                async with AsyncSessionLocal() as session:
+                    return await fn(session)
+        finally:
+            self.timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def run(self) -> Dict[str, Any]:
+        slots = _pool_slots()
+        names = list(self._queries)
+        started = time.perf_counter()
+        values = await asyncio.gather(*(self._run_one(slots, n, self._queries[n]) for n in names))
+        self.timings["_total"] = round((time.perf_counter() - started) * 1000, 2)
+        return dict(zip(names, values))
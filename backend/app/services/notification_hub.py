@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.crm import Notification
+from app.models.sales import Invoice, Payment, Reservation
+from app.models.user import UserRole
+
+logger = logging.getLogger(__name__)
+
+# In-process pub/sub for the notification stream (GET /notifications/stream, /notifications/ws).
+# Each open connection holds a bounded queue; events are fanned out to a user's connections and,
+# for approval requests, to every connected user of the approving roles. Events committed by another
+# process are not seen, so push is off unless NOTIFICATION_PUSH_ENABLED (single ASGI worker only).
+# Unread counts are not kept here: "notification" / "unread" events are completed with a fresh
+# count by the stream endpoint, so every process reports the same number.
+
+# Roles that approve deletion / return requests in warehouse.py
+APPROVER_ROLES = [UserRole.HEAD_OF_WAREHOUSE, UserRole.DIRECTOR, UserRole.ADMIN]
+PAYMENT_WATCHER_ROLES = [UserRole.ACCOUNTANT]
+
+
+class Subscription:
+    __slots__ = ("user_id", "role", "queue")
+
+    def __init__(self, user_id: int, role: str):
+        self.user_id = user_id
+        self.role = _role(role)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.NOTIFICATION_QUEUE_SIZE)
+
+
+_subscriptions: Dict[int, List[Subscription]] = {}
+
+
+def _role(role) -> str:
+    return getattr(role, "value", role)
+
+
+def _deliver(sub: Subscription, payload: dict):
+    if sub.queue.full():
+        # Slow consumer: drop its oldest event rather than block the publisher
+        sub.queue.get_nowait()
+    sub.queue.put_nowait(payload)
+
+
+class NotificationHub:
+    @staticmethod
+    def subscribe(user_id: int, role: str) -> Subscription:
+        sub = Subscription(user_id, role)
+        _subscriptions.setdefault(user_id, []).append(sub)
+        return sub
+
+    @staticmethod
+    def unsubscribe(sub: Subscription):
+        subs = _subscriptions.get(sub.user_id, [])
+        if sub in subs:
+            subs.remove(sub)
+        if not subs:
+            _subscriptions.pop(sub.user_id, None)
+
+    @staticmethod
+    def is_connected(user_id: int) -> bool:
+        return user_id in _subscriptions
+
+    @staticmethod
+    def publish(payload: dict, user_ids: Iterable[int] = (), roles: Iterable[str] = ()):
+        """Sends `payload` to every connection of `user_ids` and of users whose role is in `roles`."""
+        targets = {}
+        for user_id in user_ids:
+            for sub in _subscriptions.get(user_id, []):
+                targets[id(sub)] = sub
+        roles = {_role(r) for r in roles}
+        if roles:
+            for subs in _subscriptions.values():
+                for sub in subs:
+                    if sub.role in roles:
+                        targets[id(sub)] = sub
+        for sub in targets.values():
+            _deliver(sub, payload)
+
+    @staticmethod
+    def stats() -> dict:
+        return {"users": len(_subscriptions), "connections": sum(len(s) for s in _subscriptions.values())}
+
+
+# ── Commit-driven events ────────────────────────────────────────────────────
+# Notification rows, payments and deletion / return request flags written through ORM sessions are
+# collected at flush and published once the commit lands (nothing is sent for rolled back work).
+
+_PENDING = "notification_hub_events"
+
+
+def _notification_payload(n: Notification) -> dict:
+    return {
+        "id": n.id,
+        "topic": n.topic,
+        "message": n.message,
+        "recipient_id": n.recipient_id,
+        "status": n.status or "unread",
+        "created_at": n.created_at.isoformat() if n.created_at else None,
+        "related_entity_type": n.related_entity_type,
+        "related_entity_name": n.related_entity_name,
+    }
+
+
+def _flag_change(obj, attr: str):
+    """(old, new) of a boolean column changed in this flush, or None."""
+    history = inspect(obj).attrs[attr].history
+    if not history.added:
+        return None
+    old = bool(history.deleted[0]) if history.deleted else False
+    new = bool(history.added[0])
+    return (old, new) if old != new else None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_events(session, flush_context):
+    # Cheap exit: nobody connected (always the case while push is disabled)
+    if not _subscriptions:
+        return
+    pending = session.info.setdefault(_PENDING, [])
+    payments = []
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            pending.append(("notification", obj.recipient_id, _notification_payload(obj)))
+        elif isinstance(obj, Payment):
+            payments.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Notification):
+            history = inspect(obj).attrs.status.history
+            if history.added:
+                was_unread = (history.deleted[0] if history.deleted else "unread") == "unread"
+                if was_unread != (history.added[0] == "unread"):
+                    pending.append(("unread", obj.recipient_id, {"type": "unread"}))
+        elif isinstance(obj, (Reservation, Invoice)):
+            entity_type = type(obj).__name__
+            change = _flag_change(obj, "is_deletion_pending")
+            if change:
+                requester_history = inspect(obj).attrs.deletion_requested_by_id.history
+                requester = obj.deletion_requested_by_id or (requester_history.deleted[0] if requester_history.deleted else None)
+                pending.append(("deletion_request", requester, {
+                    "type": "deletion_request", "entity_type": entity_type, "entity_id": obj.id,
+                    "pending": change[1], "requested_by_id": requester,
+                }))
+            if isinstance(obj, Reservation):
+                change = _flag_change(obj, "is_return_pending")
+                if change:
+                    pending.append(("return_request", obj.created_by_id, {
+                        "type": "return_request", "reservation_id": obj.id, "pending": change[1],
+                    }))
+    for obj in session.deleted:
+        if isinstance(obj, Notification) and (obj.status or "unread") == "unread":
+            pending.append(("unread", obj.recipient_id, {"type": "unread"}))
+
+    if payments:
+        invoice_ids = {p.invoice_id for p in payments if p.invoice_id}
+        reps = {}
+        if invoice_ids:
+            rows = session.connection().execute(
+                select(Invoice.id, Reservation.created_by_id)
+                .join(Reservation, Invoice.reservation_id == Reservation.id)
+                .where(Invoice.id.in_(invoice_ids))
+            )
+            reps = dict(rows.all())
+        for p in payments:
+            pending.append(("payment", reps.get(p.invoice_id), {
+                "type": "payment", "payment_id": p.id, "invoice_id": p.invoice_id, "amount": p.amount,
+                "payment_type": str(getattr(p.payment_type, "value", p.payment_type)),
+            }))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_on_commit(session):
+    for kind, user_id, payload in session.info.pop(_PENDING, ()):
+        try:
+            if kind == "notification":
+                NotificationHub.publish({"type": "notification", "notification": payload}, user_ids=[user_id])
+            elif kind == "unread":
+                NotificationHub.publish(payload, user_ids=[user_id])
+            elif kind == "payment":
+                NotificationHub.publish(payload, user_ids=[user_id] if user_id else [], roles=PAYMENT_WATCHER_ROLES)
+            else:
+                # Approval requests go to the approvers; the requester / rep hears about the outcome
+                NotificationHub.publish(payload, user_ids=[user_id] if user_id and not payload["pending"] else [], roles=APPROVER_ROLES)
+        except Exception:
+            logger.exception("Failed to publish notification event")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop(_PENDING, None)
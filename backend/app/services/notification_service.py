@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.crm import Notification, NotificationArchive
+from app.services.notification_hub import NotificationHub
+
+_ARCHIVE_COLUMNS = [
+    "id", "topic", "message", "recipient_id", "created_at", "status",
+    "related_entity_type", "related_entity_name",
+]
+
+
+class NotificationService:
+    @staticmethod
+    async def unread_count(db: AsyncSession, user_id: int) -> int:
+        """One COUNT on the partial unread index (ix_notification_unread_recipient); exact in every process."""
+        return (await db.execute(
+            select(func.count()).select_from(Notification).where(
+                Notification.recipient_id == user_id, Notification.status == "unread"
+            )
+        )).scalar() or 0
+
+    @staticmethod
+    async def mark_read(
+        db: AsyncSession, user_id: int, ids: Optional[List[int]] = None, before: Optional[datetime] = None
+    ) -> int:
+        """
+        Marks the user's unread notifications read in one UPDATE: those in `ids`, or all created at or
+        before `before` (both: either). Returns how many changed.
+        """
+        conditions = []
+        if ids:
+            conditions.append(Notification.id.in_(ids))
+        if before is not None:
+            conditions.append(Notification.created_at <= before)
+        if not conditions:
+            return 0
+        condition = conditions[0] if len(conditions) == 1 else (conditions[0] | conditions[1])
+        result = await db.execute(
+            update(Notification)
+            .where(Notification.recipient_id == user_id, Notification.status == "unread", condition)
+            .values(status="read")
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        changed = result.rowcount or 0
+        # Bulk UPDATE bypasses the flush events, so open streams are told here
+        if changed:
+            NotificationHub.publish({"type": "unread"}, user_ids=[user_id])
+        return changed
+
+    @staticmethod
+    async def archive_read(db: AsyncSession, older_than_days: int, batch_size: Optional[int] = None) -> int:
+        """
+        Moves read notifications created more than `older_than_days` ago into notification_archive,
+        one short transaction per batch of ids (copy, then delete exactly the copied ids).
+        """
+        batch_size = batch_size or settings.NOTIFICATION_ARCHIVE_BATCH_SIZE
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        moved = 0
+        while True:
+            ids = (await db.execute(
+                select(Notification.id)
+                .where(Notification.status == "read", Notification.created_at < cutoff)
+                .order_by(Notification.id)
+                .limit(batch_size)
+            )).scalars().all()
+            if not ids:
+                break
+            columns = [getattr(Notification, c) for c in _ARCHIVE_COLUMNS]
+            await db.execute(
+                insert(NotificationArchive).from_select(
+                    _ARCHIVE_COLUMNS + ["archived_at"],
+                    select(*columns, literal(datetime.utcnow(), DateTime)).where(Notification.id.in_(ids))
+                )
+            )
+            await db.execute(
+                delete(Notification).where(Notification.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            moved += len(ids)
+            if len(ids) < batch_size:
+                break
+        return moved
@@ -0,0 +1,376 @@
+import io
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Sequence, Union
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.models.crm import BalanceTransaction, BalanceTransactionType, MedicalOrganization, MedicalOrganizationStock
+from app.models.ledger import BonusLedger, LedgerType
+from app.models.sales import Invoice, InvoiceStatus, Payment, Reservation, ReservationItem, UnassignedSale
+from app.schemas.sales import PaymentImportLine
+
+# Bank statement headers (lower-cased) accepted for each import field
+_STATEMENT_HEADERS = {
+    "invoice_id": {"invoice_id", "invoice", "id счета", "счет id"},
+    "factura_number": {"factura_number", "factura", "счет-фактура", "номер счет-фактуры", "№ счет-фактуры", "faktura", "faktura raqami"},
+    "amount": {"amount", "сумма", "summa"},
+    "payment_type": {"payment_type", "тип", "тип оплаты", "to'lov turi"},
+    "comment": {"comment", "комментарий", "назначение платежа", "izoh"},
+}
+_PAYMENT_TYPE_ALIASES = {
+    "наличные": "cash", "naqd": "cash",
+    "банк": "bank", "перечисление": "bank", "bank o'tkazmasi": "bank",
+    "другое": "other", "boshqa": "other",
+}
+
+
+def _cell(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _amount(value):
+    """Statement amounts may come as text: '1 500 000,50'."""
+    if isinstance(value, str):
+        return value.replace("\u00a0", "").replace(" ", "").replace(",", ".")
+    return value
+
+
+class PaymentImportService:
+    """
+    Bulk payment entry (month-end bank statements). Applies each line like FinancialService.process_payment
+    — invoice first, overflow to the organization's other open invoices (oldest first), rest to its credit
+    balance, bonus / salary accrual for the pharmacy's med rep, stock decrement on full payment — but for
+    the whole batch at once: every touched invoice and organization is locked once in id order, reference
+    data is read with one query per table and the new rows are written in batched flushes.
+    """
+
+    @staticmethod
+    def parse_statement(content: bytes) -> List[dict]:
+        """Rows of the first sheet of an .xlsx statement as dicts (with their sheet row number in `line`)."""
+        import openpyxl
+        try:
+            workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Не удалось прочитать Excel файл")
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            columns = {}
+            for index, title in enumerate(header):
+                title = str(title).strip().lower() if title is not None else ""
+                for field, aliases in _STATEMENT_HEADERS.items():
+                    if title in aliases:
+                        columns[field] = index
+            if "amount" not in columns or not ({"invoice_id", "factura_number"} & columns.keys()):
+                raise HTTPException(
+                    status_code=400,
+                    detail="В выписке нужны колонки суммы (amount / Сумма) и счета (invoice_id или factura_number)"
+                )
+
+            lines = []
+            for number, row in enumerate(rows, start=2):
+                values = {field: _cell(row[index]) if index < len(row) else None for field, index in columns.items()}
+                if all(v is None for v in values.values()):
+                    continue
+                values["amount"] = _amount(values.get("amount"))
+                if values.get("factura_number") is not None:
+                    values["factura_number"] = str(values["factura_number"])
+                payment_type = values.get("payment_type")
+                if payment_type is None:
+                    values.pop("payment_type", None)
+                else:
+                    payment_type = str(payment_type).lower()
+                    values["payment_type"] = _PAYMENT_TYPE_ALIASES.get(payment_type, payment_type)
+                lines.append({"line": number, **values})
+            return lines
+        finally:
+            workbook.close()
+
+    @staticmethod
+    async def import_payments(
+        db: AsyncSession,
+        lines: Sequence[Union[dict, PaymentImportLine]],
+        processor_id: int,
+        dry_run: bool = False,
+    ) -> dict:
+        """
+        Validates and applies all lines in one transaction (rolled back when `dry_run`).
+        Invalid lines are reported and skipped; the others are applied in order.
+        Returns {dry_run, applied, failed, total_amount, lines: [per-line result]}.
+        """
+        results = []
+        parsed = []  # (result, line)
+        for index, raw in enumerate(lines, start=1):
+            number = raw.get("line", index) if isinstance(raw, dict) else index
+            result = {"line": number, "status": "error"}
+            results.append(result)
+            try:
+                line = raw if isinstance(raw, PaymentImportLine) else PaymentImportLine.model_validate(raw)
+            except ValidationError as e:
+                result["error"] = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+                continue
+            result.update({"invoice_id": line.invoice_id, "factura_number": line.factura_number, "amount": line.amount})
+            if line.amount <= 0:
+                result["error"] = "Amount must be positive"
+            elif line.invoice_id is None and not line.factura_number:
+                result["error"] = "Invoice id or factura number is required"
+            else:
+                parsed.append((result, line))
+
+        try:
+            if parsed:
+                await PaymentImportService._apply(db, parsed, processor_id, dry_run)
+            if dry_run:
+                await db.rollback()
+            else:
+                await db.commit()
+        except HTTPException:
+            await db.rollback()
+            raise
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=f"Failed to import payments: {str(e)}")
+
+        applied = [r for r in results if r["status"] == "ok"]
+        return {
+            "dry_run": dry_run,
+            "applied": len(applied),
+            "failed": len(results) - len(applied),
+            "total_amount": sum(r["amount"] for r in applied),
+            "lines": results,
+        }
+
+    @staticmethod
+    async def _apply(db: AsyncSession, parsed: list, processor_id: int, dry_run: bool):
+        # 1. Factura numbers -> invoice ids (one query; a number used twice is ambiguous)
+        facturas = {line.factura_number for _, line in parsed if line.invoice_id is None}
+        by_factura: Dict[str, List[int]] = defaultdict(list)
+        if facturas:
+            for number, inv_id in (await db.execute(
+                select(Invoice.factura_number, Invoice.id).where(Invoice.factura_number.in_(facturas))
+            )).all():
+                by_factura[number].append(inv_id)
+        for result, line in parsed:
+            if line.invoice_id is None:
+                matches = by_factura.get(line.factura_number, [])
+                if len(matches) == 1:
+                    line.invoice_id = result["invoice_id"] = matches[0]
+                else:
+                    result["error"] = "Invoice not found" if not matches else "Factura number matches several invoices"
+        parsed = [(result, line) for result, line in parsed if "error" not in result]
+        if not parsed:
+            return
+
+        # 2. Lock the line invoices and the open invoices of their organizations (overflow targets),
+        #    then the organizations, each in one statement in id order
+        invoice_ids = {line.invoice_id for _, line in parsed}
+        org_ids = set((await db.execute(
+            select(Reservation.med_org_id).distinct()
+            .join(Invoice, Invoice.reservation_id == Reservation.id)
+            .where(Invoice.id.in_(invoice_ids), Reservation.med_org_id.isnot(None))
+        )).scalars().all())
+        candidates = Invoice.id.in_(invoice_ids)
+        if org_ids:
+            candidates = or_(candidates, and_(
+                Reservation.med_org_id.in_(org_ids),
+                Invoice.status.notin_([InvoiceStatus.PAID, InvoiceStatus.CANCELLED]),
+            ))
+        locked = (await db.execute(
+            select(Invoice, Reservation)
+            .join(Reservation, Invoice.reservation_id == Reservation.id)
+            .where(candidates)
+            .order_by(Invoice.id)
+            .with_for_update(of=Invoice)
+        )).all()
+        invoices = {inv.id: inv for inv, _ in locked}
+        reservation_of = {inv.id: res for inv, res in locked}
+        orgs = {org.id: org for org in (await db.execute(
+            select(MedicalOrganization).options(selectinload(MedicalOrganization.assigned_reps))
+            .where(MedicalOrganization.id.in_(org_ids))
+            .order_by(MedicalOrganization.id).with_for_update()
+        )).scalars().all()} if org_ids else {}
+
+        open_by_org = defaultdict(list)
+        for inv, res in sorted(locked, key=lambda row: (row[0].date or datetime.min, row[0].id)):
+            if res.med_org_id:
+                open_by_org[res.med_org_id].append(inv)
+
+        # Pharmacy med rep (picked as process_payment does) and reservation lines
+        from app.services.finance_service import FinancialService
+        from app.services.stats_service import StatsService
+        reps = {org_id: FinancialService.target_med_rep_id(org) for org_id, org in orgs.items()}
+        # Paid stats go to the organization's owner rep, as StatsService.record_payment books them
+        stat_reps = await StatsService.get_owner_rep_ids(db, orgs)
+        items = defaultdict(list)
+        for item in (await db.execute(
+            select(ReservationItem).where(ReservationItem.reservation_id.in_({res.id for res in reservation_of.values()}))
+        )).scalars().all():
+            items[item.reservation_id].append(item)
+
+        # 3. Apply the lines in memory
+        now = datetime.utcnow()
+        stat_deltas = defaultdict(lambda: defaultdict(float))
+        accruals = []      # (payment, rep_id, amount, category, notes)
+        overpayments = []  # (payment, org_id, amount, invoice)
+        payments = []
+        paid_invoices = set()      # invoices paid directly by a line (UnassignedSale paid share)
+        completed = []             # invoices a line brought to PAID (stock decrement, promo balance)
+
+        def add_payment(invoice, res, amount, payment_type, comment, source=None):
+            payment = Payment(
+                invoice_id=invoice.id, amount=amount, payment_type=payment_type, comment=comment,
+                processed_by_id=processor_id, date=now, source_payment=source,
+            )
+            payments.append(payment)
+            rep_for_stats = stat_reps.get(res.med_org_id) or res.created_by_id
+            # Callers add `amount` to invoice.paid_amount before booking the payment
+            StatsService._payment_deltas(
+                items[res.id], res.nds_percent, invoice.total_amount, amount, now, rep_for_stats, 1, stat_deltas,
+                paid_before=(invoice.paid_amount or 0.0) - amount
+            )
+            return payment
+
+        for result, line in parsed:
+            invoice = invoices.get(line.invoice_id)
+            if invoice is None:
+                result["error"] = "Invoice not found"
+                continue
+            if invoice.status == InvoiceStatus.CANCELLED:
+                result["error"] = "Invoice is cancelled"
+                continue
+            if invoice.status == InvoiceStatus.PAID:
+                result["error"] = "Invoice is already fully paid"
+                continue
+            res = reservation_of[invoice.id]
+            org = orgs.get(res.med_org_id)
+
+            remaining = line.amount
+            to_apply = max(0.0, min(remaining, invoice.total_amount - (invoice.paid_amount or 0.0)))
+            invoice.paid_amount = (invoice.paid_amount or 0.0) + to_apply
+            remaining -= to_apply
+            invoice.status = InvoiceStatus.PAID if invoice.paid_amount >= invoice.total_amount else InvoiceStatus.PARTIAL
+            payment = add_payment(invoice, res, to_apply, line.payment_type, line.comment)
+            paid_invoices.add(invoice.id)
+            if invoice.status == InvoiceStatus.PAID:
+                completed.append(invoice)
+
+            # Bonus / salary on the line amount, as process_payment does
+            rep_id = reps.get(res.med_org_id)
+            if rep_id and invoice.total_amount > 0:
+                ratio = line.amount / invoice.total_amount
+                bonus = salary = 0.0
+                for item in items[res.id]:
+                    if res.is_bonus_eligible and item.marketing_amount:
+                        bonus += item.quantity * item.marketing_amount * ratio
+                    if res.is_salary_enabled and item.salary_amount:
+                        salary += item.quantity * item.salary_amount * ratio
+                pharmacy = org.name if org else "N/A"
+                if round(bonus) > 0:
+                    accruals.append((payment, rep_id, float(round(bonus)), "bonus",
+                                     f"Бонус начислен по счет-фактуре #{invoice.id} (Аптека: {pharmacy})"))
+                if round(salary) > 0:
+                    accruals.append((payment, rep_id, float(round(salary)), "salary",
+                                     f"Зарплата начислена по счет-фактуре #{invoice.id} (Аптека: {pharmacy})"))
+
+            # Overflow: the organization's other open invoices, oldest first, then its credit balance
+            distributed = 0.0
+            if remaining > 0 and res.med_org_id:
+                for other in open_by_org[res.med_org_id]:
+                    if remaining <= 0:
+                        break
+                    if other.id == invoice.id or other.status in (InvoiceStatus.PAID, InvoiceStatus.CANCELLED):
+                        continue
+                    apply_other = min(remaining, other.total_amount - (other.paid_amount or 0.0))
+                    if apply_other <= 0:
+                        continue
+                    other.paid_amount = (other.paid_amount or 0.0) + apply_other
+                    other.status = InvoiceStatus.PAID if other.paid_amount >= other.total_amount else InvoiceStatus.PARTIAL
+                    remaining -= apply_other
+                    distributed += apply_other
+                    add_payment(
+                        other, reservation_of[other.id], apply_other, line.payment_type,
+                        f"Автоматическое погашение за счет переплаты по счёту №{invoice.factura_number or invoice.id}",
+                        source=payment,
+                    )
+                if remaining > 0 and org:
+                    org.credit_balance = (org.credit_balance or 0.0) + remaining
+                    overpayments.append((payment, org.id, remaining, invoice))
+
+            result.update({
+                "status": "ok", "applied": to_apply, "distributed": distributed,
+                "credited": remaining if remaining > 0 and org else 0.0,
+                "invoice_status": getattr(invoice.status, "value", invoice.status),
+            })
+            result["_payment"] = payment
+
+        if not payments:
+            return
+
+        # 4. Write: payments in one flush (ids), then ledger rows and balance transactions in the next
+        db.add_all(payments)
+        await db.flush()
+        for result, _ in parsed:
+            payment = result.pop("_payment", None)
+            if payment is not None:
+                result["payment_id"] = None if dry_run else payment.id
+        db.add_all([
+            BonusLedger(
+                user_id=rep_id, amount=amount, ledger_type=LedgerType.ACCRUAL, ledger_category=category,
+                payment_id=payment.id, target_month=now.month, target_year=now.year, notes=notes,
+            )
+            for payment, rep_id, amount, category, notes in accruals
+        ])
+        db.add_all([
+            BalanceTransaction(
+                organization_id=org_id, amount=amount, transaction_type=BalanceTransactionType.OVERPAYMENT,
+                related_invoice_id=invoice.id, payment_id=payment.id,
+                comment=f"Переплата по счёту №{invoice.factura_number or invoice.id}",
+            )
+            for payment, org_id, amount, invoice in overpayments
+        ])
+
+        # UnassignedSale paid quantities follow each directly paid invoice's paid share
+        for rec in (await db.execute(
+            select(UnassignedSale).where(UnassignedSale.invoice_id.in_(paid_invoices))
+        )).scalars().all():
+            invoice = invoices[rec.invoice_id]
+            ratio = min(1.0, invoice.paid_amount / invoice.total_amount) if invoice.total_amount > 0 else 0
+            rec.paid_quantity = int(rec.total_quantity * ratio)
+
+        # Fully paid invoices: pharmacy stock decrement (rows locked in one statement) and promo balance
+        if completed:
+            decrements = defaultdict(int)
+            for invoice in completed:
+                res = reservation_of[invoice.id]
+                promo = 0.0
+                for item in items[res.id]:
+                    if res.med_org_id:
+                        decrements[(res.med_org_id, item.product_id)] += item.quantity
+                    if res.is_bonus_eligible:
+                        promo += item.quantity * (item.marketing_amount or 0)
+                invoice.promo_balance = promo
+            if decrements:
+                stocks = (await db.execute(
+                    select(MedicalOrganizationStock)
+                    .where(or_(*[
+                        and_(MedicalOrganizationStock.med_org_id == org_id, MedicalOrganizationStock.product_id == product_id)
+                        for org_id, product_id in decrements
+                    ]))
+                    .order_by(MedicalOrganizationStock.id)
+                    .with_for_update()
+                )).scalars().all()
+                for stock in stocks:
+                    stock.quantity = max(0, (stock.quantity or 0) - decrements[(stock.med_org_id, stock.product_id)])
+
+        await StatsService._apply(db, stat_deltas)
+
+        from app.services.receivable_service import ReceivableService
+        await ReceivableService.refresh(db, org_ids)
@@ -2,6 +2,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 from fastapi import HTTPException
 from app.models.crm import Doctor, MedicalOrganization, medrep_organization
+from app.models.user import User
+from app.services.hierarchy_service import HierarchyService
 
 class ReassignmentService:
     @staticmethod
@@ -59,3 +61,15 @@ class ReassignmentService:
             except Exception as e:
                 await transaction.rollback()
                 raise HTTPException(status_code=500, detail=f"Reassignment failed: {str(e)}")
+
+    @staticmethod
+    async def reassign_subordinates(db: AsyncSession, from_user_id: int, to_user_id: int) -> int:
+        """
+        Moves all direct subordinates of one manager under another, keeping the
+        UserHierarchy closure table in sync. Does not commit.
+        """
+        result = await db.execute(select(User.id).where(User.manager_id == from_user_id))
+        sub_ids = result.scalars().all()
+        for sub_id in sub_ids:
+            await HierarchyService.set_manager(db, sub_id, to_user_id)
+        return len(sub_ids)
@@ -0,0 +1,116 @@
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func, case
+
+from app.db.session import dialect_insert
+from app.models.crm import MedicalOrganization, OrganizationReceivable
+from app.models.sales import Invoice, Reservation, InvoiceStatus
+
+
+def _receivable_columns():
+    """Aggregates shared by refresh() and rebuild(): one row per organization from its non-cancelled invoices."""
+    paid = func.coalesce(Invoice.paid_amount, 0.0)
+    is_open = Invoice.total_amount > paid
+    return (
+        Reservation.med_org_id,
+        func.coalesce(func.sum(case((is_open, Invoice.total_amount - paid), else_=0.0)), 0.0).label("debt"),
+        func.coalesce(func.sum(case((paid > Invoice.total_amount, paid - Invoice.total_amount), else_=0.0)), 0.0).label("surplus"),
+        func.coalesce(func.sum(case((is_open, 1), else_=0)), 0).label("open_count"),
+        func.min(case((is_open, func.coalesce(Invoice.realization_date, Invoice.date)), else_=None)).label("oldest"),
+    )
+
+
+class ReceivableService:
+    """
+    Maintains OrganizationReceivable. Writers call `refresh` (or `refresh_for_invoices`) for the
+    organizations they touched before committing; `rebuild` recomputes every row.
+    """
+
+    @staticmethod
+    async def refresh(db: AsyncSession, organization_ids: Iterable[Optional[int]]):
+        org_ids = {org_id for org_id in organization_ids if org_id}
+        if not org_ids:
+            return
+
+        # Make sure every row exists before locking: two writers creating the same organization's row
+        # would otherwise both miss it under FOR UPDATE and one INSERT would fail on the primary key
+        await db.execute(
+            dialect_insert(db.bind, OrganizationReceivable)
+            .values([{"organization_id": org_id} for org_id in sorted(org_ids)])
+            .on_conflict_do_nothing(index_elements=["organization_id"])
+        )
+        existing_res = await db.execute(
+            select(OrganizationReceivable)
+            .where(OrganizationReceivable.organization_id.in_(org_ids))
+            .order_by(OrganizationReceivable.organization_id)
+            .with_for_update()
+        )
+        existing = {r.organization_id: r for r in existing_res.scalars().all()}
+
+        # Aggregated under the row locks, so concurrent writers serialize on the same organization
+        result = await db.execute(
+            select(*_receivable_columns())
+            .join(Invoice, Invoice.reservation_id == Reservation.id)
+            .where(
+                Reservation.med_org_id.in_(org_ids),
+                Invoice.status != InvoiceStatus.CANCELLED
+            )
+            .group_by(Reservation.med_org_id)
+        )
+        totals = {row.med_org_id: row for row in result.all()}
+
+        now = datetime.utcnow()
+        for org_id in org_ids:
+            row = existing[org_id]
+            agg = totals.get(org_id)
+            row.current_debt = float(agg.debt) if agg else 0.0
+            row.invoice_surplus = float(agg.surplus) if agg else 0.0
+            row.open_invoice_count = int(agg.open_count) if agg else 0
+            row.oldest_unpaid_date = agg.oldest if agg else None
+            row.updated_at = now
+
+    @staticmethod
+    async def refresh_for_invoices(db: AsyncSession, invoice_ids: Iterable[Optional[int]]):
+        invoice_ids = {inv_id for inv_id in invoice_ids if inv_id}
+        if not invoice_ids:
+            return
+        result = await db.execute(
+            select(Reservation.med_org_id).distinct()
+            .join(Invoice, Invoice.reservation_id == Reservation.id)
+            .where(Invoice.id.in_(invoice_ids))
+        )
+        await ReceivableService.refresh(db, result.scalars().all())
+
+    @staticmethod
+    async def rebuild(db: AsyncSession) -> int:
+        """Recomputes the whole table (every organization gets a row). The caller commits."""
+        result = await db.execute(
+            select(*_receivable_columns())
+            .join(Invoice, Invoice.reservation_id == Reservation.id)
+            .where(
+                Reservation.med_org_id.isnot(None),
+                Invoice.status != InvoiceStatus.CANCELLED
+            )
+            .group_by(Reservation.med_org_id)
+        )
+        totals = {row.med_org_id: row for row in result.all()}
+        org_ids = (await db.execute(select(MedicalOrganization.id))).scalars().all()
+
+        await db.execute(delete(OrganizationReceivable))
+        now = datetime.utcnow()
+        rows = []
+        for org_id in org_ids:
+            agg = totals.get(org_id)
+            rows.append(OrganizationReceivable(
+                organization_id=org_id,
+                current_debt=float(agg.debt) if agg else 0.0,
+                invoice_surplus=float(agg.surplus) if agg else 0.0,
+                open_invoice_count=int(agg.open_count) if agg else 0,
+                oldest_unpaid_date=agg.oldest if agg else None,
+                updated_at=now
+            ))
+        db.add_all(rows)
+        await db.flush()
+        return len(rows)
@@ -0,0 +1,414 @@
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import DateTime, String, and_, case, cast, delete, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.crm import BalanceTransaction, BalanceTransactionType, MedicalOrganization
+from app.models.ledger import BonusLedger, LedgerType
+from app.models.sales import Invoice, InvoiceStatus, Payment, PaymentKind, Reservation, ReservationItem
+
+# Run order matters when repairing: orphaned payments go first so paid_amount is recomputed without them.
+CHECKS = ("orphaned_payments", "invoice_paid", "missing_accruals", "ineligible_accruals", "invoice_debt_entries")
+
+TOLERANCE = 0.01
+
+# Statuses derived from paid_amount; draft / approved / returned invoices keep theirs
+_PAYABLE_STATUSES = [InvoiceStatus.UNPAID.value, InvoiceStatus.PARTIAL.value, InvoiceStatus.PAID.value]
+
+# (ledger_category, per-unit amount column, reservation flag, note prefix) as accrued by process_payment
+_ACCRUAL_CATEGORIES = [
+    ("bonus", ReservationItem.marketing_amount, Reservation.is_bonus_eligible, "Бонус начислен"),
+    ("salary", ReservationItem.salary_amount, Reservation.is_salary_enabled, "Зарплата начислена"),
+]
+
+
+class _Touched:
+    """Organizations / med reps whose summaries must be refreshed after repairs."""
+
+    def __init__(self):
+        self.orgs: Set[int] = set()
+        self.users: Set[int] = set()
+
+
+# ── Checks ──────────────────────────────────────────────────────────────────
+# Each check finds its differences with one or two aggregate queries over the whole table and,
+# when `repair` is set, fixes them with set-based UPDATE / INSERT ... SELECT / DELETE statements.
+# Each returns (diff rows, repaired count).
+
+async def _orphaned_payments(db: AsyncSession, repair: bool, since: Optional[date], touched: _Touched):
+    """
+    Payments pointing to a missing or cancelled invoice (repaired: deleted). Payments without an invoice
+    are listed as "no_invoice" but never deleted: credit-balance receipts are recorded that way and
+    count as cash in (analytics.get_null_invoice_payments_query).
+    """
+    query = (
+        select(Payment.id.label("payment_id"), Payment.invoice_id, Payment.amount, Payment.date, Invoice.id.label("found_id"), Invoice.status)
+        .outerjoin(Invoice, Payment.invoice_id == Invoice.id)
+        .where(or_(Invoice.id.is_(None), Invoice.status == InvoiceStatus.CANCELLED))
+        .order_by(Payment.id)
+    )
+    if since:
+        query = query.where(Payment.date >= since)
+    rows = [
+        {"payment_id": r.payment_id, "invoice_id": r.invoice_id, "amount": r.amount, "date": r.date,
+         "reason": "no_invoice" if r.invoice_id is None else ("cancelled_invoice" if r.found_id else "missing_invoice")}
+        for r in (await db.execute(query)).all()
+    ]
+    ids = [r["payment_id"] for r in rows if r["reason"] != "no_invoice"]
+    if not repair or not ids:
+        return rows, 0
+
+    touched.users.update((await db.execute(
+        select(BonusLedger.user_id).distinct().where(BonusLedger.payment_id.in_(ids), BonusLedger.user_id.isnot(None))
+    )).scalars().all())
+    # Unpaid accruals earned by these payments go with them; paid-out history stays, unlinked
+    await db.execute(delete(BonusLedger).where(
+        BonusLedger.payment_id.in_(ids), BonusLedger.ledger_type == LedgerType.ACCRUAL, BonusLedger.is_paid == False
+    ))
+    await db.execute(update(BonusLedger).where(BonusLedger.payment_id.in_(ids)).values(payment_id=None))
+    await db.execute(update(BalanceTransaction).where(BalanceTransaction.payment_id.in_(ids)).values(payment_id=None))
+    await db.execute(update(Payment).where(Payment.source_payment_id.in_(ids)).values(source_payment_id=None))
+    result = await db.execute(delete(Payment).where(Payment.id.in_(ids)))
+    return rows, result.rowcount or 0
+
+
+async def _invoice_paid(db: AsyncSession, repair: bool, since: Optional[date], touched: _Touched):
+    """
+    Invoice.paid_amount that does not follow from its payments, or a status that does not follow from it.
+    An overpaid invoice (payments above the total) may carry anything between the total and the payment
+    sum: reservation approval lowers it by the credit balance it spends elsewhere, without a record of
+    which invoice gave how much, so only values outside that range are drift.
+    """
+    paid_sq = (
+        select(Payment.invoice_id, func.sum(Payment.amount).label("paid"))
+        .group_by(Payment.invoice_id)
+        .subquery()
+    )
+    paid = func.coalesce(paid_sq.c.paid, 0.0)
+    current = func.coalesce(Invoice.paid_amount, 0.0)
+    floor = case((paid < Invoice.total_amount, paid), else_=Invoice.total_amount)
+    capped = case((current > paid, paid), else_=current)
+    expected = case((capped > floor, capped), else_=floor)
+    status = _status_for(expected)
+    drift = (
+        select(
+            Invoice.id.label("invoice_id"),
+            Reservation.med_org_id,
+            Invoice.total_amount,
+            Invoice.paid_amount.label("current_paid"),
+            Invoice.status.label("current_status"),
+            expected.label("expected_paid"),
+            status.label("expected_status"),
+        )
+        .join(Reservation, Invoice.reservation_id == Reservation.id)
+        .outerjoin(paid_sq, paid_sq.c.invoice_id == Invoice.id)
+        .where(
+            Invoice.status != InvoiceStatus.CANCELLED,
+            or_(func.abs(current - expected) > TOLERANCE, Invoice.status != status),
+        )
+    )
+    if since:
+        drift = drift.where(Invoice.date >= since)
+    rows = [
+        {"invoice_id": r.invoice_id, "organization_id": r.med_org_id, "total_amount": r.total_amount,
+         "current_paid": r.current_paid, "expected_paid": float(r.expected_paid),
+         "current_status": r.current_status, "expected_status": r.expected_status}
+        for r in (await db.execute(drift.order_by(Invoice.id))).all()
+    ]
+    if not repair or not rows:
+        return rows, 0
+
+    touched.orgs.update(r["organization_id"] for r in rows)
+    fix = drift.subquery()
+    result = await db.execute(
+        update(Invoice)
+        .where(Invoice.id == fix.c.invoice_id)
+        .values(paid_amount=fix.c.expected_paid, status=fix.c.expected_status)
+        .execution_options(synchronize_session=False)
+    )
+    return rows, result.rowcount or 0
+
+
+def _status_for(paid):
+    derived = case(
+        (paid <= 0, InvoiceStatus.UNPAID.value),
+        (paid >= Invoice.total_amount, InvoiceStatus.PAID.value),
+        else_=InvoiceStatus.PARTIAL.value,
+    )
+    return case((Invoice.status.in_(_PAYABLE_STATUSES), derived), else_=Invoice.status)
+
+
+def _accrual_source(category: str, amount_col, flag_col, since: Optional[date]):
+    """
+    BonusLedger rows process_payment would have written and did not: one per direct payment and
+    category, amount = round(sum(quantity * per-unit amount) * payment / invoice total). The med rep
+    is resolved per organization afterwards (_target_reps).
+    """
+    items = (
+        select(ReservationItem.reservation_id, func.sum(ReservationItem.quantity * func.coalesce(amount_col, 0.0)).label("total"))
+        .group_by(ReservationItem.reservation_id)
+        .subquery()
+    )
+    amount = func.round(items.c.total * Payment.amount / Invoice.total_amount)
+    query = (
+        select(
+            Payment.id.label("payment_id"),
+            Payment.date,
+            Invoice.id.label("invoice_id"),
+            Reservation.med_org_id,
+            amount.label("amount"),
+        )
+        .select_from(Payment)
+        .join(Invoice, Payment.invoice_id == Invoice.id)
+        .join(Reservation, Invoice.reservation_id == Reservation.id)
+        .join(items, items.c.reservation_id == Reservation.id)
+        .where(
+            # Overflow payments (source_payment_id set) are covered by their source payment's accrual,
+            # credit-balance / tovar-skidka payments by the payment the money came from
+            Payment.source_payment_id.is_(None),
+            Payment.kind == PaymentKind.REGULAR,
+            Invoice.status != InvoiceStatus.CANCELLED,
+            Invoice.total_amount > 0,
+            Reservation.med_org_id.isnot(None),
+            flag_col == True,
+            amount > 0,
+            ~exists().where(
+                BonusLedger.payment_id == Payment.id,
+                BonusLedger.ledger_type == LedgerType.ACCRUAL,
+                BonusLedger.ledger_category == category,
+            ),
+        )
+    )
+    if since:
+        query = query.where(Payment.date >= since)
+    return query
+
+
+async def _target_reps(db: AsyncSession, org_ids: Set[int]) -> Dict[int, int]:
+    """Accruing med rep per organization, picked from assigned_reps exactly as process_payment does."""
+    from app.services.finance_service import FinancialService
+    if not org_ids:
+        return {}
+    orgs = (await db.execute(
+        select(MedicalOrganization).options(selectinload(MedicalOrganization.assigned_reps))
+        .where(MedicalOrganization.id.in_(org_ids))
+    )).scalars().all()
+    reps = {org.id: FinancialService.target_med_rep_id(org) for org in orgs}
+    return {org_id: rep_id for org_id, rep_id in reps.items() if rep_id}
+
+
+async def _missing_accruals(db: AsyncSession, repair: bool, since: Optional[date], touched: _Touched):
+    rows, repaired = [], 0
+    found_by_category = []
+    for category, amount_col, flag_col, note in _ACCRUAL_CATEGORIES:
+        source = _accrual_source(category, amount_col, flag_col, since)
+        found_by_category.append((category, note, (await db.execute(source.order_by(Payment.id))).all()))
+
+    reps = await _target_reps(db, {r.med_org_id for _, _, found in found_by_category for r in found})
+    now = datetime.utcnow()
+    for category, note, found in found_by_category:
+        # Without a MedRep on the organization process_payment accrues nothing either
+        found = [r for r in found if r.med_org_id in reps]
+        rows += [
+            {"payment_id": r.payment_id, "user_id": reps[r.med_org_id], "category": category,
+             "expected_amount": float(r.amount), "target_month": r.date.month, "target_year": r.date.year}
+            for r in found
+        ]
+        if repair and found:
+            await db.execute(insert(BonusLedger), [
+                {"user_id": reps[r.med_org_id], "amount": float(r.amount), "ledger_type": LedgerType.ACCRUAL,
+                 "ledger_category": category, "payment_id": r.payment_id, "target_month": r.date.month,
+                 "target_year": r.date.year, "notes": f"{note} по счет-фактуре #{r.invoice_id} (сверка)",
+                 "is_paid": False, "created_at": now}
+                for r in found
+            ])
+            touched.users.update(reps[r.med_org_id] for r in found)
+            repaired += len(found)
+    return rows, repaired
+
+
+async def _ineligible_accruals(db: AsyncSession, repair: bool, since: Optional[date], touched: _Touched):
+    """Payment accruals of a category the reservation is not eligible for (bonus / salary switched off)."""
+    query = (
+        select(
+            BonusLedger.id.label("ledger_id"), BonusLedger.user_id, BonusLedger.payment_id,
+            BonusLedger.ledger_category, BonusLedger.amount, BonusLedger.is_paid, Reservation.id.label("reservation_id"),
+        )
+        .join(Payment, BonusLedger.payment_id == Payment.id)
+        .join(Invoice, Payment.invoice_id == Invoice.id)
+        .join(Reservation, Invoice.reservation_id == Reservation.id)
+        .where(
+            BonusLedger.ledger_type == LedgerType.ACCRUAL,
+            or_(
+                and_(BonusLedger.ledger_category == "salary", Reservation.is_salary_enabled == False),
+                and_(BonusLedger.ledger_category == "bonus", Reservation.is_bonus_eligible == False),
+            ),
+        )
+        .order_by(BonusLedger.id)
+    )
+    if since:
+        query = query.where(Payment.date >= since)
+    rows = [dict(r._mapping) for r in (await db.execute(query)).all()]
+    if not repair or not rows:
+        return rows, 0
+
+    touched.users.update(r["user_id"] for r in rows if r["user_id"])
+    result = await db.execute(delete(BonusLedger).where(BonusLedger.id.in_([r["ledger_id"] for r in rows])))
+    return rows, result.rowcount or 0
+
+
+async def _invoice_debt_entries(db: AsyncSession, repair: bool, since: Optional[date], touched: _Touched):
+    """
+    The INVOICE BalanceTransaction (debt entry, amount = -total) of each invoice of an organization:
+    missing, duplicated, with a different amount, or still present on a cancelled invoice.
+    """
+    is_invoice_entry = BalanceTransaction.transaction_type == BalanceTransactionType.INVOICE
+    entries = (
+        select(
+            BalanceTransaction.related_invoice_id.label("invoice_id"),
+            func.count().label("entries"),
+            func.sum(BalanceTransaction.amount).label("amount"),
+        )
+        .where(is_invoice_entry, BalanceTransaction.related_invoice_id.isnot(None))
+        .group_by(BalanceTransaction.related_invoice_id)
+        .subquery()
+    )
+    cancelled = Invoice.status == InvoiceStatus.CANCELLED
+    query = (
+        select(
+            Invoice.id.label("invoice_id"), Reservation.med_org_id, Invoice.total_amount, Invoice.status,
+            entries.c.entries, entries.c.amount,
+        )
+        .join(Reservation, Invoice.reservation_id == Reservation.id)
+        .outerjoin(entries, entries.c.invoice_id == Invoice.id)
+        .where(or_(
+            and_(cancelled, entries.c.entries.isnot(None)),
+            and_(
+                ~cancelled,
+                Reservation.med_org_id.isnot(None),
+                or_(
+                    entries.c.entries.is_(None),
+                    entries.c.entries > 1,
+                    func.abs(entries.c.amount + Invoice.total_amount) > TOLERANCE,
+                ),
+            ),
+        ))
+        .order_by(Invoice.id)
+    )
+    if since:
+        query = query.where(Invoice.date >= since)
+
+    rows = []
+    for r in (await db.execute(query)).all():
+        if r.status == InvoiceStatus.CANCELLED:
+            problem = "cancelled_invoice"
+        elif r.entries is None:
+            problem = "missing"
+        elif r.entries > 1:
+            problem = "duplicate"
+        else:
+            problem = "amount"
+        rows.append({
+            "invoice_id": r.invoice_id, "organization_id": r.med_org_id, "problem": problem,
+            "entries": r.entries or 0, "current_amount": r.amount, "expected_amount": -r.total_amount,
+        })
+    if not repair or not rows:
+        return rows, 0
+
+    by_problem: Dict[str, List[int]] = {}
+    for r in rows:
+        by_problem.setdefault(r["problem"], []).append(r["invoice_id"])
+
+    if by_problem.get("cancelled_invoice"):
+        await db.execute(delete(BalanceTransaction).where(
+            is_invoice_entry, BalanceTransaction.related_invoice_id.in_(by_problem["cancelled_invoice"])
+        ))
+    if by_problem.get("duplicate"):
+        # Keep the earliest entry of each invoice
+        first = aliased(BalanceTransaction)
+        await db.execute(delete(BalanceTransaction).where(
+            is_invoice_entry,
+            BalanceTransaction.related_invoice_id.in_(by_problem["duplicate"]),
+            BalanceTransaction.id > select(func.min(first.id)).where(
+                first.related_invoice_id == BalanceTransaction.related_invoice_id,
+                first.transaction_type == BalanceTransactionType.INVOICE,
+            ).scalar_subquery(),
+        ).execution_options(synchronize_session=False))
+    to_amend = by_problem.get("duplicate", []) + by_problem.get("amount", [])
+    if to_amend:
+        await db.execute(update(BalanceTransaction).where(
+            is_invoice_entry, BalanceTransaction.related_invoice_id.in_(to_amend)
+        ).values(
+            amount=-select(Invoice.total_amount).where(Invoice.id == BalanceTransaction.related_invoice_id).scalar_subquery()
+        ).execution_options(synchronize_session=False))
+    if by_problem.get("missing"):
+        await db.execute(insert(BalanceTransaction).from_select(
+            ["organization_id", "amount", "transaction_type", "related_invoice_id", "comment", "created_at"],
+            select(
+                Reservation.med_org_id,
+                -Invoice.total_amount,
+                literal(BalanceTransactionType.INVOICE.value),
+                Invoice.id,
+                literal("Начисление долга по счету #") + func.coalesce(Invoice.factura_number, cast(Invoice.id, String)) + literal(" (сверка)"),
+                func.coalesce(Invoice.date, literal(datetime.utcnow(), DateTime)),
+            )
+            .join(Reservation, Invoice.reservation_id == Reservation.id)
+            .where(Invoice.id.in_(by_problem["missing"]))
+        ))
+    return rows, len(rows)
+
+
+_CHECK_FUNCTIONS = {
+    "orphaned_payments": _orphaned_payments,
+    "invoice_paid": _invoice_paid,
+    "missing_accruals": _missing_accruals,
+    "ineligible_accruals": _ineligible_accruals,
+    "invoice_debt_entries": _invoice_debt_entries,
+}
+
+
+class ReconciliationService:
+    """
+    Consistency checks between invoices, payments, the bonus ledger and balance transactions
+    (replaces the one-off fix_* scripts). Dry run by default: the report lists what differs and
+    nothing is written. With `repair` every fix runs in one transaction, then receivables and
+    bonus balances of the touched organizations / med reps are refreshed and it is committed.
+    """
+
+    @staticmethod
+    async def run(
+        db: AsyncSession,
+        checks: Optional[Iterable[str]] = None,
+        repair: bool = False,
+        since: Optional[date] = None,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """`since` limits checks to payments / invoices dated from then; `limit` caps the rows listed per check."""
+        selected = [c for c in CHECKS if checks is None or c in set(checks)]
+        touched = _Touched()
+        report = {"dry_run": not repair, "since": since, "checks": {}}
+        started = time.monotonic()
+        try:
+            for name in selected:
+                check_started = time.monotonic()
+                rows, repaired = await _CHECK_FUNCTIONS[name](db, repair, since, touched)
+                report["checks"][name] = {
+                    "found": len(rows),
+                    "repaired": repaired,
+                    "rows": rows if limit is None else rows[:limit],
+                    "elapsed_ms": round((time.monotonic() - check_started) * 1000),
+                }
+            if repair:
+                from app.services.receivable_service import ReceivableService
+                from app.services.bonus_balance_service import BonusBalanceService
+                await ReceivableService.refresh(db, touched.orgs)
+                await BonusBalanceService.recompute(db, touched.users)
+                await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        report["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+        return report
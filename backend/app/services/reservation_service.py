@@ -7,7 +7,7 @@ from sqlalchemy import select, update
 
 from sqlalchemy.orm import selectinload
 from fastapi import HTTPException
-from app.models.sales import Reservation, ReservationItem, ReservationStatus, Invoice, InvoiceStatus, UnassignedSale, Payment, PaymentType
+from app.models.sales import Reservation, ReservationItem, ReservationStatus, Invoice, InvoiceStatus, UnassignedSale, Payment, PaymentType, PaymentKind
 from app.models.warehouse import Warehouse, Stock, StockMovement, StockMovementType
 from app.models.crm import MedicalOrganization, Region, MedicalOrganizationStock
 from app.models.product import Product
@@ -285,13 +285,9 @@ class ReservationService:
                         db.add(wh_stock)
 
             # 6. Create UnassignedSale records for the assigned MedRep (not necessarily creator)
-            # Find the primary MedRep for this pharmacy
-            target_med_rep_id = reservation.created_by_id # Fallback
-            if reservation.med_org and reservation.med_org.assigned_reps:
-                for rep in reservation.med_org.assigned_reps:
-                    if rep.role == UserRole.MED_REP:
-                        target_med_rep_id = rep.id
-                        break
+            # The pharmacy's owner MedRep (same rule as payments and stats), creator as fallback
+            from app.services.finance_service import FinancialService
+            target_med_rep_id = FinancialService.target_med_rep_id(reservation.med_org) or reservation.created_by_id
 
             for item in reservation.items:
                 sale_query = select(UnassignedSale).where(
@@ -310,6 +306,8 @@ class ReservationService:
                     )
                     db.add(unassigned)
 
+            auto_payments = []
+
             # 6. Apply existing credit balance (kreditorka)
             if reservation.med_org and (reservation.med_org.credit_balance or 0) > 0:
                 credit_to_apply = min(reservation.med_org.credit_balance, invoice.total_amount - invoice.paid_amount)
@@ -354,10 +352,12 @@ class ReservationService:
                         invoice_id=invoice.id,
                         amount=credit_to_apply,
                         payment_type=PaymentType.BANK,
+                        kind=PaymentKind.CREDIT_BALANCE,
                         processed_by_id=reservation.created_by_id,
                         comment=f"Автоматическая оплата с баланса (Кредиторка). Сумма: {credit_to_apply:,.0f} UZS"
                     )
                     db.add(credit_payment)
+                    auto_payments.append(credit_payment)
 
             # 6.5. Apply Tovar Skidka (Promo balance from another invoice)
             if reservation.is_tovar_skidka and reservation.source_invoice_id:
@@ -381,10 +381,12 @@ class ReservationService:
                             invoice_id=invoice.id,
                             amount=needed,
                             payment_type=PaymentType.OTHER,
+                            kind=PaymentKind.TOVAR_SKIDKA,
                             processed_by_id=reservation.created_by_id,
                             comment=f"Оплачено за счет промо-суммы накладной #{source_inv.id}"
                         )
                         db.add(promo_payment)
+                        auto_payments.append(promo_payment)
                         
                         # Set source invoice promo to 0 as per user request
                         source_inv.promo_balance = 0 
@@ -395,6 +397,15 @@ class ReservationService:
 
             # 7. Update status
             reservation.status = ReservationStatus.APPROVED
+
+            # 8. Dashboard counters (DoctorMonthlyStat)
+            from app.services.stats_service import StatsService
+            await StatsService.record_sale(db, reservation, invoice)
+            for auto_payment in auto_payments:
+                await StatsService.record_payment(db, invoice.id, auto_payment.amount, auto_payment.date)
+
+            from app.services.receivable_service import ReceivableService
+            await ReceivableService.refresh(db, [reservation.med_org_id])
             
             await db.commit()
 
@@ -481,6 +492,11 @@ class ReservationService:
                     if pharm:
                         pharm.quantity = max(0, pharm.quantity - item.quantity)
 
+            # 4.5 Remove the sale from dashboard counters (DoctorMonthlyStat)
+            if reservation.status == ReservationStatus.APPROVED:
+                from app.services.stats_service import StatsService
+                await StatsService.record_sale(db, reservation, invoice, sign=-1)
+
             # 5. Manually clean up invoice-related records (no cascade on Invoice relation)
             if invoice:
                 # Delete payments (no cascade from Invoice → Payment by default)
@@ -501,6 +517,10 @@ class ReservationService:
 
             # 6. Delete reservation (items cascade via "all, delete-orphan")
             await db.delete(reservation)
+
+            from app.services.receivable_service import ReceivableService
+            await ReceivableService.refresh(db, [reservation.med_org_id])
+
             await db.commit()
             return True
 
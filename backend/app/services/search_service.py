@@ -0,0 +1,118 @@
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.crm import Doctor, MedicalOrganization
+from app.models.sales import Invoice, Reservation
+from app.models.user import User, UserRole
+
+SEARCH_TYPES = ("doctors", "organizations", "reps", "invoices")
+
+
+def _doctors():
+    query = (
+        select(Doctor.id, Doctor.full_name.label("title"), MedicalOrganization.name.label("subtitle"))
+        .outerjoin(MedicalOrganization, Doctor.med_org_id == MedicalOrganization.id)
+        .where(Doctor.is_active == True)
+    )
+    return query, [Doctor.full_name]
+
+
+def _organizations():
+    query = select(MedicalOrganization.id, MedicalOrganization.name.label("title"), MedicalOrganization.inn.label("subtitle"))
+    return query, [MedicalOrganization.name, MedicalOrganization.inn]
+
+
+def _reps():
+    query = (
+        select(User.id, User.full_name.label("title"), User.username.label("subtitle"))
+        .where(User.is_active == True, User.role == UserRole.MED_REP)
+    )
+    return query, [User.full_name, User.username]
+
+
+def _invoices(rep_ids: Optional[List[int]] = None):
+    query = (
+        select(Invoice.id, func.coalesce(Invoice.factura_number, "").label("title"), Reservation.customer_name.label("subtitle"))
+        .join(Reservation, Invoice.reservation_id == Reservation.id)
+    )
+    if rep_ids is not None:
+        query = query.outerjoin(MedicalOrganization, Reservation.med_org_id == MedicalOrganization.id).where(
+            Reservation.created_by_id.in_(rep_ids) | MedicalOrganization.assigned_reps.any(User.id.in_(rep_ids))
+        )
+    return query, [Invoice.factura_number, Reservation.customer_name]
+
+
+def _python_score(q: str, values: Iterable[Optional[str]]) -> float:
+    """SQLite fallback ranking: prefix matches first, then a similarity ratio (0..1) like pg_trgm's."""
+    q = q.lower()
+    best = 0.0
+    for value in values:
+        if not value:
+            continue
+        value = value.lower()
+        score = SequenceMatcher(None, q, value).ratio()
+        if value.startswith(q):
+            score += 1
+        best = max(best, score)
+    return best
+
+
+class SearchService:
+    """
+    Ranked name / number search over doctors, organizations, med reps and invoices.
+    On PostgreSQL matches use the pg_trgm GIN indexes (ILIKE '%q%' or trigram similarity, so small typos
+    still match) and are ordered by prefix match, then similarity. Other backends (SQLite in local
+    testing) use plain LIKE and rank the candidates in Python.
+    """
+
+    @staticmethod
+    async def search(
+        db: AsyncSession,
+        q: str,
+        types: Iterable[str] = SEARCH_TYPES,
+        limit: int = 10,
+        rep_ids: Optional[List[int]] = None
+    ) -> Dict[str, List[dict]]:
+        """`rep_ids` (None = everything) limits invoices to those of these med reps or their organizations."""
+        q = q.strip()
+        results = {}
+        for kind in types:
+            if kind == "doctors":
+                query, columns = _doctors()
+            elif kind == "organizations":
+                query, columns = _organizations()
+            elif kind == "reps":
+                query, columns = _reps()
+            elif kind == "invoices":
+                query, columns = _invoices(rep_ids)
+            else:
+                continue
+            results[kind] = await SearchService._ranked(db, query, columns, q, limit) if q else []
+        return results
+
+    @staticmethod
+    async def _ranked(db: AsyncSession, query, columns, q: str, limit: int) -> List[dict]:
+        contains = or_(*[col.icontains(q, autoescape=True) for col in columns])
+        if db.bind.dialect.name == "postgresql":
+            prefix = or_(*[col.istartswith(q, autoescape=True) for col in columns])
+            similarity = func.greatest(*[func.coalesce(func.similarity(col, q), 0) for col in columns])
+            score = (case((prefix, 1.0), else_=0.0) + similarity).label("score")
+            rows = (await db.execute(
+                query.add_columns(score)
+                .where(or_(contains, *[col.op("%")(q) for col in columns]))
+                .order_by(score.desc(), query.selected_columns[0])
+                .limit(limit)
+            )).all()
+            return [{"id": r.id, "title": r.title, "subtitle": r.subtitle, "score": round(float(r.score), 3)} for r in rows]
+
+        # Fallback: LIKE candidates, ranked here (bounded so a one-letter query stays cheap)
+        rows = (await db.execute(query.add_columns(*[col.label(f"_m{i}") for i, col in enumerate(columns)]).where(contains).limit(limit * 20))).all()
+        ranked = sorted(
+            ({"id": r.id, "title": r.title, "subtitle": r.subtitle,
+              "score": round(_python_score(q, [getattr(r, f"_m{i}") for i in range(len(columns))]), 3)} for r in rows),
+            key=lambda x: (-x["score"], x["id"])
+        )
+        return ranked[:limit]
@@ -0,0 +1,274 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func
+
+from app.db.session import dialect_insert
+from app.models.ledger import BonusLedger, LedgerType, DoctorMonthlyStat, DOCTOR_MONTHLY_STAT_KEY
+from app.models.sales import Reservation, ReservationItem, ReservationStatus, Invoice, Payment, DoctorFactAssignment
+from app.models.crm import medrep_organization
+from app.models.user import User, UserRole
+
+# (med_rep_id, doctor_id, product_id, month, year)
+StatKey = Tuple[Optional[int], Optional[int], int, int, int]
+
+STAT_FIELDS = ("sold_quantity", "sold_amount", "paid_quantity", "paid_amount", "bonus_amount")
+
+
+def _line_amount(item: ReservationItem, nds_percent: Optional[float]) -> float:
+    """Net (after returns) line amount including discount and NDS — the same basis as Invoice.total_amount."""
+    qty = (item.quantity or 0) - (item.returned_quantity or 0)
+    plain = qty * (item.price or 0.0) * (1 - (item.discount_percent or 0.0) / 100.0)
+    return plain * (1 + (nds_percent or 0.0) / 100.0)
+
+
+class StatsService:
+    """
+    Maintains the DoctorMonthlyStat rollup.
+
+    Rows with doctor_id = NULL hold MedRep level sales (sold on approval, paid on payment)
+    booked to the rep that owns the pharmacy. Rows with a doctor hold the facts a MedRep
+    attributed to that doctor. Every writer calls one of the record_* hooks inside its own
+    transaction; `rebuild` recomputes the whole table from source rows and is authoritative.
+    """
+
+    @staticmethod
+    async def get_owner_rep_ids(db: AsyncSession, med_org_ids: Iterable[Optional[int]]) -> Dict[int, int]:
+        """Owner rep per organization: its lowest-id assigned MedRep (organizations without one are left out)."""
+        med_org_ids = {org_id for org_id in med_org_ids if org_id}
+        if not med_org_ids:
+            return {}
+        rows = await db.execute(
+            select(medrep_organization.c.organization_id, func.min(User.id))
+            .join(User, medrep_organization.c.user_id == User.id)
+            .where(
+                medrep_organization.c.organization_id.in_(med_org_ids),
+                User.role == UserRole.MED_REP
+            )
+            .group_by(medrep_organization.c.organization_id)
+        )
+        return dict(rows.all())
+
+    @staticmethod
+    async def get_owner_rep_id(db: AsyncSession, med_org_id: Optional[int], fallback_id: Optional[int]) -> Optional[int]:
+        """Lowest-id MedRep assigned to the organization, falling back to the reservation creator."""
+        return (await StatsService.get_owner_rep_ids(db, [med_org_id])).get(med_org_id) or fallback_id
+
+    @staticmethod
+    async def _apply(db: AsyncSession, deltas: Dict[StatKey, Dict[str, float]]):
+        """
+        Upserts accumulated deltas in one statement: INSERT … ON CONFLICT (the coalesced key index)
+        DO UPDATE SET x = x + excluded.x, so concurrent writers of a new key cannot insert it twice.
+        """
+        deltas = {k: v for k, v in deltas.items() if any(v.values())}
+        if not deltas:
+            return
+
+        rows = []
+        # Key order keeps row locks in the same order across concurrent transactions
+        for key in sorted(deltas, key=lambda k: tuple(part or 0 for part in k)):
+            rep_id, doctor_id, product_id, month, year = key
+            row = {
+                "med_rep_id": rep_id, "doctor_id": doctor_id, "product_id": product_id,
+                "month": month, "year": year, "plan_quantity": 0,
+            }
+            for field in STAT_FIELDS:
+                value = deltas[key].get(field, 0)
+                row[field] = int(round(value)) if field.endswith("_quantity") else float(value)
+            rows.append(row)
+
+        table = DoctorMonthlyStat.__table__
+        stmt = dialect_insert(db.bind, DoctorMonthlyStat).values(rows)
+        set_ = {field: func.coalesce(table.c[field], 0) + stmt.excluded[field] for field in STAT_FIELDS}
+        set_["updated_at"] = datetime.utcnow()
+        await db.execute(stmt.on_conflict_do_update(index_elements=list(DOCTOR_MONTHLY_STAT_KEY), set_=set_))
+
+    @staticmethod
+    def _sale_deltas(reservation: Reservation, invoice: Optional[Invoice], rep_id: Optional[int], sign: int, deltas=None):
+        deltas = deltas if deltas is not None else defaultdict(lambda: defaultdict(float))
+        booked_at = (invoice.realization_date or invoice.date) if invoice else None
+        booked_at = booked_at or reservation.date or datetime.utcnow()
+        for item in reservation.items:
+            key = (rep_id, None, item.product_id, booked_at.month, booked_at.year)
+            deltas[key]["sold_quantity"] += sign * ((item.quantity or 0) - (item.returned_quantity or 0))
+            deltas[key]["sold_amount"] += sign * _line_amount(item, reservation.nds_percent)
+        return deltas
+
+    @staticmethod
+    def _payment_deltas(items: Iterable[ReservationItem], nds_percent, invoice_total: float, amount: float,
+                        paid_at: datetime, rep_id: Optional[int], sign: int, deltas=None, paid_before: float = 0.0):
+        """
+        Pro-rata share of a payment. `paid_before` is what the invoice had been paid without this
+        payment: paid_quantity is the step of the rounded cumulative paid quantity, so partial
+        payments add up to the line quantity instead of drifting by a rounding per payment.
+        """
+        deltas = deltas if deltas is not None else defaultdict(lambda: defaultdict(float))
+        if not invoice_total or invoice_total <= 0 or not amount:
+            return deltas
+        ratio = amount / invoice_total
+        before = min(1.0, max(0.0, (paid_before or 0.0) / invoice_total))
+        after = min(1.0, max(0.0, ((paid_before or 0.0) + amount) / invoice_total))
+        for item in items:
+            key = (rep_id, None, item.product_id, paid_at.month, paid_at.year)
+            qty = (item.quantity or 0) - (item.returned_quantity or 0)
+            deltas[key]["paid_quantity"] += sign * (int(round(qty * after)) - int(round(qty * before)))
+            deltas[key]["paid_amount"] += sign * _line_amount(item, nds_percent) * ratio
+        return deltas
+
+    @staticmethod
+    async def record_sale(db: AsyncSession, reservation: Reservation, invoice: Optional[Invoice] = None, sign: int = 1):
+        """Books (sign=1) or un-books (sign=-1) an approved reservation. Requires `reservation.items` loaded."""
+        rep_id = await StatsService.get_owner_rep_id(db, reservation.med_org_id, reservation.created_by_id)
+        await StatsService._apply(db, StatsService._sale_deltas(reservation, invoice, rep_id, sign))
+
+    @staticmethod
+    async def record_return(db: AsyncSession, reservation: Reservation, invoice: Optional[Invoice], returned: Dict[int, int]):
+        """Removes returned quantities ({reservation item id: qty}) from the month the sale was booked to."""
+        if not returned:
+            return
+        rep_id = await StatsService.get_owner_rep_id(db, reservation.med_org_id, reservation.created_by_id)
+        booked_at = (invoice.realization_date or invoice.date) if invoice else None
+        booked_at = booked_at or reservation.date or datetime.utcnow()
+        deltas = defaultdict(lambda: defaultdict(float))
+        nds_multiplier = 1 + (reservation.nds_percent or 0.0) / 100.0
+        for item in reservation.items:
+            # Per line: the same product can appear on several lines with different prices / discounts
+            qty = returned.get(item.id, 0)
+            if qty <= 0:
+                continue
+            key = (rep_id, None, item.product_id, booked_at.month, booked_at.year)
+            deltas[key]["sold_quantity"] -= qty
+            deltas[key]["sold_amount"] -= qty * item.price * (1 - (item.discount_percent or 0.0) / 100.0) * nds_multiplier
+        await StatsService._apply(db, deltas)
+
+    @staticmethod
+    async def record_payment(db: AsyncSession, invoice_id: int, amount: float, paid_at: Optional[datetime] = None, sign: int = 1):
+        """
+        Books (sign=1) or reverses (sign=-1) a payment against an invoice.
+        The amount is spread over the invoice lines pro-rata, in the month the payment was received.
+        The payment must still be in the session (added before booking, deleted after reversing).
+        """
+        if not invoice_id or not amount:
+            return
+        result = await db.execute(
+            select(Invoice.total_amount, Reservation.med_org_id, Reservation.created_by_id, Reservation.nds_percent, Reservation.id)
+            .join(Reservation, Invoice.reservation_id == Reservation.id)
+            .where(Invoice.id == invoice_id)
+        )
+        row = result.first()
+        if not row:
+            return
+        invoice_total, med_org_id, created_by_id, nds_percent, reservation_id = row
+        items = (await db.execute(
+            select(ReservationItem).where(ReservationItem.reservation_id == reservation_id)
+        )).scalars().all()
+        rep_id = await StatsService.get_owner_rep_id(db, med_org_id, created_by_id)
+        # Callers book a payment after adding it and reverse one before deleting it,
+        # so the invoice's payment total includes `amount` either way
+        paid_total = (await db.execute(
+            select(func.coalesce(func.sum(Payment.amount), 0.0)).where(Payment.invoice_id == invoice_id)
+        )).scalar() or 0.0
+        deltas = StatsService._payment_deltas(
+            items, nds_percent, invoice_total, amount, paid_at or datetime.utcnow(), rep_id, sign,
+            paid_before=max(0.0, paid_total - amount)
+        )
+        await StatsService._apply(db, deltas)
+
+    @staticmethod
+    async def record_fact(db: AsyncSession, fact: DoctorFactAssignment, bonus_amount: float = 0.0, sign: int = 1):
+        """Books a doctor fact assignment (and the doctor bonus accrued for it) to the doctor row."""
+        key = (fact.med_rep_id, fact.doctor_id, fact.product_id, fact.month, fact.year)
+        deltas = {key: {
+            "paid_quantity": sign * (fact.quantity or 0),
+            "paid_amount": sign * (fact.amount or 0.0),
+            "bonus_amount": sign * (bonus_amount or 0.0),
+        }}
+        await StatsService._apply(db, deltas)
+
+    @staticmethod
+    async def rebuild(db: AsyncSession) -> int:
+        """
+        Recomputes DoctorMonthlyStat from scratch:
+        - sales from approved reservations (booked to the invoice realization month),
+        - payments from the Payment table (booked to the payment month),
+        - doctor rows from DoctorFactAssignment and the doctor bonus accruals linked to them.
+        Returns the number of rows written. The caller commits.
+        """
+        deltas = defaultdict(lambda: defaultdict(float))
+
+        reservations = (await db.execute(
+            select(Reservation, Invoice)
+            .join(Invoice, Invoice.reservation_id == Reservation.id, isouter=True)
+        )).all()
+        owners = await StatsService.get_owner_rep_ids(db, {reservation.med_org_id for reservation, _ in reservations})
+        items_by_res = defaultdict(list)
+        for item in (await db.execute(select(ReservationItem))).scalars().all():
+            items_by_res[item.reservation_id].append(item)
+
+        by_invoice = {}
+        for reservation, invoice in reservations:
+            items = items_by_res.get(reservation.id, [])
+            rep_id = owners.get(reservation.med_org_id) or reservation.created_by_id
+            if invoice:
+                by_invoice[invoice.id] = (invoice, reservation, items, rep_id)
+            if reservation.status != ReservationStatus.APPROVED:
+                continue
+            booked_at = (invoice.realization_date or invoice.date) if invoice else None
+            booked_at = booked_at or reservation.date or datetime.utcnow()
+            for item in items:
+                key = (rep_id, None, item.product_id, booked_at.month, booked_at.year)
+                deltas[key]["sold_quantity"] += (item.quantity or 0) - (item.returned_quantity or 0)
+                deltas[key]["sold_amount"] += _line_amount(item, reservation.nds_percent)
+
+        payments = await db.execute(
+            select(Payment.invoice_id, Payment.amount, Payment.date)
+            .order_by(Payment.invoice_id, Payment.date, Payment.id)
+        )
+        paid_so_far = defaultdict(float)
+        for invoice_id, amount, paid_at in payments.all():
+            entry = by_invoice.get(invoice_id)
+            if not entry:
+                continue
+            invoice, reservation, items, rep_id = entry
+            StatsService._payment_deltas(
+                items, reservation.nds_percent, invoice.total_amount, amount,
+                paid_at or invoice.date or datetime.utcnow(), rep_id, 1, deltas,
+                paid_before=paid_so_far[invoice_id]
+            )
+            paid_so_far[invoice_id] += amount or 0.0
+
+        fact_bonus = dict((await db.execute(
+            select(BonusLedger.fact_id, func.sum(BonusLedger.amount))
+            .where(
+                BonusLedger.fact_id.isnot(None),
+                BonusLedger.doctor_id.isnot(None),
+                BonusLedger.ledger_type == LedgerType.ACCRUAL
+            )
+            .group_by(BonusLedger.fact_id)
+        )).all())
+        facts = (await db.execute(select(DoctorFactAssignment))).scalars().all()
+        for fact in facts:
+            key = (fact.med_rep_id, fact.doctor_id, fact.product_id, fact.month, fact.year)
+            deltas[key]["paid_quantity"] += fact.quantity or 0
+            deltas[key]["paid_amount"] += fact.amount or 0.0
+            deltas[key]["bonus_amount"] += fact_bonus.get(fact.id, 0.0) or 0.0
+
+        await db.execute(delete(DoctorMonthlyStat))
+        rows = []
+        for (rep_id, doctor_id, product_id, month, year), values in deltas.items():
+            if product_id is None:
+                continue
+            rows.append(DoctorMonthlyStat(
+                med_rep_id=rep_id, doctor_id=doctor_id, product_id=product_id,
+                month=month, year=year, plan_quantity=0,
+                sold_quantity=int(values.get("sold_quantity", 0)),
+                sold_amount=float(values.get("sold_amount", 0.0)),
+                paid_quantity=int(values.get("paid_quantity", 0)),
+                paid_amount=float(values.get("paid_amount", 0.0)),
+                bonus_amount=float(values.get("bonus_amount", 0.0)),
+            ))
+        db.add_all(rows)
+        await db.flush()
+        return len(rows)
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.core.config import settings
+from app.models.user import User, RolePermission
+from app.models.crm import Region
+
+# Authenticated users by id: (expires_at, detached User copy with assigned_regions loaded).
+# get_current_user merges the copy into the request session with load=False, so a hit costs no SQL
+# and each request still gets its own instance to read or modify.
+_users: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+
+_DIRTY_USERS = "user_cache_dirty_ids"
+_DIRTY_ALL = "user_cache_dirty_all"
+# Bulk statements on these tables can change any cached user (role, is_active, regions, region names)
+_TRACKED_TABLES = {User.__table__.name, Region.__table__.name, "user_regions", RolePermission.__table__.name}
+
+
+def _detached_copy(instance):
+    """Column-only copy of a loaded instance, marked as a clean detached row of the same identity."""
+    mapper = inspect(instance).mapper
+    copy = mapper.class_()
+    for attr in mapper.column_attrs:
+        set_committed_value(copy, attr.key, getattr(instance, attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
+
+class UserCache:
+    @staticmethod
+    def get(user_id: int) -> Optional[User]:
+        entry = _users.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            _users.pop(user_id, None)
+            return None
+        _users.move_to_end(user_id)
+        return user
+
+    @staticmethod
+    def set(user: User):
+        """Caches a copy of `user` (which must have assigned_regions loaded); the instance itself is not kept."""
+        copy = _detached_copy(user)
+        # set_committed_value: no backref into Region.assigned_users, nothing marked as changed
+        set_committed_value(copy, "assigned_regions", [_detached_copy(r) for r in user.assigned_regions])
+        _users[user.id] = (time.monotonic() + settings.USER_CACHE_TTL_SECONDS, copy)
+        _users.move_to_end(user.id)
+        while len(_users) > settings.USER_CACHE_MAX_ENTRIES:
+            _users.popitem(last=False)
+
+    @staticmethod
+    def invalidate(user_id: Optional[int] = None):
+        """Drops one user, or everyone when user_id is None. Committed ORM writes call this automatically."""
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(user_id, None)
+
+
+# ── Write-driven invalidation ───────────────────────────────────────────────
+# crud_user.update, the users endpoints (role, regions, deactivation) and role permission edits all
+# go through ORM sessions; the affected entries are dropped once the commit lands.
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_users(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault(_DIRTY_USERS, set()).add(obj.id)
+        elif isinstance(obj, (Region, RolePermission)):
+            session.info[_DIRTY_ALL] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and table.name in _TRACKED_TABLES:
+            orm_execute_state.session.info[_DIRTY_ALL] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop(_DIRTY_ALL, False):
+        UserCache.invalidate()
+    for user_id in session.info.pop(_DIRTY_USERS, ()):
+        UserCache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop(_DIRTY_ALL, None)
+    session.info.pop(_DIRTY_USERS, None)
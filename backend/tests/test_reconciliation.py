@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.db.base  # noqa: F401  (registers every model)
+from app.db.base_class import Base
+from app.models.crm import BalanceTransaction, BalanceTransactionType, MedicalOrganization
+from app.models.sales import Invoice, InvoiceStatus, Payment, Reservation
+from app.models.user import User, UserRole
+from app.services.reconciliation_service import ReconciliationService
+
+
+async def _repair_orphans(db_path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as db:
+        rep = User(username="rep", full_name="Rep", hashed_password="x", role=UserRole.MED_REP)
+        org = MedicalOrganization(name="Apteka")
+        db.add_all([rep, org])
+        await db.flush()
+        reservation = Reservation(customer_name="Apteka", created_by_id=rep.id, med_org_id=org.id, total_amount=100)
+        db.add(reservation)
+        await db.flush()
+        cancelled = Invoice(reservation_id=reservation.id, total_amount=100, paid_amount=0, status=InvoiceStatus.CANCELLED, date=datetime(2026, 5, 1))
+        db.add(cancelled)
+        await db.flush()
+
+        # Credit-balance receipt: no invoice, linked to the organization through its balance transaction
+        balance_payment = Payment(invoice_id=None, amount=250, date=datetime(2026, 5, 2))
+        on_cancelled = Payment(invoice_id=cancelled.id, amount=40, date=datetime(2026, 5, 3))
+        on_missing = Payment(invoice_id=9999, amount=10, date=datetime(2026, 5, 4))
+        db.add_all([balance_payment, on_cancelled, on_missing])
+        await db.flush()
+        db.add(BalanceTransaction(organization_id=org.id, amount=250, transaction_type=BalanceTransactionType.TOPUP, payment_id=balance_payment.id))
+        await db.commit()
+
+        report = await ReconciliationService.run(db, checks=["orphaned_payments"], repair=True)
+        remaining = (await db.execute(select(Payment.id))).scalars().all()
+    await engine.dispose()
+    return report["checks"]["orphaned_payments"], remaining, balance_payment.id, on_cancelled.id, on_missing.id
+
+
+def test_repair_keeps_balance_payments(tmp_path):
+    check, remaining, balance_id, cancelled_id, missing_id = asyncio.run(_repair_orphans(str(tmp_path / "reconcile.db")))
+
+    reasons = {row["payment_id"]: row["reason"] for row in check["rows"]}
+    assert reasons == {balance_id: "no_invoice", cancelled_id: "cancelled_invoice", missing_id: "missing_invoice"}
+    assert check["repaired"] == 2
+    assert remaining == [balance_id]
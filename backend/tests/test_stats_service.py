@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.db.base  # noqa: F401  (registers every model)
+from app.db.base_class import Base
+from app.models.crm import MedicalOrganization, medrep_organization
+from app.models.ledger import DoctorMonthlyStat
+from app.models.product import Category, Product
+from app.models.sales import Invoice, InvoiceStatus, Payment, Reservation, ReservationItem
+from app.models.user import User, UserRole
+from app.services.stats_service import StatsService
+
+
+async def _pay_in_thirds(db_path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as db:
+        first = User(username="first", full_name="First", hashed_password="x", role=UserRole.MED_REP)
+        second = User(username="second", full_name="Second", hashed_password="x", role=UserRole.MED_REP)
+        org = MedicalOrganization(name="Apteka")
+        category = Category(name="Tabletka")
+        db.add_all([first, second, org, category])
+        await db.flush()
+        # Assigned in reverse id order: the owner is still the lowest-id rep
+        await db.execute(medrep_organization.insert().values([
+            {"user_id": second.id, "organization_id": org.id},
+            {"user_id": first.id, "organization_id": org.id},
+        ]))
+        product = Product(name="Dori", price=10.0, production_price=1.0, category_id=category.id)
+        db.add(product)
+        await db.flush()
+        reservation = Reservation(customer_name="Apteka", created_by_id=second.id, med_org_id=org.id, total_amount=90, nds_percent=0)
+        db.add(reservation)
+        await db.flush()
+        db.add(ReservationItem(reservation_id=reservation.id, product_id=product.id, quantity=10, price=9, total_price=90))
+        invoice = Invoice(reservation_id=reservation.id, total_amount=90, paid_amount=0, status=InvoiceStatus.UNPAID, date=datetime(2026, 5, 1))
+        db.add(invoice)
+        await db.flush()
+
+        # Each third alone rounds to 3 items; the three together must come to all 10
+        for day in (2, 3, 4):
+            db.add(Payment(invoice_id=invoice.id, amount=30, date=datetime(2026, 5, day)))
+            await db.flush()
+            await StatsService.record_payment(db, invoice.id, 30, datetime(2026, 5, day))
+        await db.commit()
+        incremental = (await db.execute(
+            select(DoctorMonthlyStat.med_rep_id, DoctorMonthlyStat.paid_quantity, DoctorMonthlyStat.paid_amount)
+        )).all()
+
+        await StatsService.rebuild(db)
+        await db.commit()
+        rebuilt = (await db.execute(
+            select(DoctorMonthlyStat.med_rep_id, DoctorMonthlyStat.paid_quantity, DoctorMonthlyStat.paid_amount)
+        )).all()
+    await engine.dispose()
+    return incremental, rebuilt, first.id
+
+
+def test_partial_payments_add_up_to_line_quantity(tmp_path):
+    incremental, rebuilt, owner_id = asyncio.run(_pay_in_thirds(str(tmp_path / "stats.db")))
+
+    # One row per key however many payments were booked to it
+    assert len(incremental) == 1
+    rep_id, paid_quantity, paid_amount = incremental[0]
+    assert (rep_id, paid_quantity) == (owner_id, 10)
+    assert round(paid_amount, 2) == 90.0
+    assert [(r, q, round(a, 2)) for r, q, a in rebuilt] == [(owner_id, 10, 90.0)]
@@ -29,3 +29,34 @@ export const markNotificationRead = async (id: number) => {
         throw error;
     }
 };
+
+export const getUnreadCount = async (): Promise<number> => {
+    const response = await api.get('/notifications/unread-count');
+    return response.data.unread;
+};
+
+// Marks the given notifications read, or all up to `before` (ISO timestamp), in one request
+export const markNotificationsRead = async (params: { ids?: number[]; before?: string }) => {
+    const response = await api.post('/notifications/read', params);
+    return response.data;
+};
+
+// Server push (replaces polling GET /notifications/). `onEvent` receives parsed events:
+// hello / notification / unread / payment / deletion_request / return_request.
+// EventSource reconnects on its own; call the returned function to close the stream.
+// Only available when the backend runs with NOTIFICATION_PUSH_ENABLED (404 otherwise: keep polling).
+export const subscribeNotifications = (token: string, onEvent: (event: any) => void) => {
+    const url = `${api.defaults.baseURL}/notifications/stream?token=${encodeURIComponent(token)}`;
+    const source = new EventSource(url);
+    const types = ['hello', 'notification', 'unread', 'payment', 'deletion_request', 'return_request'];
+    types.forEach((type) =>
+        source.addEventListener(type, (e) => {
+            try {
+                onEvent(JSON.parse((e as MessageEvent).data));
+            } catch (error) {
+                console.error("Bad notification event:", error);
+            }
+        })
+    );
+    return () => source.close();
+};
@@ -64,8 +64,11 @@ export const createPlan = async (planData: Omit<Plan, 'id'>) => {
     return response.data;
 };
 
-export const getSaleFacts = async (med_rep_id?: number, skip: number = 0, limit: number = 100) => {
-    const params: any = { skip, limit };
+export const getSaleFacts = async (
+    med_rep_id?: number,
+    filters: { month?: number; year?: number; doctor_id?: number; product_id?: number; skip?: number; limit?: number } = {}
+) => {
+    const params: any = { ...filters };
     if (med_rep_id) params.med_rep_id = med_rep_id;
     const response = await axiosInstance.get('/sales/facts/', { params });
     return response.data;
@@ -142,6 +145,30 @@ export const deletePayment = async (id: number) => {
     return response.data;
 };
 
+export interface PaymentImportLine {
+    invoice_id?: number;
+    factura_number?: string;
+    amount: number;
+    payment_type?: 'cash' | 'bank' | 'other';
+    comment?: string;
+}
+
+// Bulk payments (bank statement); dry_run validates without saving. Returns a per-line report.
+export const importPayments = async (lines: PaymentImportLine[], dry_run: boolean = false) => {
+    const response = await axiosInstance.post('/sales/payments/import', { lines, dry_run });
+    return response.data;
+};
+
+export const importPaymentsExcel = async (file: File, dry_run: boolean = false) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await axiosInstance.post('/sales/payments/import/excel', formData, {
+        params: { dry_run },
+        headers: { 'Content-Type': 'multipart/form-data' }
+    });
+    return response.data;
+};
+
 export const deleteBalanceTransaction = async (id: number) => {
     const response = await axiosInstance.delete(`/sales/balance-transactions/${id}`);
     return response.data;
@@ -1,7 +1,18 @@
 import axiosInstance from './axios';
 
-export const getVisits = async (userId: number) => {
-    const response = await axiosInstance.get(`/users/${userId}/visits`);
+export const getVisits = async (
+    userId: number,
+    params: { date_from?: string; date_to?: string; doctor_id?: number; med_org_id?: number; limit?: number; cursor?: string } = {}
+) => {
+    const response = await axiosInstance.get(`/users/${userId}/visits`, { params });
+    return response.data;
+};
+
+export const getVisitMonthlyCounts = async (
+    userId: number,
+    params: { date_from?: string; date_to?: string; doctor_id?: number; med_org_id?: number } = {}
+) => {
+    const response = await axiosInstance.get(`/users/${userId}/visits/monthly`, { params });
     return response.data;
 };
 
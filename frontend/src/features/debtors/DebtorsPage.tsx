@@ -27,7 +27,7 @@ export default function DebtorsPage() {
         onlyOverdue: false,
     });
 
-    const [selectedInvoiceForView, setSelectedInvoiceForView] = useState<any | null>(null);
+    const [selectedReservationId, setSelectedReservationId] = useState<number | null>(null);
 
     const { data: invoices = [], isLoading, refetch } = useQuery({
         queryKey: ['invoices-debtors', filterValues],
@@ -46,11 +46,21 @@ export default function DebtorsPage() {
             params.has_debt = true;
             if (filterValues.onlyOverdue) params.only_overdue = true;
 
-            const response = await api.get('/sales/invoices/', { params });
+            const response = await api.get('/sales/invoices/list', { params });
             return Array.isArray(response.data) ? response.data : (response.data?.items || response.data || []);
         }
     });
 
+    // List rows are slim; the details modal needs the full graph (invoice payments, warehouse)
+    const { data: selectedReservation, isLoading: isReservationLoading } = useQuery({
+        queryKey: ['reservation-detail', selectedReservationId],
+        queryFn: async () => {
+            const response = await api.get(`/sales/reservations/${selectedReservationId}/detail`);
+            return response.data;
+        },
+        enabled: !!selectedReservationId
+    });
+
     const { data: globalStats } = useQuery({
         queryKey: ['debtors-global-stats', filterValues.selectedMedRep, filterValues.selectedRegion],
         queryFn: async () => {
@@ -354,7 +364,7 @@ export default function DebtorsPage() {
                         <DataTable
                             columns={columns}
                             data={invoices}
-                            onRowClick={(row) => setSelectedInvoiceForView(row)}
+                            onRowClick={(row) => setSelectedReservationId(row.reservation_id)}
                             getRowClassName={(row: any) => {
                                 if (row.is_deletion_pending || row.reservation?.is_deletion_pending || row.reservation?.is_return_pending) return 'bg-yellow-100/70 hover:bg-yellow-100';
                                 
@@ -372,9 +382,10 @@ export default function DebtorsPage() {
             </div>
 
             <ReservationDetailsModal
-                isOpen={!!selectedInvoiceForView}
-                onClose={() => setSelectedInvoiceForView(null)}
-                reservation={selectedInvoiceForView?.reservation}
+                isOpen={!!selectedReservationId}
+                onClose={() => setSelectedReservationId(null)}
+                reservation={selectedReservation}
+                isLoading={isReservationLoading}
             />
         </PageContainer>
     );
@@ -40,7 +40,7 @@ export default function InvoicesPage() {
         }
     }, [searchParams]);
 
-    const [selectedInvoiceForView, setSelectedInvoiceForView] = useState<any | null>(null);
+    const [selectedReservationId, setSelectedReservationId] = useState<number | null>(null);
 
     const { data: invoices = [], isLoading, refetch } = useQuery({
         queryKey: ['invoices', filterValues],
@@ -57,11 +57,21 @@ export default function InvoicesPage() {
             }
             if (filterValues.invNumSearch) params.inv_num = filterValues.invNumSearch;
 
-            const response = await api.get('/sales/invoices/', { params });
+            const response = await api.get('/sales/invoices/list', { params });
             return Array.isArray(response.data) ? response.data : (response.data?.items || response.data || []);
         }
     });
 
+    // List rows are slim; the details modal needs the full graph (invoice payments, warehouse)
+    const { data: selectedReservation, isLoading: isReservationLoading, refetch: refetchReservation } = useQuery({
+        queryKey: ['reservation-detail', selectedReservationId],
+        queryFn: async () => {
+            const response = await api.get(`/sales/reservations/${selectedReservationId}/detail`);
+            return response.data;
+        },
+        enabled: !!selectedReservationId
+    });
+
     const { data: globalStats, isLoading: isStatsLoading } = useQuery({
         queryKey: ['invoice-stats', filterValues],
         queryFn: async () => {
@@ -368,7 +378,7 @@ export default function InvoicesPage() {
                         <DataTable
                             columns={columns}
                             data={invoices}
-                            onRowClick={(row) => setSelectedInvoiceForView(row)}
+                            onRowClick={(row) => setSelectedReservationId(row.reservation_id)}
                             getRowClassName={(row: any) => {
                                 if (row.is_deletion_pending || row.reservation?.is_deletion_pending || row.reservation?.is_return_pending) return 'bg-yellow-100/70 hover:bg-yellow-100';
                                 
@@ -389,10 +399,11 @@ export default function InvoicesPage() {
             </div>
 
             <ReservationDetailsModal
-                isOpen={!!selectedInvoiceForView}
-                onClose={() => setSelectedInvoiceForView(null)}
-                reservation={selectedInvoiceForView?.reservation}
-                onRefresh={refetch}
+                isOpen={!!selectedReservationId}
+                onClose={() => setSelectedReservationId(null)}
+                reservation={selectedReservation}
+                isLoading={isReservationLoading}
+                onRefresh={() => { refetch(); refetchReservation(); }}
             />
         </PageContainer>
     );
@@ -16,7 +16,7 @@ export default function KreditorkaPage() {
             // Fetch invoices with debt/credit info
             // In DebtorsPage we saw that fetching all invoices and filtering on frontend is common
             // Or we can use the new balance endpoint
-            const response = await api.get('/sales/invoices/', {
+            const response = await api.get('/sales/invoices/list', {
                 params: { limit: 1000 }
             });
             const all = Array.isArray(response.data) ? response.data : (response.data?.items || []);
@@ -147,7 +147,7 @@ export function MedOrgDetailModal({ org, isOpen, onClose, readOnly = false }: Me
             // Try fetching specific data if he has an assigned rep
             // If the user has permission to fetch all, we just pass no med_rep_id
             const plans = await getPlans();
-            const facts = await getSaleFacts();
+            const facts = await getSaleFacts(undefined, { doctor_id: doc.id });
             const bonuses = await getBonusPayments();
 
             setViewDoctorPlans(plans.filter((p: any) => p.doctor_id === doc.id));
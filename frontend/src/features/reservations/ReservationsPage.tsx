@@ -19,7 +19,7 @@ export default function ReservationsPage() {
     const user = useAuthStore((state) => state.user);
     const isMedRep = user?.role === 'med_rep';
     const [isModalOpen, setIsModalOpen] = useState(false);
-    const [selectedReservationForView, setSelectedReservationForView] = useState<any | null>(null);
+    const [selectedReservationId, setSelectedReservationId] = useState<number | null>(null);
 
     const [filterValues, setFilterValues] = useState<FilterValues>({
         dateStart: '',
@@ -55,12 +55,22 @@ export default function ReservationsPage() {
             if (filterValues.invNumSearch) params.inv_num = filterValues.invNumSearch;
             params.status = 'pending';
 
-            const response = await api.get('/sales/reservations/', { params });
+            const response = await api.get('/sales/reservations/list', { params });
             const data = Array.isArray(response.data) ? response.data : (response.data?.items || response.data || []);
             return data;
         }
     });
 
+    // List rows are slim; the details modal needs the full graph (invoice payments, warehouse)
+    const { data: selectedReservation, isLoading: isReservationLoading } = useQuery({
+        queryKey: ['reservation-detail', selectedReservationId],
+        queryFn: async () => {
+            const response = await api.get(`/sales/reservations/${selectedReservationId}/detail`);
+            return response.data;
+        },
+        enabled: !!selectedReservationId
+    });
+
     const stats = useMemo(() => {
         // Obshaya summa broni - summary of all reservations
         const totalAmount = reservations.reduce((acc: number, r: any) => acc + (r.total_amount || 0), 0);
@@ -235,7 +245,7 @@ export default function ReservationsPage() {
                         <DataTable
                             columns={columns}
                             data={reservations}
-                            onRowClick={(row) => setSelectedReservationForView(row)}
+                            onRowClick={(row) => setSelectedReservationId(row.id)}
                             getRowClassName={(row: any) => row.is_deletion_pending || row.is_return_pending ? 'bg-yellow-100/70 hover:bg-yellow-100' : ''}
                         />
                     </div>
@@ -249,9 +259,10 @@ export default function ReservationsPage() {
             />
 
             <ReservationDetailsModal
-                isOpen={!!selectedReservationForView}
-                onClose={() => setSelectedReservationForView(null)}
-                reservation={selectedReservationForView}
+                isOpen={!!selectedReservationId}
+                onClose={() => setSelectedReservationId(null)}
+                reservation={selectedReservation}
+                isLoading={isReservationLoading}
             />
         </PageContainer>
     );